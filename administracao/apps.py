@@ -4,3 +4,8 @@ class AdministracaoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'administracao'
     verbose_name = 'Administração do Sistema'
+
+    def ready(self):
+        # Versão do cardápio (invalida o cache do bot do WhatsApp)
+        from .signals import conectar_sinais
+        conectar_sinais()
@@ -13,6 +13,25 @@ class ConfiguracaoSistema(models.Model):
         verbose_name_plural = "Configurações do Sistema"
         ordering = ['chave']
 
+
+class ContadorVersao(models.Model):
+    """
+    Carimbo de versão monotônico por escopo (ex: 'cozinha', 'mesas').
+    Incrementado após o commit de escritas que mudam o conteúdo do escopo
+    (ver administracao/versoes.py) e usado como ETag pelos endpoints de polling.
+    """
+    escopo = models.CharField(max_length=50, unique=True)
+    valor = models.PositiveBigIntegerField(default=0)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.escopo} = {self.valor}"
+
+    class Meta:
+        verbose_name = "Contador de Versão"
+        verbose_name_plural = "Contadores de Versão"
+        ordering = ['escopo']
+
 # --- Placeholder Models for Produto e CategoriaProduto ---
 # Estes modelos são definidos aqui temporariamente para permitir o desenvolvimento
 # das APIs de administração de cardápio. Idealmente, eles residiriam em um
@@ -0,0 +1,125 @@
+import math
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Aggregate, Count, F, FloatField
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+
+from cozinha_api.models import EventoStatusCozinha, EventoStatusCozinhaItem
+
+# Percentis calculados nos relatórios de tempo da cozinha
+PERCENTIS = (('p50_segundos', 0.5), ('p90_segundos', 0.9), ('p99_segundos', 0.99))
+
+# Etapa medida por cada status de destino: a duração do evento é o tempo no status anterior
+ETAPAS_COZINHA = {
+    'EmPreparo': 'espera',  # AguardandoPreparo -> EmPreparo
+    'Pronto': 'preparo',    # EmPreparo -> Pronto
+}
+
+
+class PercentilCont(Aggregate):
+    """
+    PERCENTILE_CONT(p) WITHIN GROUP (ORDER BY expressão), do PostgreSQL.
+    Interpola linearmente entre os dois valores vizinhos, como percentil_cont_python.
+    """
+    function = 'PERCENTILE_CONT'
+    template = '%(function)s(%(percentil)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = FloatField()
+
+    def __init__(self, expression, percentil, **extra):
+        super().__init__(expression, percentil=float(percentil), **extra)
+
+
+def percentil_cont_python(valores_ordenados, percentil):
+    """ Mesmo cálculo de PERCENTILE_CONT para uma lista já ordenada. """
+    if not valores_ordenados:
+        return None
+    posicao = percentil * (len(valores_ordenados) - 1)
+    inferior, superior = math.floor(posicao), math.ceil(posicao)
+    return valores_ordenados[inferior] + (valores_ordenados[superior] - valores_ordenados[inferior]) * (posicao - inferior)
+
+
+def _percentis_por_grupo(queryset, chave):
+    """
+    Agrupa os eventos por (chave, etapa) e calcula quantidade de amostras e percentis
+    de duracao_segundos. No PostgreSQL, tudo em uma consulta agregada; nos demais bancos
+    (sem PERCENTILE_CONT), o banco ordena as durações e a interpolação é feita aqui, com
+    todas as durações do período passando pelo Python: caminho de desenvolvimento
+    (SQLite), limitado por _validar_periodo_sem_percentil.
+    """
+    queryset = queryset.filter(
+        status_novo__in=list(ETAPAS_COZINHA), duracao_segundos__isnull=False
+    ).annotate(chave=chave)
+
+    if connections[queryset.db].vendor == 'postgresql':
+        linhas = queryset.values('chave', 'status_novo').annotate(
+            amostras=Count('id'),
+            **{nome: PercentilCont('duracao_segundos', percentil) for nome, percentil in PERCENTIS}
+        ).order_by('chave', 'status_novo')
+        return [
+            {
+                'chave': linha['chave'],
+                'etapa': ETAPAS_COZINHA[linha['status_novo']],
+                'amostras': linha['amostras'],
+                **{nome: linha[nome] for nome, _ in PERCENTIS},
+            }
+            for linha in linhas
+        ]
+
+    linhas = queryset.order_by('chave', 'status_novo', 'duracao_segundos').values_list(
+        'chave', 'status_novo', 'duracao_segundos'
+    )
+    resultado = []
+    for (valor_chave, status_novo), grupo in groupby(linhas.iterator(), key=lambda linha: linha[:2]):
+        duracoes = [linha[2] for linha in grupo]
+        resultado.append({
+            'chave': valor_chave,
+            'etapa': ETAPAS_COZINHA[status_novo],
+            'amostras': len(duracoes),
+            **{nome: percentil_cont_python(duracoes, percentil) for nome, percentil in PERCENTIS},
+        })
+    return resultado
+
+
+def _validar_periodo_sem_percentil(inicio, fim):
+    """
+    Sem PERCENTILE_CONT, o relatório lê uma linha por evento do período; só aceita
+    períodos com início e de até RELATORIO_TEMPOS_COZINHA_MAX_DIAS_SEM_PERCENTIL dias
+    (default 92). Levanta ValueError fora disso.
+    """
+    maximo_dias = getattr(settings, 'RELATORIO_TEMPOS_COZINHA_MAX_DIAS_SEM_PERCENTIL', 92)
+    if inicio is None or (fim or timezone.localdate() + timedelta(days=1)) - inicio > timedelta(days=maximo_dias):
+        raise ValueError(
+            f"Sem PostgreSQL, o relatório de tempos da cozinha aceita períodos de até {maximo_dias} dias."
+        )
+
+
+def relatorio_tempos_cozinha(inicio=None, fim=None):
+    """
+    Percentis (p50/p90/p99) dos tempos de espera (entrada na fila até EmPreparo) e de
+    preparo (EmPreparo até Pronto), por hora do dia, por canal (WhatsApp/Mesa) e por
+    produto, para os eventos com horario em [inicio, fim) (datas; fim exclusivo).
+
+    As consultas usam os índices (status_novo, horario) de EventoStatusCozinha e
+    EventoStatusCozinhaItem: uma por agrupamento. Fora do PostgreSQL, levanta ValueError
+    para períodos longos demais (_validar_periodo_sem_percentil).
+    """
+    if connections[EventoStatusCozinha.objects.db].vendor != 'postgresql':
+        _validar_periodo_sem_percentil(inicio, fim)
+    eventos = EventoStatusCozinha.objects.all()
+    itens = EventoStatusCozinhaItem.objects.all()
+    if inicio:
+        eventos = eventos.filter(horario__gte=inicio)
+        itens = itens.filter(horario__gte=inicio)
+    if fim:
+        eventos = eventos.filter(horario__lt=fim)
+        itens = itens.filter(horario__lt=fim)
+
+    return {
+        'por_hora': _percentis_por_grupo(eventos, ExtractHour('horario')),
+        'por_canal': _percentis_por_grupo(eventos, F('tipo_origem')),
+        'por_produto': _percentis_por_grupo(itens, F('nome_produto')),
+    }
@@ -86,3 +86,19 @@ class ProdutosVendidosSimplesRelatorioSerializer(serializers.Serializer):
     # This serializer represents an aggregated result, not a direct model.
     nome_produto = serializers.CharField()
     quantidade_total_vendida = serializers.IntegerField()
+
+
+class TempoCozinhaPercentisSerializer(serializers.Serializer):
+    # Formato: { "chave" (hora, canal ou produto), "etapa" (espera/preparo), "amostras", "p50_segundos", ... }
+    chave = serializers.ReadOnlyField() # Hora (int), canal ou nome do produto
+    etapa = serializers.CharField()
+    amostras = serializers.IntegerField()
+    p50_segundos = serializers.FloatField()
+    p90_segundos = serializers.FloatField()
+    p99_segundos = serializers.FloatField()
+
+
+class TemposCozinhaRelatorioSerializer(serializers.Serializer):
+    por_hora = TempoCozinhaPercentisSerializer(many=True)
+    por_canal = TempoCozinhaPercentisSerializer(many=True)
+    por_produto = TempoCozinhaPercentisSerializer(many=True)
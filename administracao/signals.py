@@ -0,0 +1,19 @@
+from django.db.models.signals import post_save, post_delete
+
+from .models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+from .versoes import incrementar_versao, ESCOPO_CATALOGO
+
+# Toda escrita em categorias e produtos (ProdutoAdminViewSet, CategoriaProdutoAdminViewSet,
+# admin do Django, ligar/desligar 'disponivel') muda os menus do bot, então incrementa a
+# versão 'catalogo'. Escritas com queryset.update() não disparam sinais: chame
+# incrementar_versao(ESCOPO_CATALOGO) junto.
+
+
+def catalogo_alterado(sender, **kwargs):
+    incrementar_versao(ESCOPO_CATALOGO)
+
+
+def conectar_sinais():
+    for modelo in (CategoriaProdutoPlaceholder, ProdutoPlaceholder):
+        post_save.connect(catalogo_alterado, sender=modelo, dispatch_uid=f'versao_catalogo_{modelo.__name__}_salvo')
+        post_delete.connect(catalogo_alterado, sender=modelo, dispatch_uid=f'versao_catalogo_{modelo.__name__}_removido')
@@ -1,13 +1,21 @@
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import override_settings
 from django.urls import reverse
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.utils import timezone
 from decimal import Decimal
+from django.contrib.contenttypes.models import ContentType
 
 from .models import ConfiguracaoSistema, ProdutoPlaceholder, CategoriaProdutoPlaceholder
-from atendimento_interno.models import Mesa, PedidoMesa, ItemPedidoMesa
+from atendimento_interno.models import Mesa, PedidoMesa, ItemPedidoMesa, Produto
 from pagamentos.models import Pagamento
 from whatsapp_bot.models import PedidoWhatsApp
+from cozinha_api.models import EventoStatusCozinha, EventoStatusCozinhaItem
+from .relatorios import percentil_cont_python
 
 # Refer to TESTING_STRATEGY.md for overall testing guidelines.
 
@@ -59,6 +67,8 @@ class AdministracaoAPITests(APITestCase):
         # Pagamento de outro dia para testar filtro de data
         self.pedido_wp_report_old = PedidoWhatsApp.objects.create(telefone_cliente="+5511888886666", carrinho_atual=[{'id': self.prod_report_1.id, 'nome': self.prod_report_1.nome, 'preco': 20.00, 'quantidade': 1}]) #20
         Pagamento.objects.create(pedido=self.pedido_wp_report_old, metodo_pagamento=Pagamento.METODO_PIX, valor_pago=20.00, status_pagamento=Pagamento.STATUS_APROVADO, data_hora_pagamento=timezone.now() - timezone.timedelta(days=5))
+        # Itens normalizados dos pedidos WhatsApp (no bot, gravados ao informar o pagamento)
+        call_command('normalizar_itens_whatsapp', stdout=StringIO())
 
 
     # --- Testes CRUD (Exemplo para Categoria, similar para Produto, Mesa, Configuracao) ---
@@ -201,4 +211,151 @@ class AdministracaoAPITests(APITestCase):
 #
 # Os testes de CRUD para ProdutoPlaceholder, MesaAdmin, e ConfiguracaoSistema
 # seguiriam o padrão mostrado para CategoriaProdutoPlaceholder.
+
+
+class ProdutosVendidosAgregacaoTests(APITestCase):
+    """
+    Relatório de produtos vendidos: itens de mesa (Produto) somados por nome aos
+    ItemPedidoWhatsApp dos pedidos com pagamento aprovado, agregados no banco.
+    """
+    url = reverse('administracao:relatorio_produtos_vendidos_simples')
+
+    def setUp(self):
+        agora = timezone.now()
+        calabresa_mesa = Produto.objects.create(nome="Calabresa", preco_base=Decimal('30.00'))
+        refri_mesa = Produto.objects.create(nome="Refrigerante", preco_base=Decimal('6.00'))
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Relatório")
+        self.calabresa_whatsapp = ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30.00)
+
+        # Mesa paga ontem: 2 Calabresa e 1 Refrigerante
+        pedido_mesa = PedidoMesa.objects.create(
+            mesa=Mesa.objects.create(numero_identificador="PV01"), status_pedido=PedidoMesa.STATUS_PAGO,
+            data_fechamento=agora - timezone.timedelta(days=1),
+        )
+        ItemPedidoMesa.objects.create(pedido_mesa=pedido_mesa, produto=calabresa_mesa, quantidade=2, preco_unitario_no_momento=30.00)
+        ItemPedidoMesa.objects.create(pedido_mesa=pedido_mesa, produto=refri_mesa, quantidade=1, preco_unitario_no_momento=6.00)
+
+        # WhatsApp: 3 Calabresa pagas há 2 dias, 1 há 10 dias e 5 com pagamento pendente (fora)
+        for quantidade, dias, status_pagamento in [
+            (3, 2, Pagamento.STATUS_APROVADO), (1, 10, Pagamento.STATUS_APROVADO), (5, 1, Pagamento.STATUS_PENDENTE),
+        ]:
+            self._pedido_whatsapp(quantidade, status_pagamento, agora - timezone.timedelta(days=dias))
+
+    def _pedido_whatsapp(self, quantidade, status_pagamento=Pagamento.STATUS_APROVADO, pago_em=None):
+        from whatsapp_bot.pedidos import registrar_itens_pedido_whatsapp
+        pedido = PedidoWhatsApp.objects.create(
+            telefone_cliente=f"+5511777{PedidoWhatsApp.objects.count():06d}",
+            carrinho_atual=[{'id': self.calabresa_whatsapp.id, 'nome': "Calabresa", 'preco': 30.00, 'quantidade': quantidade}],
+        )
+        registrar_itens_pedido_whatsapp(pedido)
+        Pagamento.objects.create(
+            pedido=pedido, metodo_pagamento=Pagamento.METODO_PIX, valor_pago=30.00 * quantidade,
+            status_pagamento=status_pagamento, data_hora_pagamento=pago_em or timezone.now(),
+        )
+        return pedido
+
+    def _vendidos(self, **filtros):
+        response = self.client.get(self.url, filtros, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return {linha['nome_produto']: linha['quantidade_total_vendida'] for linha in response.data}
+
+    def test_soma_mesa_e_whatsapp_pelo_nome(self):
+        self.assertEqual(self._vendidos(), {"Calabresa": 6, "Refrigerante": 1})
+
+    def test_filtro_pela_data_do_pagamento(self):
+        hoje = timezone.localdate()
+        inicio = (hoje - timezone.timedelta(days=5)).isoformat()
+        self.assertEqual(self._vendidos(data_inicio=inicio), {"Calabresa": 5, "Refrigerante": 1})
+        # Só o pagamento de 10 dias atrás; a mesa (fechada ontem) fica fora
+        self.assertEqual(self._vendidos(
+            data_inicio=(hoje - timezone.timedelta(days=15)).isoformat(),
+            data_fim=(hoje - timezone.timedelta(days=3)).isoformat(),
+        ), {"Calabresa": 1})
+
+    def test_consultas_nao_crescem_com_os_pedidos(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as contexto:
+            self.client.get(self.url, format='json')
+        for _ in range(10):
+            self._pedido_whatsapp(1)
+        with self.assertNumQueries(len(contexto.captured_queries)):
+            self.assertEqual(self._vendidos()["Calabresa"], 16)
+
+class TemposCozinhaRelatorioTests(APITestCase):
+    """ Percentis de espera/preparo da cozinha a partir de EventoStatusCozinha(Item). """
+    def setUp(self):
+        mesa_ct = ContentType.objects.get_for_model(PedidoMesa)
+        agora = timezone.now()
+        # Preparos de 100..1000s no canal Mesa, e um de 60s no WhatsApp
+        for i, duracao in enumerate(range(100, 1001, 100), start=1):
+            EventoStatusCozinha.objects.create(
+                content_type=mesa_ct, object_id=i, tipo_origem='Mesa', status_anterior='EmPreparo',
+                status_novo='Pronto', horario=agora, duracao_segundos=duracao
+            )
+            EventoStatusCozinhaItem.objects.create(
+                tipo_origem='Mesa', object_id=i, produto_id=1, nome_produto='Calabresa',
+                status_novo='Pronto', horario=agora, duracao_segundos=duracao
+            )
+        EventoStatusCozinha.objects.create(
+            content_type=ContentType.objects.get_for_model(PedidoWhatsApp), object_id=1, tipo_origem='WhatsApp',
+            status_anterior='AguardandoPreparo', status_novo='EmPreparo', horario=agora, duracao_segundos=60
+        )
+        # Entrada na fila (sem duração) e evento antigo, fora do período padrão
+        EventoStatusCozinha.objects.create(content_type=mesa_ct, object_id=1, tipo_origem='Mesa', status_novo='AguardandoPreparo', horario=agora)
+        EventoStatusCozinha.objects.create(
+            content_type=mesa_ct, object_id=99, tipo_origem='Mesa', status_anterior='EmPreparo',
+            status_novo='Pronto', horario=agora - timezone.timedelta(days=60), duracao_segundos=99999
+        )
+        self.url = reverse('administracao:relatorio_tempos_cozinha')
+        self.client.force_authenticate(user=get_user_model().objects.create_superuser(
+            username='admin_tempos', password='senha', email='admin_tempos@example.com'
+        ))
+
+    def test_somente_admin(self):
+        self.client.force_authenticate(user=get_user_model().objects.create_user(username='garcom', password='senha'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.force_authenticate(user=None)
+        self.assertIn(self.client.get(self.url).status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+
+    def test_percentis_por_canal_e_produto(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        por_canal = {(linha['chave'], linha['etapa']): linha for linha in response.data['por_canal']}
+        preparo_mesa = por_canal[('Mesa', 'preparo')]
+        self.assertEqual(preparo_mesa['amostras'], 10)
+        self.assertAlmostEqual(preparo_mesa['p50_segundos'], 550.0)
+        self.assertAlmostEqual(preparo_mesa['p90_segundos'], 910.0)
+        self.assertAlmostEqual(preparo_mesa['p99_segundos'], 991.0)
+        self.assertEqual(por_canal[('WhatsApp', 'espera')]['amostras'], 1)
+        self.assertAlmostEqual(por_canal[('WhatsApp', 'espera')]['p99_segundos'], 60.0)
+
+        self.assertEqual(len(response.data['por_produto']), 1)
+        self.assertEqual(response.data['por_produto'][0]['chave'], 'Calabresa')
+        self.assertEqual(sum(linha['amostras'] for linha in response.data['por_hora']), 11)
+
+    def test_filtro_de_datas(self):
+        ontem = (timezone.localdate() - timezone.timedelta(days=1)).isoformat()
+        inicio = (timezone.localdate() - timezone.timedelta(days=70)).isoformat()
+        response = self.client.get(self.url, {'data_inicio': inicio, 'data_fim': ontem})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([linha['amostras'] for linha in response.data['por_canal']], [1])
+
+    def test_data_impossivel_responde_400(self):
+        self.assertEqual(self.client.get(self.url, {'data_inicio': '2024-02-30'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'data_fim': '2024-13-01'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(RELATORIO_TEMPOS_COZINHA_MAX_DIAS_SEM_PERCENTIL=31)
+    def test_periodo_limitado_sem_postgres(self):
+        from django.db import connection
+        if connection.vendor == 'postgresql':
+            self.skipTest("PERCENTILE_CONT no banco: sem limite de período.")
+        response = self.client.get(self.url, {'data_inicio': '2000-01-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_percentil_cont_python(self):
+        self.assertIsNone(percentil_cont_python([], 0.5))
+        self.assertEqual(percentil_cont_python([10.0], 0.99), 10.0)
+        self.assertAlmostEqual(percentil_cont_python([1.0, 2.0, 3.0, 4.0], 0.5), 2.5)
 ```
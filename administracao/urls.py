@@ -3,7 +3,8 @@ from rest_framework.routers import DefaultRouter
 
 from .views import (
     CategoriaProdutoAdminViewSet, ProdutoAdminViewSet, MesaAdminViewSet,
-    ConfiguracaoSistemaViewSet, VendasSimplesRelatorioView, ProdutosVendidosSimplesRelatorioView
+    ConfiguracaoSistemaViewSet, VendasSimplesRelatorioView, ProdutosVendidosSimplesRelatorioView,
+    TemposCozinhaRelatorioView
 )
 
 # Router para os ViewSets de CRUD
@@ -24,6 +25,7 @@ urlpatterns = [
     # URLs para os Relatórios
     path('relatorios/vendas_simples/', VendasSimplesRelatorioView.as_view(), name='relatorio_vendas_simples'),
     path('relatorios/produtos_vendidos_simples/', ProdutosVendidosSimplesRelatorioView.as_view(), name='relatorio_produtos_vendidos_simples'),
+    path('relatorios/tempos_cozinha/', TemposCozinhaRelatorioView.as_view(), name='relatorio_tempos_cozinha'),
 ]
 
 # URLs Geradas (exemplos):
@@ -42,3 +44,4 @@ urlpatterns = [
 # Relatórios:
 #   GET /api/admin/relatorios/vendas_simples/
 #   GET /api/admin/relatorios/produtos_vendidos_simples/
+#   GET /api/admin/relatorios/tempos_cozinha/
@@ -0,0 +1,49 @@
+import hashlib
+
+from django.db import transaction
+from django.db.models import F
+
+from .models import ContadorVersao
+
+# Escopos de versão usados como ETag pelos endpoints de polling
+ESCOPO_COZINHA = 'cozinha' # Fila da cozinha (KitchenTicket)
+ESCOPO_MESAS = 'mesas'     # Mesas com seus pedidos e itens (MesaViewSet)
+ESCOPO_CATALOGO = 'catalogo' # Categorias e produtos do cardápio (cache do bot do WhatsApp)
+
+
+def obter_versao(escopo):
+    """Versão atual do escopo (0 se ainda não houve escrita). Consulta apenas ContadorVersao."""
+    return ContadorVersao.objects.filter(escopo=escopo).values_list('valor', flat=True).first() or 0
+
+
+def _incrementar(escopo):
+    if ContadorVersao.objects.filter(escopo=escopo).update(valor=F('valor') + 1):
+        return
+    _, criado = ContadorVersao.objects.get_or_create(escopo=escopo, defaults={'valor': 1})
+    if not criado: # Criado por outra requisição entre o update e o get_or_create
+        ContadorVersao.objects.filter(escopo=escopo).update(valor=F('valor') + 1)
+
+
+def incrementar_versao(escopo):
+    """
+    Incrementa a versão do escopo após o commit da transação atual.
+
+    Fora da transação, o UPDATE não segura o lock da linha do contador durante a
+    escrita dos pedidos. Como as views leem a versão antes dos dados, um cliente
+    que leu dados novos com a versão antiga apenas recebe o payload mais uma vez.
+    """
+    transaction.on_commit(lambda: _incrementar(escopo))
+
+
+def etag_por_escopo(escopo):
+    """
+    Retorna uma etag_func para django.views.decorators.http.condition.
+    Parâmetros de query (ex: paginação) entram no ETag, pois mudam o conteúdo.
+    """
+    def etag_func(request, *args, **kwargs):
+        etag = f"{escopo}-{obter_versao(escopo)}"
+        query = request.META.get('QUERY_STRING')
+        if query:
+            etag += '-' + hashlib.md5(query.encode(), usedforsecurity=False).hexdigest()[:12]
+        return etag
+    return etag_func
@@ -1,17 +1,21 @@
-from rest_framework import viewsets, generics, status
+from rest_framework import viewsets, generics, status, permissions
 from rest_framework.response import Response
+from rest_framework.views import APIView
 from django.db.models import Sum, Count, Q, F
+from django.utils import timezone
 from django.utils.dateparse import parse_datetime, parse_date
 from django.contrib.contenttypes.models import ContentType
 
 from .models import ConfiguracaoSistema, ProdutoPlaceholder, CategoriaProdutoPlaceholder
 from .serializers import (
     ConfiguracaoSistemaSerializer, ProdutoPlaceholderSerializer, CategoriaProdutoPlaceholderSerializer,
-    MesaAdminSerializer, VendasSimplesRelatorioSerializer, ProdutosVendidosSimplesRelatorioSerializer
+    MesaAdminSerializer, VendasSimplesRelatorioSerializer, ProdutosVendidosSimplesRelatorioSerializer,
+    TemposCozinhaRelatorioSerializer
 )
+from .relatorios import relatorio_tempos_cozinha
 from atendimento_interno.models import Mesa, ItemPedidoMesa, PedidoMesa
 from pagamentos.models import Pagamento
-from whatsapp_bot.models import PedidoWhatsApp # For product sales report
+from whatsapp_bot.models import PedidoWhatsApp, ItemPedidoWhatsApp # For product sales report
 
 # --- Gerenciamento de Cardápio (using Placeholders) ---
 class CategoriaProdutoAdminViewSet(viewsets.ModelViewSet):
@@ -137,55 +141,28 @@ class ProdutosVendidosSimplesRelatorioView(APIView):
 
 
         # --- Vendas de Pedidos WhatsApp ---
-        # Acessar carrinho_atual (JSONField) de PedidoWhatsApp.
-        # Filtrar PedidoWhatsApp que foram pagos (status_pagamento='Aprovado' no modelo Pagamento associado)
-        content_type_whatsapp = ContentType.objects.get_for_model(PedidoWhatsApp)
-        pagamentos_whatsapp_aprovados_ids = Pagamento.objects.filter(
-            content_type=content_type_whatsapp,
-            status_pagamento=Pagamento.STATUS_APROVADO
-        ).values_list('object_id', flat=True)
-
-        pedidos_whatsapp_pagos_qs = PedidoWhatsApp.objects.filter(id__in=pagamentos_whatsapp_aprovados_ids)
-
+        # Itens normalizados (ItemPedidoWhatsApp) dos pedidos com pagamento aprovado no período,
+        # agregados com GROUP BY no banco. Filtra pela data do pagamento, mais precisa que a do pedido.
+        pagamentos_whatsapp_qs = Pagamento.objects.filter(
+            content_type=ContentType.objects.get_for_model(PedidoWhatsApp),
+            status_pagamento=Pagamento.STATUS_APROVADO,
+        )
         if data_inicio_str:
             data_inicio = parse_date(data_inicio_str)
             if data_inicio:
-                # Filtrar por data de atualização do PedidoWhatsApp ou data do pagamento associado
-                # Usar data do pagamento é mais preciso
-                pagamentos_whatsapp_aprovados_ids_data_filtrada = Pagamento.objects.filter(
-                    content_type=content_type_whatsapp,
-                    status_pagamento=Pagamento.STATUS_APROVADO,
-                    data_hora_pagamento__gte=data_inicio
-                ).values_list('object_id', flat=True)
-                pedidos_whatsapp_pagos_qs = pedidos_whatsapp_pagos_qs.filter(id__in=pagamentos_whatsapp_aprovados_ids_data_filtrada)
-
+                pagamentos_whatsapp_qs = pagamentos_whatsapp_qs.filter(data_hora_pagamento__gte=data_inicio)
         if data_fim_str:
             data_fim = parse_date(data_fim_str)
             if data_fim:
                 from datetime import timedelta
-                data_fim_ajustada = data_fim + timedelta(days=1)
-                pagamentos_whatsapp_aprovados_ids_data_filtrada_fim = Pagamento.objects.filter(
-                    content_type=content_type_whatsapp,
-                    status_pagamento=Pagamento.STATUS_APROVADO,
-                    data_hora_pagamento__lt=data_fim_ajustada
-                ).values_list('object_id', flat=True)
-                # Interseção com o filtro de data_inicio se ambos estiverem presentes
-                if data_inicio_str and data_inicio:
-                    final_ids = set(pagamentos_whatsapp_aprovados_ids_data_filtrada).intersection(set(pagamentos_whatsapp_aprovados_ids_data_filtrada_fim))
-                    pedidos_whatsapp_pagos_qs = PedidoWhatsApp.objects.filter(id__in=list(final_ids))
-                else:
-                    pedidos_whatsapp_pagos_qs = pedidos_whatsapp_pagos_qs.filter(id__in=pagamentos_whatsapp_aprovados_ids_data_filtrada_fim)
-
-
-        vendas_whatsapp_dict = {} # { 'nome_produto': quantidade }
-        for pedido_wp in pedidos_whatsapp_pagos_qs:
-            if isinstance(pedido_wp.carrinho_atual, list):
-                for item_carrinho in pedido_wp.carrinho_atual:
-                    nome_produto = item_carrinho.get('nome')
-                    quantidade = item_carrinho.get('quantidade', 0)
-                    if nome_produto and quantidade > 0:
-                        vendas_whatsapp_dict[nome_produto] = vendas_whatsapp_dict.get(nome_produto, 0) + quantidade
-        
+                pagamentos_whatsapp_qs = pagamentos_whatsapp_qs.filter(data_hora_pagamento__lt=data_fim + timedelta(days=1))
+
+        vendas_whatsapp_dict = dict(ItemPedidoWhatsApp.objects.filter(
+            pedido_whatsapp_id__in=pagamentos_whatsapp_qs.values('object_id')
+        ).values('nome_produto').annotate(
+            quantidade_total_vendida=Sum('quantidade')
+        ).filter(quantidade_total_vendida__gt=0).order_by().values_list('nome_produto', 'quantidade_total_vendida'))
+
         # Combinar resultados de Mesa e WhatsApp
         resultado_combinado_dict = {}
         for item_mesa in vendas_mesa_agregado:
@@ -206,3 +183,36 @@ class ProdutosVendidosSimplesRelatorioView(APIView):
 
         serializer = ProdutosVendidosSimplesRelatorioSerializer(resultado_final_lista, many=True)
         return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+class TemposCozinhaRelatorioView(APIView):
+    """
+    API para Relatório de Tempos da Cozinha (dimensionamento da equipe).
+    Percentis p50/p90/p99, em segundos, do tempo de espera na fila (até "Em Preparo")
+    e do tempo de preparo (até "Pronto"), por hora do dia, por canal e por produto.
+    Filtros via query params: data_inicio, data_fim (formato YYYY-MM-DD).
+    Sem data_inicio, considera os últimos 30 dias.
+    Ex: /api/admin/relatorios/tempos_cozinha/?data_inicio=2023-01-01&data_fim=2023-01-31
+    Fora do PostgreSQL, períodos longos respondem 400 (ver administracao/relatorios.py).
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        from datetime import timedelta
+        try:
+            # parse_date levanta ValueError para datas impossíveis (ex: 2024-02-30)
+            data_inicio = parse_date(self.request.query_params.get('data_inicio') or '')
+            data_fim = parse_date(self.request.query_params.get('data_fim') or '')
+
+            if not data_inicio:
+                data_inicio = timezone.localdate() - timedelta(days=30)
+            fim = None
+            if data_fim:
+                # Adicionar 1 dia ao data_fim para incluir todos os horários do dia final
+                fim = data_fim + timedelta(days=1)
+
+            relatorio = relatorio_tempos_cozinha(data_inicio, fim)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        serializer = TemposCozinhaRelatorioSerializer(relatorio)
+        return Response(serializer.data, status=status.HTTP_200_OK)
@@ -4,3 +4,8 @@ class AtendimentoInternoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'atendimento_interno'
     verbose_name = 'Atendimento Interno (Mesas)'
+
+    def ready(self):
+        # Versão (ETag) da listagem de mesas
+        from .signals import conectar_sinais
+        conectar_sinais()
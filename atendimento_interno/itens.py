@@ -0,0 +1,104 @@
+"""
+Inclusão de vários itens em um pedido de mesa de uma vez (POST
+/api/pedidos_mesa/{id}/adicionar-itens/), para o garçom lançar a comanda inteira da mesa
+em uma requisição.
+
+Tudo acontece em uma transação, com o pedido travado: uma consulta de preços, uma dos
+itens já existentes, um bulk_update (produtos que já estavam no pedido têm a quantidade
+somada, por causa do unique_together ('pedido_mesa', 'produto')) e um bulk_create. Como
+as escritas em lote não passam por ItemPedidoMesa.save() nem pelos sinais, o total do
+pedido, a versão 'mesas' e o ticket da cozinha são atualizados aqui, uma vez por lote.
+"""
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from administracao.versoes import incrementar_versao, ESCOPO_MESAS
+from cozinha_api.services import atualizar_itens_ticket_mesa
+from .models import PedidoMesa, ItemPedidoMesa, Produto
+
+
+def _juntar_observacoes(*observacoes):
+    vistas = []
+    for observacao in observacoes:
+        observacao = (observacao or '').strip()
+        if observacao and observacao not in vistas:
+            vistas.append(observacao)
+    return "; ".join(vistas) or None
+
+
+def agrupar_itens(itens):
+    """
+    {produto_id: (quantidade, observacoes)} dos itens pedidos ({'produto_id', 'quantidade',
+    'observacoes_item'}), somando as quantidades de um mesmo produto.
+    """
+    agrupados = {}
+    for item in itens:
+        quantidade, observacoes = agrupados.get(item['produto_id'], (0, None))
+        agrupados[item['produto_id']] = (
+            quantidade + item['quantidade'], _juntar_observacoes(observacoes, item.get('observacoes_item'))
+        )
+    return agrupados
+
+
+@transaction.atomic
+def adicionar_itens_ao_pedido(pedido_id, itens):
+    """
+    Adiciona os itens ao pedido (que precisa estar 'Aberto') e o envia para a cozinha se
+    ainda não estiver lá, como na inclusão de um item só. Levanta PedidoMesa.DoesNotExist
+    ou ValueError (pedido não aberto, produto inexistente). Retorna (pedido, entrou_na_cozinha).
+    """
+    pedido = PedidoMesa.objects.select_for_update().select_related('mesa').get(pk=pedido_id)
+    if pedido.status_pedido != PedidoMesa.STATUS_ABERTO:
+        raise ValueError(
+            f"Não é possível adicionar itens a um pedido que não está 'Aberto'. Status atual: {pedido.get_status_pedido_display()}"
+        )
+
+    agrupados = agrupar_itens(itens)
+    precos = dict(Produto.objects.filter(pk__in=agrupados).values_list('id', 'preco_base'))
+    inexistentes = sorted(set(agrupados) - set(precos))
+    if inexistentes:
+        raise ValueError(f"Produtos não encontrados: {', '.join(map(str, inexistentes))}.")
+
+    agora = timezone.now()
+    total, quantidade_total = 0, 0
+    existentes = list(ItemPedidoMesa.objects.filter(pedido_mesa=pedido, produto_id__in=agrupados))
+    for item in existentes: # Mesmo produto já no pedido: soma a quantidade, mantém o preço lançado
+        quantidade, observacoes = agrupados.pop(item.produto_id)
+        item.quantidade += quantidade
+        item.subtotal_item = item.quantidade * item.preco_unitario_no_momento
+        item.observacoes_item = _juntar_observacoes(item.observacoes_item, observacoes)
+        item.data_atualizacao = agora
+        total += quantidade * item.preco_unitario_no_momento
+        quantidade_total += quantidade
+    ItemPedidoMesa.objects.bulk_update(
+        existentes, ['quantidade', 'subtotal_item', 'observacoes_item', 'data_atualizacao']
+    )
+    novos = [
+        ItemPedidoMesa(
+            pedido_mesa=pedido, produto_id=produto_id, quantidade=quantidade, observacoes_item=observacoes,
+            preco_unitario_no_momento=precos[produto_id], subtotal_item=quantidade * precos[produto_id],
+        )
+        for produto_id, (quantidade, observacoes) in agrupados.items()
+    ]
+    ItemPedidoMesa.objects.bulk_create(novos)
+    total += sum(item.subtotal_item for item in novos)
+    quantidade_total += sum(item.quantidade for item in novos)
+
+    PedidoMesa.objects.filter(pk=pedido.pk).update(
+        total=F('total') + total, quantidade_itens=F('quantidade_itens') + quantidade_total
+    )
+    pedido.total += total
+    pedido.quantidade_itens += quantidade_total
+    incrementar_versao(ESCOPO_MESAS)
+
+    status_cozinha_anterior = pedido.status_cozinha
+    entrou_na_cozinha = not status_cozinha_anterior or status_cozinha_anterior == PedidoMesa.STATUS_COZINHA_ENTREGUE
+    if entrou_na_cozinha:
+        pedido.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
+        pedido.horario_entrada_cozinha = agora
+        # O post_save cria (ou devolve à fila) o ticket da cozinha, já com os itens novos
+        pedido.save(update_fields=['status_cozinha', 'horario_entrada_cozinha', 'data_atualizacao'])
+    if status_cozinha_anterior: # Ticket já existia: re-renderiza os itens uma vez
+        atualizar_itens_ticket_mesa(pedido.pk)
+    return pedido, entrou_na_cozinha
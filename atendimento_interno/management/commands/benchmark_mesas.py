@@ -0,0 +1,118 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.test import APIRequestFactory
+
+from atendimento_interno.mapa import descartar_mapa
+from atendimento_interno.models import Mesa, PedidoMesa, ItemPedidoMesa, Produto
+from atendimento_interno.serializers import MesaSerializer
+from atendimento_interno.views import MesaViewSet
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o GET /api/mesas/ (MesaViewSet.list) com N mesas ocupadas, cada uma com um "
+        "pedido aberto de M itens, e compara com a serialização sem prefetch (uma consulta "
+        "por mesa, por pedido e por item), e com o mapa resumido (GET /api/mesas/mapa/, "
+        "a primeira leitura fora do cache e as seguintes no cache). Os dados são criados "
+        "dentro de uma transação que é desfeita ao final, então o comando pode rodar em qualquer banco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', nargs='+', type=int, default=[20, 100, 500],
+                            help="Quantidades de mesas a medir (default: 20 100 500).")
+        parser.add_argument('--itens-por-pedido', type=int, default=10)
+        parser.add_argument('--repeticoes', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mesas':>6} {'consultas':>10} {'mediana (ms)':>13} {'máx (ms)':>10} {'bytes':>9} "
+            f"{'sem prefetch: consultas':>24} {'mediana (ms)':>13} "
+            f"{'mapa: 1ª (ms)':>14} {'mediana (ms)':>13} {'bytes':>7}"
+        )
+        for tamanho in options['tamanhos']:
+            otimizado, sem_prefetch, mapa = self._medir(tamanho, options['itens_por_pedido'], options['repeticoes'])
+            self.stdout.write(
+                f"{tamanho:>6} {otimizado[0]:>10} {statistics.median(otimizado[2]):>13.2f} {max(otimizado[2]):>10.2f} "
+                f"{otimizado[3]:>9} {sem_prefetch[0]:>24} {statistics.median(sem_prefetch[2]):>13.2f} "
+                f"{mapa[1]:>14.2f} {statistics.median(mapa[2]):>13.2f} {mapa[3]:>7}"
+            )
+
+    def _medir(self, tamanho, itens_por_pedido, repeticoes):
+        listar = MesaViewSet.as_view({'get': 'list'})
+        ver_mapa = MesaViewSet.as_view({'get': 'mapa'})
+        fabrica = APIRequestFactory()
+
+        def pela_view():
+            response = listar(fabrica.get('/api/mesas/'))
+            response.render()
+            return response
+
+        def pelo_mapa():
+            response = ver_mapa(fabrica.get('/api/mesas/mapa/'))
+            response.render()
+            return response
+
+        def sem_prefetch():
+            return MesaSerializer(Mesa.objects.order_by('numero_identificador'), many=True).data
+
+        try:
+            with transaction.atomic():
+                self._criar_salao(tamanho, itens_por_pedido)
+                descartar_mapa() # bulk_create não muda a versão 'mesas': a 1ª leitura do mapa tem que ir ao banco
+                resultados = [self._cronometrar(funcao, repeticoes) for funcao in (pela_view, sem_prefetch, pelo_mapa)]
+                raise _Rollback()
+        except _Rollback:
+            pass
+        descartar_mapa() # O cache não é desfeito com a transação
+        return resultados
+
+    @staticmethod
+    def _cronometrar(funcao, repeticoes):
+        consultas = []
+
+        def contar(execute, sql, params, many, context): # Sem o limite de 9000 do CaptureQueriesContext
+            consultas.append(sql)
+            return execute(sql, params, many, context)
+
+        inicio = time.perf_counter()
+        with connection.execute_wrapper(contar):
+            resultado = funcao()
+        primeira = (time.perf_counter() - inicio) * 1000
+        tempos = []
+        for _ in range(repeticoes):
+            inicio = time.perf_counter()
+            funcao()
+            tempos.append((time.perf_counter() - inicio) * 1000)
+        tamanho = len(resultado.content) if hasattr(resultado, 'content') else 0
+        return len(consultas), primeira, tempos, tamanho
+
+    def _criar_salao(self, tamanho, itens_por_pedido):
+        produtos = Produto.objects.bulk_create([
+            Produto(nome=f"Produto Benchmark {i}", preco_base=Decimal('10.00') + i) for i in range(itens_por_pedido)
+        ])
+        mesas = Mesa.objects.bulk_create([
+            Mesa(numero_identificador=f"BM{i}", status=Mesa.STATUS_OCUPADA) for i in range(tamanho)
+        ])
+        # bulk_create não passa por ItemPedidoMesa.save(): totais já gravados
+        pedidos = PedidoMesa.objects.bulk_create([
+            PedidoMesa(
+                mesa=mesa, total=sum(2 * produto.preco_base for produto in produtos),
+                quantidade_itens=2 * len(produtos),
+            )
+            for mesa in mesas
+        ])
+        ItemPedidoMesa.objects.bulk_create([
+            ItemPedidoMesa(
+                pedido_mesa=pedido, produto=produto, quantidade=2,
+                preco_unitario_no_momento=produto.preco_base, subtotal_item=2 * produto.preco_base,
+            )
+            for pedido in pedidos for produto in produtos
+        ])
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from atendimento_interno.models import PedidoMesa
+from atendimento_interno.totais import reconciliar_totais
+
+
+class Command(BaseCommand):
+    help = (
+        "Confere PedidoMesa.total e quantidade_itens contra a soma dos itens de cada pedido "
+        "e, com --corrigir, regrava os divergentes. Rode uma vez depois da migração que cria "
+        "os campos e sempre que itens forem alterados por escritas em lote (bulk_create/update), "
+        "que não passam por ItemPedidoMesa.save() nem pelos sinais."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--corrigir', action='store_true', help="Regrava os totais divergentes.")
+        parser.add_argument('--ativos', action='store_true', help="Só pedidos abertos ou fechados (não pagos nem cancelados).")
+        parser.add_argument('--lote', type=int, default=500)
+        parser.add_argument('--listar', type=int, default=20, help="Quantas divergências detalhar (default: 20).")
+
+    def handle(self, *args, **options):
+        pedidos = PedidoMesa.objects.all()
+        if options['ativos']:
+            pedidos = pedidos.exclude(status_pedido__in=[PedidoMesa.STATUS_PAGO, PedidoMesa.STATUS_CANCELADO])
+        verificados, divergencias = reconciliar_totais(pedidos, options['corrigir'], options['lote'])
+
+        for divergencia in divergencias[:options['listar']]:
+            self.stdout.write(
+                f"Pedido {divergencia.pedido_id}: total {divergencia.total_gravado} -> {divergencia.total_itens}, "
+                f"itens {divergencia.quantidade_gravada} -> {divergencia.quantidade_itens}"
+            )
+        if not divergencias:
+            self.stdout.write(self.style.SUCCESS(f"{verificados} pedidos de mesa verificados, nenhuma divergência."))
+        elif options['corrigir']:
+            self.stdout.write(self.style.SUCCESS(f"{verificados} pedidos de mesa verificados, {len(divergencias)} corrigidos."))
+        else:
+            self.stdout.write(self.style.WARNING(
+                f"{verificados} pedidos de mesa verificados, {len(divergencias)} com divergência. "
+                "Rode com --corrigir para regravar."
+            ))
@@ -0,0 +1,161 @@
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from rest_framework.test import APIRequestFactory
+
+from atendimento_interno.models import Mesa, PedidoMesa
+from atendimento_interno.views import MesaViewSet, PedidoMesaViewSet
+from pagamentos.models import Pagamento
+
+PREFIXO_MESAS = 'STRESSM'
+
+
+def _percentil(valores, fracao):
+    ordenados = sorted(valores)
+    return ordenados[min(int(len(ordenados) * fracao), len(ordenados) - 1)] if ordenados else 0.0
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga da abertura de pedido e do registro de pagamento de mesa: várias "
+        "threads (cada uma com sua conexão, como garçons diferentes) abrem ao mesmo tempo "
+        "pedidos nas mesmas mesas e depois pagam os mesmos pedidos, pelas views "
+        "(POST /api/mesas/{id}/pedidos/ e /api/pedidos_mesa/{id}/registrar-pagamento/). "
+        "Verifica que cada mesa teve um único pedido aberto por rodada, que cada pedido foi "
+        "pago uma única vez e que as mesas terminam livres, e mede a vazão sob contenção. "
+        "Cria mesas reais (removidas ao final): use em banco de teste/homologação. "
+        "Não funciona com SQLite em memória."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--mesas', type=int, default=10)
+        parser.add_argument('--rodadas', type=int, default=5,
+                            help="Quantas vezes cada mesa é aberta e paga.")
+        parser.add_argument('--semente', type=int, default=0, help="Semente da ordem das mesas em cada thread.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("SQLite em memória não é compartilhado entre threads; use outro banco.")
+
+        mesas = [
+            Mesa.objects.create(numero_identificador=f"{PREFIXO_MESAS}{i}").id for i in range(options['mesas'])
+        ]
+        try:
+            resultados, duracao = self._disparar_threads(mesas, options)
+            self._verificar(mesas, resultados, options['rodadas'])
+        finally:
+            pedidos = PedidoMesa.objects.filter(mesa_id__in=mesas)
+            Pagamento.objects.filter(
+                content_type=ContentType.objects.get_for_model(PedidoMesa), object_id__in=pedidos.values('id')
+            ).delete()
+            pedidos.delete()
+            Mesa.objects.filter(id__in=mesas).delete()
+
+        self.stdout.write(
+            f"{len(resultados)} requisições em {duracao:.2f}s ({len(resultados) / duracao:.0f}/s) "
+            f"com {options['threads']} threads, {len(mesas)} mesas e {options['rodadas']} rodadas:"
+        )
+        for operacao in ('abrir', 'pagar'):
+            da_operacao = [r for r in resultados if r[0] == operacao]
+            latencias = [r[5] for r in da_operacao]
+            contagem = Counter(r[3] for r in da_operacao)
+            self.stdout.write(
+                f"  {operacao}: " + ", ".join(f"HTTP {codigo}={total}" for codigo, total in sorted(contagem.items()))
+                + f"; p50 {_percentil(latencias, 0.5):.1f} ms, p95 {_percentil(latencias, 0.95):.1f} ms, "
+                f"máx {max(latencias, default=0):.1f} ms"
+            )
+        self.stdout.write(self.style.SUCCESS("Nenhum pedido duplicado nem pagamento em dobro."))
+
+    def _disparar_threads(self, mesas, options):
+        abrir = MesaViewSet.as_view({'post': 'criar_pedido_para_mesa'})
+        pagar = PedidoMesaViewSet.as_view({'post': 'registrar_pagamento'})
+        fabrica = APIRequestFactory()
+        resultados = [] # (operação, rodada, mesa_id, status HTTP, pedido_id, ms)
+        erros = []
+        lock = threading.Lock()
+        largada = threading.Barrier(options['threads'])
+
+        def chamar(view, url, pk, dados):
+            inicio = time.perf_counter()
+            response = view(fabrica.post(url, dados, format='json'), pk=pk)
+            return response, (time.perf_counter() - inicio) * 1000
+
+        def garcom(numero):
+            ordem = random.Random(options['semente'] * 1000 + numero)
+            try:
+                for rodada in range(options['rodadas']):
+                    vistos = {}
+                    largada.wait()
+                    for mesa_id in ordem.sample(mesas, len(mesas)):
+                        response, ms = chamar(abrir, f"/api/mesas/{mesa_id}/pedidos/", mesa_id, {})
+                        dados = response.data if response.status_code == 201 else response.data.get('pedido_existente') or {}
+                        vistos[mesa_id] = dados.get('id')
+                        with lock:
+                            resultados.append(('abrir', rodada, mesa_id, response.status_code, vistos[mesa_id], ms))
+                    largada.wait() # Todas as aberturas da rodada antes dos pagamentos
+                    for mesa_id in ordem.sample(mesas, len(mesas)):
+                        pedido_id = vistos[mesa_id]
+                        response, ms = chamar(
+                            pagar, f"/api/pedidos_mesa/{pedido_id}/registrar-pagamento/", pedido_id,
+                            {'metodo': Pagamento.METODO_DINHEIRO, 'valor_pago': '10.00'},
+                        )
+                        with lock:
+                            resultados.append(('pagar', rodada, mesa_id, response.status_code, pedido_id, ms))
+                    largada.wait() # Mesas pagas antes da próxima rodada
+            except Exception as exc: # Repassado para a thread principal
+                erros.append(exc)
+                largada.abort() # Libera as outras threads paradas na barreira
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=garcom, args=(numero,)) for numero in range(options['threads'])]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+        if erros:
+            raise CommandError(f"Erro em uma das threads: {erros[0]!r}")
+        return resultados, duracao
+
+    def _verificar(self, mesas, resultados, rodadas):
+        inesperados = Counter(r[3] for r in resultados if r[3] not in (200, 201, 400))
+        if inesperados:
+            raise CommandError(f"Respostas inesperadas: {dict(inesperados)}")
+
+        aberturas = defaultdict(list) # (rodada, mesa) -> [(status, pedido_id)]
+        pagamentos = Counter() # pedido_id -> pagamentos aceitos
+        for operacao, rodada, mesa_id, codigo, pedido_id, _ in resultados:
+            if operacao == 'abrir':
+                aberturas[(rodada, mesa_id)].append((codigo, pedido_id))
+            elif codigo == 200:
+                pagamentos[pedido_id] += 1
+        for (rodada, mesa_id), respostas in aberturas.items():
+            criados = sum(1 for codigo, _ in respostas if codigo == 201)
+            pedidos = {pedido_id for _, pedido_id in respostas}
+            if criados != 1 or len(pedidos) != 1:
+                raise CommandError(
+                    f"Mesa {mesa_id}, rodada {rodada}: {criados} pedidos criados, ids vistos {sorted(pedidos, key=str)} "
+                    "(esperado: um pedido, visto por todas as threads)."
+                )
+        duplicados = {pedido_id: total for pedido_id, total in pagamentos.items() if total != 1}
+        if duplicados or len(pagamentos) != len(aberturas):
+            raise CommandError(f"Pagamentos aceitos por pedido fora do esperado: {duplicados or dict(pagamentos)}")
+
+        pedidos = PedidoMesa.objects.filter(mesa_id__in=mesas)
+        if pedidos.count() != rodadas * len(mesas) or pedidos.exclude(status_pedido=PedidoMesa.STATUS_PAGO).exists():
+            raise CommandError("Pedidos criados a mais ou não pagos no banco.")
+        por_pedido = Counter(Pagamento.objects.filter(
+            content_type=ContentType.objects.get_for_model(PedidoMesa), object_id__in=pedidos.values('id')
+        ).values_list('object_id', flat=True))
+        if len(por_pedido) != rodadas * len(mesas) or set(por_pedido.values()) != {1}:
+            raise CommandError(f"Registros de Pagamento por pedido fora do esperado: {dict(Counter(por_pedido.values()))}")
+        if Mesa.objects.filter(id__in=mesas).exclude(status=Mesa.STATUS_LIVRE).exists():
+            raise CommandError("Mesas não liberadas depois do pagamento.")
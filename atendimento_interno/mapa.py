@@ -0,0 +1,94 @@
+"""
+Mapa do salão para a tela inicial do garçom (GET /api/mesas/mapa/): uma linha por mesa com
+o pedido em aberto (id, status, total, quantidade de itens e minutos desde a abertura),
+sem os itens.
+
+As linhas saem de uma consulta (mesas com LEFT JOIN no pedido não pago nem cancelado,
+usando os totais gravados em PedidoMesa) e ficam no cache do Django (MAPA_MESAS_CACHE,
+default 'default') sob a versão 'mesas' (administracao.versoes). Toda escrita em mesas,
+pedidos e itens incrementa a versão, então uma versão nova simplesmente não encontra
+entrada no cache; as antigas expiram pelo TTL. Os minutos são calculados a cada resposta,
+a partir do horário de abertura guardado.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import FilteredRelation, Q
+from django.utils import timezone
+
+from administracao.versoes import obter_versao, ESCOPO_MESAS
+from .models import Mesa, PedidoMesa
+
+PEDIDO_ATIVO = Q(pedidos__status_pedido__in=[PedidoMesa.STATUS_ABERTO, PedidoMesa.STATUS_FECHADO])
+
+
+def _cache():
+    return caches[getattr(settings, 'MAPA_MESAS_CACHE', 'default')]
+
+
+def linhas_do_salao():
+    """
+    [(mesa_id, numero, status, pedido_id, status_pedido, total, quantidade_itens, data_abertura)],
+    uma por mesa, em uma consulta. Com mais de um pedido ativo na mesa, fica o mais antigo.
+    """
+    linhas, vistas = [], set()
+    for linha in Mesa.objects.annotate(pedido_ativo=FilteredRelation('pedidos', condition=PEDIDO_ATIVO)).order_by(
+        'numero_identificador', 'pedido_ativo__data_abertura'
+    ).values_list(
+        'id', 'numero_identificador', 'status', 'pedido_ativo__id', 'pedido_ativo__status_pedido',
+        'pedido_ativo__total', 'pedido_ativo__quantidade_itens', 'pedido_ativo__data_abertura',
+    ):
+        if linha[0] not in vistas:
+            vistas.add(linha[0])
+            linhas.append(linha)
+    return linhas
+
+
+def _chave(versao):
+    return f"mapa_mesas:{versao}"
+
+
+def obter_linhas(versao):
+    """ Linhas do salão na versão, do cache ou (na primeira leitura da versão) do banco. """
+    linhas = _cache().get(_chave(versao))
+    if linhas is None:
+        linhas = linhas_do_salao()
+        _cache().set(_chave(versao), linhas, getattr(settings, 'MAPA_MESAS_CACHE_TTL', 300))
+    return linhas
+
+
+def descartar_mapa():
+    """
+    Remove do cache as linhas da versão atual. Só é preciso depois de escritas que não
+    incrementam a versão (bulk_create/update, SQL direto).
+    """
+    _cache().delete(_chave(obter_versao(ESCOPO_MESAS)))
+
+
+def mapa_do_salao(agora=None):
+    """ Payload do mapa: uma consulta de versão e, fora do cache, a consulta das linhas. """
+    agora = agora or timezone.now()
+    mapa = []
+    for mesa_id, numero, status, pedido_id, status_pedido, total, quantidade_itens, aberto_em in obter_linhas(
+        obter_versao(ESCOPO_MESAS)
+    ):
+        mesa = {'id': mesa_id, 'numero_identificador': numero, 'status': status, 'pedido': None}
+        if pedido_id is not None:
+            mesa['pedido'] = {
+                'id': pedido_id,
+                'status': status_pedido,
+                'total': f"{total:.2f}",
+                'itens': quantidade_itens,
+                'minutos': max(int((agora - aberto_em).total_seconds() // 60), 0),
+            }
+        mapa.append(mesa)
+    return mapa
+
+
+def etag_mapa(request, *args, **kwargs):
+    """
+    etag_func do mapa: versão 'mesas' e o minuto atual, pois os minutos desde a abertura
+    mudam sem nenhuma escrita.
+    """
+    return f"mapa-{obter_versao(ESCOPO_MESAS)}-{int(time.time() // 60)}"
@@ -1,4 +1,7 @@
-from django.db import models
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import F
 from django.utils import timezone
 # from products.models import Produto # Assume this will exist in a 'products' app
 
@@ -94,20 +97,44 @@ class PedidoMesa(models.Model):
     )
     horario_entrada_cozinha = models.DateTimeField(null=True, blank=True, help_text="Horário que o pedido entrou na fila da cozinha")
 
+    # Mantidos por ItemPedidoMesa (incrementos com F() ao salvar/remover itens); conferidos e
+    # corrigidos em lote por `manage.py reconciliar_totais_mesa`.
+    total = models.DecimalField(max_digits=10, decimal_places=2, default=0, help_text="Soma dos subtotal_item dos itens")
+    quantidade_itens = models.PositiveIntegerField(default=0, help_text="Soma das quantidades dos itens")
 
     data_criacao = models.DateTimeField(auto_now_add=True)
     data_atualizacao = models.DateTimeField(auto_now=True)
 
+    CAMPOS_MANTIDOS_PELOS_ITENS = ('total', 'quantidade_itens')
+    STATUS_ATIVOS = [STATUS_ABERTO, STATUS_FECHADO] # Ainda não pagos nem cancelados
+
     def __str__(self):
         return f"Pedido {self.id} - Mesa {self.mesa.numero_identificador} ({self.get_status_pedido_display()})"
 
+    def save(self, *args, **kwargs):
+        # total e quantidade_itens só mudam por incremento (ItemPedidoMesa) ou pela reconciliação:
+        # um save() de uma instância lida antes de um item ser adicionado não pode sobrescrevê-los.
+        if not self._state.adding and kwargs.get('update_fields') is None and not kwargs.get('force_insert'):
+            kwargs['update_fields'] = [
+                campo.name for campo in self._meta.concrete_fields
+                if not campo.primary_key and campo.name not in self.CAMPOS_MANTIDOS_PELOS_ITENS
+            ]
+        super().save(*args, **kwargs)
+
     def calcular_total(self):
-        return sum(item.subtotal_item for item in self.itens_pedido.all())
+        return self.total
 
     class Meta:
         verbose_name = "Pedido de Mesa"
         verbose_name_plural = "Pedidos de Mesa"
         ordering = ['-data_abertura']
+        constraints = [
+            # No máximo um pedido Aberto/Fechado por mesa, mesmo com dois garçons abrindo ao mesmo tempo
+            models.UniqueConstraint(
+                fields=['mesa'], condition=models.Q(status_pedido__in=['Aberto', 'Fechado']),
+                name='pedido_mesa_um_ativo_por_mesa',
+            ),
+        ]
 
 
 class ItemPedidoMesa(models.Model):
@@ -122,11 +149,48 @@ class ItemPedidoMesa(models.Model):
     data_criacao = models.DateTimeField(auto_now_add=True)
     data_atualizacao = models.DateTimeField(auto_now=True)
 
+    CAMPOS_DO_TOTAL = {'pedido_mesa', 'pedido_mesa_id', 'quantidade', 'subtotal_item', 'preco_unitario_no_momento'}
+
     def save(self, *args, **kwargs):
         # Ensure subtotal is calculated on save
         if self.preco_unitario_no_momento is not None: # Check to avoid error if price not set yet
              self.subtotal_item = self.quantidade * self.preco_unitario_no_momento
-        super().save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.CAMPOS_DO_TOTAL.isdisjoint(update_fields):
+            super().save(*args, **kwargs)
+            return
+        with transaction.atomic():
+            anterior = None
+            if not self._state.adding:
+                # Valores gravados, com a linha travada: a instância pode estar desatualizada
+                anterior = ItemPedidoMesa.objects.select_for_update().filter(pk=self.pk).values_list(
+                    'pedido_mesa_id', 'subtotal_item', 'quantidade'
+                ).first()
+            super().save(*args, **kwargs)
+            subtotal = Decimal(str(self.subtotal_item)) # Pode ter vindo como float
+            if anterior is None:
+                self._somar_no_pedido(self.pedido_mesa_id, subtotal, self.quantidade)
+            elif anterior[0] == self.pedido_mesa_id:
+                self._somar_no_pedido(self.pedido_mesa_id, subtotal - anterior[1], self.quantidade - anterior[2])
+            else: # Item movido para outro pedido
+                self._somar_no_pedido(anterior[0], -anterior[1], -anterior[2])
+                self._somar_no_pedido(self.pedido_mesa_id, subtotal, self.quantidade)
+
+    def descontar_do_pedido(self):
+        """ Chamado no post_delete (signals.py), também nas remoções em lote e em cascata. """
+        self._somar_no_pedido(self.pedido_mesa_id, -Decimal(str(self.subtotal_item)), -self.quantidade)
+
+    def _somar_no_pedido(self, pedido_id, valor, quantidade):
+        if not valor and not quantidade:
+            return
+        # Incremento no banco: dois itens salvos ao mesmo tempo no mesmo pedido não perdem a soma
+        PedidoMesa.objects.filter(pk=pedido_id).update(
+            total=F('total') + valor, quantidade_itens=F('quantidade_itens') + quantidade
+        )
+        pedido = self._state.fields_cache.get('pedido_mesa')
+        if pedido is not None and pedido.pk == pedido_id: # Mantém a instância em memória coerente
+            pedido.total += valor
+            pedido.quantidade_itens += quantidade
 
     def __str__(self):
         return f"{self.quantidade}x {self.produto.nome} no Pedido {self.pedido_mesa.id}"
@@ -0,0 +1,72 @@
+"""
+Abertura de pedido e registro de pagamento de mesa, seguros com dois garçons tocando na
+mesma mesa ao mesmo tempo.
+
+  * Abertura: a restrição parcial 'pedido_mesa_um_ativo_por_mesa' (um pedido Aberto/Fechado
+    por mesa) decide quem abre; quem perde recebe o IntegrityError, em um savepoint, e
+    devolve o pedido que a outra requisição criou.
+  * Pagamento: o pedido só passa para Pago por um UPDATE condicional ao status ainda ser
+    Aberto/Fechado, que é também a primeira escrita da transação; o segundo pagamento do
+    mesmo pedido não altera nenhuma linha e nada mais é gravado. A mesa só é liberada por
+    outro UPDATE condicional, se não restar pedido ativo nela.
+
+Os dois UPDATEs não disparam sinais: a versão 'mesas' é incrementada aqui.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from administracao.versoes import incrementar_versao, ESCOPO_MESAS
+from pagamentos.models import Pagamento
+from pagamentos.services import registrar_pagamento_para_pedido
+from .models import Mesa, PedidoMesa
+
+
+def abrir_pedido(mesa):
+    """
+    Abre um pedido para a mesa, ou devolve o pedido ativo que ela já tem.
+    Retorna (pedido, criado). Levanta ValueError se a mesa estiver interditada.
+    """
+    if mesa.status == Mesa.STATUS_INTERDITADA:
+        raise ValueError('Mesa está interditada.')
+    existente = PedidoMesa.objects.filter(mesa=mesa, status_pedido__in=PedidoMesa.STATUS_ATIVOS).first()
+    if existente:
+        return existente, False
+    try:
+        with transaction.atomic():
+            pedido = PedidoMesa.objects.create(mesa=mesa, status_pedido=PedidoMesa.STATUS_ABERTO)
+            if mesa.status != Mesa.STATUS_OCUPADA:
+                mesa.status = Mesa.STATUS_OCUPADA
+                mesa.save(update_fields=['status', 'data_atualizacao'])
+    except IntegrityError: # Outra requisição abriu o pedido entre a leitura e o INSERT
+        return PedidoMesa.objects.get(mesa=mesa, status_pedido__in=PedidoMesa.STATUS_ATIVOS), False
+    return pedido, True
+
+
+@transaction.atomic
+def registrar_pagamento_mesa(pedido_id, metodo, valor_pago):
+    """
+    Marca o pedido como pago, grava o Pagamento (aprovado, pagamento manual) e libera a
+    mesa se ela não tiver outro pedido ativo. Levanta PedidoMesa.DoesNotExist ou
+    ValueError (pedido já pago ou cancelado, inclusive por outra requisição simultânea).
+    """
+    agora = timezone.now()
+    if not PedidoMesa.objects.filter(pk=pedido_id, status_pedido__in=PedidoMesa.STATUS_ATIVOS).update(
+        status_pedido=PedidoMesa.STATUS_PAGO, metodo_pagamento_registrado=metodo,
+        valor_pago_registrado=valor_pago, data_fechamento=agora, data_atualizacao=agora,
+    ):
+        pedido = PedidoMesa.objects.get(pk=pedido_id)
+        raise ValueError(
+            f'Não é possível registrar pagamento para pedido com status "{pedido.get_status_pedido_display()}".'
+        )
+    pedido = PedidoMesa.objects.select_related('mesa').get(pk=pedido_id)
+    registrar_pagamento_para_pedido(
+        pedido_obj=pedido, metodo_pagamento=metodo, valor_pago=valor_pago,
+        status_pagamento=Pagamento.STATUS_APROVADO, data_hora_pagamento=agora,
+    )
+    if Mesa.objects.filter(pk=pedido.mesa_id).exclude(status=Mesa.STATUS_LIVRE).exclude(
+        Exists(PedidoMesa.objects.filter(mesa=OuterRef('pk'), status_pedido__in=PedidoMesa.STATUS_ATIVOS))
+    ).update(status=Mesa.STATUS_LIVRE, data_atualizacao=agora):
+        pedido.mesa.status = Mesa.STATUS_LIVRE
+    incrementar_versao(ESCOPO_MESAS)
+    return pedido
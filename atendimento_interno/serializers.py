@@ -1,3 +1,4 @@
+from django.db.models import Prefetch
 from rest_framework import serializers
 # from products.models import Produto # Assuming a real Product model from a 'products' app
 # from products.serializers import ProdutoSerializer # Assuming a ProductSerializer exists
@@ -68,16 +69,42 @@ class PedidoMesaSerializer(serializers.ModelSerializer):
         model = PedidoMesa
         fields = [
             'id', 'mesa', 'mesa_numero', 'status_pedido', 'data_abertura', 'data_fechamento',
-            'observacoes_gerais', 'itens_pedido', 'total_pedido',
+            'observacoes_gerais', 'itens_pedido', 'total_pedido', 'quantidade_itens',
             'metodo_pagamento_registrado', 'valor_pago_registrado' # For MVP payment registration
         ]
-        read_only_fields = ['data_abertura', 'data_fechamento', 'total_pedido']
+        read_only_fields = ['data_abertura', 'data_fechamento', 'total_pedido', 'quantidade_itens']
 
     # For creating/updating orders, items might be handled by their own dedicated endpoints
     # or by accepting nested writes (more complex, often avoided for simplicity).
     # For MVP, adding items will be via /api/pedidos_mesa/{pedido_id}/itens/
 
 
+class ItemLoteSerializer(serializers.Serializer):
+    # Um item de POST /api/pedidos_mesa/{id}/adicionar-itens/ (produto conferido no serviço, em uma consulta)
+    produto_id = serializers.IntegerField(min_value=1)
+    quantidade = serializers.IntegerField(min_value=1, max_value=999)
+    observacoes_item = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class AdicionarItensSerializer(serializers.Serializer):
+    itens = ItemLoteSerializer(many=True, allow_empty=False, max_length=200)
+
+
+def prefetch_pedidos_ativos():
+    """
+    Prefetch dos pedidos não pagos nem cancelados de cada mesa (em Mesa.pedidos_ativos),
+    com os itens e seus produtos: uma consulta para os pedidos e uma para os itens, para
+    todas as mesas da página (o total já vem gravado em PedidoMesa.total). O prefetch já liga cada pedido à
+    sua mesa e cada item ao seu pedido, sem consultas extras.
+    """
+    pedidos = PedidoMesa.objects.exclude(
+        status_pedido__in=[PedidoMesa.STATUS_PAGO, PedidoMesa.STATUS_CANCELADO]
+    ).prefetch_related(
+        Prefetch('itens_pedido', queryset=ItemPedidoMesa.objects.select_related('produto'))
+    )
+    return Prefetch('pedidos', queryset=pedidos, to_attr='pedidos_ativos')
+
+
 class MesaSerializer(serializers.ModelSerializer):
     # Optionally, include active orders or summary
     # pedidos_ativos = PedidoMesaSerializer(many=True, read_only=True, source='pedidos') # Example if filtering for active
@@ -92,7 +119,9 @@ class MesaSerializer(serializers.ModelSerializer):
 
     def get_pedidos_recentes(self, obj):
         # Get pedidos that are not 'Pago' or 'Cancelado'
-        pedidos_filtrados = obj.pedidos.exclude(status_pedido__in=[PedidoMesa.STATUS_PAGO, PedidoMesa.STATUS_CANCELADO])
+        pedidos_filtrados = getattr(obj, 'pedidos_ativos', None) # Já carregados por prefetch_pedidos_ativos
+        if pedidos_filtrados is None:
+            pedidos_filtrados = obj.pedidos.exclude(status_pedido__in=[PedidoMesa.STATUS_PAGO, PedidoMesa.STATUS_CANCELADO])
         serializer = PedidoMesaSerializer(pedidos_filtrados, many=True, context=self.context)
         return serializer.data
 
@@ -0,0 +1,23 @@
+from django.db.models.signals import post_save, post_delete
+
+from administracao.versoes import incrementar_versao, ESCOPO_MESAS
+from .models import Mesa, PedidoMesa, ItemPedidoMesa
+
+# Toda escrita em mesas, pedidos de mesa e seus itens muda o payload de MesaViewSet.list
+# (que inclui os pedidos em aberto com itens e total), então incrementa a versão 'mesas'.
+
+
+def mesas_alteradas(sender, **kwargs):
+    incrementar_versao(ESCOPO_MESAS)
+
+
+def item_removido(sender, instance, **kwargs):
+    # Também roda em QuerySet.delete() e na cascata do pedido (dentro da transação da remoção)
+    instance.descontar_do_pedido()
+
+
+def conectar_sinais():
+    for modelo in (Mesa, PedidoMesa, ItemPedidoMesa):
+        post_save.connect(mesas_alteradas, sender=modelo, dispatch_uid=f'versao_mesas_{modelo.__name__}_salvo')
+        post_delete.connect(mesas_alteradas, sender=modelo, dispatch_uid=f'versao_mesas_{modelo.__name__}_removido')
+    post_delete.connect(item_removido, sender=ItemPedidoMesa, dispatch_uid='total_pedido_mesa_item_removido')
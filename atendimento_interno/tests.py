@@ -1,8 +1,16 @@
+from decimal import Decimal
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
 from django.urls import reverse
+from django.utils import timezone
 from rest_framework.test import APITestCase
 from rest_framework import status
 
-from .models import Mesa, PedidoMesa, ItemPedidoMesa
+from .models import Mesa, PedidoMesa, ItemPedidoMesa, Produto
+from .totais import reconciliar_totais
 # from products.models import ProdutoPlaceholder as Produto # Using placeholder for now
 # from pagamentos.models import Pagamento # To verify payment creation
 
@@ -207,4 +215,346 @@ class AtendimentoAPITests(APITestCase):
     # - Testar filtros de listagem se houver (ex: listar apenas mesas 'Livres')
     # - Testar o PATCH em PedidoMesa para mudar status_pedido para 'Cancelado' ou 'Fechado'
     #   e verificar o impacto no status_cozinha e status da mesa.
+
+
+class MesaListEtagTests(APITestCase):
+    """ GET /api/mesas/ responde If-None-Match com 304 enquanto nada mudar. """
+    def setUp(self):
+        self.url = reverse('atendimento_interno:mesa-list')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.mesa = Mesa.objects.create(numero_identificador="E01")
+
+    def test_304_sem_consultar_mesas_enquanto_versao_nao_muda(self):
+        response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        with self.assertNumQueries(1): # Apenas o contador de versão
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_escrita_em_pedido_muda_o_etag(self):
+        etag = self.client.get(self.url, format='json')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            PedidoMesa.objects.create(mesa=self.mesa)
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(len(response.data[0]['pedidos_recentes']), 1)
+
+
+class MesaListConsultasTests(APITestCase):
+    """ GET /api/mesas/ faz o mesmo número de consultas para qualquer número de mesas. """
+    url = reverse('atendimento_interno:mesa-list')
+
+    def setUp(self):
+        self.produtos = [Produto.objects.create(nome=f"Pizza {i}", preco_base=30 + i) for i in range(3)]
+
+    def _criar_mesas(self, quantidade, inicio=0):
+        for i in range(inicio, inicio + quantidade):
+            mesa = Mesa.objects.create(numero_identificador=f"C{i:02d}", status=Mesa.STATUS_OCUPADA)
+            pedido = PedidoMesa.objects.create(mesa=mesa)
+            PedidoMesa.objects.create(mesa=mesa, status_pedido=PedidoMesa.STATUS_PAGO) # Fora da listagem
+            for produto in self.produtos:
+                ItemPedidoMesa.objects.create(
+                    pedido_mesa=pedido, produto=produto, quantidade=2, preco_unitario_no_momento=produto.preco_base
+                )
+
+    def _consultas_da_listagem(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return len(contexto.captured_queries), response
+
+    def test_consultas_constantes(self):
+        self._criar_mesas(2)
+        consultas, _ = self._consultas_da_listagem()
+        self._criar_mesas(8, inicio=2)
+        self.assertEqual(self._consultas_da_listagem()[0], consultas)
+        self.assertLessEqual(consultas, 4) # Versão (ETag), mesas, pedidos, itens
+
+    def test_totais_e_itens_na_listagem(self):
+        self._criar_mesas(1)
+        _, response = self._consultas_da_listagem()
+        pedidos = response.data[0]['pedidos_recentes']
+        self.assertEqual(len(pedidos), 1)
+        self.assertEqual(pedidos[0]['total_pedido'], '186.00') # 2 x (30 + 31 + 32)
+        self.assertEqual(pedidos[0]['quantidade_itens'], 6)
+        self.assertEqual(len(pedidos[0]['itens_pedido']), 3)
+        self.assertEqual(pedidos[0]['itens_pedido'][0]['produto']['nome'], 'Pizza 0')
+
+
+class TotaisPedidoMesaTests(APITestCase):
+    """ PedidoMesa.total e quantidade_itens acompanham os itens e são reconciliáveis em lote. """
+    def setUp(self):
+        self.pizza = Produto.objects.create(nome="Pizza Total", preco_base=Decimal('30.00'))
+        self.refri = Produto.objects.create(nome="Refri Total", preco_base=Decimal('6.50'))
+        self.mesa = Mesa.objects.create(numero_identificador="T01")
+        self.pedido = PedidoMesa.objects.create(mesa=self.mesa)
+
+    def _item(self, produto, quantidade, pedido=None):
+        return ItemPedidoMesa.objects.create(
+            pedido_mesa=pedido or self.pedido, produto=produto, quantidade=quantidade,
+            preco_unitario_no_momento=produto.preco_base,
+        )
+
+    def _gravados(self, pedido=None):
+        pedido = PedidoMesa.objects.get(pk=(pedido or self.pedido).pk)
+        return pedido.total, pedido.quantidade_itens
+
+    def test_criar_alterar_e_remover_itens(self):
+        item_pizza = self._item(self.pizza, 2)
+        item_refri = self._item(self.refri, 3)
+        self.assertEqual(self._gravados(), (Decimal('79.50'), 5))
+        self.assertEqual(self.pedido.calcular_total(), Decimal('79.50')) # Instância em memória acompanha
+
+        item_pizza.quantidade = 1
+        item_pizza.save()
+        self.assertEqual(self._gravados(), (Decimal('49.50'), 4))
+
+        item_refri.delete()
+        self.assertEqual(self._gravados(), (Decimal('30.00'), 1))
+
+    def test_instancia_desatualizada_nao_perde_incrementos(self):
+        item = self._item(self.pizza, 1)
+        desatualizado = ItemPedidoMesa.objects.get(pk=item.pk)
+        item.quantidade = 3
+        item.save()
+        desatualizado.quantidade = 2 # Delta calculado sobre o valor gravado (3), não o lido (1)
+        desatualizado.save()
+        self.assertEqual(self._gravados(), (Decimal('60.00'), 2))
+
+        pedido_antigo = PedidoMesa.objects.get(pk=self.pedido.pk)
+        self._item(self.refri, 2)
+        pedido_antigo.observacoes_gerais = "Sem cebola"
+        pedido_antigo.save() # Não sobrescreve o total com o valor lido antes do item
+        self.assertEqual(self._gravados(), (Decimal('73.00'), 4))
+
+    def test_mover_item_para_outro_pedido(self):
+        outro = PedidoMesa.objects.create(mesa=Mesa.objects.create(numero_identificador="T02"))
+        item = self._item(self.pizza, 2)
+        item.pedido_mesa = outro
+        item.save()
+        self.assertEqual(self._gravados(), (Decimal('0.00'), 0))
+        self.assertEqual(self._gravados(outro), (Decimal('60.00'), 2))
+
+    def test_remocao_em_lote_desconta_do_pedido(self):
+        self._item(self.pizza, 2)
+        self._item(self.refri, 1)
+        ItemPedidoMesa.objects.filter(pedido_mesa=self.pedido).delete()
+        self.assertEqual(self._gravados(), (Decimal('0.00'), 0))
+
+    def test_reconciliacao_corrige_escritas_em_lote(self):
+        self._item(self.pizza, 1)
+        outro = PedidoMesa.objects.create(mesa=Mesa.objects.create(numero_identificador="T02"))
+        ItemPedidoMesa.objects.bulk_create([ # Não passa por save(): total fica em zero
+            ItemPedidoMesa(pedido_mesa=outro, produto=self.refri, quantidade=2,
+                           preco_unitario_no_momento=Decimal('6.50'), subtotal_item=Decimal('13.00')),
+        ])
+        PedidoMesa.objects.filter(pk=self.pedido.pk).update(total=Decimal('1.00'))
+
+        verificados, divergencias = reconciliar_totais(PedidoMesa.objects.all())
+        self.assertEqual(verificados, 2)
+        self.assertEqual(sorted(divergencia.pedido_id for divergencia in divergencias), [self.pedido.pk, outro.pk])
+        self.assertEqual(self._gravados(outro), (Decimal('0.00'), 0)) # Sem corrigir, só relata
+
+        saida = StringIO()
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            call_command('reconciliar_totais_mesa', '--corrigir', '--lote', '1', stdout=saida)
+        self.assertIn("2 corrigidos", saida.getvalue())
+        self.assertTrue(callbacks) # Versão das mesas incrementada (ETag)
+        self.assertEqual(self._gravados(), (Decimal('30.00'), 1))
+        self.assertEqual(self._gravados(outro), (Decimal('13.00'), 2))
+        self.assertEqual(reconciliar_totais(PedidoMesa.objects.all())[1], [])
+
+
+class MapaMesasTests(APITestCase):
+    """ GET /api/mesas/mapa/: resumo por mesa, em cache e invalidado pela versão 'mesas'. """
+    url = reverse('atendimento_interno:mesa-mapa')
+
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear() # A versão volta a zero a cada teste; entradas antigas não podem sobrar
+        self.pizza = Produto.objects.create(nome="Pizza Mapa", preco_base=Decimal('40.00'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Mesa.objects.create(numero_identificador="A01")
+            self.mesa = Mesa.objects.create(numero_identificador="A02", status=Mesa.STATUS_OCUPADA)
+            self.pedido = PedidoMesa.objects.create(
+                mesa=self.mesa, data_abertura=timezone.now() - timezone.timedelta(minutes=25)
+            )
+            PedidoMesa.objects.create(mesa=self.mesa, status_pedido=PedidoMesa.STATUS_PAGO)
+            ItemPedidoMesa.objects.create(
+                pedido_mesa=self.pedido, produto=self.pizza, quantidade=2, preco_unitario_no_momento=Decimal('40.00')
+            )
+
+    def test_resumo_por_mesa(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        livre, ocupada = response.data
+        self.assertEqual(livre, {'id': livre['id'], 'numero_identificador': 'A01', 'status': Mesa.STATUS_LIVRE, 'pedido': None})
+        self.assertEqual(ocupada['pedido'], {
+            'id': self.pedido.id, 'status': PedidoMesa.STATUS_ABERTO, 'total': '80.00', 'itens': 2, 'minutos': 25,
+        })
+
+    def test_consultas_e_cache(self):
+        with self.assertNumQueries(3): # Versão (ETag), versão (chave do cache) e as linhas
+            etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(2): # Linhas já em cache nesta versão
+            self.client.get(self.url)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_escrita_em_item_invalida(self):
+        etag = self.client.get(self.url)['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            ItemPedidoMesa.objects.create(
+                pedido_mesa=self.pedido, produto=Produto.objects.create(nome="Refri Mapa", preco_base=Decimal('7.00')),
+                quantidade=1, preco_unitario_no_momento=Decimal('7.00'),
+            )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[1]['pedido']['total'], '87.00')
+        self.assertEqual(response.data[1]['pedido']['itens'], 3)
+
+
+class AdicionarItensLoteTests(APITestCase):
+    """ POST /api/pedidos_mesa/{id}/adicionar-itens/: a comanda inteira em uma transação. """
+    def setUp(self):
+        self.produtos = [Produto.objects.create(nome=f"Lote {i}", preco_base=Decimal('10.00') + i) for i in range(12)]
+        self.mesa = Mesa.objects.create(numero_identificador="L01", status=Mesa.STATUS_OCUPADA)
+        self.pedido = PedidoMesa.objects.create(mesa=self.mesa)
+        self.url = reverse('atendimento_interno:pedidomesa-adicionar-itens', kwargs={'pk': self.pedido.pk})
+
+    def _itens(self, quantidade):
+        return [{'produto_id': produto.id, 'quantidade': 1} for produto in self.produtos[:quantidade]]
+
+    def test_agrupa_repetidos_e_soma_nos_existentes(self):
+        from cozinha_api.models import KitchenTicket
+        ItemPedidoMesa.objects.create(
+            pedido_mesa=self.pedido, produto=self.produtos[0], quantidade=1,
+            preco_unitario_no_momento=Decimal('9.00'), observacoes_item="Sem cebola",
+        )
+        response = self.client.post(self.url, {'itens': [
+            {'produto_id': self.produtos[0].id, 'quantidade': 2, 'observacoes_item': "Bem passada"},
+            {'produto_id': self.produtos[1].id, 'quantidade': 1},
+            {'produto_id': self.produtos[1].id, 'quantidade': 3},
+        ]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        itens = {item.produto_id: item for item in self.pedido.itens_pedido.all()}
+        self.assertEqual(len(itens), 2)
+        self.assertEqual(itens[self.produtos[0].id].quantidade, 3)
+        self.assertEqual(itens[self.produtos[0].id].subtotal_item, Decimal('27.00')) # Preço lançado antes
+        self.assertEqual(itens[self.produtos[0].id].observacoes_item, "Sem cebola; Bem passada")
+        self.assertEqual(itens[self.produtos[1].id].quantidade, 4)
+        self.assertEqual(response.data['total_pedido'], '71.00') # 27 + 4 x 11
+        self.assertEqual(response.data['quantidade_itens'], 7)
+        self.assertEqual(reconciliar_totais(PedidoMesa.objects.all())[1], [])
+
+        self.pedido.refresh_from_db()
+        self.assertEqual(self.pedido.status_cozinha, PedidoMesa.STATUS_COZINHA_AGUARDANDO)
+        ticket = KitchenTicket.objects.get(object_id=self.pedido.pk)
+        self.assertEqual(sorted(item['quantidade'] for item in ticket.itens), [3, 4])
+
+    def test_consultas_nao_crescem_com_os_itens(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        consultas = []
+        for quantidade in (2, 12):
+            pedido = PedidoMesa.objects.create(mesa=Mesa.objects.create(numero_identificador=f"L{quantidade}"))
+            url = reverse('atendimento_interno:pedidomesa-adicionar-itens', kwargs={'pk': pedido.pk})
+            with CaptureQueriesContext(connection) as contexto:
+                response = self.client.post(url, {'itens': self._itens(quantidade)}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            self.assertEqual(len(response.data['itens_pedido']), quantidade)
+            consultas.append(len(contexto.captured_queries))
+        self.assertEqual(consultas[0], consultas[1])
+
+    def test_produto_inexistente_nao_grava_nada(self):
+        itens = self._itens(2) + [{'produto_id': 999999, 'quantidade': 1}]
+        response = self.client.post(self.url, {'itens': itens}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn("999999", response.data['detail'])
+        self.assertFalse(self.pedido.itens_pedido.exists())
+        self.pedido.refresh_from_db()
+        self.assertEqual((self.pedido.total, self.pedido.status_cozinha), (Decimal('0.00'), None))
+
+    def test_pedido_fechado_ou_lista_vazia(self):
+        self.assertEqual(self.client.post(self.url, {'itens': []}, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        PedidoMesa.objects.filter(pk=self.pedido.pk).update(status_pedido=PedidoMesa.STATUS_FECHADO)
+        response = self.client.post(self.url, {'itens': self._itens(1)}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AberturaPagamentoConcorrentesTests(APITestCase):
+    """ Um pedido ativo por mesa e um pagamento por pedido, mesmo com requisições simultâneas. """
+    def setUp(self):
+        self.mesa = Mesa.objects.create(numero_identificador="P01")
+        self.url_abrir = reverse('atendimento_interno:mesa-criar-pedido-para-mesa', kwargs={'pk': self.mesa.pk})
+
+    def _pagar(self, pedido):
+        url = reverse('atendimento_interno:pedidomesa-registrar-pagamento', kwargs={'pk': pedido.pk})
+        return self.client.post(url, {'metodo': 'dinheiro', 'valor_pago': '50.00'}, format='json')
+
+    def test_segunda_abertura_devolve_o_pedido_existente(self):
+        response = self.client.post(self.url_abrir, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        repetida = self.client.post(self.url_abrir, {}, format='json')
+        self.assertEqual(repetida.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(repetida.data['pedido_existente']['id'], response.data['id'])
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.status, Mesa.STATUS_OCUPADA)
+
+    def test_restricao_barra_segundo_pedido_ativo(self):
+        from django.db import IntegrityError, transaction
+        PedidoMesa.objects.create(mesa=self.mesa)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            PedidoMesa.objects.create(mesa=self.mesa, status_pedido=PedidoMesa.STATUS_FECHADO)
+        PedidoMesa.objects.create(mesa=self.mesa, status_pedido=PedidoMesa.STATUS_PAGO) # Finalizados não contam
+
+    def test_abertura_que_perde_a_corrida_devolve_o_pedido_da_outra(self):
+        from unittest.mock import patch
+        from .pedidos import abrir_pedido
+        existente = PedidoMesa.objects.create(mesa=self.mesa)
+        # A leitura não vê o pedido (criado por outra requisição logo depois dela): o INSERT decide
+        with patch.object(PedidoMesa.objects, 'filter', return_value=PedidoMesa.objects.none()):
+            pedido, criado = abrir_pedido(self.mesa)
+        self.assertEqual((pedido.pk, criado), (existente.pk, False))
+        self.assertEqual(PedidoMesa.objects.filter(mesa=self.mesa).count(), 1)
+
+    def test_pagamento_repetido_nao_grava_de_novo(self):
+        from django.contrib.contenttypes.models import ContentType
+        from pagamentos.models import Pagamento
+        pedido = PedidoMesa.objects.create(mesa=self.mesa, status_pedido=PedidoMesa.STATUS_FECHADO)
+        Mesa.objects.filter(pk=self.mesa.pk).update(status=Mesa.STATUS_AGUARDANDO_PAGAMENTO)
+
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            response = self._pagar(pedido)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status_pedido'], PedidoMesa.STATUS_PAGO)
+        self.assertTrue(callbacks) # Versão 'mesas' incrementada (os UPDATEs não disparam sinais)
+        self.assertEqual(self._pagar(pedido).status_code, status.HTTP_400_BAD_REQUEST)
+
+        pagamentos = Pagamento.objects.filter(content_type=ContentType.objects.get_for_model(PedidoMesa), object_id=pedido.pk)
+        self.assertEqual(list(pagamentos.values_list('valor_pago', flat=True)), [Decimal('50.00')])
+        self.mesa.refresh_from_db()
+        self.assertEqual(self.mesa.status, Mesa.STATUS_LIVRE)
+
+
+class AberturaPagamentoStressTests(TransactionTestCase):
+    """ Várias threads abrindo e pagando as mesmas mesas: nenhum pedido duplicado nem pagamento em dobro. """
+    def setUp(self):
+        # Verificado aqui, e não na carga do módulo: só agora a conexão aponta para o banco de teste
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite em memória não é compartilhado entre threads.")
+
+    def test_threads_disputando_as_mesmas_mesas(self):
+        saida = StringIO()
+        call_command('stress_mesas', threads=6, mesas=4, rodadas=2, stdout=saida)
+        self.assertIn("Nenhum pedido duplicado nem pagamento em dobro.", saida.getvalue())
+
 ```
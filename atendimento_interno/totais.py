@@ -0,0 +1,74 @@
+"""
+Conferência dos totais gravados em PedidoMesa (total e quantidade_itens) contra a soma
+dos seus ItemPedidoMesa. No dia a dia eles são mantidos por incremento (ItemPedidoMesa.save
+e o post_delete em signals.py); escritas em lote (bulk_create/update, SQL direto) não passam
+por ali e deixam o total desatualizado até a reconciliação.
+"""
+import collections
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Sum
+
+from administracao.versoes import incrementar_versao, ESCOPO_MESAS
+from .models import PedidoMesa, ItemPedidoMesa
+
+ZERO = Decimal('0.00')
+
+Divergencia = collections.namedtuple(
+    'Divergencia', 'pedido_id total_gravado total_itens quantidade_gravada quantidade_itens'
+)
+
+
+def somas_dos_itens(pedido_ids):
+    """ {pedido_id: (soma dos subtotais, soma das quantidades)} em uma consulta agrupada. """
+    return {
+        pedido_id: (total, quantidade)
+        for pedido_id, total, quantidade in ItemPedidoMesa.objects.filter(pedido_mesa_id__in=pedido_ids)
+        .order_by().values('pedido_mesa_id')
+        .annotate(total=Sum('subtotal_item'), quantidade=Sum('quantidade'))
+        .values_list('pedido_mesa_id', 'total', 'quantidade')
+    }
+
+
+def reconciliar_totais(pedidos, corrigir=False, tamanho_lote=500):
+    """
+    Confere os pedidos (queryset) em lotes: uma leitura dos pedidos e uma soma agrupada
+    dos itens por lote. Com corrigir=True, os pedidos do lote ficam travados enquanto
+    são conferidos e os divergentes são regravados com um bulk_update; um item salvo
+    ao mesmo tempo espera a trava e aplica seu incremento sobre o valor corrigido.
+    Retorna (pedidos verificados, [Divergencia]).
+    """
+    verificados, divergencias = 0, []
+    lote = []
+    for pedido_id in pedidos.order_by('pk').values_list('pk', flat=True).iterator(chunk_size=tamanho_lote):
+        lote.append(pedido_id)
+        if len(lote) >= tamanho_lote:
+            divergencias += _reconciliar_lote(lote, corrigir)
+            verificados += len(lote)
+            lote = []
+    if lote:
+        divergencias += _reconciliar_lote(lote, corrigir)
+        verificados += len(lote)
+    return verificados, divergencias
+
+
+def _reconciliar_lote(pedido_ids, corrigir):
+    with transaction.atomic():
+        gravados = PedidoMesa.objects.filter(pk__in=pedido_ids).only('pk', 'total', 'quantidade_itens')
+        if corrigir:
+            gravados = gravados.select_for_update()
+        gravados = list(gravados) # Trava antes de somar os itens
+        somas = somas_dos_itens(pedido_ids)
+        divergencias, corrigidos = [], []
+        for pedido in gravados:
+            total, quantidade = somas.get(pedido.pk, (ZERO, 0))
+            if pedido.total == total and pedido.quantidade_itens == quantidade:
+                continue
+            divergencias.append(Divergencia(pedido.pk, pedido.total, total, pedido.quantidade_itens, quantidade))
+            pedido.total, pedido.quantidade_itens = total, quantidade
+            corrigidos.append(pedido)
+        if corrigir and corrigidos:
+            PedidoMesa.objects.bulk_update(corrigidos, ['total', 'quantidade_itens'])
+            incrementar_versao(ESCOPO_MESAS) # bulk_update não dispara os sinais
+    return divergencias
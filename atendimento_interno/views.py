@@ -1,20 +1,46 @@
+import logging
+
 from rest_framework import viewsets, status, generics
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.utils import timezone
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 
 from .models import Mesa, PedidoMesa, ItemPedidoMesa, Produto # Using placeholder Produto
 from .serializers import (
-    MesaSerializer, PedidoMesaSerializer, ItemPedidoMesaSerializer,
-    MesaStatusUpdateSerializer, PagamentoRegistroSerializer, PedidoMesaUpdateSerializer
+    prefetch_pedidos_ativos, MesaSerializer, PedidoMesaSerializer, ItemPedidoMesaSerializer,
+    MesaStatusUpdateSerializer, PagamentoRegistroSerializer, PedidoMesaUpdateSerializer, AdicionarItensSerializer
 )
 # from products.models import Produto # Would be used in a real multi-app setup
+from administracao.versoes import etag_por_escopo, ESCOPO_MESAS
+from cozinha_api.eventos import publicar_evento_cozinha, EVENTO_PEDIDO_ENTROU, EVENTO_PEDIDO_ATUALIZADO
+from cozinha_api.services import serializar_pedido_cozinha
+from .mapa import mapa_do_salao, etag_mapa
+from .itens import adicionar_itens_ao_pedido
+from .pedidos import abrir_pedido, registrar_pagamento_mesa
+
+logger = logging.getLogger(__name__)
+
+
+def _notificar_cozinha(pedido, tipo_evento):
+    """Publica no stream da cozinha o estado atual (com itens) de um PedidoMesa."""
+    publicar_evento_cozinha(tipo_evento, serializar_pedido_cozinha(pedido))
+
+
+def _pedido_na_fila_cozinha(pedido):
+    return pedido.status_cozinha in [PedidoMesa.STATUS_COZINHA_AGUARDANDO, PedidoMesa.STATUS_COZINHA_EM_PREPARO]
+
 
+@method_decorator(condition(etag_func=etag_por_escopo(ESCOPO_MESAS)), name='list')
 class MesaViewSet(viewsets.ModelViewSet):
     """
     API endpoint para Mesas.
-    - Listar todas as mesas: `GET /api/mesas/`
+    - Listar todas as mesas: `GET /api/mesas/` (com ETag; If-None-Match sem mudanças -> 304)
+    - Mapa resumido do salão: `GET /api/mesas/mapa/` (sem itens, em cache; ver mapa.py)
     - Detalhes de uma mesa: `GET /api/mesas/{mesa_id}/`
     - Atualizar status da mesa: `PATCH /api/mesas/{mesa_id}/atualizar_status/` (custom action)
     - Criar/Atualizar/Deletar mesas (geralmente via admin ou setup inicial, mas ModelViewSet provê).
@@ -22,6 +48,19 @@ class MesaViewSet(viewsets.ModelViewSet):
     queryset = Mesa.objects.all().order_by('numero_identificador')
     serializer_class = MesaSerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'retrieve'):
+            # Salão inteiro em três consultas, qualquer que seja o número de mesas
+            queryset = queryset.prefetch_related(prefetch_pedidos_ativos())
+        return queryset
+
+    @action(detail=False, methods=['get'], url_path='mapa')
+    @method_decorator(condition(etag_func=etag_mapa))
+    def mapa(self, request):
+        # Tela inicial do garçom: só o resumo de cada mesa e do seu pedido em aberto
+        return Response(mapa_do_salao())
+
     @action(detail=True, methods=['patch'], serializer_class=MesaStatusUpdateSerializer, url_path='atualizar-status')
     def atualizar_status(self, request, pk=None):
         mesa = self.get_object()
@@ -48,26 +87,15 @@ class MesaViewSet(viewsets.ModelViewSet):
     @action(detail=True, methods=['post'], serializer_class=PedidoMesaSerializer, url_path='pedidos')
     def criar_pedido_para_mesa(self, request, pk=None):
         mesa = self.get_object()
+        # Dois garçons abrindo a mesma mesa: só um pedido é criado (ver pedidos.abrir_pedido)
+        try:
+            pedido, criado = abrir_pedido(mesa)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if mesa.status == Mesa.STATUS_INTERDITADA:
-            return Response({'detail': 'Mesa está interditada.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Verifica se já existe um pedido aberto ou aguardando pagamento para esta mesa
-        pedido_existente_aberto = PedidoMesa.objects.filter(
-            mesa=mesa, 
-            status_pedido__in=[PedidoMesa.STATUS_ABERTO, PedidoMesa.STATUS_FECHADO]
-        ).first()
-
-        if pedido_existente_aberto:
-            serializer = PedidoMesaSerializer(pedido_existente_aberto)
-            return Response({'detail': 'Mesa já possui um pedido aberto ou fechado.', 'pedido_existente': serializer.data}, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Criar novo pedido
-        pedido = PedidoMesa.objects.create(mesa=mesa, status_pedido=PedidoMesa.STATUS_ABERTO)
-        mesa.status = Mesa.STATUS_OCUPADA
-        mesa.save()
-        
         serializer = PedidoMesaSerializer(pedido)
+        if not criado:
+            return Response({'detail': 'Mesa já possui um pedido aberto ou fechado.', 'pedido_existente': serializer.data}, status=status.HTTP_400_BAD_REQUEST)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
@@ -77,6 +105,7 @@ class PedidoMesaViewSet(viewsets.ModelViewSet):
     - Detalhes de um pedido: `GET /api/pedidos_mesa/{pedido_id}/`
     - Atualizar pedido: `PATCH /api/pedidos_mesa/{pedido_id}/` (ex: observação, fechar)
     - Listar todos os pedidos (para admin/gerenciamento): `GET /api/pedidos_mesa/`
+    - Adicionar vários itens de uma vez: `POST /api/pedidos_mesa/{pedido_id}/adicionar-itens/`
     """
     queryset = PedidoMesa.objects.all().order_by('-data_abertura')
     serializer_class = PedidoMesaSerializer # Para list e retrieve
@@ -111,87 +140,46 @@ class PedidoMesaViewSet(viewsets.ModelViewSet):
 
         serializer.save()
 
+    @action(detail=True, methods=['post'], serializer_class=AdicionarItensSerializer, url_path='adicionar-itens')
+    def adicionar_itens(self, request, pk=None):
+        # Comanda inteira da mesa em uma requisição: {"itens": [{"produto_id", "quantidade", "observacoes_item"}]}
+        serializer = AdicionarItensSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            pedido, entrou_na_cozinha = adicionar_itens_ao_pedido(pk, serializer.validated_data['itens'])
+        except PedidoMesa.DoesNotExist:
+            return Response({'detail': 'Pedido não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if entrou_na_cozinha:
+            _notificar_cozinha(pedido, EVENTO_PEDIDO_ENTROU)
+        elif _pedido_na_fila_cozinha(pedido):
+            _notificar_cozinha(pedido, EVENTO_PEDIDO_ATUALIZADO)
+
+        pedido = PedidoMesa.objects.select_related('mesa').prefetch_related(
+            Prefetch('itens_pedido', queryset=ItemPedidoMesa.objects.select_related('produto'))
+        ).get(pk=pedido.pk)
+        return Response(PedidoMesaSerializer(pedido).data, status=status.HTTP_201_CREATED)
+
     @action(detail=True, methods=['post'], serializer_class=PagamentoRegistroSerializer, url_path='registrar-pagamento')
     def registrar_pagamento(self, request, pk=None):
         pedido = self.get_object()
         serializer = PagamentoRegistroSerializer(data=request.data)
-
-        if pedido.status_pedido not in [PedidoMesa.STATUS_FECHADO, PedidoMesa.STATUS_ABERTO]: # Permitir pagar pedido aberto também
-            return Response({'detail': f'Não é possível registrar pagamento para pedido com status "{pedido.get_status_pedido_display()}".'}, status=status.HTTP_400_BAD_REQUEST)
-
-        if serializer.is_valid():
-            metodo_pagamento_req = serializer.validated_data['metodo']
-            valor_pago_req = serializer.validated_data['valor_pago']
-
-            # Usar o serviço de pagamentos para criar o registro de Pagamento
-            try:
-                from pagamentos.services import registrar_pagamento_para_pedido
-                from pagamentos.models import Pagamento # Para acesso a choices e mapeamento de métodos
-
-                # Mapear o método de pagamento do request para os choices do modelo Pagamento, se necessário
-                # Neste caso, os choices em PagamentoRegistroSerializer já são baseados nos do PedidoMesa,
-                # mas o modelo Pagamento pode ter mais opções ou nomes ligeiramente diferentes.
-                # Para MVP, vamos assumir que os valores de 'metodo_pagamento_req' são compatíveis.
-                # Ex: se PedidoMesa usa 'cartao_maquineta' e Pagamento usa 'cartao_credito_maquineta'/'cartao_debito_maquineta'
-                # seria necessário um mapeamento. Por ora, vamos usar o valor diretamente.
-                # Se 'cartao_maquineta' é genérico, podemos mapeá-lo para um dos específicos ou 'outro'.
-                # Para este exemplo, vamos assumir que os métodos são diretamente compatíveis ou que
-                # Pagamento.METODO_CARTAO_CREDITO_MAQUINETA e Pagamento.METODO_CARTAO_DEBITO_MAQUINETA
-                # são os esperados se o método for 'cartao_maquineta'.
-                # O serializer do pedido usa: ('dinheiro', 'Dinheiro'), ('cartao_maquineta', 'Cartão (Maquineta)'), ('pix_maquineta', 'PIX (Maquineta)')
-
-                metodo_pagamento_modelo = metodo_pagamento_req # Default
-                if metodo_pagamento_req == 'cartao_maquineta':
-                    # Decidir se é crédito ou débito é Pós-MVP para o modelo Pagamento.
-                    # Por enquanto, podemos usar um genérico ou um default.
-                    # Vamos usar Pagamento.METODO_CARTAO_CREDITO_MAQUINETA como exemplo se for só 'cartao_maquineta'
-                    # Ou melhor, adicionar 'cartao_maquineta_generico' ao modelo Pagamento ou usar 'outro'.
-                    # Para MVP, vamos apenas passar o que veio, assumindo compatibilidade ou que o modelo Pagamento tem essa opção.
-                    # Se o modelo Pagamento tem 'cartao_credito_maquineta' e 'cartao_debito_maquineta',
-                    # o frontend precisaria enviar qual foi usado.
-                    # O mais simples é o modelo Pagamento também ter 'cartao_maquineta'.
-                    # Olhando o modelo Pagamento: ele tem METODO_CARTAO_DEBITO_MAQUINETA e METODO_CARTAO_CREDITO_MAQUINETA
-                    # Então, o frontend precisaria ser mais específico, ou o atendente.
-                    # Para MVP, vamos simplificar: se for 'cartao_maquineta', registramos como METODO_OUTRO ou um default.
-                    # Ou melhor: O `PagamentoRegistroSerializer` deve ser atualizado para ter as mesmas opções do `Pagamento.METODO_PAGAMENTO_CHOICES`
-                    # Por agora, vamos assumir que `metodo_pagamento_req` é um valor válido em `Pagamento.METODO_PAGAMENTO_CHOICES`.
-                    # O ideal é que o PagamentoRegistroSerializer use os choices de Pagamento.
-                    # Vou fazer um ajuste no PagamentoRegistroSerializer depois.
-                    # Por agora, vamos assumir que o valor é compatível.
-                    pass # Usar metodo_pagamento_req diretamente
-
-                registrar_pagamento_para_pedido(
-                    pedido_obj=pedido,
-                    metodo_pagamento=metodo_pagamento_req, 
-                    valor_pago=valor_pago_req,
-                    status_pagamento=Pagamento.STATUS_APROVADO # Pagamentos manuais são aprovados
-                )
-                logger.info(f"Pagamento manual registrado para PedidoMesa ID {pedido.id}")
-            except Exception as e:
-                logger.error(f"Erro ao registrar pagamento para PedidoMesa ID {pedido.id} via serviço: {e}")
-                # Considerar se a transação deve ser abortada ou se o log é suficiente.
-                # Por ora, continua para atualizar o pedido e a mesa.
-            
-            # Atualizar PedidoMesa (como já estava fazendo)
-            # Estes campos em PedidoMesa são para registro simplificado, o Pagamento é o mestre.
-            pedido.metodo_pagamento_registrado = metodo_pagamento_req
-            pedido.valor_pago_registrado = valor_pago_req
-            pedido.status_pedido = PedidoMesa.STATUS_PAGO
-            pedido.data_fechamento = timezone.now() # Garante que está fechado
-            pedido.save()
-
-            # Liberar a mesa se não houver outros pedidos abertos/fechados para ela
-            outros_pedidos_nao_finalizados = PedidoMesa.objects.filter(
-                mesa=pedido.mesa,
-                status_pedido__in=[PedidoMesa.STATUS_ABERTO, PedidoMesa.STATUS_FECHADO]
-            ).exists() # Não precisa excluir o pedido atual, pois ele já está sendo marcado como PAGO
-
-            if not outros_pedidos_nao_finalizados:
-                pedido.mesa.status = Mesa.STATUS_LIVRE
-                pedido.mesa.save()
-            
-            return Response(PedidoMesaSerializer(pedido).data, status=status.HTTP_200_OK)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        # Pedido pago, Pagamento gravado e mesa liberada na mesma transação; um segundo
+        # pagamento simultâneo do mesmo pedido recebe 400 sem gravar nada (ver pedidos.py).
+        # Os métodos de PagamentoRegistroSerializer já são os choices do modelo Pagamento.
+        try:
+            pedido = registrar_pagamento_mesa(
+                pedido.pk, serializer.validated_data['metodo'], serializer.validated_data['valor_pago']
+            )
+        except ValueError as e:
+            return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        logger.info(f"Pagamento manual registrado para PedidoMesa ID {pedido.id}")
+        return Response(PedidoMesaSerializer(pedido).data, status=status.HTTP_200_OK)
 
 
 class ItemPedidoMesaViewSet(viewsets.ModelViewSet):
@@ -212,6 +200,7 @@ class ItemPedidoMesaViewSet(viewsets.ModelViewSet):
             return self.queryset.filter(pedido_mesa_id=pedido_id)
         return self.queryset # Ou retornar um empty queryset se pedido_id for obrigatório para listar
 
+    @transaction.atomic # Pedido, item e ticket da cozinha na mesma transação
     def perform_create(self, serializer):
         pedido_id = self.kwargs.get('pedido_mesa_pk')
         pedido = get_object_or_404(PedidoMesa, id=pedido_id)
@@ -233,6 +222,7 @@ class ItemPedidoMesaViewSet(viewsets.ModelViewSet):
         # Assumindo que o frontend pode enviar um PUT para um item existente para mudar quantidade.
 
         # Set kitchen status for the order if this is the first item or order is being reopened for kitchen
+        entrou_na_cozinha = False
         if pedido.status_cozinha is None or pedido.status_cozinha not in [PedidoMesa.STATUS_COZINHA_AGUARDANDO, PedidoMesa.STATUS_COZINHA_EM_PREPARO, PedidoMesa.STATUS_COZINHA_PRONTO]:
             # This logic might be too simple. What if an order was 'Entregue' and items are added?
             # For MVP, assume adding items to an 'Aberto' order sends it to kitchen if not already there.
@@ -242,23 +232,38 @@ class ItemPedidoMesaViewSet(viewsets.ModelViewSet):
                     pedido.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
                     pedido.horario_entrada_cozinha = timezone.now()
                     pedido.save() # Save the parent PedidoMesa
+                    entrou_na_cozinha = True
 
         serializer.save(pedido_mesa=pedido, preco_unitario_no_momento=preco_no_momento)
 
+        if entrou_na_cozinha:
+            _notificar_cozinha(pedido, EVENTO_PEDIDO_ENTROU)
+        elif _pedido_na_fila_cozinha(pedido):
+            _notificar_cozinha(pedido, EVENTO_PEDIDO_ATUALIZADO)
+
+    @transaction.atomic
     def perform_update(self, serializer):
         item = serializer.instance
         if item.pedido_mesa.status_pedido != PedidoMesa.STATUS_ABERTO:
             raise serializers.ValidationError(f"Não é possível modificar itens de um pedido que não está 'Aberto'. Status: {item.pedido_mesa.get_status_pedido_display()}")
         serializer.save()
 
+        if _pedido_na_fila_cozinha(item.pedido_mesa):
+            _notificar_cozinha(item.pedido_mesa, EVENTO_PEDIDO_ATUALIZADO)
+
+    @transaction.atomic
     def perform_destroy(self, instance):
         if instance.pedido_mesa.status_pedido != PedidoMesa.STATUS_ABERTO:
              raise serializers.ValidationError(
                 {"detail": f"Não é possível remover itens de um pedido que não está 'Aberto'. Status: {instance.pedido_mesa.get_status_pedido_display()}"},
                 code=status.HTTP_400_BAD_REQUEST
             )
+        pedido = instance.pedido_mesa
         instance.delete()
 
+        if _pedido_na_fila_cozinha(pedido):
+            _notificar_cozinha(pedido, EVENTO_PEDIDO_ATUALIZADO)
+
 # Para as rotas aninhadas como /api/pedidos_mesa/{pedido_id}/itens/
 # vamos precisar de um ViewSet que não seja ModelViewSet padrão para o POST,
 # ou ajustar o ModelViewSet para lidar com a criação dentro do contexto do pedido.
@@ -4,3 +4,8 @@ class CozinhaApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'cozinha_api'
     verbose_name = 'API da Cozinha'
+
+    def ready(self):
+        # Sincronização da projeção KitchenTicket com os pedidos de origem
+        from .signals import conectar_sinais
+        conectar_sinais()
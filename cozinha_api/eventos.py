@@ -0,0 +1,84 @@
+import itertools
+import logging
+import queue
+import threading
+
+from django.db import transaction
+
+logger = logging.getLogger(__name__)
+
+# Tipos de evento enviados pelo stream da fila da cozinha
+EVENTO_SNAPSHOT = 'snapshot'                 # Fila completa (enviado ao conectar e ao ressincronizar)
+EVENTO_PEDIDO_ENTROU = 'pedido_entrou'       # Pedido entrou na fila (payload: pedido consolidado)
+EVENTO_PEDIDO_ATUALIZADO = 'pedido_atualizado' # Itens de um pedido já na fila mudaram (payload: pedido consolidado)
+EVENTO_STATUS_ALTERADO = 'status_alterado'   # Pedido continua na fila com outro status (ex: EmPreparo)
+EVENTO_PEDIDO_SAIU = 'pedido_saiu'           # Pedido saiu da fila (ex: Pronto)
+
+# Evento interno: o assinante perdeu eventos e precisa receber um novo snapshot
+EVENTO_RESSINCRONIZAR = 'ressincronizar'
+
+
+class BarramentoEventosCozinha:
+    """
+    Barramento publish/subscribe em memória para as mudanças da fila da cozinha.
+
+    Cada assinante (uma conexão de stream) recebe sua própria fila limitada.
+    Se um assinante lento estourar a fila, os eventos pendentes são descartados
+    e ele recebe um EVENTO_RESSINCRONIZAR, para reenviar o snapshot completo.
+
+    O barramento é por processo: com vários processos (ex: gunicorn com múltiplos
+    workers), o stream só recebe por aqui os eventos gerados no mesmo processo.
+    As mudanças dos outros processos são detectadas pelo stream ao reler a versão
+    'cozinha' (ContadorVersao), que então reenvia o snapshot (ver cozinha_api/views.py).
+    """
+    def __init__(self, tamanho_fila_assinante=500):
+        self.tamanho_fila_assinante = tamanho_fila_assinante
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self._sequencia = itertools.count(1)
+
+    def assinar(self):
+        fila = queue.Queue(maxsize=self.tamanho_fila_assinante)
+        with self._lock:
+            self._assinantes.add(fila)
+        return fila
+
+    def cancelar_assinatura(self, fila):
+        with self._lock:
+            self._assinantes.discard(fila)
+
+    @property
+    def total_assinantes(self):
+        with self._lock:
+            return len(self._assinantes)
+
+    def publicar(self, tipo, dados):
+        evento = {'id': next(self._sequencia), 'tipo': tipo, 'dados': dados}
+        with self._lock:
+            assinantes = list(self._assinantes)
+        for fila in assinantes:
+            try:
+                fila.put_nowait(evento)
+            except queue.Full:
+                logger.warning("Assinante do stream da cozinha atrasado; forçando ressincronização.")
+                self._forcar_ressincronizacao(fila)
+        return evento
+
+    def _forcar_ressincronizacao(self, fila):
+        try:
+            while True:
+                fila.get_nowait()
+        except queue.Empty:
+            pass
+        fila.put_nowait({'id': next(self._sequencia), 'tipo': EVENTO_RESSINCRONIZAR, 'dados': None})
+
+
+barramento_cozinha = BarramentoEventosCozinha()
+
+
+def publicar_evento_cozinha(tipo, dados):
+    """
+    Publica um evento da fila da cozinha somente após o commit da transação atual,
+    para que as telas nunca recebam mudanças que foram desfeitas (rollback).
+    """
+    transaction.on_commit(lambda: barramento_cozinha.publicar(tipo, dados))
@@ -0,0 +1,138 @@
+"""
+Escalonamento dos itens da fila da cozinha nos fornos.
+
+A cozinha tem COZINHA_FORNOS fornos com COZINHA_SLOTS_POR_FORNO posições cada (uma
+pizza por posição) e cada produto tem um tempo de forno conhecido
+(COZINHA_TEMPO_FORNO_SEGUNDOS; 0 para itens que não vão ao forno, como bebidas). As
+chaves são nomes de produto, que valem para as duas origens, ou (tipo_origem,
+produto_id): os itens do WhatsApp usam os ids de administracao.ProdutoPlaceholder e os
+de mesa os de atendimento_interno.Produto, então um id sozinho não identifica o produto.
+
+Heurística (list scheduling com fila de prioridade):
+  * pedidos 'EmPreparo' já estão no forno e mantêm suas posições (não são replanejados);
+  * entre os que aguardam, o próximo pedido a entrar é o de menor tempo total de forno
+    (minimiza a espera média), a não ser que o pedido mais antigo já tenha sido
+    ultrapassado COZINHA_FORNO_MAX_ULTRAPASSAGENS vezes: aí ele entra (limite de justiça
+    FIFO; com 0, a ordem é estritamente FIFO);
+  * cada unidade do pedido vai para a posição que libera primeiro (heap de posições),
+    as mais demoradas antes.
+
+planejar_fornos é uma função pura, O(n log n) no número de pedidos e unidades.
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+
+STATUS_EM_PREPARO = 'EmPreparo'
+
+
+def configuracao_fornos():
+    """ (fornos, posições por forno, máximo de ultrapassagens) a partir dos settings. """
+    return (
+        max(int(getattr(settings, 'COZINHA_FORNOS', 2)), 1),
+        max(int(getattr(settings, 'COZINHA_SLOTS_POR_FORNO', 4)), 1),
+        max(int(getattr(settings, 'COZINHA_FORNO_MAX_ULTRAPASSAGENS', 3)), 0),
+    )
+
+
+def tempo_forno(tipo_origem, produto_id, nome_produto):
+    """
+    Tempo de forno de uma unidade do produto (timedelta); zero se o produto não vai ao
+    forno. Procura (tipo_origem, produto_id) e depois o nome do produto.
+    """
+    tempos = getattr(settings, 'COZINHA_TEMPO_FORNO_SEGUNDOS', {})
+    segundos = tempos.get((tipo_origem, produto_id), tempos.get(nome_produto))
+    if segundos is None:
+        segundos = getattr(settings, 'COZINHA_TEMPO_FORNO_PADRAO_SEGUNDOS', 480)
+    return timedelta(seconds=segundos)
+
+
+def _unidades(tipo_origem, itens):
+    """ Unidades de forno de um pedido, as mais demoradas primeiro: (tempo, produto_id, nome_produto). """
+    unidades = []
+    for item in itens or []:
+        duracao = tempo_forno(tipo_origem, item.get('produto_id'), item.get('nome_produto'))
+        if duracao > timedelta(0):
+            unidades.extend([(duracao, item.get('produto_id'), item.get('nome_produto'))] * max(int(item.get('quantidade') or 0), 0))
+    unidades.sort(key=lambda unidade: unidade[0], reverse=True)
+    return unidades
+
+
+def planejar_fornos(tickets, agora, fornos, slots_por_forno, max_ultrapassagens):
+    """
+    Planeja os pedidos nos fornos.
+
+    tickets: sequência em ordem de chegada (FIFO) de tuplas
+        (tipo_origem, id_pedido_origem, horario_entrada_cozinha, status_cozinha, horario_status, itens).
+    Retorna {'pedidos': [...], 'fornadas': [...], 'espera_media_segundos': float}, com os pedidos
+    na ordem em que entram no forno; espera = previsto_pronto - horario_entrada_cozinha.
+    """
+    # Posições livres: (livre_a_partir_de, forno, posição). Livres desde o início do pedido
+    # em preparo mais antigo, para que os que já estão no forno mantenham o horário real.
+    inicio_fila = min([agora] + [t[4] for t in tickets if t[3] == STATUS_EM_PREPARO and t[4]])
+    posicoes = [(inicio_fila, forno, posicao) for forno in range(1, fornos + 1) for posicao in range(1, slots_por_forno + 1)]
+    heapq.heapify(posicoes)
+    pedidos, fornadas = [], []
+
+    def alocar(ticket, unidades, inicio_minimo):
+        tipo_origem, id_pedido, horario_entrada, status_cozinha = ticket[:4]
+        inicio_pedido = fim_pedido = None
+        for duracao, produto_id, nome_produto in unidades:
+            livre, forno, posicao = heapq.heappop(posicoes)
+            inicio = max(livre, inicio_minimo)
+            fim = inicio + duracao
+            heapq.heappush(posicoes, (fim, forno, posicao))
+            fornadas.append({
+                'forno': forno, 'posicao': posicao, 'inicio': inicio, 'fim': fim,
+                'produto_id': produto_id, 'nome_produto': nome_produto,
+                'tipo_origem': tipo_origem, 'id_pedido_origem': id_pedido,
+            })
+            inicio_pedido = inicio if inicio_pedido is None else min(inicio_pedido, inicio)
+            fim_pedido = fim if fim_pedido is None else max(fim_pedido, fim)
+        pedidos.append({
+            'tipo_origem': tipo_origem, 'id_pedido_origem': id_pedido, 'status_cozinha_atual': status_cozinha,
+            'horario_entrada_cozinha': horario_entrada,
+            'inicio_previsto': inicio_pedido or agora, 'previsto_pronto': fim_pedido or agora,
+        })
+
+    # Pedidos já no forno ocupam as posições desde que entraram em preparo
+    aguardando = []
+    for ticket in tickets:
+        if ticket[3] == STATUS_EM_PREPARO:
+            alocar(ticket, _unidades(ticket[0], ticket[5]), min(ticket[4] or agora, agora))
+        else:
+            aguardando.append(ticket)
+
+    # Menor tempo total de forno primeiro, com no máximo max_ultrapassagens sobre o mais antigo
+    unidades = [_unidades(ticket[0], ticket[5]) for ticket in aguardando]
+    prioridade = [
+        (sum(unidade[0].total_seconds() for unidade in unidades_pedido), posicao_fifo)
+        for posicao_fifo, unidades_pedido in enumerate(unidades)
+    ]
+    heapq.heapify(prioridade)
+    alocado = [False] * len(aguardando)
+    mais_antigo = 0
+    for escolhidos in range(len(aguardando)):
+        while alocado[mais_antigo]:
+            mais_antigo += 1
+        # Todos os pedidos antes do mais antigo já entraram; os demais escolhidos o ultrapassaram
+        if escolhidos - mais_antigo >= max_ultrapassagens:
+            escolhido = mais_antigo
+        else:
+            while alocado[prioridade[0][1]]:
+                heapq.heappop(prioridade)
+            escolhido = heapq.heappop(prioridade)[1]
+        alocado[escolhido] = True
+        alocar(aguardando[escolhido], unidades[escolhido], agora)
+
+    esperas = [
+        (pedido['previsto_pronto'] - (pedido['horario_entrada_cozinha'] or agora)).total_seconds() for pedido in pedidos
+    ]
+    for pedido, espera in zip(pedidos, esperas):
+        pedido['espera_segundos'] = espera
+    return {
+        'pedidos': pedidos,
+        'fornadas': fornadas,
+        'espera_media_segundos': sum(esperas) / len(esperas) if esperas else 0.0,
+    }
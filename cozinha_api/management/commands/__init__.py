@@ -0,0 +1 @@
+# This file intentionally left blank to indicate that this directory is a Python package.
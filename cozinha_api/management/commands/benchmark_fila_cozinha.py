@@ -0,0 +1,122 @@
+import statistics
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from whatsapp_bot.models import PedidoWhatsApp
+from atendimento_interno.models import Mesa, PedidoMesa, ItemPedidoMesa, Produto
+from cozinha_api.services import montar_fila_cozinha, reconstruir_tickets_cozinha
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede a latência da montagem da fila da cozinha (PedidosParaPrepararListView) "
+        "com N pedidos sintéticos na fila (e, opcionalmente, pedidos já entregues no histórico). "
+        "Os dados são criados dentro de uma transação "
+        "que é desfeita ao final, então o comando pode rodar em qualquer banco "
+        "(pedidos já existentes na fila entram na medição)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--tamanhos', nargs='+', type=int, default=[50, 500, 5000],
+                            help="Quantidades de pedidos na fila a medir (default: 50 500 5000).")
+        parser.add_argument('--itens-por-pedido', type=int, default=3)
+        parser.add_argument('--repeticoes', type=int, default=5)
+        parser.add_argument('--historico', type=int, default=0,
+                            help="Pedidos já entregues (fora da fila) criados junto de cada medição.")
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'pedidos':>8} {'consultas':>10} {'mediana (ms)':>13} {'máx (ms)':>10}")
+        for tamanho in options['tamanhos']:
+            consultas, tempos = self._medir(
+                tamanho, options['itens_por_pedido'], options['repeticoes'], options['historico']
+            )
+            self.stdout.write(
+                f"{tamanho:>8} {consultas:>10} {statistics.median(tempos):>13.2f} {max(tempos):>10.2f}"
+            )
+
+    def _medir(self, tamanho, itens_por_pedido, repeticoes, historico):
+        try:
+            with transaction.atomic():
+                self._criar_fila_sintetica(tamanho, itens_por_pedido)
+                if historico:
+                    self._criar_historico(historico)
+                # bulk_create não dispara os sinais que mantêm os KitchenTicket
+                reconstruir_tickets_cozinha()
+                with CaptureQueriesContext(connection) as contexto:
+                    fila = montar_fila_cozinha()
+                consultas = len(contexto.captured_queries)
+
+                tempos = []
+                for _ in range(repeticoes):
+                    inicio = time.perf_counter()
+                    montar_fila_cozinha()
+                    tempos.append((time.perf_counter() - inicio) * 1000)
+                raise _Rollback()
+        except _Rollback:
+            pass
+        return consultas, tempos
+
+    def _criar_fila_sintetica(self, tamanho, itens_por_pedido):
+        agora = timezone.now()
+        produtos = [
+            Produto.objects.create(nome=f"Produto Benchmark {i}", preco_base=Decimal('10.00') + i)
+            for i in range(itens_por_pedido)
+        ]
+        carrinho = [
+            {'id': p.id, 'nome': p.nome, 'preco': float(p.preco_base), 'quantidade': 1, 'observacoes': ''}
+            for p in produtos
+        ]
+
+        total_whatsapp = tamanho // 2
+        PedidoWhatsApp.objects.bulk_create([
+            PedidoWhatsApp(
+                telefone_cliente=f"+55000{i:08d}",
+                carrinho_atual=carrinho,
+                status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=agora - timezone.timedelta(seconds=2 * i),
+            )
+            for i in range(total_whatsapp)
+        ])
+
+        total_mesa = tamanho - total_whatsapp
+        mesas = Mesa.objects.bulk_create([
+            Mesa(numero_identificador=f"BM{i}", status=Mesa.STATUS_OCUPADA) for i in range(total_mesa)
+        ])
+        pedidos = PedidoMesa.objects.bulk_create([
+            PedidoMesa(
+                mesa=mesa,
+                status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=agora - timezone.timedelta(seconds=2 * i + 1),
+                # bulk_create não passa por ItemPedidoMesa.save(): totais já gravados
+                total=sum(produto.preco_base for produto in produtos), quantidade_itens=len(produtos),
+            )
+            for i, mesa in enumerate(mesas)
+        ])
+        ItemPedidoMesa.objects.bulk_create([
+            ItemPedidoMesa(
+                pedido_mesa=pedido, produto=produto, quantidade=1,
+                preco_unitario_no_momento=produto.preco_base, subtotal_item=produto.preco_base,
+            )
+            for pedido in pedidos for produto in produtos
+        ])
+
+    def _criar_historico(self, quantidade):
+        agora = timezone.now()
+        PedidoWhatsApp.objects.bulk_create([
+            PedidoWhatsApp(
+                telefone_cliente=f"+55999{i:08d}",
+                carrinho_atual=[],
+                status_cozinha=PedidoWhatsApp.STATUS_COZINHA_ENTREGUE,
+                horario_entrada_cozinha=agora - timezone.timedelta(days=1, seconds=i),
+            )
+            for i in range(quantidade)
+        ])
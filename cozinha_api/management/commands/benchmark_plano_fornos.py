@@ -0,0 +1,69 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cozinha_api.forno import planejar_fornos, configuracao_fornos
+
+
+class Command(BaseCommand):
+    help = (
+        "Mede o tempo de planejamento dos fornos (cozinha_api.forno.planejar_fornos) com filas "
+        "sintéticas de N itens e compara a espera média do plano com a ordem estritamente FIFO. "
+        "Não acessa o banco."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--itens', nargs='+', type=int, default=[50, 200, 500],
+                            help="Quantidades de itens (unidades de forno) na fila (default: 50 200 500).")
+        parser.add_argument('--itens-por-pedido', type=int, default=3)
+        parser.add_argument('--repeticoes', type=int, default=20)
+        parser.add_argument('--semente', type=int, default=42)
+
+    def handle(self, *args, **options):
+        fornos, slots_por_forno, max_ultrapassagens = configuracao_fornos()
+        aleatorio = random.Random(options['semente'])
+        self.stdout.write(
+            f"{fornos} fornos x {slots_por_forno} posições, até {max_ultrapassagens} ultrapassagens"
+        )
+        self.stdout.write(
+            f"{'itens':>6} {'pedidos':>8} {'mediana (ms)':>13} {'máx (ms)':>10} "
+            f"{'espera média (min)':>19} {'FIFO (min)':>11}"
+        )
+        for total_itens in options['itens']:
+            agora = timezone.now()
+            tickets = self._fila_sintetica(aleatorio, total_itens, options['itens_por_pedido'], agora)
+
+            tempos = []
+            for _ in range(options['repeticoes']):
+                inicio = time.perf_counter()
+                plano = planejar_fornos(tickets, agora, fornos, slots_por_forno, max_ultrapassagens)
+                tempos.append((time.perf_counter() - inicio) * 1000)
+            fifo = planejar_fornos(tickets, agora, fornos, slots_por_forno, 0)
+
+            self.stdout.write(
+                f"{total_itens:>6} {len(tickets):>8} {statistics.median(tempos):>13.2f} {max(tempos):>10.2f} "
+                f"{plano['espera_media_segundos'] / 60:>19.1f} {fifo['espera_media_segundos'] / 60:>11.1f}"
+            )
+
+    def _fila_sintetica(self, aleatorio, total_itens, itens_por_pedido, agora):
+        # Produtos sem configuração usam COZINHA_TEMPO_FORNO_PADRAO_SEGUNDOS; os nomes abaixo
+        # podem ser mapeados em COZINHA_TEMPO_FORNO_SEGUNDOS para variar os tempos.
+        produtos = [(101, 'Calabresa'), (102, 'Margherita'), (103, 'Frango com Catupiry'), (201, 'Chocolate com Morango')]
+        tickets = []
+        restantes = total_itens
+        while restantes > 0:
+            quantidade_itens = min(aleatorio.randint(1, 2 * itens_por_pedido - 1), restantes)
+            restantes -= quantidade_itens
+            itens = []
+            for _ in range(quantidade_itens):
+                produto_id, nome_produto = aleatorio.choice(produtos)
+                itens.append({'produto_id': produto_id, 'nome_produto': nome_produto, 'quantidade': 1, 'observacoes_item': None})
+            indice = len(tickets)
+            tickets.append((
+                'WhatsApp' if indice % 2 else 'Mesa', indice + 1,
+                agora - timezone.timedelta(seconds=30 * (total_itens - indice)), 'AguardandoPreparo', None, itens,
+            ))
+        return tickets
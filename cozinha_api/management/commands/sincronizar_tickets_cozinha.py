@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from cozinha_api.services import reconstruir_tickets_cozinha
+
+
+class Command(BaseCommand):
+    help = (
+        "Recria a projeção KitchenTicket a partir de PedidoWhatsApp e PedidoMesa. "
+        "Rode uma vez após criar a tabela de tickets e sempre que pedidos forem "
+        "alterados por escritas em lote (bulk_create/update), que não disparam os sinais."
+    )
+
+    def handle(self, *args, **options):
+        total = reconstruir_tickets_cozinha()
+        self.stdout.write(self.style.SUCCESS(f"{total} tickets da cozinha sincronizados."))
@@ -0,0 +1,112 @@
+import threading
+import time
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from atendimento_interno.models import Mesa, PedidoMesa
+from cozinha_api.models import KitchenTicket
+from cozinha_api.services import (
+    aplicar_transicoes_status_cozinha, RESULTADO_OK, RESULTADO_CONFLITO, RESULTADO_INVALIDO,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga das transições de status da cozinha: várias threads (cada uma com "
+        "sua conexão, como tablets diferentes) tentam levar os mesmos pedidos para "
+        "'EmPreparo' e depois 'Pronto'. Verifica que cada transição foi aplicada exatamente "
+        "uma vez e mede a vazão sob contenção. Cria pedidos de mesa reais (removidos ao final): "
+        "use em banco de teste/homologação. Não funciona com SQLite em memória."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--pedidos', type=int, default=20)
+        parser.add_argument('--tentativas', type=int, default=3,
+                            help="Quantas vezes cada thread tenta cada transição de cada pedido.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("SQLite em memória não é compartilhado entre threads; use outro banco.")
+
+        pedidos = self._criar_pedidos(options['pedidos'])
+        try:
+            resultados, duracao = self._disparar_threads(pedidos, options['threads'], options['tentativas'])
+            self._verificar(pedidos, resultados)
+        finally:
+            PedidoMesa.objects.filter(id__in=pedidos).delete()
+            Mesa.objects.filter(numero_identificador__startswith='STRESS').delete()
+
+        total = len(resultados)
+        contagem = Counter(resultado for _, _, resultado in resultados)
+        self.stdout.write(
+            f"{total} tentativas em {duracao:.2f}s ({total / duracao:.0f}/s) com {options['threads']} threads: "
+            + ", ".join(f"{chave}={valor}" for chave, valor in sorted(contagem.items()))
+        )
+        self.stdout.write(self.style.SUCCESS("Nenhuma transição perdida ou ilegal."))
+
+    def _criar_pedidos(self, quantidade):
+        agora = timezone.now()
+        ids = []
+        for i in range(quantidade):
+            mesa = Mesa.objects.create(numero_identificador=f"STRESS{i}", status=Mesa.STATUS_OCUPADA)
+            ids.append(PedidoMesa.objects.create(
+                mesa=mesa,
+                status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=agora,
+            ).id)
+        return ids
+
+    def _disparar_threads(self, pedidos, total_threads, tentativas):
+        resultados = []
+        erros = []
+        lock = threading.Lock()
+        largada = threading.Barrier(total_threads)
+
+        def tablet():
+            try:
+                largada.wait()
+                for novo_status in (PedidoMesa.STATUS_COZINHA_EM_PREPARO, PedidoMesa.STATUS_COZINHA_PRONTO):
+                    for _ in range(tentativas):
+                        for id_pedido in pedidos:
+                            resultado = aplicar_transicoes_status_cozinha([('mesa', id_pedido, novo_status)])[0]
+                            with lock:
+                                resultados.append((id_pedido, novo_status, resultado['resultado']))
+            except Exception as exc: # Repassado para a thread principal
+                erros.append(exc)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=tablet) for _ in range(total_threads)]
+        inicio = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duracao = time.perf_counter() - inicio
+        if erros:
+            raise CommandError(f"Erro em uma das threads: {erros[0]!r}")
+        return resultados, duracao
+
+    def _verificar(self, pedidos, resultados):
+        aplicadas = Counter((id_pedido, novo) for id_pedido, novo, resultado in resultados if resultado == RESULTADO_OK)
+        for id_pedido in pedidos:
+            for novo_status in (PedidoMesa.STATUS_COZINHA_EM_PREPARO, PedidoMesa.STATUS_COZINHA_PRONTO):
+                if aplicadas[(id_pedido, novo_status)] != 1:
+                    raise CommandError(
+                        f"Pedido {id_pedido}: transição para {novo_status} aplicada "
+                        f"{aplicadas[(id_pedido, novo_status)]} vezes (esperado: 1)."
+                    )
+        inesperados = {r for _, _, r in resultados} - {RESULTADO_OK, RESULTADO_CONFLITO, RESULTADO_INVALIDO}
+        if inesperados:
+            raise CommandError(f"Resultados inesperados: {inesperados}")
+
+        finais = set(PedidoMesa.objects.filter(id__in=pedidos).values_list('status_cozinha', flat=True))
+        finais |= set(KitchenTicket.objects.filter(
+            tipo_origem='Mesa', object_id__in=pedidos
+        ).values_list('status_cozinha', flat=True))
+        if finais != {PedidoMesa.STATUS_COZINHA_PRONTO}:
+            raise CommandError(f"Status finais inesperados (pedido/ticket): {finais}")
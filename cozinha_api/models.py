@@ -1,9 +1,122 @@
 from django.db import models
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
 
-# Este app não define seus próprios modelos Django, pois opera
-# sobre modelos existentes de outros apps (whatsapp_bot, atendimento_interno).
-# Ele é usado para centralizar a lógica da API da Cozinha.
+# Os pedidos continuam sendo definidos nos apps de origem (whatsapp_bot, atendimento_interno).
+# Este app mantém apenas projeções e registros próprios da cozinha.
 
-# Se houvesse necessidade de modelos específicos para a cozinha no futuro
-# (ex: preferências de visualização do cozinheiro, logs específicos da cozinha),
-# eles seriam definidos aqui. Para o MVP atual, não são necessários.
+
+class KitchenTicket(models.Model):
+    """
+    Projeção desnormalizada de um pedido (PedidoWhatsApp ou PedidoMesa) na fila da cozinha.
+
+    É mantida pelos sinais em cozinha_api/signals.py, na mesma transação da escrita
+    do pedido de origem, e permite montar a fila com uma única consulta ordenada
+    pelo índice (status_cozinha, horario_entrada_cozinha), sem juntar as duas
+    tabelas de pedidos em memória.
+    """
+    STATUS_COZINHA_AGUARDANDO = 'AguardandoPreparo'
+    STATUS_COZINHA_EM_PREPARO = 'EmPreparo'
+    STATUS_COZINHA_PRONTO = 'Pronto'
+    STATUS_COZINHA_ENTREGUE = 'Entregue'
+
+    STATUS_COZINHA_CHOICES = [
+        (STATUS_COZINHA_AGUARDANDO, 'Aguardando Preparo'),
+        (STATUS_COZINHA_EM_PREPARO, 'Em Preparo'),
+        (STATUS_COZINHA_PRONTO, 'Pronto'),
+        (STATUS_COZINHA_ENTREGUE, 'Entregue'),
+    ]
+
+    # Origem genérica, no mesmo formato usado por pagamentos.Pagamento
+    content_type = models.ForeignKey(
+        ContentType,
+        on_delete=models.CASCADE,
+        help_text="Tipo do pedido de origem (PedidoWhatsApp ou PedidoMesa)"
+    )
+    object_id = models.PositiveIntegerField(help_text="ID do pedido de origem")
+    pedido = GenericForeignKey('content_type', 'object_id')
+
+    tipo_origem = models.CharField(max_length=20, help_text="'WhatsApp' ou 'Mesa'")
+    identificador_cliente = models.CharField(max_length=255, help_text="Número da Mesa ou Nome/Telefone do cliente WhatsApp")
+    status_cozinha = models.CharField(max_length=20, choices=STATUS_COZINHA_CHOICES)
+    horario_entrada_cozinha = models.DateTimeField(null=True, blank=True)
+    horario_status = models.DateTimeField(null=True, blank=True, help_text="Quando o pedido entrou no status_cozinha atual")
+    itens = models.JSONField(default=list, help_text="Itens já no formato de ItemConsolidadoSerializer")
+    tempo_preparo_estimado = models.DurationField(null=True, blank=True, help_text="Estimado pelo histórico de preparo dos produtos (cozinha_api.previsao)")
+    horario_previsto_pronto = models.DateTimeField(null=True, blank=True, help_text="Previsão de ficar pronto (ETA), mantida por cozinha_api.previsao")
+
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Ticket {self.tipo_origem} {self.object_id} ({self.get_status_cozinha_display()})"
+
+    class Meta:
+        verbose_name = "Ticket da Cozinha"
+        verbose_name_plural = "Tickets da Cozinha"
+        ordering = ['horario_entrada_cozinha', 'id']
+        constraints = [
+            models.UniqueConstraint(fields=['content_type', 'object_id'], name='cozinha_ticket_origem_unica'),
+        ]
+        indexes = [
+            # Fila da cozinha: filtro por status e ordem de chegada direto do índice
+            models.Index(fields=['status_cozinha', 'horario_entrada_cozinha'], name='cozinha_ticket_fila_idx'),
+        ]
+
+
+class EventoStatusCozinha(models.Model):
+    """
+    Registro append-only de cada mudança de status_cozinha de um pedido (inclusive a
+    entrada na fila). Gravado pelo caminho de atualização de status (cozinha_api.services),
+    na mesma transação da mudança. duracao_segundos é o tempo que o pedido passou no
+    status anterior: espera na fila para 'EmPreparo', preparo para 'Pronto'.
+    """
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    pedido = GenericForeignKey('content_type', 'object_id')
+
+    tipo_origem = models.CharField(max_length=20, help_text="Canal: 'WhatsApp' ou 'Mesa'")
+    status_anterior = models.CharField(max_length=20, null=True, blank=True)
+    status_novo = models.CharField(max_length=20, choices=KitchenTicket.STATUS_COZINHA_CHOICES)
+    horario = models.DateTimeField()
+    duracao_segundos = models.FloatField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.tipo_origem} {self.object_id}: {self.status_anterior} -> {self.status_novo}"
+
+    class Meta:
+        verbose_name = "Evento de Status da Cozinha"
+        verbose_name_plural = "Eventos de Status da Cozinha"
+        ordering = ['horario', 'id']
+        indexes = [
+            # Relatórios por período: filtro por status e intervalo de horário
+            models.Index(fields=['status_novo', 'horario'], name='cozinha_evento_status_idx'),
+            models.Index(fields=['content_type', 'object_id'], name='cozinha_evento_origem_idx'),
+        ]
+
+
+class EventoStatusCozinhaItem(models.Model):
+    """
+    Uma linha por produto do pedido em cada EventoStatusCozinha com duração, com os
+    campos do evento repetidos, para agrupar tempos de espera/preparo por produto
+    direto no banco, sem JOIN nem leitura dos itens em JSON.
+    """
+    tipo_origem = models.CharField(max_length=20)
+    object_id = models.PositiveIntegerField()
+    produto_id = models.PositiveIntegerField(null=True, blank=True) # Sem FK: itens do WhatsApp vêm do carrinho (JSON)
+    nome_produto = models.CharField(max_length=255)
+    quantidade = models.PositiveIntegerField(default=1)
+    status_novo = models.CharField(max_length=20, choices=KitchenTicket.STATUS_COZINHA_CHOICES)
+    horario = models.DateTimeField()
+    duracao_segundos = models.FloatField()
+
+    def __str__(self):
+        return f"{self.quantidade}x {self.nome_produto} -> {self.status_novo} ({self.duracao_segundos:.0f}s)"
+
+    class Meta:
+        verbose_name = "Item de Evento de Status da Cozinha"
+        verbose_name_plural = "Itens de Eventos de Status da Cozinha"
+        ordering = ['horario', 'id']
+        indexes = [
+            models.Index(fields=['status_novo', 'horario'], name='cozinha_evento_item_idx'),
+            models.Index(fields=['produto_id', 'status_novo', 'horario'], name='cozinha_evento_produto_idx'),
+        ]
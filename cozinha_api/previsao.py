@@ -0,0 +1,171 @@
+"""
+Previsão de horário de "Pronto" (ETA) dos pedidos na fila da cozinha.
+
+Modelo: a cozinha prepara até COZINHA_CAPACIDADE_PARALELA pedidos ao mesmo tempo
+(estações) e atende a fila por ordem de chegada; cada pedido leva o tempo de
+preparo estimado a partir do histórico de EventoStatusCozinhaItem.
+
+A previsão fica gravada no KitchenTicket (horario_previsto_pronto) e é mantida de
+forma incremental: a entrada de um pedido calcula só a previsão dele, e uma mudança
+de status ajusta os pedidos que aguardam com um único UPDATE. recalcular_previsoes_fila
+refaz o escalonamento completo (usado na reconstrução dos tickets).
+"""
+import heapq
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Avg, DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Greatest
+
+from .models import KitchenTicket, EventoStatusCozinhaItem
+
+_NA_FILA = [KitchenTicket.STATUS_COZINHA_AGUARDANDO, KitchenTicket.STATUS_COZINHA_EM_PREPARO]
+
+
+def capacidade_cozinha():
+    """ Quantos pedidos a cozinha prepara em paralelo (setting COZINHA_CAPACIDADE_PARALELA). """
+    return max(int(getattr(settings, 'COZINHA_CAPACIDADE_PARALELA', 4)), 1)
+
+
+def tempo_preparo_padrao():
+    """ Tempo de preparo de produtos sem histórico (setting COZINHA_TEMPO_PREPARO_PADRAO_SEGUNDOS). """
+    return timedelta(seconds=getattr(settings, 'COZINHA_TEMPO_PREPARO_PADRAO_SEGUNDOS', 900))
+
+
+def tempos_preparo_por_produto(chaves, agora):
+    """
+    Tempo médio de preparo (EmPreparo -> Pronto) dos pedidos que continham cada produto,
+    nos últimos COZINHA_HISTORICO_PREPARO_DIAS dias (default 30), por (tipo_origem,
+    produto_id): os itens do WhatsApp usam os ids de administracao.ProdutoPlaceholder e os
+    de mesa os de atendimento_interno.Produto, então o mesmo id é um produto diferente em
+    cada origem. Uma consulta, pelo índice (produto_id, status_novo, horario) de
+    EventoStatusCozinhaItem.
+    """
+    chaves = {(tipo_origem, produto_id) for tipo_origem, produto_id in chaves if produto_id is not None}
+    if not chaves:
+        return {}
+    janela = timedelta(days=getattr(settings, 'COZINHA_HISTORICO_PREPARO_DIAS', 30))
+    medias = EventoStatusCozinhaItem.objects.filter(
+        produto_id__in={produto_id for _, produto_id in chaves},
+        tipo_origem__in={tipo_origem for tipo_origem, _ in chaves},
+        status_novo=KitchenTicket.STATUS_COZINHA_PRONTO, horario__gte=agora - janela,
+    ).values('tipo_origem', 'produto_id').annotate(media=Avg('duracao_segundos')).values_list(
+        'tipo_origem', 'produto_id', 'media'
+    )
+    return {(tipo_origem, produto_id): timedelta(seconds=media) for tipo_origem, produto_id, media in medias}
+
+
+def estimar_tempo_preparo(tipo_origem, itens, tempos_por_produto):
+    """
+    Tempo de preparo de um pedido (itens no formato de ItemConsolidadoSerializer).
+    Os itens de um pedido vão ao forno juntos, então o pedido leva o tempo do produto
+    mais demorado; produtos sem histórico usam tempo_preparo_padrao().
+    """
+    padrao = tempo_preparo_padrao()
+    if not itens:
+        return padrao
+    return max(tempos_por_produto.get((tipo_origem, item.get('produto_id')), padrao) for item in itens)
+
+
+def tempo_preparo_itens(tipo_origem, itens, agora):
+    return estimar_tempo_preparo(
+        tipo_origem, itens, tempos_preparo_por_produto([(tipo_origem, item.get('produto_id')) for item in itens], agora)
+    )
+
+
+def previsao_entrada(status_cozinha, tempo_preparo, desde, agora, excluir_ticket_id=None):
+    """
+    Previsão de um pedido que acabou de entrar na fila, sem recalcular os demais.
+
+    Com N estações atendendo a fila em ordem, as estações ficam livres nos horários
+    das N maiores previsões da fila; o pedido que entra no fim começa quando a
+    primeira delas libera (a N-ésima maior previsão), ou agora se há estação livre.
+    Uma consulta (no máximo N linhas). Pedidos que já entram 'EmPreparo' terminam
+    tempo_preparo depois de desde.
+    """
+    if status_cozinha not in _NA_FILA:
+        return None
+    if status_cozinha == KitchenTicket.STATUS_COZINHA_EM_PREPARO:
+        return max((desde or agora) + tempo_preparo, agora)
+
+    capacidade = capacidade_cozinha()
+    previsoes = KitchenTicket.objects.filter(status_cozinha__in=_NA_FILA, horario_previsto_pronto__isnull=False)
+    if excluir_ticket_id is not None:
+        previsoes = previsoes.exclude(pk=excluir_ticket_id)
+    ultimas = list(
+        previsoes.order_by('-horario_previsto_pronto').values_list('horario_previsto_pronto', flat=True)[:capacidade]
+    )
+    inicio = ultimas[-1] if len(ultimas) == capacidade else agora
+    return max(inicio, agora) + tempo_preparo
+
+
+def previsao_apos_transicao(status_anterior, status_novo, tempo_preparo, previsao_atual, agora):
+    """
+    Nova previsão de um pedido que mudou de status e o desvio em relação à previsão
+    anterior (quanto a estação dele vai liberar antes ou depois do previsto).
+    'EmPreparo' termina tempo_preparo depois de agora; ao sair da fila ('Pronto' ou
+    'Entregue'), o pedido ficou pronto agora.
+    """
+    if status_anterior not in _NA_FILA:
+        return previsao_atual, timedelta(0)
+    if status_novo == KitchenTicket.STATUS_COZINHA_EM_PREPARO:
+        nova = agora + (tempo_preparo or tempo_preparo_padrao())
+    elif status_novo in _NA_FILA:
+        return previsao_atual, timedelta(0)
+    else:
+        nova = agora
+    return nova, (nova - previsao_atual if previsao_atual else timedelta(0))
+
+
+def propagar_desvio(desvio, agora):
+    """
+    Ajusta, em um único UPDATE, as previsões dos pedidos 'AguardandoPreparo' pelo desvio
+    de um pedido à frente. Os pedidos seguintes se revezam entre as N estações, então
+    cada um absorve em média desvio / N; nenhuma previsão fica antes de agora mais o
+    tempo de preparo do próprio pedido. O escalonamento exato é refeito por
+    recalcular_previsoes_fila.
+    """
+    if not desvio:
+        return 0
+    parcela = desvio / capacidade_cozinha()
+    return KitchenTicket.objects.filter(
+        status_cozinha=KitchenTicket.STATUS_COZINHA_AGUARDANDO,
+        horario_previsto_pronto__isnull=False,
+        tempo_preparo_estimado__isnull=False,
+    ).update(horario_previsto_pronto=Greatest(
+        ExpressionWrapper(F('horario_previsto_pronto') + Value(parcela), output_field=DateTimeField()),
+        ExpressionWrapper(Value(agora, output_field=DateTimeField()) + F('tempo_preparo_estimado'), output_field=DateTimeField()),
+    ))
+
+
+def recalcular_previsoes_fila(agora):
+    """
+    Refaz o escalonamento da fila inteira: pedidos 'EmPreparo' ocupam as estações até
+    horario_status + tempo de preparo; os que aguardam, em ordem de chegada, vão para a
+    estação que liberar primeiro. Usa o tempo_preparo_estimado já gravado nos tickets
+    (não consulta o histórico). Retorna o número de tickets atualizados.
+    """
+    padrao = tempo_preparo_padrao()
+    tickets = list(KitchenTicket.objects.filter(status_cozinha__in=_NA_FILA).order_by(
+        F('horario_entrada_cozinha').asc(nulls_last=True), 'id'
+    ).only('id', 'status_cozinha', 'horario_status', 'tempo_preparo_estimado'))
+
+    for ticket in tickets:
+        if ticket.status_cozinha == KitchenTicket.STATUS_COZINHA_EM_PREPARO:
+            ticket.horario_previsto_pronto = max(
+                (ticket.horario_status or agora) + (ticket.tempo_preparo_estimado or padrao), agora
+            )
+
+    capacidade = capacidade_cozinha()
+    estacoes = sorted(
+        t.horario_previsto_pronto for t in tickets if t.status_cozinha == KitchenTicket.STATUS_COZINHA_EM_PREPARO
+    )[-capacidade:]
+    estacoes += [agora] * (capacidade - len(estacoes))
+    heapq.heapify(estacoes)
+    for ticket in tickets:
+        if ticket.status_cozinha == KitchenTicket.STATUS_COZINHA_AGUARDANDO:
+            ticket.horario_previsto_pronto = heapq.heappop(estacoes) + (ticket.tempo_preparo_estimado or padrao)
+            heapq.heappush(estacoes, ticket.horario_previsto_pronto)
+
+    KitchenTicket.objects.bulk_update(tickets, ['horario_previsto_pronto'], batch_size=500)
+    return len(tickets)
@@ -4,6 +4,7 @@ from atendimento_interno.models import PedidoMesa, ItemPedidoMesa # Assuming Ite
 
 # Serializer for individual items within a consolidated order
 class ItemConsolidadoSerializer(serializers.Serializer):
+    produto_id = serializers.IntegerField(allow_null=True, required=False)
     nome_produto = serializers.CharField()
     quantidade = serializers.IntegerField()
     observacoes_item = serializers.CharField(allow_null=True, required=False)
@@ -18,6 +19,7 @@ class ConsolidatedPedidoCozinhaSerializer(serializers.Serializer):
     identificador_cliente = serializers.CharField() # Número da Mesa ou Telefone/Nome do Cliente WhatsApp
     horario_entrada_cozinha = serializers.DateTimeField()
     status_cozinha_atual = serializers.CharField()
+    horario_previsto_pronto = serializers.DateTimeField(allow_null=True, required=False) # ETA (cozinha_api.previsao)
     itens = ItemConsolidadoSerializer(many=True)
     # total_itens = serializers.IntegerField() # Pode ser útil para a cozinha
 
@@ -37,3 +39,29 @@ class KitchenStatusUpdateSerializer(serializers.Serializer):
         if value not in [PedidoMesa.STATUS_COZINHA_EM_PREPARO, PedidoMesa.STATUS_COZINHA_PRONTO]:
             raise serializers.ValidationError(f"Status inválido. Apenas '{PedidoMesa.STATUS_COZINHA_EM_PREPARO}' ou '{PedidoMesa.STATUS_COZINHA_PRONTO}' são permitidos aqui.")
         return value
+
+
+# Serializers for the bulk kitchen status update (several orders in one request)
+class KitchenStatusTransicaoSerializer(KitchenStatusUpdateSerializer):
+    tipo_origem = serializers.CharField()
+    id_pedido_origem = serializers.IntegerField(min_value=1)
+
+    def validate_tipo_origem(self, value):
+        value = value.lower()
+        if value not in ['whatsapp', 'mesa']:
+            raise serializers.ValidationError('Tipo de origem inválido. Use "whatsapp" ou "mesa".')
+        return value
+
+
+class KitchenStatusBulkUpdateSerializer(serializers.Serializer):
+    MAX_TRANSICOES = 50
+
+    transicoes = KitchenStatusTransicaoSerializer(many=True, allow_empty=False)
+
+    def validate_transicoes(self, value):
+        if len(value) > self.MAX_TRANSICOES:
+            raise serializers.ValidationError(f'Envie no máximo {self.MAX_TRANSICOES} pedidos por requisição.')
+        chaves = [(t['tipo_origem'], t['id_pedido_origem']) for t in value]
+        if len(chaves) != len(set(chaves)):
+            raise serializers.ValidationError('Cada pedido só pode aparecer uma vez por requisição.')
+        return value
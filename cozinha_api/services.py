@@ -0,0 +1,749 @@
+import json
+from datetime import timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import F, Case, When, Value, DateTimeField
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from rest_framework import serializers
+
+from whatsapp_bot.models import PedidoWhatsApp
+from atendimento_interno.models import PedidoMesa, ItemPedidoMesa
+from administracao.versoes import incrementar_versao, ESCOPO_COZINHA
+from .models import KitchenTicket, EventoStatusCozinha, EventoStatusCozinhaItem
+from .eventos import publicar_evento_cozinha, EVENTO_STATUS_ALTERADO, EVENTO_PEDIDO_SAIU
+from .forno import configuracao_fornos, planejar_fornos
+from .previsao import (
+    tempos_preparo_por_produto, estimar_tempo_preparo, tempo_preparo_itens, previsao_entrada,
+    previsao_apos_transicao, propagar_desvio, recalcular_previsoes_fila,
+)
+
+TIPO_ORIGEM_WHATSAPP = 'WhatsApp'
+TIPO_ORIGEM_MESA = 'Mesa'
+
+# Status em que o pedido aparece na fila da cozinha
+STATUS_COZINHA_NA_FILA = [PedidoMesa.STATUS_COZINHA_AGUARDANDO, PedidoMesa.STATUS_COZINHA_EM_PREPARO]
+
+# Os dicionários abaixo são montados diretamente no formato de saída de
+# ConsolidatedPedidoCozinhaSerializer / ItemConsolidadoSerializer. Instanciar um
+# serializer por item custa mais do que a própria consulta em filas grandes, então
+# apenas o campo de data/hora reaproveita a formatação do DRF.
+_campo_horario = serializers.DateTimeField()
+
+
+def _formatar_horario(horario):
+    return _campo_horario.to_representation(horario) if horario is not None else None
+
+
+def _item_consolidado(produto_id, nome_produto, quantidade, observacoes_item):
+    return {
+        'produto_id': produto_id,
+        'nome_produto': str(nome_produto),
+        'quantidade': int(quantidade),
+        'observacoes_item': str(observacoes_item) if observacoes_item is not None else None,
+    }
+
+
+def _pedido_consolidado(id_pedido_origem, tipo_origem, identificador_cliente, horario_entrada_cozinha, status_cozinha, itens,
+                        horario_previsto_pronto=None):
+    return {
+        'id_pedido_origem': id_pedido_origem,
+        'tipo_origem': tipo_origem,
+        'identificador_cliente': identificador_cliente,
+        'horario_entrada_cozinha': _formatar_horario(horario_entrada_cozinha),
+        'status_cozinha_atual': status_cozinha,
+        'horario_previsto_pronto': _formatar_horario(horario_previsto_pronto),
+        'itens': itens,
+    }
+
+
+def _itens_do_carrinho(carrinho_atual):
+    if not isinstance(carrinho_atual, list): # carrinho_atual is a list of dicts
+        return []
+    return [
+        _item_consolidado(
+            item_no_carrinho.get('id'),
+            item_no_carrinho.get('nome', 'Produto Desconhecido'),
+            item_no_carrinho.get('quantidade', 0),
+            item_no_carrinho.get('observacoes', '') # Assumindo que pode haver 'observacoes' no item do carrinho
+        )
+        for item_no_carrinho in carrinho_atual
+    ]
+
+
+def _itens_do_pedido_mesa(pedido_mesa_id):
+    return [
+        _item_consolidado(produto_id, nome, quantidade, observacoes)
+        for produto_id, nome, quantidade, observacoes in ItemPedidoMesa.objects.filter(
+            pedido_mesa_id=pedido_mesa_id
+        ).order_by('data_criacao', 'id').values_list('produto_id', 'produto__nome', 'quantidade', 'observacoes_item')
+    ]
+
+
+def _identificador_whatsapp(pw):
+    return pw.nome_cliente or pw.telefone_cliente
+
+
+def _identificador_mesa(numero_identificador):
+    return f"Mesa {numero_identificador}"
+
+
+def pedido_whatsapp_para_cozinha(pw, horario_previsto_pronto=None):
+    """
+    Monta o pedido consolidado (formato ConsolidatedPedidoCozinhaSerializer)
+    de um PedidoWhatsApp, a partir dos itens de carrinho_atual.
+    """
+    return _pedido_consolidado(
+        pw.id, TIPO_ORIGEM_WHATSAPP, _identificador_whatsapp(pw),
+        pw.horario_entrada_cozinha, pw.status_cozinha, _itens_do_carrinho(pw.carrinho_atual), horario_previsto_pronto
+    )
+
+
+def pedido_mesa_para_cozinha(pm, horario_previsto_pronto=None):
+    """
+    Monta o pedido consolidado de um PedidoMesa, a partir de seus ItemPedidoMesa.
+    """
+    return _pedido_consolidado(
+        pm.id, TIPO_ORIGEM_MESA, _identificador_mesa(pm.mesa.numero_identificador),
+        pm.horario_entrada_cozinha, pm.status_cozinha, _itens_do_pedido_mesa(pm.id), horario_previsto_pronto
+    )
+
+
+# Colunas lidas da fila, na ordem dos argumentos de _pedido_consolidado
+_COLUNAS_FILA = (
+    'object_id', 'tipo_origem', 'identificador_cliente', 'horario_entrada_cozinha', 'status_cozinha', 'itens',
+    'horario_previsto_pronto',
+)
+
+
+def ticket_para_cozinha(linha):
+    """
+    Converte uma linha de tickets_na_fila() no formato consolidado da cozinha.
+    Não consulta o banco: os itens já estão pré-renderizados no ticket.
+    """
+    return _pedido_consolidado(*linha)
+
+
+def tickets_na_fila():
+    """
+    Fila da cozinha como QuerySet de tuplas (values_list, sem instanciar modelos):
+    uma única consulta em KitchenTicket, filtrada e ordenada pelo índice
+    (status_cozinha, horario_entrada_cozinha). Pode ser paginada.
+    """
+    return KitchenTicket.objects.filter(
+        status_cozinha__in=STATUS_COZINHA_NA_FILA
+    ).order_by(F('horario_entrada_cozinha').asc(nulls_last=True), 'id').values_list(*_COLUNAS_FILA)
+
+
+def montar_fila_cozinha():
+    """
+    Retorna a fila da cozinha já serializada: todos os pedidos com status_cozinha
+    'AguardandoPreparo' ou 'EmPreparo', ordenados por horario_entrada_cozinha
+    (mais antigos primeiro). Executa uma única consulta, independente do tamanho
+    da fila e do histórico de pedidos.
+    """
+    return [ticket_para_cozinha(linha) for linha in tickets_na_fila()]
+
+
+def previsao_pronto_pedido(pedido_obj):
+    """
+    Previsão de ficar pronto (ETA) de um PedidoWhatsApp ou PedidoMesa, lida do seu
+    KitchenTicket; None se o pedido não está na fila da cozinha.
+    """
+    return KitchenTicket.objects.filter(
+        content_type=ContentType.objects.get_for_model(pedido_obj.__class__),
+        object_id=pedido_obj.pk,
+        status_cozinha__in=STATUS_COZINHA_NA_FILA,
+    ).values_list('horario_previsto_pronto', flat=True).first()
+
+
+def serializar_pedido_cozinha(pedido_obj):
+    """
+    Serializa um único pedido (PedidoWhatsApp ou PedidoMesa) no formato consolidado da cozinha,
+    com a previsão de ficar pronto do seu ticket.
+    """
+    if isinstance(pedido_obj, PedidoWhatsApp):
+        return pedido_whatsapp_para_cozinha(pedido_obj, previsao_pronto_pedido(pedido_obj))
+    return pedido_mesa_para_cozinha(pedido_obj, previsao_pronto_pedido(pedido_obj))
+
+
+def _itens_para_cozinha(pedido_obj):
+    if isinstance(pedido_obj, PedidoWhatsApp):
+        return _itens_do_carrinho(pedido_obj.carrinho_atual)
+    return _itens_do_pedido_mesa(pedido_obj.pk)
+
+
+# --- Produção agrupada por produto ---
+
+# Expansão dos itens (JSON) dos tickets em linhas, por banco. Em ambos, a agregação
+# por produto (totais, horário mais antigo e a lista de pedidos) é um único GROUP BY.
+_SQL_ITENS_POR_BANCO = {
+    'postgresql': {
+        'expandir': 'CROSS JOIN LATERAL jsonb_array_elements(t.itens) AS item',
+        'texto': "item->>'{}'",
+        'inteiro': "(item->>'{}')::integer",
+        'agregar': 'json_agg(json_build_object({}))',
+    },
+    'sqlite': {
+        'expandir': ', json_each(t.itens) AS item',
+        'texto': "json_extract(item.value, '$.{}')",
+        'inteiro': "json_extract(item.value, '$.{}')",
+        'agregar': 'json_group_array(json_object({}))',
+    },
+}
+
+
+def _horario_do_banco(valor):
+    """ Horário lido de JSON/SQL cru (texto ISO ou do SQLite, ou datetime), sempre aware. """
+    if isinstance(valor, str):
+        valor = parse_datetime(valor)
+    if valor is not None and settings.USE_TZ and timezone.is_naive(valor):
+        valor = timezone.make_aware(valor, dt_timezone.utc)
+    return valor
+
+
+def _produto_agrupado(produto_id, nome_produto, quantidade_total, horario_mais_antigo, pedidos):
+    pedidos = sorted(pedidos, key=lambda p: (p['horario_entrada_cozinha'] is None, p['horario_entrada_cozinha'], p['id_pedido_origem']))
+    for pedido in pedidos:
+        pedido['horario_entrada_cozinha'] = _formatar_horario(pedido['horario_entrada_cozinha'])
+    return {
+        'produto_id': produto_id,
+        'nome_produto': nome_produto,
+        'quantidade_total': int(quantidade_total or 0),
+        'horario_entrada_mais_antigo': horario_mais_antigo,
+        'pedidos': pedidos,
+    }
+
+
+def _agrupar_itens_sql(conexao, status_cozinha):
+    dialeto = _SQL_ITENS_POR_BANCO[conexao.vendor]
+    texto, inteiro = dialeto['texto'].format, dialeto['inteiro'].format
+    pedido = dialeto['agregar'].format(', '.join([
+        "'tipo_origem', t.tipo_origem",
+        "'id_pedido_origem', t.object_id",
+        "'identificador_cliente', t.identificador_cliente",
+        "'status_cozinha_atual', t.status_cozinha",
+        "'horario_entrada_cozinha', t.horario_entrada_cozinha",
+        f"'quantidade', {inteiro('quantidade')}",
+        f"'observacoes_item', {texto('observacoes_item')}",
+    ]))
+    consulta = (
+        f"SELECT {inteiro('produto_id')}, {texto('nome_produto')}, SUM({inteiro('quantidade')}), "
+        f"MIN(t.horario_entrada_cozinha), {pedido} "
+        f"FROM {conexao.ops.quote_name(KitchenTicket._meta.db_table)} t {dialeto['expandir']} "
+        f"WHERE t.status_cozinha IN ({', '.join(['%s'] * len(status_cozinha))}) "
+        f"GROUP BY 1, 2"
+    )
+    with conexao.cursor() as cursor:
+        cursor.execute(consulta, list(status_cozinha))
+        linhas = cursor.fetchall()
+
+    produtos = []
+    for produto_id, nome_produto, quantidade_total, horario_mais_antigo, pedidos in linhas:
+        if isinstance(pedidos, str): # SQLite devolve o JSON agregado como texto
+            pedidos = json.loads(pedidos)
+        for p in pedidos:
+            p['horario_entrada_cozinha'] = _horario_do_banco(p['horario_entrada_cozinha'])
+        produtos.append(_produto_agrupado(produto_id, nome_produto, quantidade_total, _horario_do_banco(horario_mais_antigo), pedidos))
+    return produtos
+
+
+def _agrupar_itens_python(status_cozinha):
+    """ Mesmo resultado de _agrupar_itens_sql, em uma passada sobre os tickets da fila. """
+    grupos = {}
+    for object_id, tipo_origem, identificador_cliente, horario, status_atual, itens in KitchenTicket.objects.filter(
+        status_cozinha__in=status_cozinha
+    ).values_list('object_id', 'tipo_origem', 'identificador_cliente', 'horario_entrada_cozinha', 'status_cozinha', 'itens'):
+        for item in itens:
+            grupo = grupos.setdefault((item.get('produto_id'), item.get('nome_produto')), [0, None, []])
+            grupo[0] += item.get('quantidade') or 0
+            if horario is not None and (grupo[1] is None or horario < grupo[1]):
+                grupo[1] = horario
+            grupo[2].append({
+                'tipo_origem': tipo_origem,
+                'id_pedido_origem': object_id,
+                'identificador_cliente': identificador_cliente,
+                'status_cozinha_atual': status_atual,
+                'horario_entrada_cozinha': horario,
+                'quantidade': item.get('quantidade'),
+                'observacoes_item': item.get('observacoes_item'),
+            })
+    return [
+        _produto_agrupado(produto_id, nome_produto, quantidade_total, horario_mais_antigo, pedidos)
+        for (produto_id, nome_produto), (quantidade_total, horario_mais_antigo, pedidos) in grupos.items()
+    ]
+
+
+def agrupar_itens_fila_por_produto(status_cozinha=None):
+    """
+    Itens dos pedidos na fila agrupados por produto (produção em lote: "7x Calabresa"),
+    com a quantidade total, o horário de entrada do pedido mais antigo e os pedidos
+    que contribuem (com quantidade e observações de cada um).
+
+    Lê os itens já consolidados nos KitchenTicket (carrinho_atual dos pedidos WhatsApp
+    e ItemPedidoMesa dos pedidos de mesa). No PostgreSQL e no SQLite, os itens JSON são
+    expandidos e agregados em uma única consulta GROUP BY; nos demais bancos, os tickets
+    são lidos em uma consulta e agrupados aqui.
+    Ordenado pelo pedido mais antigo (o produto que está esperando há mais tempo primeiro).
+    """
+    status_cozinha = list(status_cozinha or STATUS_COZINHA_NA_FILA)
+    conexao = connections[KitchenTicket.objects.db]
+    if conexao.vendor in _SQL_ITENS_POR_BANCO:
+        produtos = _agrupar_itens_sql(conexao, status_cozinha)
+    else:
+        produtos = _agrupar_itens_python(status_cozinha)
+    produtos.sort(key=lambda p: (p['horario_entrada_mais_antigo'] is None, p['horario_entrada_mais_antigo'], p['nome_produto'] or ''))
+    for produto in produtos:
+        produto['horario_entrada_mais_antigo'] = _formatar_horario(produto['horario_entrada_mais_antigo'])
+    return produtos
+
+
+# --- Plano dos fornos ---
+
+def _formatar_plano(plano):
+    for pedido in plano['pedidos']:
+        for campo in ('horario_entrada_cozinha', 'inicio_previsto', 'previsto_pronto'):
+            pedido[campo] = _formatar_horario(pedido[campo])
+    for fornada in plano['fornadas']:
+        fornada['inicio'] = _formatar_horario(fornada['inicio'])
+        fornada['fim'] = _formatar_horario(fornada['fim'])
+    return plano
+
+
+def plano_fornos_fila():
+    """
+    Plano dos fornos para a fila atual (os pedidos de PedidosParaPrepararListView),
+    calculado por forno.planejar_fornos com a configuração dos settings. Uma consulta.
+    Inclui a espera média do mesmo plano em ordem estritamente FIFO, para comparação.
+    """
+    fornos, slots_por_forno, max_ultrapassagens = configuracao_fornos()
+    agora = timezone.now()
+    tickets = list(KitchenTicket.objects.filter(status_cozinha__in=STATUS_COZINHA_NA_FILA).order_by(
+        F('horario_entrada_cozinha').asc(nulls_last=True), 'id'
+    ).values_list('tipo_origem', 'object_id', 'horario_entrada_cozinha', 'status_cozinha', 'horario_status', 'itens'))
+
+    plano = planejar_fornos(tickets, agora, fornos, slots_por_forno, max_ultrapassagens)
+    plano['espera_media_fifo_segundos'] = (
+        planejar_fornos(tickets, agora, fornos, slots_por_forno, 0)['espera_media_segundos']
+        if max_ultrapassagens else plano['espera_media_segundos']
+    )
+    plano.update({
+        'gerado_em': _formatar_horario(agora),
+        'fornos': fornos,
+        'slots_por_forno': slots_por_forno,
+        'max_ultrapassagens': max_ultrapassagens,
+    })
+    return _formatar_plano(plano)
+
+
+# --- Sincronização dos tickets (chamada pelos sinais em signals.py) ---
+
+def sincronizar_ticket_cozinha(pedido_obj, renderizar_itens=False):
+    """
+    Cria ou atualiza o KitchenTicket de um PedidoWhatsApp ou PedidoMesa.
+
+    Pedidos que ainda não foram para a cozinha (status_cozinha vazio) não têm ticket.
+    Os itens são renderizados na criação do ticket; em atualizações, apenas quando
+    renderizar_itens=True (itens de mesa alterados). Assim o ticket de um pedido
+    WhatsApp guarda o carrinho do momento em que entrou na cozinha.
+    """
+    if not pedido_obj.status_cozinha:
+        return None
+
+    if isinstance(pedido_obj, PedidoWhatsApp):
+        tipo_origem = TIPO_ORIGEM_WHATSAPP
+        identificador_cliente = _identificador_whatsapp(pedido_obj)
+    else:
+        tipo_origem = TIPO_ORIGEM_MESA
+        identificador_cliente = _identificador_mesa(pedido_obj.mesa.numero_identificador)
+
+    content_type = ContentType.objects.get_for_model(pedido_obj.__class__) # Cacheado pelo Django
+    campos = {
+        'tipo_origem': tipo_origem,
+        'identificador_cliente': identificador_cliente,
+        'status_cozinha': pedido_obj.status_cozinha,
+        'horario_entrada_cozinha': pedido_obj.horario_entrada_cozinha,
+    }
+    if renderizar_itens:
+        campos['itens'] = _itens_para_cozinha(pedido_obj)
+
+    agora = timezone.now()
+    tickets = KitchenTicket.objects.filter(content_type=content_type, object_id=pedido_obj.pk)
+    atual = tickets.values(
+        *campos, 'id', 'horario_status', 'itens', 'tempo_preparo_estimado', 'horario_previsto_pronto'
+    ).first()
+
+    if atual is not None:
+        if all(atual[campo] == valor for campo, valor in campos.items()):
+            return None # Nada mudou para a cozinha (ex: conversa do bot depois do pagamento)
+        tempo_preparo = atual['tempo_preparo_estimado']
+        if tempo_preparo is None or (renderizar_itens and campos['itens'] != atual['itens']):
+            tempo_preparo = campos['tempo_preparo_estimado'] = tempo_preparo_itens(tipo_origem, campos['itens'], agora)
+        if atual['status_cozinha'] != pedido_obj.status_cozinha:
+            campos['horario_status'] = agora
+            _registrar_eventos_status(content_type, tipo_origem, [
+                (pedido_obj.pk, atual['status_cozinha'], pedido_obj.status_cozinha, atual['horario_status'], atual['itens'])
+            ], agora)
+            if atual['status_cozinha'] not in STATUS_COZINHA_NA_FILA: # Voltou para a fila
+                campos['horario_previsto_pronto'] = previsao_entrada(
+                    pedido_obj.status_cozinha, tempo_preparo, agora, agora, excluir_ticket_id=atual['id']
+                )
+            else:
+                campos['horario_previsto_pronto'], desvio = previsao_apos_transicao(
+                    atual['status_cozinha'], pedido_obj.status_cozinha, tempo_preparo, atual['horario_previsto_pronto'], agora
+                )
+                propagar_desvio(desvio, agora)
+        elif 'tempo_preparo_estimado' in campos and atual['horario_previsto_pronto'] and atual['tempo_preparo_estimado']:
+            # Itens alterados: a previsão do próprio pedido acompanha o novo tempo de preparo
+            campos['horario_previsto_pronto'] = atual['horario_previsto_pronto'] + (tempo_preparo - atual['tempo_preparo_estimado'])
+        tickets.update(**campos)
+        incrementar_versao(ESCOPO_COZINHA)
+        return None
+
+    if 'itens' not in campos:
+        campos['itens'] = _itens_para_cozinha(pedido_obj)
+    campos['horario_status'] = pedido_obj.horario_entrada_cozinha or agora
+    campos['tempo_preparo_estimado'] = tempo_preparo_itens(tipo_origem, campos['itens'], agora)
+    campos['horario_previsto_pronto'] = previsao_entrada(
+        pedido_obj.status_cozinha, campos['tempo_preparo_estimado'], campos['horario_status'], agora
+    )
+    ticket, criado = KitchenTicket.objects.get_or_create(
+        content_type=content_type, object_id=pedido_obj.pk, defaults=campos
+    )
+    if not criado: # Criado por outra transação entre a leitura e o get_or_create
+        tickets.update(**campos)
+    else: # Entrada na fila
+        _registrar_eventos_status(content_type, tipo_origem, [
+            (pedido_obj.pk, None, pedido_obj.status_cozinha, None, campos['itens'])
+        ], campos['horario_status'])
+    incrementar_versao(ESCOPO_COZINHA)
+    return ticket
+
+
+def _registrar_eventos_status(content_type, tipo_origem, mudancas, horario):
+    """
+    Grava EventoStatusCozinha (e os EventoStatusCozinhaItem, quando há duração) para
+    uma lista de mudanças (object_id, status_anterior, status_novo, horario_status_anterior, itens).
+    """
+    eventos = []
+    itens_evento = []
+    for object_id, status_anterior, status_novo, desde, itens in mudancas:
+        duracao = (horario - desde).total_seconds() if status_anterior and desde else None
+        eventos.append(EventoStatusCozinha(
+            content_type=content_type, object_id=object_id, tipo_origem=tipo_origem,
+            status_anterior=status_anterior, status_novo=status_novo, horario=horario, duracao_segundos=duracao,
+        ))
+        if duracao is None:
+            continue
+        # Um registro por produto (o mesmo produto pode aparecer em mais de um item)
+        quantidades = {}
+        for item in itens or []:
+            chave = (item.get('produto_id'), item.get('nome_produto'))
+            quantidades[chave] = quantidades.get(chave, 0) + max(int(item.get('quantidade') or 0), 0)
+        itens_evento.extend(
+            EventoStatusCozinhaItem(
+                tipo_origem=tipo_origem, object_id=object_id, produto_id=produto_id, nome_produto=nome_produto or '',
+                quantidade=quantidade, status_novo=status_novo, horario=horario, duracao_segundos=duracao,
+            )
+            for (produto_id, nome_produto), quantidade in quantidades.items()
+        )
+    EventoStatusCozinha.objects.bulk_create(eventos)
+    if itens_evento:
+        EventoStatusCozinhaItem.objects.bulk_create(itens_evento)
+
+
+def atualizar_itens_ticket_mesa(pedido_mesa_id):
+    """
+    Re-renderiza os itens do ticket de um PedidoMesa (após inclusão, alteração ou
+    remoção de ItemPedidoMesa), junto com o tempo de preparo estimado e a previsão
+    do próprio pedido. Não faz nada se o pedido não tiver ticket.
+    """
+    content_type = ContentType.objects.get_for_model(PedidoMesa)
+    tickets = KitchenTicket.objects.filter(content_type=content_type, object_id=pedido_mesa_id)
+    atual = tickets.values('tempo_preparo_estimado', 'horario_previsto_pronto').first()
+    if atual is None:
+        return
+    itens = _itens_do_pedido_mesa(pedido_mesa_id)
+    campos = {'itens': itens, 'tempo_preparo_estimado': tempo_preparo_itens(TIPO_ORIGEM_MESA, itens, timezone.now())}
+    if atual['horario_previsto_pronto'] and atual['tempo_preparo_estimado']:
+        campos['horario_previsto_pronto'] = (
+            atual['horario_previsto_pronto'] + campos['tempo_preparo_estimado'] - atual['tempo_preparo_estimado']
+        )
+    if tickets.update(**campos):
+        incrementar_versao(ESCOPO_COZINHA)
+
+
+def remover_ticket_cozinha(modelo, object_id):
+    content_type = ContentType.objects.get_for_model(modelo)
+    removidos, _ = KitchenTicket.objects.filter(content_type=content_type, object_id=object_id).delete()
+    if removidos:
+        incrementar_versao(ESCOPO_COZINHA)
+
+
+@transaction.atomic
+def reconstruir_tickets_cozinha():
+    """
+    Recria os tickets de todos os pedidos com status_cozinha preenchido, a partir
+    das tabelas de origem (usado na carga inicial e para reparar a projeção após
+    escritas que não disparam sinais, como bulk_create/update).
+
+    Executa um número fixo de consultas: pedidos WhatsApp, pedidos de mesa (com o
+    número da mesa via JOIN), itens desses pedidos de mesa, o histórico de preparo
+    dos produtos, a remoção e a inserção em lote dos tickets e, por fim, o
+    recálculo das previsões da fila (recalcular_previsoes_fila).
+    """
+    agora = timezone.now()
+    content_type_whatsapp = ContentType.objects.get_for_model(PedidoWhatsApp)
+    content_type_mesa = ContentType.objects.get_for_model(PedidoMesa)
+
+    pedidos_whatsapp = PedidoWhatsApp.objects.filter(status_cozinha__isnull=False).exclude(
+        status_cozinha=''
+    ).values_list(
+        'id', 'horario_entrada_cozinha', 'status_cozinha', 'nome_cliente', 'telefone_cliente', 'carrinho_atual'
+    )
+    pedidos_mesa = list(PedidoMesa.objects.filter(status_cozinha__isnull=False).exclude(
+        status_cozinha=''
+    ).values_list(
+        'id', 'horario_entrada_cozinha', 'status_cozinha', 'mesa__numero_identificador'
+    ))
+
+    itens_por_pedido_mesa = {}
+    if pedidos_mesa:
+        itens_mesa = ItemPedidoMesa.objects.filter(
+            pedido_mesa__status_cozinha__isnull=False
+        ).order_by('pedido_mesa_id', 'data_criacao', 'id').values_list(
+            'pedido_mesa_id', 'produto_id', 'produto__nome', 'quantidade', 'observacoes_item'
+        )
+        for pedido_mesa_id, produto_id, nome_produto, quantidade, observacoes_item in itens_mesa:
+            itens_por_pedido_mesa.setdefault(pedido_mesa_id, []).append(
+                _item_consolidado(produto_id, nome_produto, quantidade, observacoes_item)
+            )
+
+    tickets = [
+        KitchenTicket(
+            content_type=content_type_whatsapp, object_id=id_pedido, tipo_origem=TIPO_ORIGEM_WHATSAPP,
+            identificador_cliente=nome_cliente or telefone_cliente, status_cozinha=status_cozinha,
+            horario_entrada_cozinha=horario, horario_status=horario, itens=_itens_do_carrinho(carrinho_atual),
+        )
+        for id_pedido, horario, status_cozinha, nome_cliente, telefone_cliente, carrinho_atual in pedidos_whatsapp
+    ]
+    tickets.extend(
+        KitchenTicket(
+            content_type=content_type_mesa, object_id=id_pedido, tipo_origem=TIPO_ORIGEM_MESA,
+            identificador_cliente=_identificador_mesa(numero_mesa), status_cozinha=status_cozinha,
+            horario_entrada_cozinha=horario, horario_status=horario, itens=itens_por_pedido_mesa.get(id_pedido, []),
+        )
+        for id_pedido, horario, status_cozinha, numero_mesa in pedidos_mesa
+    )
+
+    tempos_por_produto = tempos_preparo_por_produto(
+        {(ticket.tipo_origem, item['produto_id']) for ticket in tickets for item in ticket.itens}, agora
+    )
+    for ticket in tickets:
+        ticket.tempo_preparo_estimado = estimar_tempo_preparo(ticket.tipo_origem, ticket.itens, tempos_por_produto)
+
+    KitchenTicket.objects.all().delete()
+    KitchenTicket.objects.bulk_create(tickets, batch_size=500)
+    recalcular_previsoes_fila(agora)
+    incrementar_versao(ESCOPO_COZINHA)
+    return len(tickets)
+
+
+# --- Transições de status da cozinha ---
+
+# Tipos de origem aceitos na URL/payload (minúsculos) -> modelo e rótulo usado na fila
+MODELOS_POR_ORIGEM = {'whatsapp': PedidoWhatsApp, 'mesa': PedidoMesa}
+ROTULOS_POR_ORIGEM = {'whatsapp': TIPO_ORIGEM_WHATSAPP, 'mesa': TIPO_ORIGEM_MESA}
+
+# Transições permitidas por esta API: status atual -> próximo status
+PROXIMO_STATUS_COZINHA = {
+    PedidoMesa.STATUS_COZINHA_AGUARDANDO: PedidoMesa.STATUS_COZINHA_EM_PREPARO,
+    PedidoMesa.STATUS_COZINHA_EM_PREPARO: PedidoMesa.STATUS_COZINHA_PRONTO,
+}
+
+# Resultado de cada transição
+RESULTADO_OK = 'ok'
+RESULTADO_NAO_ENCONTRADO = 'nao_encontrado'
+RESULTADO_INVALIDO = 'transicao_invalida'
+RESULTADO_CONFLITO = 'conflito' # Outra tela já levou o pedido para este status (ou além)
+
+# Ordem do ciclo da cozinha, usada para distinguir conflito de transição inválida
+ORDEM_STATUS_COZINHA = [
+    PedidoMesa.STATUS_COZINHA_AGUARDANDO, PedidoMesa.STATUS_COZINHA_EM_PREPARO,
+    PedidoMesa.STATUS_COZINHA_PRONTO, PedidoMesa.STATUS_COZINHA_ENTREGUE,
+]
+
+
+def validar_transicao_status_cozinha(status_atual, novo_status):
+    """
+    Retorna a mensagem de erro da transição status_atual -> novo_status, ou None se for permitida.
+    (AguardandoPreparo -> EmPreparo), (EmPreparo -> Pronto)
+    """
+    if not status_atual:
+        return 'Este pedido ainda não foi enviado para a cozinha.'
+    if status_atual == PedidoMesa.STATUS_COZINHA_AGUARDANDO and novo_status != PedidoMesa.STATUS_COZINHA_EM_PREPARO:
+        return 'Status inválido. Pedido "Aguardando Preparo" só pode ir para "Em Preparo".'
+    if status_atual == PedidoMesa.STATUS_COZINHA_EM_PREPARO and novo_status != PedidoMesa.STATUS_COZINHA_PRONTO:
+        return 'Status inválido. Pedido "Em Preparo" só pode ir para "Pronto".'
+    if status_atual not in PROXIMO_STATUS_COZINHA: # Já está pronto (ou entregue), não deveria mudar por esta API
+        return 'Pedido já está "Pronto". Nenhuma alteração permitida por esta API.'
+    return None
+
+
+def _publicar_transicao(tipo_origem, id_pedido_origem, novo_status, horario_previsto_pronto=None):
+    # Notificar as telas conectadas ao stream da cozinha
+    evento_dados = {
+        'id_pedido_origem': id_pedido_origem,
+        'tipo_origem': ROTULOS_POR_ORIGEM[tipo_origem],
+        'status_cozinha_atual': novo_status,
+    }
+    if novo_status == PedidoMesa.STATUS_COZINHA_EM_PREPARO:
+        evento_dados['horario_previsto_pronto'] = _formatar_horario(horario_previsto_pronto)
+        publicar_evento_cozinha(EVENTO_STATUS_ALTERADO, evento_dados)
+    else: # 'Pronto' tira o pedido da fila
+        publicar_evento_cozinha(EVENTO_PEDIDO_SAIU, evento_dados)
+
+
+def _update_status_retornando_ids(modelo, ids_por_transicao, agora):
+    """
+    Aplica as transições {(status_anterior, novo_status): [ids]} com um único UPDATE
+    condicional (WHERE id IN (...) AND status_cozinha = <status anterior>) e retorna os
+    ids das linhas alteradas, para saber exatamente quais pedidos esta requisição
+    transicionou mesmo com outras telas escrevendo ao mesmo tempo.
+
+    O SQL é explícito por banco: PostgreSQL e SQLite (>= 3.35) devolvem os ids com
+    UPDATE ... RETURNING; nos demais, é feito um UPDATE condicional por pedido, pelo ORM.
+    """
+    conexao = connections[modelo.objects.db]
+    if conexao.vendor not in ('postgresql', 'sqlite'):
+        return [
+            pk for (status_anterior, novo_status), ids in ids_por_transicao.items() for pk in ids
+            if modelo.objects.filter(pk=pk, status_cozinha=status_anterior).update(
+                status_cozinha=novo_status, data_atualizacao=agora
+            )
+        ]
+
+    nome = conexao.ops.quote_name
+    opcoes = modelo._meta
+    coluna_id = nome(opcoes.pk.column)
+    coluna_status = nome(opcoes.get_field('status_cozinha').column)
+    casos, condicoes, params_casos, params_condicoes = [], [], [], []
+    for (status_anterior, novo_status), ids in ids_por_transicao.items():
+        casos.append("WHEN %s THEN %s")
+        params_casos += [status_anterior, novo_status]
+        condicoes.append(f"({coluna_id} IN ({', '.join(['%s'] * len(ids))}) AND {coluna_status} = %s)")
+        params_condicoes += [*ids, status_anterior]
+    consulta = (
+        f"UPDATE {nome(opcoes.db_table)} SET {coluna_status} = CASE {coluna_status} {' '.join(casos)} END, "
+        f"{nome(opcoes.get_field('data_atualizacao').column)} = %s "
+        f"WHERE {' OR '.join(condicoes)} RETURNING {coluna_id}"
+    )
+    with conexao.cursor() as cursor:
+        cursor.execute(consulta, params_casos + [conexao.ops.adapt_datetimefield_value(agora)] + params_condicoes)
+        return [linha[0] for linha in cursor.fetchall()]
+
+
+def _classificar_falha(status_atual, novo_status):
+    """ Resultado e mensagem de uma transição cujo UPDATE condicional não afetou o pedido. """
+    erro = validar_transicao_status_cozinha(status_atual, novo_status)
+    if status_atual in ORDEM_STATUS_COZINHA and (
+        ORDEM_STATUS_COZINHA.index(status_atual) >= ORDEM_STATUS_COZINHA.index(novo_status)
+    ):
+        # O pedido já está no status pedido (ou depois dele): outra tela chegou antes
+        return RESULTADO_CONFLITO, 'O pedido já foi atualizado por outra tela. Recarregue a fila.'
+    return RESULTADO_INVALIDO, erro
+
+
+def aplicar_transicoes_status_cozinha(transicoes):
+    """
+    Aplica uma lista de transições (tipo_origem, id_pedido_origem, novo_status) em uma
+    única transação, com as mesmas regras de validar_transicao_status_cozinha.
+
+    Cada transição é um compare-and-set: por tipo de origem, um único UPDATE condicional
+    (WHERE id IN (...) AND status_cozinha = <status anterior exigido>) aplica todas as
+    transições e retorna os ids alterados; não há leitura prévia nem locks mantidos entre
+    leitura e escrita. Só os pedidos que não foram alterados são relidos, para explicar
+    o motivo (não encontrado, transição inválida ou conflito com outra tela).
+
+    Retorna uma lista de dicts, na ordem da entrada, com tipo_origem, id_pedido_origem,
+    resultado (RESULTADO_*), status_cozinha_atual e detail.
+    """
+    por_origem = {}
+    for tipo_origem, id_pedido, novo_status in transicoes:
+        por_origem.setdefault(tipo_origem, {})[id_pedido] = novo_status
+
+    resultados = {}
+    agora = timezone.now()
+    desvio_total = timedelta(0)
+    with transaction.atomic():
+        for tipo_origem, novo_status_por_id in por_origem.items():
+            modelo = MODELOS_POR_ORIGEM[tipo_origem]
+            content_type = ContentType.objects.get_for_model(modelo)
+
+            ids_por_transicao = {}
+            for status_anterior, novo_status in PROXIMO_STATUS_COZINHA.items():
+                ids = [i for i, novo in novo_status_por_id.items() if novo == novo_status]
+                if ids:
+                    ids_por_transicao[(status_anterior, novo_status)] = ids
+            ok = []
+            if ids_por_transicao: # Novos status fora de PROXIMO_STATUS_COZINHA nunca são aplicados
+                ok = _update_status_retornando_ids(modelo, ids_por_transicao, agora)
+
+            previsoes = {}
+            if ok:
+                tickets = KitchenTicket.objects.filter(content_type=content_type, object_id__in=ok)
+                status_anterior = {novo: anterior for anterior, novo in PROXIMO_STATUS_COZINHA.items()}
+                linhas = list(tickets.values_list(
+                    'object_id', 'horario_status', 'itens', 'tempo_preparo_estimado', 'horario_previsto_pronto'
+                ))
+                _registrar_eventos_status(content_type, ROTULOS_POR_ORIGEM[tipo_origem], [
+                    (object_id, status_anterior[novo_status_por_id[object_id]], novo_status_por_id[object_id], desde, itens)
+                    for object_id, desde, itens, _, _ in linhas
+                ], agora)
+                for object_id, _, _, tempo_preparo, previsao_atual in linhas:
+                    novo_status = novo_status_por_id[object_id]
+                    previsoes[object_id], desvio = previsao_apos_transicao(
+                        status_anterior[novo_status], novo_status, tempo_preparo, previsao_atual, agora
+                    )
+                    desvio_total += desvio
+                tickets.update(
+                    status_cozinha=Case(*[
+                        When(object_id__in=[i for i in ok if novo_status_por_id[i] == novo], then=Value(novo))
+                        for novo in PROXIMO_STATUS_COZINHA.values()
+                    ], default=F('status_cozinha')),
+                    horario_status=agora,
+                    horario_previsto_pronto=Case(*[
+                        When(object_id=object_id, then=Value(previsao))
+                        for object_id, previsao in previsoes.items()
+                    ], default=F('horario_previsto_pronto'), output_field=DateTimeField()),
+                )
+                incrementar_versao(ESCOPO_COZINHA)
+            for id_pedido in ok:
+                resultados[(tipo_origem, id_pedido)] = (RESULTADO_OK, novo_status_por_id[id_pedido], None)
+                _publicar_transicao(tipo_origem, id_pedido, novo_status_por_id[id_pedido], previsoes.get(id_pedido))
+
+            falhas = set(novo_status_por_id) - set(ok)
+            if falhas:
+                status_atual = dict(modelo.objects.filter(id__in=falhas).values_list('id', 'status_cozinha'))
+                for id_pedido in falhas:
+                    if id_pedido not in status_atual:
+                        resultados[(tipo_origem, id_pedido)] = (RESULTADO_NAO_ENCONTRADO, None, 'Pedido não encontrado.')
+                        continue
+                    resultado, detail = _classificar_falha(status_atual[id_pedido], novo_status_por_id[id_pedido])
+                    resultados[(tipo_origem, id_pedido)] = (resultado, status_atual[id_pedido], detail)
+
+        # Pedidos que começaram ou terminaram antes/depois do previsto adiantam/atrasam os que aguardam
+        propagar_desvio(desvio_total, agora)
+
+    return [
+        {
+            'tipo_origem': tipo_origem,
+            'id_pedido_origem': id_pedido,
+            'resultado': resultados[(tipo_origem, id_pedido)][0],
+            'status_cozinha_atual': resultados[(tipo_origem, id_pedido)][1],
+            'detail': resultados[(tipo_origem, id_pedido)][2],
+        }
+        for tipo_origem, id_pedido, _ in transicoes
+    ]
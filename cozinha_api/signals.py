@@ -0,0 +1,69 @@
+from django.db.models.signals import post_save, post_delete
+
+from whatsapp_bot.models import PedidoWhatsApp
+from atendimento_interno.models import Mesa, PedidoMesa, ItemPedidoMesa
+from administracao.versoes import incrementar_versao, ESCOPO_COZINHA
+from .models import KitchenTicket
+from .services import (
+    TIPO_ORIGEM_MESA, sincronizar_ticket_cozinha, atualizar_itens_ticket_mesa, remover_ticket_cozinha,
+)
+
+# Mantém a projeção KitchenTicket em sincronia com os pedidos de origem.
+# Os receptores rodam na mesma conexão/transação da escrita que os disparou;
+# as views que alteram pedidos da cozinha fazem essas escritas dentro de transaction.atomic().
+# Escritas em lote (bulk_create, QuerySet.update) não disparam sinais: depois delas,
+# use services.reconstruir_tickets_cozinha() (comando sincronizar_tickets_cozinha).
+
+# Campos do pedido que aparecem no ticket (exceto itens)
+CAMPOS_TICKET_WHATSAPP = {'status_cozinha', 'horario_entrada_cozinha', 'nome_cliente', 'telefone_cliente'}
+CAMPOS_TICKET_MESA = {'status_cozinha', 'horario_entrada_cozinha', 'mesa'}
+
+
+def _deve_sincronizar(instance, update_fields, campos_ticket):
+    if not instance.status_cozinha:
+        return False
+    return update_fields is None or bool(campos_ticket.intersection(update_fields))
+
+
+def pedido_whatsapp_salvo(sender, instance, created, update_fields=None, **kwargs):
+    if _deve_sincronizar(instance, update_fields, CAMPOS_TICKET_WHATSAPP):
+        sincronizar_ticket_cozinha(instance)
+
+
+def pedido_mesa_salvo(sender, instance, created, update_fields=None, **kwargs):
+    if _deve_sincronizar(instance, update_fields, CAMPOS_TICKET_MESA):
+        sincronizar_ticket_cozinha(instance)
+
+
+def pedido_removido(sender, instance, **kwargs):
+    remover_ticket_cozinha(sender, instance.pk)
+
+
+def item_pedido_mesa_alterado(sender, instance, **kwargs):
+    # Só re-renderiza se o pedido já estiver na cozinha (o objeto pai costuma estar em cache)
+    try:
+        pedido_mesa = instance.pedido_mesa
+    except PedidoMesa.DoesNotExist: # Removido em cascata junto com o pedido
+        return
+    if pedido_mesa.status_cozinha:
+        atualizar_itens_ticket_mesa(instance.pedido_mesa_id)
+
+
+def mesa_salva(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields is not None and 'numero_identificador' not in update_fields):
+        return
+    pedidos_ids = PedidoMesa.objects.filter(mesa=instance, status_cozinha__isnull=False).values('id')
+    if KitchenTicket.objects.filter(tipo_origem=TIPO_ORIGEM_MESA, object_id__in=pedidos_ids).exclude(
+        identificador_cliente=f"Mesa {instance.numero_identificador}"
+    ).update(identificador_cliente=f"Mesa {instance.numero_identificador}"):
+        incrementar_versao(ESCOPO_COZINHA)
+
+
+def conectar_sinais():
+    post_save.connect(pedido_whatsapp_salvo, sender=PedidoWhatsApp, dispatch_uid='cozinha_ticket_pedido_whatsapp')
+    post_save.connect(pedido_mesa_salvo, sender=PedidoMesa, dispatch_uid='cozinha_ticket_pedido_mesa')
+    post_delete.connect(pedido_removido, sender=PedidoWhatsApp, dispatch_uid='cozinha_ticket_pedido_whatsapp_removido')
+    post_delete.connect(pedido_removido, sender=PedidoMesa, dispatch_uid='cozinha_ticket_pedido_mesa_removido')
+    post_save.connect(item_pedido_mesa_alterado, sender=ItemPedidoMesa, dispatch_uid='cozinha_ticket_item_mesa_salvo')
+    post_delete.connect(item_pedido_mesa_alterado, sender=ItemPedidoMesa, dispatch_uid='cozinha_ticket_item_mesa_removido')
+    post_save.connect(mesa_salva, sender=Mesa, dispatch_uid='cozinha_ticket_mesa')
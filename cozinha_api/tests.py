@@ -1,12 +1,26 @@
+from io import StringIO
+from unittest.mock import patch
+
+from django.core.management import call_command
 from django.urls import reverse
 from django.utils import timezone
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
 from rest_framework.test import APITestCase
 from rest_framework import status
 
 from whatsapp_bot.models import PedidoWhatsApp
-from atendimento_interno.models import PedidoMesa, Mesa, ItemPedidoMesa
+from atendimento_interno.models import PedidoMesa, Mesa, ItemPedidoMesa, Produto
 # from products.models import ProdutoPlaceholder as Produto # Using placeholder from administracao for now
 from administracao.models import ProdutoPlaceholder, CategoriaProdutoPlaceholder
+from .models import KitchenTicket, EventoStatusCozinha, EventoStatusCozinhaItem
+from .previsao import recalcular_previsoes_fila
+from .forno import planejar_fornos, tempo_forno
+from .services import STATUS_COZINHA_NA_FILA, _agrupar_itens_python, _agrupar_itens_sql
+from .eventos import (
+    BarramentoEventosCozinha, barramento_cozinha,
+    EVENTO_SNAPSHOT, EVENTO_STATUS_ALTERADO, EVENTO_PEDIDO_SAIU, EVENTO_RESSINCRONIZAR,
+)
 
 # Refer to TESTING_STRATEGY.md for overall testing guidelines.
 
@@ -23,7 +37,6 @@ class CozinhaAPITests(APITestCase):
         # Pedido WhatsApp para teste
         self.pedido_whatsapp = PedidoWhatsApp.objects.create(
             telefone_cliente="+5511911112222",
-            estado_conversa='FINALIZADO', # Supõe que passou pelo fluxo do bot
             carrinho_atual=[
                 {'id': self.produto_cozinha.id, 'nome': self.produto_cozinha.nome, 'preco': float(self.produto_cozinha.preco_base), 'quantidade': 2, 'observacoes': 'Sem cebola WP'}
             ],
@@ -178,4 +191,629 @@ class CozinhaAPITests(APITestCase):
     # - Pedido já 'Pronto' não pode ser alterado por esta API.
     # - Tipo de origem inválido (ex: 'email').
     # - ID de pedido com formato inválido.
+
+
+class StreamCozinhaTests(APITestCase):
+    """ Testes do stream (SSE) da fila da cozinha e do barramento de eventos. """
+    def setUp(self):
+        self.barramento = BarramentoEventosCozinha(tamanho_fila_assinante=2)
+        self.mesa = Mesa.objects.create(numero_identificador="S01")
+        self.pedido_mesa = PedidoMesa.objects.create(
+            mesa=self.mesa,
+            status_pedido=PedidoMesa.STATUS_ABERTO,
+            status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=timezone.now()
+        )
+
+    def test_barramento_entrega_evento_para_todos_assinantes(self):
+        fila_1 = self.barramento.assinar()
+        fila_2 = self.barramento.assinar()
+        self.barramento.publicar(EVENTO_STATUS_ALTERADO, {'id_pedido_origem': 1})
+        self.assertEqual(fila_1.get_nowait()['tipo'], EVENTO_STATUS_ALTERADO)
+        self.assertEqual(fila_2.get_nowait()['dados'], {'id_pedido_origem': 1})
+
+        self.barramento.cancelar_assinatura(fila_2)
+        self.assertEqual(self.barramento.total_assinantes, 1)
+
+    def test_barramento_forca_ressincronizacao_de_assinante_atrasado(self):
+        fila = self.barramento.assinar()
+        for i in range(3): # Fila do assinante comporta apenas 2 eventos
+            self.barramento.publicar(EVENTO_STATUS_ALTERADO, {'id_pedido_origem': i})
+        self.assertEqual(fila.get_nowait()['tipo'], EVENTO_RESSINCRONIZAR)
+        self.assertTrue(fila.empty())
+
+    def test_atualizar_status_publica_evento_apos_commit(self):
+        fila = barramento_cozinha.assinar()
+        self.addCleanup(barramento_cozinha.cancelar_assinatura, fila)
+        url = reverse('cozinha_api:atualizar_status_cozinha', kwargs={
+            'tipo_origem': 'mesa',
+            'id_pedido_origem': self.pedido_mesa.id
+        })
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        evento = fila.get_nowait()
+        self.assertEqual(evento['tipo'], EVENTO_STATUS_ALTERADO)
+        self.assertEqual(evento['dados']['status_cozinha_atual'], PedidoMesa.STATUS_COZINHA_EM_PREPARO)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_PRONTO}, format='json')
+        self.assertEqual(fila.get_nowait()['tipo'], EVENTO_PEDIDO_SAIU)
+
+    def test_stream_envia_snapshot_e_depois_eventos(self):
+        url = reverse('cozinha_api:pedidos_para_preparar_stream')
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+
+        conteudo = iter(response.streaming_content)
+        primeiro = next(conteudo).decode()
+        self.assertIn(f"event: {EVENTO_SNAPSHOT}", primeiro)
+        self.assertIn(f'"id_pedido_origem": {self.pedido_mesa.id}', primeiro)
+
+        barramento_cozinha.publicar(EVENTO_PEDIDO_SAIU, {'id_pedido_origem': self.pedido_mesa.id, 'tipo_origem': 'Mesa'})
+        segundo = next(conteudo).decode()
+        self.assertIn(f"event: {EVENTO_PEDIDO_SAIU}", segundo)
+        response.close() # Encerra o gerador e remove a assinatura
+
+
+    @override_settings(COZINHA_STREAM_VERIFICACAO_SEGUNDOS=0)
+    def test_stream_reenvia_snapshot_quando_outro_processo_altera_a_fila(self):
+        from administracao.versoes import incrementar_versao, ESCOPO_COZINHA
+        response = self.client.get(reverse('cozinha_api:pedidos_para_preparar_stream'))
+        conteudo = iter(response.streaming_content)
+        self.assertIn(f'"id_pedido_origem": {self.pedido_mesa.id}', next(conteudo).decode())
+
+        # Mudança feita em outro processo: nenhum evento chega a este barramento, só a versão muda
+        with self.captureOnCommitCallbacks(execute=True):
+            KitchenTicket.objects.filter(object_id=self.pedido_mesa.id).delete()
+            incrementar_versao(ESCOPO_COZINHA)
+        segundo = next(conteudo).decode()
+        self.assertIn(f"event: {EVENTO_SNAPSHOT}", segundo)
+        self.assertNotIn(f'"id_pedido_origem": {self.pedido_mesa.id}', segundo)
+        response.close()
+
+    @override_settings(COZINHA_STREAM_DURACAO_MAXIMA_SEGUNDOS=0)
+    def test_stream_encerra_apos_duracao_maxima(self):
+        assinantes = barramento_cozinha.total_assinantes
+        response = self.client.get(reverse('cozinha_api:pedidos_para_preparar_stream'))
+        eventos = [parte.decode() for parte in response.streaming_content]
+        self.assertEqual(len(eventos), 1)
+        self.assertIn(f"event: {EVENTO_SNAPSHOT}", eventos[0])
+        self.assertEqual(barramento_cozinha.total_assinantes, assinantes)
+
+    def test_stream_aceita_event_source(self):
+        url = reverse('cozinha_api:pedidos_para_preparar_stream')
+        response = self.client.get(url, HTTP_ACCEPT='text/event-stream')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        response.close()
+
+    def test_stream_verifica_permissoes_antes_de_assinar(self):
+        from rest_framework.permissions import IsAuthenticated
+        from .views import StreamPedidosCozinhaView
+        assinantes = barramento_cozinha.total_assinantes
+        with patch.object(StreamPedidosCozinhaView, 'permission_classes', [IsAuthenticated]):
+            response = self.client.get(reverse('cozinha_api:pedidos_para_preparar_stream'), HTTP_ACCEPT='text/event-stream')
+        self.assertIn(response.status_code, [status.HTTP_401_UNAUTHORIZED, status.HTTP_403_FORBIDDEN])
+        self.assertEqual(barramento_cozinha.total_assinantes, assinantes)
+
+class FilaCozinhaConsultasTests(APITestCase):
+    """ A fila da cozinha deve custar um número fixo de consultas, independente do tamanho. """
+    def setUp(self):
+        self.produtos = [
+            Produto.objects.create(nome=f"Produto Fila {i}", preco_base=10 + i) for i in range(3)
+        ]
+        self.url = reverse('cozinha_api:pedidos_para_preparar_list')
+
+    def _criar_pedidos(self, quantidade, inicio=0):
+        for i in range(inicio, inicio + quantidade):
+            PedidoWhatsApp.objects.create(
+                telefone_cliente=f"+55119000{i:05d}",
+                carrinho_atual=[{'id': p.id, 'nome': p.nome, 'preco': 10.0, 'quantidade': 1} for p in self.produtos],
+                status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=timezone.now() - timezone.timedelta(minutes=i)
+            )
+            mesa = Mesa.objects.create(numero_identificador=f"Q{i}")
+            pedido = PedidoMesa.objects.create(
+                mesa=mesa,
+                status_cozinha=PedidoMesa.STATUS_COZINHA_EM_PREPARO,
+                horario_entrada_cozinha=timezone.now() - timezone.timedelta(minutes=i, seconds=30)
+            )
+            for produto in self.produtos:
+                ItemPedidoMesa.objects.create(
+                    pedido_mesa=pedido, produto=produto, quantidade=2,
+                    preco_unitario_no_momento=produto.preco_base
+                )
+
+    def test_numero_de_consultas_nao_cresce_com_a_fila(self):
+        self._criar_pedidos(2)
+        with self.assertNumQueries(2): # Contador de versão (ETag) + fila
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(len(response.data), 4)
+
+        self._criar_pedidos(20, inicio=2)
+        with self.assertNumQueries(2):
+            response = self.client.get(self.url, format='json')
+        self.assertEqual(len(response.data), 44)
+        self.assertTrue(all(len(p['itens']) == 3 for p in response.data))
+
+    def test_fila_intercalada_por_horario_de_entrada(self):
+        self._criar_pedidos(3)
+        response = self.client.get(self.url, format='json')
+        horarios = [p['horario_entrada_cozinha'] for p in response.data]
+        self.assertEqual(horarios, sorted(horarios))
+        # O mais antigo é o pedido de mesa (entrou 30s antes do WhatsApp de mesmo índice)
+        self.assertEqual(response.data[0]['tipo_origem'], 'Mesa')
+        self.assertEqual(response.data[0]['identificador_cliente'], 'Mesa Q2')
+        self.assertEqual(response.data[0]['itens'][0], {
+            'produto_id': self.produtos[0].id, 'nome_produto': 'Produto Fila 0', 'quantidade': 2, 'observacoes_item': None
+        })
+
+
+    def test_fila_paginada_com_limit_offset(self):
+        self._criar_pedidos(3)
+        response = self.client.get(self.url, {'limit': 2, 'offset': 1}, format='json')
+        self.assertEqual(response.data['count'], 6)
+        self.assertEqual(len(response.data['results']), 2)
+        fila_completa = self.client.get(self.url, format='json').data
+        self.assertEqual(response.data['results'], fila_completa[1:3])
+
+
+class KitchenTicketSincronizacaoTests(APITestCase):
+    """ A projeção KitchenTicket acompanha as escritas nos pedidos de origem. """
+    def setUp(self):
+        self.produto = Produto.objects.create(nome="Produto Ticket", preco_base=20)
+        self.mesa = Mesa.objects.create(numero_identificador="T01")
+        self.pedido_mesa = PedidoMesa.objects.create(mesa=self.mesa, status_pedido=PedidoMesa.STATUS_ABERTO)
+
+    def _ticket_mesa(self):
+        return KitchenTicket.objects.get(tipo_origem='Mesa', object_id=self.pedido_mesa.id)
+
+    def test_pedido_fora_da_cozinha_nao_tem_ticket(self):
+        PedidoWhatsApp.objects.create(telefone_cliente="+5511900000001")
+        self.assertFalse(KitchenTicket.objects.exists())
+
+    def test_itens_e_status_do_pedido_mesa_sao_refletidos_no_ticket(self):
+        self.pedido_mesa.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
+        self.pedido_mesa.horario_entrada_cozinha = timezone.now()
+        self.pedido_mesa.save()
+        item = ItemPedidoMesa.objects.create(
+            pedido_mesa=self.pedido_mesa, produto=self.produto, quantidade=2,
+            preco_unitario_no_momento=self.produto.preco_base
+        )
+        ticket = self._ticket_mesa()
+        self.assertEqual(ticket.identificador_cliente, "Mesa T01")
+        self.assertEqual([i['quantidade'] for i in ticket.itens], [2])
+
+        item.quantidade = 5
+        item.save()
+        self.assertEqual([i['quantidade'] for i in self._ticket_mesa().itens], [5])
+
+        self.pedido_mesa.status_cozinha = PedidoMesa.STATUS_COZINHA_PRONTO
+        self.pedido_mesa.save()
+        self.assertEqual(self._ticket_mesa().status_cozinha, PedidoMesa.STATUS_COZINHA_PRONTO)
+
+        item.delete()
+        self.assertEqual(self._ticket_mesa().itens, [])
+
+        self.pedido_mesa.delete()
+        self.assertFalse(KitchenTicket.objects.exists())
+
+    def test_ticket_whatsapp_guarda_carrinho_do_momento_da_entrada(self):
+        pedido = PedidoWhatsApp.objects.create(
+            telefone_cliente="+5511900000002",
+            carrinho_atual=[{'id': self.produto.id, 'nome': self.produto.nome, 'preco': 20.0, 'quantidade': 1}],
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=timezone.now()
+        )
+        # O cliente continua conversando (ex: 'cancelar' limpa o carrinho da conversa)
+        pedido.carrinho_atual = []
+        pedido.save()
+        ticket = KitchenTicket.objects.get(tipo_origem='WhatsApp', object_id=pedido.id)
+        self.assertEqual(ticket.itens[0]['produto_id'], self.produto.id)
+
+    def test_renomear_mesa_atualiza_identificador_do_ticket(self):
+        self.pedido_mesa.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
+        self.pedido_mesa.save()
+        self.mesa.numero_identificador = "Varanda 1"
+        self.mesa.save()
+        self.assertEqual(self._ticket_mesa().identificador_cliente, "Mesa Varanda 1")
+
+    def test_reconstruir_tickets_apos_escrita_em_lote(self):
+        PedidoMesa.objects.filter(id=self.pedido_mesa.id).update(
+            status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO, horario_entrada_cozinha=timezone.now()
+        )
+        self.assertFalse(KitchenTicket.objects.exists()) # QuerySet.update não dispara sinais
+        call_command('sincronizar_tickets_cozinha', stdout=StringIO())
+        self.assertEqual(self._ticket_mesa().status_cozinha, PedidoMesa.STATUS_COZINHA_AGUARDANDO)
+
+
+class FilaCozinhaEtagTests(APITestCase):
+    """ A fila da cozinha responde If-None-Match com 304 sem tocar nas tabelas de pedidos. """
+    def setUp(self):
+        self.url = reverse('cozinha_api:pedidos_para_preparar_list')
+        self.mesa = Mesa.objects.create(numero_identificador="E01")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.pedido_mesa = PedidoMesa.objects.create(
+                mesa=self.mesa,
+                status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=timezone.now()
+            )
+
+    def test_304_enquanto_fila_nao_muda(self):
+        etag = self.client.get(self.url, format='json')['ETag']
+        # Conversas do bot que não estão na cozinha não mudam a versão da fila
+        with self.captureOnCommitCallbacks(execute=True):
+            PedidoWhatsApp.objects.create(telefone_cliente="+5511900000003")
+
+        with self.assertNumQueries(1): # Apenas o contador de versão
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_mudanca_de_status_muda_o_etag(self):
+        etag = self.client.get(self.url, format='json')['ETag']
+        url_status = reverse('cozinha_api:atualizar_status_cozinha', kwargs={
+            'tipo_origem': 'mesa', 'id_pedido_origem': self.pedido_mesa.id
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(url_status, {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}, format='json')
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data[0]['status_cozinha_atual'], PedidoMesa.STATUS_COZINHA_EM_PREPARO)
+
+    def test_etag_considera_parametros_de_paginacao(self):
+        etag_completa = self.client.get(self.url, format='json')['ETag']
+        etag_paginada = self.client.get(self.url, {'limit': 1}, format='json')['ETag']
+        self.assertNotEqual(etag_completa, etag_paginada)
+
+
+class AtualizarStatusCozinhaEmLoteTests(APITestCase):
+    """ Testes de PATCH /api/cozinha/pedidos/status/lote/ """
+    def setUp(self):
+        self.url = reverse('cozinha_api:atualizar_status_cozinha_lote')
+        self.pedidos_mesa = []
+        for i in range(3):
+            mesa = Mesa.objects.create(numero_identificador=f"L{i}")
+            self.pedidos_mesa.append(PedidoMesa.objects.create(
+                mesa=mesa,
+                status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+                horario_entrada_cozinha=timezone.now()
+            ))
+        self.pedido_whatsapp = PedidoWhatsApp.objects.create(
+            telefone_cliente="+5511900000004",
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_EM_PREPARO,
+            horario_entrada_cozinha=timezone.now()
+        )
+
+    def _transicao(self, tipo_origem, pedido, novo_status):
+        return {'tipo_origem': tipo_origem, 'id_pedido_origem': pedido.id, 'status_cozinha': novo_status}
+
+    def test_lote_aplica_transicoes_com_consultas_fixas(self):
+        transicoes = [self._transicao('mesa', p, PedidoMesa.STATUS_COZINHA_EM_PREPARO) for p in self.pedidos_mesa]
+        transicoes.append(self._transicao('WhatsApp', self.pedido_whatsapp, PedidoMesa.STATUS_COZINHA_PRONTO))
+
+        # Por origem: UPDATE ... RETURNING do pedido, leitura do ticket, INSERT dos eventos
+        # e UPDATE do ticket; um UPDATE das previsões da fila (mais o savepoint do atomic)
+        with self.assertNumQueries(11):
+            response = self.client.patch(self.url, {'transicoes': transicoes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['resultado'] for r in response.data['resultados']], ['ok'] * 4)
+
+        self.assertEqual(
+            set(PedidoMesa.objects.values_list('status_cozinha', flat=True)), {PedidoMesa.STATUS_COZINHA_EM_PREPARO}
+        )
+        self.pedido_whatsapp.refresh_from_db()
+        self.assertEqual(self.pedido_whatsapp.status_cozinha, PedidoWhatsApp.STATUS_COZINHA_PRONTO)
+        self.assertEqual(
+            KitchenTicket.objects.get(tipo_origem='WhatsApp', object_id=self.pedido_whatsapp.id).status_cozinha,
+            PedidoWhatsApp.STATUS_COZINHA_PRONTO
+        )
+
+    def test_lote_retorna_resultado_por_pedido(self):
+        transicoes = [
+            self._transicao('mesa', self.pedidos_mesa[0], PedidoMesa.STATUS_COZINHA_EM_PREPARO),
+            self._transicao('mesa', self.pedidos_mesa[1], PedidoMesa.STATUS_COZINHA_PRONTO), # Pula "Em Preparo"
+            {'tipo_origem': 'mesa', 'id_pedido_origem': 999, 'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO},
+        ]
+        response = self.client.patch(self.url, {'transicoes': transicoes}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        resultados = response.data['resultados']
+        self.assertEqual([r['resultado'] for r in resultados], ['ok', 'transicao_invalida', 'nao_encontrado'])
+        self.assertEqual(resultados[1]['status_cozinha_atual'], PedidoMesa.STATUS_COZINHA_AGUARDANDO)
+
+        self.pedidos_mesa[1].refresh_from_db()
+        self.assertEqual(self.pedidos_mesa[1].status_cozinha, PedidoMesa.STATUS_COZINHA_AGUARDANDO)
+
+    def test_lote_publica_eventos_apos_commit(self):
+        fila = barramento_cozinha.assinar()
+        self.addCleanup(barramento_cozinha.cancelar_assinatura, fila)
+        transicoes = [self._transicao('mesa', p, PedidoMesa.STATUS_COZINHA_EM_PREPARO) for p in self.pedidos_mesa[:2]]
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(self.url, {'transicoes': transicoes}, format='json')
+        eventos = [fila.get_nowait(), fila.get_nowait()]
+        self.assertEqual({e['dados']['id_pedido_origem'] for e in eventos}, {p.id for p in self.pedidos_mesa[:2]})
+
+    def test_lote_rejeita_pedido_repetido(self):
+        transicao = self._transicao('mesa', self.pedidos_mesa[0], PedidoMesa.STATUS_COZINHA_EM_PREPARO)
+        response = self.client.patch(self.url, {'transicoes': [transicao, transicao]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class AtualizarStatusCozinhaConcorrenciaTests(APITestCase):
+    """ Transições de status como compare-and-set: a tela que chega depois recebe 409. """
+    def setUp(self):
+        mesa = Mesa.objects.create(numero_identificador="CC1")
+        self.pedido_mesa = PedidoMesa.objects.create(
+            mesa=mesa,
+            status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=timezone.now()
+        )
+        self.url = reverse('cozinha_api:atualizar_status_cozinha', kwargs={
+            'tipo_origem': 'mesa', 'id_pedido_origem': self.pedido_mesa.id
+        })
+
+    def test_segunda_tela_recebe_409_com_status_atual(self):
+        dados = {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}
+        self.assertEqual(self.client.patch(self.url, dados, format='json').status_code, status.HTTP_200_OK)
+
+        response = self.client.patch(self.url, dados, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['status_cozinha_atual'], PedidoMesa.STATUS_COZINHA_EM_PREPARO)
+
+    def test_transicao_e_um_unico_update_condicional(self):
+        # UPDATE ... RETURNING do pedido, leitura do ticket, INSERT do evento, UPDATE do ticket
+        # e UPDATE das previsões da fila (mais o savepoint do atomic)
+        with self.assertNumQueries(7):
+            response = self.client.patch(self.url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class AtualizarStatusCozinhaStressTests(TransactionTestCase):
+    """ Várias threads disputando os mesmos pedidos: nenhuma transição perdida ou aplicada duas vezes. """
+    def setUp(self):
+        # Verificado aqui, e não na carga do módulo: só agora a conexão aponta para o banco de teste
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest("SQLite em memória não é compartilhado entre threads.")
+
+    def test_threads_disputando_os_mesmos_pedidos(self):
+        saida = StringIO()
+        call_command('stress_status_cozinha', threads=8, pedidos=5, tentativas=2, stdout=saida)
+        self.assertIn("Nenhuma transição perdida ou ilegal.", saida.getvalue())
+
+
+class EventoStatusCozinhaTests(APITestCase):
+    """ Cada mudança de status_cozinha grava um evento com o tempo passado no status anterior. """
+    def setUp(self):
+        self.produto = Produto.objects.create(nome="Pizza Cronometrada", preco_base=30.00)
+        mesa = Mesa.objects.create(numero_identificador="EV1")
+        self.pedido_mesa = PedidoMesa.objects.create(mesa=mesa)
+        ItemPedidoMesa.objects.create(pedido_mesa=self.pedido_mesa, produto=self.produto, quantidade=2, preco_unitario_no_momento=30.00)
+        self.pedido_mesa.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
+        self.pedido_mesa.horario_entrada_cozinha = timezone.now()
+        self.pedido_mesa.save()
+        self.url = reverse('cozinha_api:atualizar_status_cozinha', kwargs={
+            'tipo_origem': 'mesa', 'id_pedido_origem': self.pedido_mesa.id
+        })
+
+    def _atrasar_status_atual(self, segundos):
+        KitchenTicket.objects.filter(object_id=self.pedido_mesa.id).update(
+            horario_status=timezone.now() - timezone.timedelta(seconds=segundos)
+        )
+
+    def test_entrada_e_transicoes_gravam_eventos_com_duracao(self):
+        self._atrasar_status_atual(120)
+        self.client.patch(self.url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}, format='json')
+        self._atrasar_status_atual(600)
+        self.client.patch(self.url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_PRONTO}, format='json')
+
+        eventos = list(EventoStatusCozinha.objects.filter(object_id=self.pedido_mesa.id).order_by('id'))
+        self.assertEqual(
+            [(e.status_anterior, e.status_novo) for e in eventos],
+            [(None, 'AguardandoPreparo'), ('AguardandoPreparo', 'EmPreparo'), ('EmPreparo', 'Pronto')]
+        )
+        self.assertIsNone(eventos[0].duracao_segundos)
+        self.assertAlmostEqual(eventos[1].duracao_segundos, 120, delta=5)
+        self.assertAlmostEqual(eventos[2].duracao_segundos, 600, delta=5)
+
+        itens = EventoStatusCozinhaItem.objects.filter(object_id=self.pedido_mesa.id, status_novo='Pronto')
+        self.assertEqual(itens.count(), 1)
+        self.assertEqual((itens[0].produto_id, itens[0].quantidade), (self.produto.id, 2))
+
+    def test_transicao_rejeitada_nao_grava_evento(self):
+        total = EventoStatusCozinha.objects.count()
+        response = self.client.patch(self.url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_PRONTO}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(EventoStatusCozinha.objects.count(), total)
+
+
+@override_settings(COZINHA_CAPACIDADE_PARALELA=1, COZINHA_TEMPO_PREPARO_PADRAO_SEGUNDOS=600)
+class PrevisaoProntoTests(APITestCase):
+    """ Previsão de ficar pronto (ETA) dos tickets, mantida incrementalmente. """
+    def setUp(self):
+        self.produto_rapido = Produto.objects.create(nome="Esfiha", preco_base=8.00)
+        self.produto_sem_historico = Produto.objects.create(nome="Pizza Nova", preco_base=40.00)
+        for duracao in (200, 400): # Média de preparo do produto rápido: 300s
+            EventoStatusCozinhaItem.objects.create(
+                tipo_origem='Mesa', object_id=999, produto_id=self.produto_rapido.id, nome_produto="Esfiha",
+                status_novo=KitchenTicket.STATUS_COZINHA_PRONTO, horario=timezone.now(), duracao_segundos=duracao
+            )
+
+    def _entrar_na_fila(self, numero_mesa, produto):
+        pedido = PedidoMesa.objects.create(mesa=Mesa.objects.create(numero_identificador=numero_mesa))
+        ItemPedidoMesa.objects.create(pedido_mesa=pedido, produto=produto, quantidade=1, preco_unitario_no_momento=produto.preco_base)
+        pedido.status_cozinha = PedidoMesa.STATUS_COZINHA_AGUARDANDO
+        pedido.horario_entrada_cozinha = timezone.now()
+        pedido.save()
+        return pedido, KitchenTicket.objects.get(object_id=pedido.id, tipo_origem='Mesa')
+
+    def test_entrada_estima_pelo_historico_e_espera_a_fila(self):
+        _, primeiro = self._entrar_na_fila("ETA1", self.produto_rapido)
+        _, segundo = self._entrar_na_fila("ETA2", self.produto_sem_historico)
+
+        self.assertEqual(primeiro.tempo_preparo_estimado, timezone.timedelta(seconds=300))
+        self.assertEqual(segundo.tempo_preparo_estimado, timezone.timedelta(seconds=600))
+        # Uma estação: o segundo pedido começa quando o primeiro fica pronto
+        self.assertEqual(segundo.horario_previsto_pronto, primeiro.horario_previsto_pronto + timezone.timedelta(seconds=600))
+
+        fila = self.client.get(reverse('cozinha_api:pedidos_para_preparar_list')).data
+        self.assertTrue(all(pedido['horario_previsto_pronto'] for pedido in fila))
+
+    def test_transicao_ajusta_o_pedido_e_os_que_aguardam(self):
+        pedido, primeiro = self._entrar_na_fila("ETA3", self.produto_rapido)
+        _, segundo = self._entrar_na_fila("ETA4", self.produto_rapido)
+        # O primeiro começa a ser preparado 10 minutos depois do previsto
+        KitchenTicket.objects.filter(pk=primeiro.pk).update(
+            horario_previsto_pronto=primeiro.horario_previsto_pronto - timezone.timedelta(minutes=10)
+        )
+        KitchenTicket.objects.filter(pk=segundo.pk).update(
+            horario_previsto_pronto=segundo.horario_previsto_pronto - timezone.timedelta(minutes=10)
+        )
+
+        antes = timezone.now()
+        url = reverse('cozinha_api:atualizar_status_cozinha', kwargs={'tipo_origem': 'mesa', 'id_pedido_origem': pedido.id})
+        self.client.patch(url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_EM_PREPARO}, format='json')
+
+        primeiro.refresh_from_db()
+        segundo.refresh_from_db()
+        self.assertGreaterEqual(primeiro.horario_previsto_pronto, antes + timezone.timedelta(seconds=300))
+        # Atraso de 10 minutos repassado a quem aguarda (uma estação)
+        self.assertAlmostEqual(
+            segundo.horario_previsto_pronto.timestamp(),
+            (primeiro.horario_previsto_pronto + timezone.timedelta(seconds=300)).timestamp(), delta=1
+        )
+
+    def test_historico_separado_por_origem(self):
+        # Mesmo id no catálogo do WhatsApp (ProdutoPlaceholder): não é o produto da mesa
+        EventoStatusCozinhaItem.objects.create(
+            tipo_origem='WhatsApp', object_id=998, produto_id=self.produto_sem_historico.id, nome_produto="Outro",
+            status_novo=KitchenTicket.STATUS_COZINHA_PRONTO, horario=timezone.now(), duracao_segundos=60
+        )
+        _, ticket = self._entrar_na_fila("ETA9", self.produto_sem_historico)
+        self.assertEqual(ticket.tempo_preparo_estimado, timezone.timedelta(seconds=600))
+
+    @override_settings(COZINHA_CAPACIDADE_PARALELA=2)
+    def test_incremental_igual_ao_recalculo_completo(self):
+        tickets = [self._entrar_na_fila(f"ETA{5 + i}", produto)[1] for i, produto in enumerate(
+            [self.produto_rapido, self.produto_sem_historico, self.produto_rapido, self.produto_rapido]
+        )]
+        incrementais = {t.pk: t.horario_previsto_pronto for t in tickets}
+
+        recalcular_previsoes_fila(min(incrementais.values()) - timezone.timedelta(seconds=300))
+        recalculados = dict(KitchenTicket.objects.values_list('pk', 'horario_previsto_pronto'))
+        for pk, previsao in incrementais.items():
+            self.assertAlmostEqual(recalculados[pk].timestamp(), previsao.timestamp(), delta=1)
+
+
+class ProducaoPorProdutoTests(APITestCase):
+    """ Itens da fila agrupados por produto em uma consulta agregada. """
+    def setUp(self):
+        self.calabresa = Produto.objects.create(nome="Calabresa", preco_base=30.00)
+        self.refri = Produto.objects.create(nome="Refrigerante", preco_base=6.00)
+        agora = timezone.now()
+
+        self.pedido_whatsapp = PedidoWhatsApp.objects.create(
+            telefone_cliente="+5511900000009",
+            carrinho_atual=[
+                {'id': self.calabresa.id, 'nome': "Calabresa", 'preco': 30.00, 'quantidade': 3, 'observacoes': 'sem cebola'},
+            ],
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=agora - timezone.timedelta(minutes=10),
+        )
+        self.pedido_mesa = PedidoMesa.objects.create(mesa=Mesa.objects.create(numero_identificador="PP1"))
+        ItemPedidoMesa.objects.create(pedido_mesa=self.pedido_mesa, produto=self.calabresa, quantidade=4, preco_unitario_no_momento=30.00)
+        ItemPedidoMesa.objects.create(pedido_mesa=self.pedido_mesa, produto=self.refri, quantidade=2, preco_unitario_no_momento=6.00)
+        self.pedido_mesa.status_cozinha = PedidoMesa.STATUS_COZINHA_EM_PREPARO
+        self.pedido_mesa.horario_entrada_cozinha = agora - timezone.timedelta(minutes=5)
+        self.pedido_mesa.save()
+        # Pedido já pronto: fora da produção
+        PedidoWhatsApp.objects.create(
+            telefone_cliente="+5511900000010",
+            carrinho_atual=[{'id': self.calabresa.id, 'nome': "Calabresa", 'preco': 30.00, 'quantidade': 9}],
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_PRONTO,
+            horario_entrada_cozinha=agora - timezone.timedelta(minutes=30),
+        )
+        self.url = reverse('cozinha_api:producao_por_produto')
+
+    def test_agrupa_itens_whatsapp_e_mesa(self):
+        with self.assertNumQueries(2): # Versão (ETag) e a consulta agregada
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual([(p['nome_produto'], p['quantidade_total']) for p in response.data], [("Calabresa", 7), ("Refrigerante", 2)])
+        calabresa = response.data[0]
+        self.assertEqual(calabresa['produto_id'], self.calabresa.id)
+        self.assertEqual(
+            [(p['tipo_origem'], p['id_pedido_origem'], p['quantidade']) for p in calabresa['pedidos']],
+            [('WhatsApp', self.pedido_whatsapp.id, 3), ('Mesa', self.pedido_mesa.id, 4)]
+        )
+        self.assertEqual(calabresa['pedidos'][0]['observacoes_item'], 'sem cebola')
+        self.assertEqual(calabresa['horario_entrada_mais_antigo'], calabresa['pedidos'][0]['horario_entrada_cozinha'])
+
+    def test_filtro_por_status(self):
+        response = self.client.get(self.url, {'status_cozinha': PedidoMesa.STATUS_COZINHA_AGUARDANDO})
+        self.assertEqual([(p['nome_produto'], p['quantidade_total']) for p in response.data], [("Calabresa", 3)])
+        self.assertEqual(self.client.get(self.url, {'status_cozinha': 'Pronto'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_agrupamento_em_python_igual_ao_sql(self):
+        por_python = sorted(_agrupar_itens_python(STATUS_COZINHA_NA_FILA), key=lambda p: p['nome_produto'])
+        por_sql = sorted(_agrupar_itens_sql(connection, STATUS_COZINHA_NA_FILA), key=lambda p: p['nome_produto'])
+        self.assertEqual(por_python, por_sql)
+
+
+@override_settings(
+    COZINHA_TEMPO_FORNO_SEGUNDOS={('Mesa', 1): 600, ('Mesa', 2): 300, 'Refrigerante': 0}, COZINHA_TEMPO_FORNO_PADRAO_SEGUNDOS=480
+)
+class PlanoFornosTests(APITestCase):
+    """ Escalonamento dos pedidos nos fornos (cozinha_api.forno). """
+    def setUp(self):
+        self.agora = timezone.now()
+
+    def _ticket(self, id_pedido, itens, status_cozinha='AguardandoPreparo', horario_status=None):
+        return (
+            'Mesa', id_pedido, self.agora - timezone.timedelta(minutes=10 - id_pedido), status_cozinha, horario_status,
+            [{'produto_id': produto_id, 'nome_produto': nome, 'quantidade': quantidade} for produto_id, nome, quantidade in itens],
+        )
+
+    def test_pedido_curto_ultrapassa_ate_o_limite(self):
+        grande = self._ticket(1, [(1, 'Calabresa', 2)])
+        curtos = [self._ticket(i, [(2, 'Esfiha', 1)]) for i in range(2, 5)]
+        # Um forno com uma posição: o pedido grande pode ser ultrapassado por no máximo 2 pedidos
+        plano = planejar_fornos([grande] + curtos, self.agora, 1, 1, 2)
+        self.assertEqual([p['id_pedido_origem'] for p in plano['pedidos']], [2, 3, 1, 4])
+        fifo = planejar_fornos([grande] + curtos, self.agora, 1, 1, 0)
+        self.assertEqual([p['id_pedido_origem'] for p in fifo['pedidos']], [1, 2, 3, 4])
+        self.assertLess(plano['espera_media_segundos'], fifo['espera_media_segundos'])
+
+    def test_unidades_nas_posicoes_que_liberam_primeiro(self):
+        plano = planejar_fornos([self._ticket(1, [(1, 'Calabresa', 3), (9, 'Refrigerante', 2)])], self.agora, 1, 2, 3)
+        # Bebida não vai ao forno; a terceira pizza espera a primeira posição liberar
+        self.assertEqual(len(plano['fornadas']), 3)
+        self.assertEqual(plano['pedidos'][0]['previsto_pronto'], self.agora + timezone.timedelta(seconds=1200))
+
+    def test_tempo_de_forno_pelo_catalogo_da_origem(self):
+        # ('Mesa', 1) não vale para o id 1 do catálogo do WhatsApp: cai no padrão
+        self.assertEqual(tempo_forno('Mesa', 1, 'Calabresa'), timezone.timedelta(seconds=600))
+        self.assertEqual(tempo_forno('WhatsApp', 1, 'Outra'), timezone.timedelta(seconds=480))
+        self.assertEqual(tempo_forno('WhatsApp', 7, 'Refrigerante'), timezone.timedelta(0))
+
+    def test_pedido_em_preparo_mantem_horario_real(self):
+        em_preparo = self._ticket(1, [(2, 'Esfiha', 1)], 'EmPreparo', self.agora - timezone.timedelta(seconds=100))
+        plano = planejar_fornos([em_preparo, self._ticket(2, [(2, 'Esfiha', 1)])], self.agora, 1, 1, 3)
+        self.assertEqual(plano['pedidos'][0]['previsto_pronto'], self.agora + timezone.timedelta(seconds=200))
+        self.assertEqual(plano['pedidos'][1]['inicio_previsto'], self.agora + timezone.timedelta(seconds=200))
+
+    def test_endpoint_planeja_a_fila_com_uma_consulta(self):
+        PedidoWhatsApp.objects.create(
+            telefone_cliente="+5511900000011",
+            carrinho_atual=[{'id': 1, 'nome': "Calabresa", 'preco': 30.00, 'quantidade': 2}],
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=self.agora,
+        )
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('cozinha_api:plano_fornos'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['pedidos']), 1)
+        self.assertEqual(len(response.data['fornadas']), 2)
+        self.assertIn('espera_media_fifo_segundos', response.data)
 ```
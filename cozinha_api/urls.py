@@ -1,9 +1,15 @@
 from django.urls import path
-from .views import PedidosParaPrepararListView, AtualizarStatusCozinhaView
+from .views import (
+    PedidosParaPrepararListView, ProducaoPorProdutoView, PlanoFornosView, AtualizarStatusCozinhaView, AtualizarStatusCozinhaEmLoteView, StreamPedidosCozinhaView,
+)
 
 app_name = 'cozinha_api'
 
 urlpatterns = [
     path('pedidos_para_preparar/', PedidosParaPrepararListView.as_view(), name='pedidos_para_preparar_list'),
+    path('pedidos_para_preparar/stream/', StreamPedidosCozinhaView.as_view(), name='pedidos_para_preparar_stream'),
+    path('producao_por_produto/', ProducaoPorProdutoView.as_view(), name='producao_por_produto'),
+    path('plano_fornos/', PlanoFornosView.as_view(), name='plano_fornos'),
+    path('pedidos/status/lote/', AtualizarStatusCozinhaEmLoteView.as_view(), name='atualizar_status_cozinha_lote'),
     path('pedidos/<str:tipo_origem>/<int:id_pedido_origem>/status/', AtualizarStatusCozinhaView.as_view(), name='atualizar_status_cozinha'),
 ]
@@ -1,78 +1,88 @@
+import json
+import queue
+import time
+
 from rest_framework.views import APIView
 from rest_framework.response import Response
-from rest_framework import status
-from django.utils import timezone
-from django.db.models import Q
-
-from whatsapp_bot.models import PedidoWhatsApp
-from atendimento_interno.models import PedidoMesa, ItemPedidoMesa
-from .serializers import ConsolidatedPedidoCozinhaSerializer, KitchenStatusUpdateSerializer, ItemConsolidadoSerializer
-
-class PedidosParaPrepararListView(APIView):
+from rest_framework import status, generics, renderers
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.settings import api_settings
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from administracao.versoes import etag_por_escopo, obter_versao, ESCOPO_COZINHA
+from .serializers import KitchenStatusUpdateSerializer, KitchenStatusBulkUpdateSerializer
+from .services import (
+    montar_fila_cozinha, tickets_na_fila, ticket_para_cozinha, aplicar_transicoes_status_cozinha,
+    agrupar_itens_fila_por_produto, plano_fornos_fila, STATUS_COZINHA_NA_FILA,
+    RESULTADO_NAO_ENCONTRADO, RESULTADO_INVALIDO, RESULTADO_CONFLITO,
+)
+from .eventos import barramento_cozinha, EVENTO_SNAPSHOT, EVENTO_RESSINCRONIZAR
+
+class FilaCozinhaPagination(LimitOffsetPagination):
+    # Sem ?limit= a fila é devolvida inteira, como lista simples (formato esperado pelo dashboard)
+    default_limit = None
+    max_limit = 500
+
+
+@method_decorator(condition(etag_func=etag_por_escopo(ESCOPO_COZINHA)), name='get')
+class PedidosParaPrepararListView(generics.ListAPIView):
     """
     Lista todos os PedidoWhatsApp e PedidoMesa que estão com
     status_cozinha = 'AguardandoPreparo' ou 'EmPreparo'.
     Ordena por horario_entrada_cozinha (mais antigos primeiro).
+    Lê a projeção KitchenTicket com uma única consulta ordenada pelo índice da fila.
+    Paginação opcional: ?limit=50&offset=0.
+    Responde If-None-Match com 304 consultando apenas o contador de versão 'cozinha'.
+    """
+    pagination_class = FilaCozinhaPagination
+
+    def get_queryset(self):
+        return tickets_na_fila()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.get_queryset()
+        pagina = self.paginate_queryset(queryset)
+        if pagina is not None:
+            return self.get_paginated_response([ticket_para_cozinha(linha) for linha in pagina])
+        return Response([ticket_para_cozinha(linha) for linha in queryset], status=status.HTTP_200_OK)
+
+
+
+@method_decorator(condition(etag_func=etag_por_escopo(ESCOPO_COZINHA)), name='get')
+class ProducaoPorProdutoView(APIView):
+    """
+    Itens dos pedidos na fila agrupados por produto, para a cozinha produzir em lote.
+    GET /api/cozinha/producao_por_produto/
+    Filtro opcional: ?status_cozinha=AguardandoPreparo (ou EmPreparo).
+    Output: [ { "produto_id", "nome_produto", "quantidade_total", "horario_entrada_mais_antigo",
+                "pedidos": [ { "tipo_origem", "id_pedido_origem", "identificador_cliente", "quantidade", ... } ] } ]
+    Uma consulta agregada (GROUP BY) sobre os KitchenTicket; mesmo ETag da fila.
     """
     def get(self, request, *args, **kwargs):
-        pedidos_whatsapp = PedidoWhatsApp.objects.filter(
-            Q(status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO) |
-            Q(status_cozinha=PedidoWhatsApp.STATUS_COZINHA_EM_PREPARO)
-        ).exclude(status_cozinha__isnull=True).exclude(status_cozinha='').order_by('horario_entrada_cozinha')
-
-        pedidos_mesa = PedidoMesa.objects.filter(
-            Q(status_cozinha=PedidoMesa.STATUS_COZINHA_AGUARDANDO) |
-            Q(status_cozinha=PedidoMesa.STATUS_COZINHA_EM_PREPARO)
-        ).exclude(status_cozinha__isnull=True).exclude(status_cozinha='').order_by('horario_entrada_cozinha')
-
-        pedidos_consolidados = []
-
-        # Processar Pedidos WhatsApp
-        for pw in pedidos_whatsapp:
-            itens_formatados = []
-            if isinstance(pw.carrinho_atual, list): # carrinho_atual is a list of dicts
-                for item_no_carrinho in pw.carrinho_atual:
-                    itens_formatados.append(ItemConsolidadoSerializer({
-                        'nome_produto': item_no_carrinho.get('nome', 'Produto Desconhecido'),
-                        'quantidade': item_no_carrinho.get('quantidade', 0),
-                        'observacoes_item': item_no_carrinho.get('observacoes', '') # Assumindo que pode haver 'observacoes' no item do carrinho
-                    }).data)
-            
-            pedidos_consolidados.append({
-                'id_pedido_origem': pw.id,
-                'tipo_origem': 'WhatsApp',
-                'identificador_cliente': pw.nome_cliente or pw.telefone_cliente,
-                'horario_entrada_cozinha': pw.horario_entrada_cozinha,
-                'status_cozinha_atual': pw.status_cozinha,
-                'itens': itens_formatados,
-            })
-
-        # Processar Pedidos de Mesa
-        for pm in pedidos_mesa:
-            itens_formatados = []
-            for item_pedido_mesa in pm.itens_pedido.all(): # itens_pedido is a related manager
-                itens_formatados.append(ItemConsolidadoSerializer({
-                    'nome_produto': item_pedido_mesa.produto.nome, # Assumindo que produto.nome existe
-                    'quantidade': item_pedido_mesa.quantidade,
-                    'observacoes_item': item_pedido_mesa.observacoes_item
-                }).data)
-
-            pedidos_consolidados.append({
-                'id_pedido_origem': pm.id,
-                'tipo_origem': 'Mesa',
-                'identificador_cliente': f"Mesa {pm.mesa.numero_identificador}",
-                'horario_entrada_cozinha': pm.horario_entrada_cozinha,
-                'status_cozinha_atual': pm.status_cozinha,
-                'itens': itens_formatados,
-            })
-        
-        # Ordenar a lista consolidada por horario_entrada_cozinha
-        # Pedidos sem horário de entrada (improvável dado o filtro, mas por segurança) viriam por último ou primeiro dependendo do None handling
-        pedidos_consolidados.sort(key=lambda p: p['horario_entrada_cozinha'] or timezone.now())
-
-        serializer = ConsolidatedPedidoCozinhaSerializer(pedidos_consolidados, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        status_cozinha = request.query_params.get('status_cozinha')
+        if status_cozinha and status_cozinha not in STATUS_COZINHA_NA_FILA:
+            return Response(
+                {'detail': f"status_cozinha deve ser um de: {', '.join(STATUS_COZINHA_NA_FILA)}."},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        produtos = agrupar_itens_fila_por_produto([status_cozinha] if status_cozinha else None)
+        return Response(produtos, status=status.HTTP_200_OK)
+
 
+class PlanoFornosView(APIView):
+    """
+    Plano de uso dos fornos para a fila atual (ver cozinha_api/forno.py).
+    GET /api/cozinha/plano_fornos/
+    Output: { "fornos", "slots_por_forno", "espera_media_segundos", "espera_media_fifo_segundos",
+              "pedidos": [ ...na ordem em que entram no forno... ], "fornadas": [ { "forno", "posicao", "inicio", "fim", ... } ] }
+    Sem ETag: o plano depende do horário atual, não só do conteúdo da fila.
+    """
+    def get(self, request, *args, **kwargs):
+        return Response(plano_fornos_fila(), status=status.HTTP_200_OK)
 
 class AtualizarStatusCozinhaView(APIView):
     """
@@ -86,51 +96,156 @@ class AtualizarStatusCozinhaView(APIView):
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
         novo_status_cozinha = serializer.validated_data['status_cozinha']
-        pedido_obj = None
-        
+
         try:
             id_pedido_origem = int(id_pedido_origem)
         except ValueError:
             return Response({'detail': 'ID do pedido inválido.'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if tipo_origem.lower() == 'whatsapp':
-            try:
-                pedido_obj = PedidoWhatsApp.objects.get(id=id_pedido_origem)
-            except PedidoWhatsApp.DoesNotExist:
-                return Response({'detail': 'Pedido WhatsApp não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
-        elif tipo_origem.lower() == 'mesa':
-            try:
-                pedido_obj = PedidoMesa.objects.get(id=id_pedido_origem)
-            except PedidoMesa.DoesNotExist:
-                return Response({'detail': 'Pedido de Mesa não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
-        else:
+        tipo_origem = tipo_origem.lower()
+        if tipo_origem not in ['whatsapp', 'mesa']:
             return Response({'detail': 'Tipo de origem inválido. Use "whatsapp" ou "mesa".'}, status=status.HTTP_400_BAD_REQUEST)
 
-        if not pedido_obj.status_cozinha:
-             return Response({'detail': f'Este pedido ainda não foi enviado para a cozinha.'}, status=status.HTTP_400_BAD_REQUEST)
-
-        # Lógica de transição de status (exemplo simples)
-        # (AguardandoPreparo -> EmPreparo), (EmPreparo -> Pronto)
-        if pedido_obj.status_cozinha == PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO and novo_status_cozinha != PedidoWhatsApp.STATUS_COZINHA_EM_PREPARO:
-            return Response({'detail': f'Status inválido. Pedido "Aguardando Preparo" só pode ir para "Em Preparo".'}, status=status.HTTP_400_BAD_REQUEST)
-        if pedido_obj.status_cozinha == PedidoWhatsApp.STATUS_COZINHA_EM_PREPARO and novo_status_cozinha != PedidoWhatsApp.STATUS_COZINHA_PRONTO:
-            return Response({'detail': f'Status inválido. Pedido "Em Preparo" só pode ir para "Pronto".'}, status=status.HTTP_400_BAD_REQUEST)
-        if pedido_obj.status_cozinha == PedidoWhatsApp.STATUS_COZINHA_PRONTO: # Já está pronto, não deveria mudar por esta API
-             return Response({'detail': f'Pedido já está "Pronto". Nenhuma alteração permitida por esta API.'}, status=status.HTTP_400_BAD_REQUEST)
-
-
-        pedido_obj.status_cozinha = novo_status_cozinha
-        
-        # Se estiver indo para "Pronto", poderia registrar um horário de finalização, se houvesse tal campo.
-        # if novo_status_cozinha == PedidoWhatsApp.STATUS_COZINHA_PRONTO:
-        #     pedido_obj.horario_finalizacao_cozinha = timezone.now() # Exemplo, se campo existir
-
-        pedido_obj.save()
+        # Compare-and-set: um UPDATE condicional ao status anterior exigido, sem ler o pedido antes
+        # nem segurar locks. Se outra tela chegou antes, esta recebe 409 com o status atual.
+        resultado = aplicar_transicoes_status_cozinha([(tipo_origem, id_pedido_origem, novo_status_cozinha)])[0]
+
+        if resultado['resultado'] == RESULTADO_NAO_ENCONTRADO:
+            rotulo = 'WhatsApp' if tipo_origem == 'whatsapp' else 'de Mesa'
+            return Response({'detail': f'Pedido {rotulo} não encontrado.'}, status=status.HTTP_404_NOT_FOUND)
+        if resultado['resultado'] == RESULTADO_INVALIDO:
+            return Response({'detail': resultado['detail']}, status=status.HTTP_400_BAD_REQUEST)
+        if resultado['resultado'] == RESULTADO_CONFLITO:
+            return Response({
+                'detail': resultado['detail'],
+                'id_pedido_origem': id_pedido_origem,
+                'tipo_origem': tipo_origem,
+                'status_cozinha_atual': resultado['status_cozinha_atual'],
+            }, status=status.HTTP_409_CONFLICT)
 
         # Retornar o pedido atualizado no formato consolidado pode ser uma boa prática,
         # mas para simplificar, apenas um success com o novo status.
         return Response({
-            'id_pedido_origem': pedido_obj.id,
-            'tipo_origem': tipo_origem.lower(),
+            'id_pedido_origem': id_pedido_origem,
+            'tipo_origem': tipo_origem,
             'status_cozinha_novo': novo_status_cozinha
         }, status=status.HTTP_200_OK)
+
+
+class AtualizarStatusCozinhaEmLoteView(APIView):
+    """
+    Atualiza o status_cozinha de vários pedidos (WhatsApp e/ou Mesa) em uma requisição
+    e uma transação, com as mesmas regras de transição de AtualizarStatusCozinhaView.
+    PATCH /api/cozinha/pedidos/status/lote/
+    Input: { "transicoes": [ { "tipo_origem": "mesa", "id_pedido_origem": 1, "status_cozinha": "EmPreparo" }, ... ] }
+    Output: { "resultados": [ { "tipo_origem", "id_pedido_origem", "resultado", "status_cozinha_atual", "detail" }, ... ] }
+    "resultado" é 'ok', 'nao_encontrado', 'transicao_invalida' ou 'conflito' para cada pedido.
+    """
+    def patch(self, request, *args, **kwargs):
+        serializer = KitchenStatusBulkUpdateSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        resultados = aplicar_transicoes_status_cozinha([
+            (t['tipo_origem'], t['id_pedido_origem'], t['status_cozinha'])
+            for t in serializer.validated_data['transicoes']
+        ])
+        return Response({'resultados': resultados}, status=status.HTTP_200_OK)
+
+
+def _formatar_evento_sse(tipo, dados, evento_id=None):
+    linhas = []
+    if evento_id is not None:
+        linhas.append(f"id: {evento_id}")
+    linhas.append(f"event: {tipo}")
+    linhas.append(f"data: {json.dumps(dados, cls=DjangoJSONEncoder)}")
+    return "\n".join(linhas) + "\n\n"
+
+
+def _gerar_eventos_cozinha(fila, intervalo_keepalive, intervalo_verificacao, duracao_maxima):
+    """
+    Gera os eventos SSE de uma conexão: snapshot, eventos do barramento (do próprio processo)
+    e keepalives. A cada intervalo_verificacao a versão 'cozinha' (ContadorVersao) é relida;
+    se mudou desde o último snapshot, a fila foi alterada (possivelmente em outro processo,
+    cujos eventos não chegam a este barramento) e um novo snapshot é enviado.
+    Após duracao_maxima o stream é encerrado para liberar o worker; o EventSource reconecta
+    sozinho e recebe um novo snapshot.
+    """
+    try:
+        # A assinatura é feita antes do snapshot, então nenhuma mudança entre os dois se perde
+        # (no pior caso o cliente recebe um evento já refletido no snapshot, o que é idempotente).
+        # A versão é lida antes dos dados, como no ETag: uma mudança no meio apenas gera outro snapshot.
+        versao = obter_versao(ESCOPO_COZINHA)
+        yield _formatar_evento_sse(EVENTO_SNAPSHOT, montar_fila_cozinha())
+        inicio = ultimo_envio = time.monotonic()
+        proxima_verificacao = inicio + intervalo_verificacao
+        while True:
+            agora = time.monotonic()
+            if agora - inicio >= duracao_maxima:
+                return
+            if agora >= proxima_verificacao:
+                versao_atual = obter_versao(ESCOPO_COZINHA)
+                if versao_atual != versao:
+                    versao = versao_atual
+                    yield _formatar_evento_sse(EVENTO_SNAPSHOT, montar_fila_cozinha())
+                    ultimo_envio = time.monotonic()
+                proxima_verificacao = agora + intervalo_verificacao
+            espera = min(proxima_verificacao, ultimo_envio + intervalo_keepalive, inicio + duracao_maxima) - agora
+            try:
+                evento = fila.get(timeout=max(espera, 0))
+            except queue.Empty:
+                if time.monotonic() - ultimo_envio >= intervalo_keepalive:
+                    yield ": keepalive\n\n" # Comentário SSE para manter a conexão aberta em proxies
+                    ultimo_envio = time.monotonic()
+                continue
+            if evento['tipo'] == EVENTO_RESSINCRONIZAR:
+                versao = obter_versao(ESCOPO_COZINHA)
+                yield _formatar_evento_sse(EVENTO_SNAPSHOT, montar_fila_cozinha(), evento['id'])
+            else:
+                yield _formatar_evento_sse(evento['tipo'], evento['dados'], evento['id'])
+            ultimo_envio = time.monotonic()
+    finally:
+        barramento_cozinha.cancelar_assinatura(fila)
+
+
+class EventStreamRenderer(renderers.BaseRenderer):
+    """
+    Aceita 'Accept: text/event-stream' (EventSource) na negociação de conteúdo do DRF.
+    O stream em si é um StreamingHttpResponse; só as respostas de erro (401/403) passam
+    por aqui, em JSON.
+    """
+    media_type = 'text/event-stream'
+    format = 'sse'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, cls=DjangoJSONEncoder).encode()
+
+
+class StreamPedidosCozinhaView(APIView):
+    """
+    Stream (Server-Sent Events) da fila da cozinha.
+    GET /api/cozinha/pedidos_para_preparar/stream/
+    Envia primeiro um evento 'snapshot' com a fila completa (mesmo formato de
+    PedidosParaPrepararListView) e depois apenas eventos incrementais:
+    'pedido_entrou', 'pedido_atualizado', 'status_alterado' e 'pedido_saiu'.
+    Autenticação e permissões são as de PedidosParaPrepararListView, verificadas pelo
+    DRF antes de assinar o barramento e abrir o stream.
+    Mudanças feitas em outros processos chegam como um novo 'snapshot' (verificação da
+    versão 'cozinha'), e o stream é encerrado após COZINHA_STREAM_DURACAO_MAXIMA_SEGUNDOS.
+    """
+    authentication_classes = PedidosParaPrepararListView.authentication_classes
+    permission_classes = PedidosParaPrepararListView.permission_classes
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, EventStreamRenderer]
+
+    def get(self, request, *args, **kwargs):
+        intervalo_keepalive = getattr(settings, 'COZINHA_STREAM_KEEPALIVE_SEGUNDOS', 15)
+        intervalo_verificacao = getattr(settings, 'COZINHA_STREAM_VERIFICACAO_SEGUNDOS', 5)
+        duracao_maxima = getattr(settings, 'COZINHA_STREAM_DURACAO_MAXIMA_SEGUNDOS', 300)
+        fila = barramento_cozinha.assinar()
+        response = StreamingHttpResponse(
+            _gerar_eventos_cozinha(fila, intervalo_keepalive, intervalo_verificacao, duracao_maxima),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no' # Desabilita buffering em proxies nginx
+        return response
@@ -46,8 +46,12 @@ const MesaCard = ({ mesa }) => {
     <div style={cardStyle} onClick={handleMesaClick} role="button" tabIndex={0} onKeyPress={handleMesaClick}>
       <h3>Mesa {mesa.numero_identificador}</h3>
       <p>Status: {mesa.status || 'N/A'}</p>
-      {/* Poderia exibir informações do pedido ativo se disponíveis e relevantes aqui */}
-      {/* Ex: mesa.pedidos_recentes?.[0]?.id ? `Pedido: #${mesa.pedidos_recentes[0].id}` : '' */}
+      {/* Pedido em aberto, vindo do mapa do salão (GET /api/mesas/mapa/) */}
+      {mesa.pedido && (
+        <p>
+          Pedido #{mesa.pedido.id}: R$ {mesa.pedido.total} ({mesa.pedido.itens} itens, {mesa.pedido.minutos} min)
+        </p>
+      )}
     </div>
   );
 };
@@ -20,8 +20,8 @@ jest.mock('../../services/atendimentoService', () => ({
 
 
 const mockMesas = [
-  { id: 1, numero_identificador: 'M01', status: 'Livre', pedidos_recentes: [] }, // Ajustado para corresponder ao MesaCard
-  { id: 2, numero_identificador: 'M02', status: 'Ocupada', pedidos_recentes: [{ id: 101 }] },
+  { id: 1, numero_identificador: 'M01', status: 'Livre', pedido: null }, // Formato do mapa do salão (GET /api/mesas/mapa/)
+  { id: 2, numero_identificador: 'M02', status: 'Ocupada', pedido: { id: 101, status: 'Aberto', total: '80.00', itens: 2, minutos: 25 } },
 ];
 
 describe('MesasDashboardPage', () => {
@@ -23,12 +23,40 @@ const CozinhaDashboardPage = () => {
     }
   }, []);
 
+  // Aplica um evento do stream da cozinha à lista local, sem re-buscar a fila inteira
+  const handleEventoStream = useCallback((tipo, dados) => {
+    const mesmoPedido = (p) => p.tipo_origem === dados.tipo_origem && p.id_pedido_origem === dados.id_pedido_origem;
+    setPedidos((atuais) => {
+      switch (tipo) {
+        case 'snapshot':
+          return dados;
+        case 'pedido_entrou':
+        case 'pedido_atualizado': {
+          const semPedido = atuais.filter((p) => !mesmoPedido(p));
+          return [...semPedido, dados].sort(
+            (a, b) => new Date(a.horario_entrada_cozinha) - new Date(b.horario_entrada_cozinha)
+          );
+        }
+        case 'status_alterado':
+          return atuais.map((p) => (mesmoPedido(p) ? { ...p, status_cozinha_atual: dados.status_cozinha_atual } : p));
+        case 'pedido_saiu':
+          return atuais.filter((p) => !mesmoPedido(p));
+        default:
+          return atuais;
+      }
+    });
+  }, []);
+
   useEffect(() => {
     fetchPedidos();
-    // Opcional: configurar um intervalo para auto-atualização (Pós-MVP)
-    // const intervalId = setInterval(fetchPedidos, 30000); // Atualiza a cada 30 segundos
-    // return () => clearInterval(intervalId);
-  }, [fetchPedidos]);
+    // Atualizações em tempo real via stream; sem suporte a EventSource, o botão "Atualizar Lista" continua disponível.
+    const fecharStream = cozinhaService.abrirStreamPedidos(handleEventoStream);
+    return () => {
+      if (typeof fecharStream === 'function') {
+        fecharStream();
+      }
+    };
+  }, [fetchPedidos, handleEventoStream]);
 
   const handlePedidoStatusAtualizado = useCallback((_pedidoIdOrigem, _tipoOrigem, novoStatus) => {
     // Quando um pedido é marcado como "Pronto", ele não aparecerá mais na lista
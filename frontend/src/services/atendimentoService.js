@@ -2,7 +2,9 @@ import apiClient from './api'; // apiClient from previous setup
 
 const atendimentoService = {
   getMesas: () => {
-    return apiClient.get('/mesas/');
+    // Mapa resumido do salão: por mesa, só o pedido em aberto (id, status, total, itens, minutos).
+    // Os itens de cada pedido ficam em getMesaDetalhes / getPedidoMesaDetalhes.
+    return apiClient.get('/mesas/mapa/');
   },
 
   getMesaDetalhes: (mesaId) => {
@@ -32,6 +34,13 @@ const atendimentoService = {
     return apiClient.post(`/pedidos_mesa/${pedidoId}/itens/`, itemData);
   },
 
+  adicionarItensAoPedido: (pedidoId, itens) => {
+    // itens: [{ produto_id: id, quantidade: X, observacoes_item: "obs" (opcional) }]
+    // Uma requisição para a comanda inteira; produtos repetidos (ou já no pedido) somam a quantidade.
+    // Responde com o pedido atualizado (itens e total_pedido).
+    return apiClient.post(`/pedidos_mesa/${pedidoId}/adicionar-itens/`, { itens });
+  },
+
   removerItemDoPedido: (pedidoId, itemId) => {
     // Note: The URL structure in the backend was:
     // DELETE /api/pedidos_mesa/{pedido_mesa_pk}/itens/{item_pk}/
@@ -5,6 +5,19 @@ const cozinhaService = {
     return apiClient.get('/cozinha/pedidos_para_preparar/');
   },
 
+  // Abre o stream (Server-Sent Events) da fila da cozinha.
+  // Retorna uma função para fechar a conexão, ou null se o navegador não suportar EventSource.
+  abrirStreamPedidos: (onEvento) => {
+    if (typeof window === 'undefined' || typeof window.EventSource === 'undefined') {
+      return null;
+    }
+    const eventSource = new window.EventSource(`${apiClient.defaults.baseURL}/cozinha/pedidos_para_preparar/stream/`);
+    ['snapshot', 'pedido_entrou', 'pedido_atualizado', 'status_alterado', 'pedido_saiu'].forEach((tipo) => {
+      eventSource.addEventListener(tipo, (event) => onEvento(tipo, JSON.parse(event.data)));
+    });
+    return () => eventSource.close();
+  },
+
   atualizarStatusPedidoCozinha: (tipoOrigem, idPedidoOrigem, statusCozinha) => {
     // O backend espera um payload { "status_cozinha": "NovoStatus" }
     const payload = { status_cozinha: statusCozinha };
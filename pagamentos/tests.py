@@ -20,7 +20,6 @@ class PagamentoServiceTests(TestCase):
         # PedidoWhatsApp para teste
         self.pedido_whatsapp = PedidoWhatsApp.objects.create(
             telefone_cliente="+5511933334444",
-            estado_conversa='AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX', # Estado relevante
             carrinho_atual=[{'id': 1, 'nome': 'Pizza Teste WP', 'preco': 50.00, 'quantidade': 1}]
         )
 
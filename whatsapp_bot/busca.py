@@ -0,0 +1,207 @@
+"""
+Busca de produtos por texto livre ("quero uma calabresa e 2 coca") para o bot.
+
+O índice é montado a partir da foto do cardápio (whatsapp_bot.catalogo.CatalogoBot), uma
+vez por versão do cardápio: nomes normalizados (minúsculas, sem acentos), palavra -> produtos
+e trigramas -> palavras, para tolerar erros de digitação. Cada consulta só usa dicionários
+em memória, sem tocar no banco.
+"""
+import bisect
+import collections
+import re
+import unicodedata
+
+PALAVRAS_IGNORADAS = frozenset({
+    'a', 'as', 'o', 'os', 'e', 'de', 'da', 'do', 'das', 'dos', 'com', 'em', 'no', 'na', 'pra', 'para',
+    'por', 'favor', 'pf', 'pfv', 'quero', 'queria', 'gostaria', 'manda', 'mande', 'me', 'mais', 'tambem',
+    'pode', 'ser', 'vou', 'querer', 'uns', 'umas', 'ai',
+})
+QUANTIDADES_POR_EXTENSO = {
+    'um': 1, 'uma': 1, 'dois': 2, 'duas': 2, 'tres': 3, 'quatro': 4, 'cinco': 5,
+    'seis': 6, 'sete': 7, 'oito': 8, 'nove': 9, 'dez': 10,
+}
+QUANTIDADE_MAXIMA = 50
+# Separam itens em "calabresa, 2 coca e uma agua" ('e' é tratado palavra a palavra)
+SEPARADORES_ITENS = re.compile(r"[,;+\n]")
+QUANTIDADE_COM_X = re.compile(r"(\d+)x?")
+# Pesos de cada palavra da consulta conforme como casou com a palavra do cardápio
+PESO_EXATO, PESO_PREFIXO, PESO_ERRO_DIGITACAO = 1.0, 0.9, 0.8
+MAXIMO_PALAVRAS_EM_CACHE = 5000
+
+ItemInterpretado = collections.namedtuple('ItemInterpretado', 'produto categoria_id quantidade')
+ResultadoBusca = collections.namedtuple('ResultadoBusca', 'itens ambiguos nao_encontrados')
+
+
+def normalizar(texto):
+    """ Minúsculas, sem acentos, só letras e números separados por um espaço. """
+    sem_acentos = unicodedata.normalize('NFKD', texto).encode('ascii', 'ignore').decode('ascii')
+    return " ".join(re.findall(r"[a-z0-9]+", sem_acentos.lower()))
+
+
+def _trigramas(palavra):
+    marcada = f"#{palavra}#"
+    return {marcada[i:i + 3] for i in range(len(marcada) - 2)}
+
+
+def _distancia_ate(a, b, limite):
+    """ Distância de edição entre a e b, ou limite + 1 se passar do limite (para cedo). """
+    if abs(len(a) - len(b)) > limite:
+        return limite + 1
+    anterior = list(range(len(b) + 1))
+    for i, letra_a in enumerate(a, 1):
+        atual = [i]
+        for j, letra_b in enumerate(b, 1):
+            atual.append(min(anterior[j] + 1, atual[j - 1] + 1, anterior[j - 1] + (letra_a != letra_b)))
+        if min(atual) > limite:
+            return limite + 1
+        anterior = atual
+    return anterior[-1]
+
+
+def _erros_tolerados(palavra):
+    if len(palavra) <= 3:
+        return 0
+    return 1 if len(palavra) <= 6 else 2
+
+
+class IndiceProdutos:
+    """
+    Índice de busca dos produtos de uma foto do cardápio. Imutável depois de montado,
+    exceto pelo cache de palavras já resolvidas, que pode ser compartilhado entre threads.
+    """
+    def __init__(self, categorias):
+        self._produtos = [] # [(produto, categoria_id, palavras do nome)]
+        self._postagens = collections.defaultdict(list) # palavra -> índices em _produtos
+        self._pares_com_e = set() # ('romeu', 'julieta'): o 'e' faz parte do nome
+        for categoria in categorias:
+            for produto in categoria['produtos']:
+                palavras = [p for p in normalizar(produto['nome']).split() if p not in PALAVRAS_IGNORADAS]
+                if not palavras:
+                    continue
+                indice = len(self._produtos)
+                self._produtos.append((produto, categoria['id'], palavras))
+                for palavra in set(palavras):
+                    self._postagens[palavra].append(indice)
+                nome = normalizar(produto['nome']).split()
+                self._pares_com_e.update(
+                    (nome[i - 1], nome[i + 1]) for i in range(1, len(nome) - 1) if nome[i] == 'e'
+                )
+        self._vocabulario = sorted(self._postagens)
+        self._palavras_por_trigrama = collections.defaultdict(list)
+        for palavra in self._vocabulario:
+            for trigrama in _trigramas(palavra):
+                self._palavras_por_trigrama[trigrama].append(palavra)
+        self._cache_palavras = {}
+
+    def __len__(self):
+        return len(self._produtos)
+
+    def _resolver_palavra(self, palavra):
+        """ Palavras do cardápio que casam com a palavra digitada: [(palavra, peso)]. """
+        resolvida = self._cache_palavras.get(palavra)
+        if resolvida is not None:
+            return resolvida
+        if palavra in self._postagens:
+            resolvida = [(palavra, PESO_EXATO)]
+        else:
+            resolvida = []
+            if len(palavra) >= 3: # "marg" -> "marguerita"
+                inicio = bisect.bisect_left(self._vocabulario, palavra)
+                for candidata in self._vocabulario[inicio:inicio + 20]:
+                    if not candidata.startswith(palavra):
+                        break
+                    resolvida.append((candidata, PESO_PREFIXO))
+            limite = _erros_tolerados(palavra)
+            if not resolvida and limite:
+                trigramas = _trigramas(palavra)
+                comuns = collections.Counter(
+                    candidata for trigrama in trigramas for candidata in self._palavras_por_trigrama.get(trigrama, ())
+                )
+                minimo = max(len(trigramas) - 3 * limite, 1) # Cada erro desfaz no máximo 3 trigramas
+                resolvida = [
+                    (candidata, PESO_ERRO_DIGITACAO) for candidata, total in comuns.items()
+                    if total >= minimo and _distancia_ate(palavra, candidata, limite) <= limite
+                ]
+        if len(self._cache_palavras) >= MAXIMO_PALAVRAS_EM_CACHE:
+            self._cache_palavras.clear()
+        self._cache_palavras[palavra] = resolvida
+        return resolvida
+
+    def buscar(self, trecho):
+        """
+        Produtos que melhor casam com um trecho de texto já normalizado, sem quantidades:
+        [(produto, categoria_id)], com mais de um só se empatarem (ambíguo).
+        """
+        pesos_palavras = {} # palavra do cardápio -> maior peso entre as palavras digitadas
+        for palavra in trecho.split():
+            if palavra in PALAVRAS_IGNORADAS:
+                continue
+            for palavra_cardapio, peso in self._resolver_palavra(palavra):
+                if pesos_palavras.get(palavra_cardapio, 0) < peso:
+                    pesos_palavras[palavra_cardapio] = peso
+        somas = collections.defaultdict(float) # índice do produto -> soma dos pesos casados
+        for palavra_cardapio, peso in pesos_palavras.items():
+            for indice in self._postagens[palavra_cardapio]:
+                somas[indice] += peso
+        if not somas:
+            return []
+        # Fração do nome coberta pelo texto; no empate, o que casou mais palavras
+        pontuacoes = {indice: (soma / len(self._produtos[indice][2]), soma) for indice, soma in somas.items()}
+        melhor = max(pontuacoes.values())
+        return [self._produtos[indice][:2] for indice in sorted(somas) if pontuacoes[indice] == melhor]
+
+    def interpretar(self, texto):
+        """
+        Itens e quantidades de uma mensagem em texto livre. Cada trecho separado por
+        vírgula, 'e' ou um novo número vira no máximo um item.
+        """
+        itens, ambiguos, nao_encontrados = [], [], []
+        for quantidade, trecho in self._trechos(texto):
+            encontrados = self.buscar(trecho)
+            if len(encontrados) == 1:
+                produto, categoria_id = encontrados[0]
+                itens.append(ItemInterpretado(produto, categoria_id, quantidade))
+            elif encontrados:
+                ambiguos.append((trecho, [produto['nome'] for produto, _ in encontrados]))
+            else:
+                nao_encontrados.append(trecho)
+        return ResultadoBusca(itens, ambiguos, nao_encontrados)
+
+    def _parte_de_nome(self, tokens, posicao):
+        """ Se a palavra e a seguinte aparecem juntas no nome de algum produto. """
+        if posicao + 1 >= len(tokens):
+            return False
+        produtos = self._postagens.get(tokens[posicao])
+        return bool(produtos) and not set(produtos).isdisjoint(self._postagens.get(tokens[posicao + 1], ()))
+
+    def _trechos(self, texto):
+        """ (quantidade, trecho normalizado) de cada item pedido no texto. """
+        for parte in SEPARADORES_ITENS.split(texto):
+            tokens = normalizar(parte).split()
+            trechos, atual = [], [None, []] # [quantidade, palavras]
+            for posicao, palavra in enumerate(tokens):
+                if palavra == 'e' and (
+                    tokens[posicao - 1] if posicao else None, tokens[posicao + 1] if posicao + 1 < len(tokens) else None
+                ) not in self._pares_com_e: # "calabresa e coca", mas não "romeu e julieta"
+                    if atual[1]:
+                        trechos.append(atual)
+                    atual = [None, []]
+                    continue
+                numero = QUANTIDADE_COM_X.fullmatch(palavra)
+                numero = int(numero.group(1)) if numero else QUANTIDADES_POR_EXTENSO.get(palavra)
+                if numero is not None and not palavra.isdigit() and self._parte_de_nome(tokens, posicao):
+                    numero = None # "quatro queijos"
+                if numero is None:
+                    if palavra not in PALAVRAS_IGNORADAS:
+                        atual[1].append(palavra)
+                elif atual[1]: # "2 calabresa 1 coca": o número abre outro item
+                    trechos.append(atual)
+                    atual = [numero, []]
+                elif atual[0] is None:
+                    atual[0] = numero
+            if atual[1]:
+                trechos.append(atual)
+            elif atual[0] is not None and trechos and trechos[-1][0] is None: # "calabresa 2"
+                trechos[-1][0] = atual[0]
+            for quantidade, palavras in trechos:
+                yield min(max(quantidade or 1, 1), QUANTIDADE_MAXIMA), " ".join(palavras)
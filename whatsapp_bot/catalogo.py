@@ -0,0 +1,109 @@
+"""
+Cardápio do bot (administracao.CategoriaProdutoPlaceholder / ProdutoPlaceholder) em cache
+no processo, com os menus já formatados.
+
+O cache guarda uma foto do cardápio junto com a versão 'catalogo' (administracao.versoes),
+incrementada a cada escrita em categorias e produtos. Cada uso confere a versão (uma
+consulta em ContadorVersao, sem tocar nas tabelas do cardápio) e só recarrega a foto
+quando ela mudou; assim um produto desligado some do menu já na mensagem seguinte. O
+índice de busca por texto livre acompanha a foto e também só é refeito em uma nova versão.
+"""
+import threading
+from functools import cached_property
+
+from administracao.models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+from administracao.versoes import obter_versao, ESCOPO_CATALOGO
+from .busca import IndiceProdutos
+
+MENSAGEM_CATEGORIA_NAO_ENCONTRADA = "Categoria não encontrada ou sem produtos. Digite 'V' para ver as categorias."
+
+
+class CatalogoBot:
+    """
+    Foto imutável do cardápio em uma versão. Só entram produtos disponíveis e categorias
+    com algum produto disponível, numeradas na ordem do menu (por nome).
+    """
+    def __init__(self, versao, categorias):
+        self.versao = versao
+        self.categorias = categorias # [{'id', 'nome', 'produtos': [{'id', 'nome', 'preco'}], 'menu'}]
+        self.categorias_por_numero = {str(numero): categoria for numero, categoria in enumerate(categorias, 1)}
+        self.categorias_por_id = {categoria['id']: categoria for categoria in categorias}
+        self._produtos = {
+            (categoria['id'], produto['id']): produto for categoria in categorias for produto in categoria['produtos']
+        }
+
+        linhas = ["Categorias:"]
+        for numero, categoria in self.categorias_por_numero.items():
+            linhas.append(f"{numero}. {categoria['nome']}")
+            categoria['menu'] = self._formatar_produtos(categoria)
+        linhas.append("\nDigite o número da categoria ou 'V' para voltar ao menu inicial.")
+        linhas.append("Ou escreva o que deseja, ex: 'uma calabresa e 2 coca'.")
+        self.menu_categorias = "\n".join(linhas)
+
+    @staticmethod
+    def _formatar_produtos(categoria):
+        linhas = [f"{categoria['nome']}:"]
+        for numero, produto in enumerate(categoria['produtos'], 1):
+            linhas.append(f"{numero}. {produto['nome']} - R${produto['preco']:.2f}")
+        linhas.append("\nDigite o número do produto para adicionar ou 'V' para voltar às categorias.")
+        return "\n".join(linhas)
+
+    def menu_produtos(self, categoria_id):
+        categoria = self.categorias_por_id.get(categoria_id)
+        return categoria['menu'] if categoria else MENSAGEM_CATEGORIA_NAO_ENCONTRADA
+
+    def ids_produtos(self, categoria_id):
+        """ Ids dos produtos na ordem do menu da categoria. """
+        return [produto['id'] for produto in self.categorias_por_id.get(categoria_id, {}).get('produtos', [])]
+
+    @cached_property
+    def busca(self):
+        """ Índice de busca por texto livre (whatsapp_bot.busca), montado no primeiro uso desta versão. """
+        return IndiceProdutos(self.categorias)
+
+    def produto(self, categoria_id, produto_id):
+        """ Produto disponível da categoria, ou None (removido ou indisponível nesta versão). """
+        return self._produtos.get((categoria_id, produto_id))
+
+
+def _carregar_catalogo(versao):
+    """ Monta a foto do cardápio com duas consultas. """
+    produtos_por_categoria = {}
+    for produto_id, nome, preco, categoria_id in ProdutoPlaceholder.objects.filter(
+        disponivel=True, categoria__isnull=False
+    ).order_by('nome', 'id').values_list('id', 'nome', 'preco_base', 'categoria_id'):
+        produtos_por_categoria.setdefault(categoria_id, []).append(
+            {'id': produto_id, 'nome': nome, 'preco': float(preco)}
+        )
+    categorias = [
+        {'id': categoria_id, 'nome': nome, 'produtos': produtos_por_categoria[categoria_id]}
+        for categoria_id, nome in CategoriaProdutoPlaceholder.objects.order_by('nome', 'id').values_list('id', 'nome')
+        if categoria_id in produtos_por_categoria
+    ]
+    return CatalogoBot(versao, categorias)
+
+
+_catalogo = None
+_catalogo_lock = threading.Lock()
+
+
+def obter_catalogo():
+    """
+    Cardápio atual. Lê a versão antes dos dados: se uma escrita acontecer durante a
+    carga, a foto pode ser mais nova que a versão, e só é recarregada mais uma vez.
+    """
+    global _catalogo
+    versao = obter_versao(ESCOPO_CATALOGO)
+    catalogo = _catalogo
+    if catalogo is not None and catalogo.versao == versao:
+        return catalogo
+    with _catalogo_lock: # Uma carga por versão, mesmo com vários workers ao mesmo tempo
+        if _catalogo is None or _catalogo.versao != versao:
+            _catalogo = _carregar_catalogo(versao)
+        return _catalogo
+
+
+def limpar_cache_catalogo():
+    """ Descarta a foto em cache (testes). """
+    global _catalogo
+    _catalogo = None
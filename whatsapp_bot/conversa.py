@@ -0,0 +1,345 @@
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.db import transaction
+import logging
+
+# Assuming models from the same app.
+# If products are in another app, you'd import them: from products.models import Produto, CategoriaProduto
+# For now, we'll mock product/category fetching or assume they are passed in a simplified way.
+from .envio import enfileirar_envio
+from .catalogo import obter_catalogo
+from .sessoes import obter_armazem_sessoes
+from .pedidos import registrar_itens_pedido_whatsapp
+
+# Configure logging
+logger = logging.getLogger(__name__)
+
+# --- Helper Functions ---
+def formatar_previsao_pronto(horario_previsto_pronto):
+    """
+    Trecho da mensagem com a previsão de ficar pronto (ETA da cozinha, no formato ISO
+    do payload consolidado), ou string vazia se não houver previsão.
+    """
+    previsao = parse_datetime(horario_previsto_pronto) if horario_previsto_pronto else None
+    if previsao is None:
+        return ""
+    minutos = max(round((previsao - timezone.now()).total_seconds() / 60), 1)
+    return f"\n\n⏱️ Previsão de ficar pronto: por volta das {timezone.localtime(previsao):%H:%M} (cerca de {minutos} min)."
+
+def get_categories_formatted():
+    return obter_catalogo().menu_categorias
+
+def get_products_formatted(categoria_id):
+    return obter_catalogo().menu_produtos(categoria_id)
+
+def _mostrar_produtos(pedido_conversa, catalogo, categoria_id):
+    """
+    Menu de produtos da categoria. Guarda os ids na ordem mostrada, para que o número
+    escolhido pelo cliente se refira ao produto que ele viu, mesmo se o cardápio mudar.
+    """
+    pedido_conversa.dados_temporarios = {
+        'categoria_id': categoria_id, 'produtos_menu': catalogo.ids_produtos(categoria_id),
+    }
+    return catalogo.menu_produtos(categoria_id)
+
+
+def _opcoes_carrinho(pedido_conversa, catalogo, categoria_id):
+    return (
+        f"Seu carrinho tem {len(pedido_conversa.carrinho_atual)} item(ns), totalizando R${pedido_conversa.calcular_total_carrinho():.2f}.\n"
+        f"Digite:\n"
+        f"'C' para continuar comprando (na categoria '{catalogo.categorias_por_id[categoria_id]['nome']}')\n"
+        f"'CAT' para ver outras categorias\n"
+        f"'F' para finalizar o pedido\n"
+        f"'R' para remover o último item."
+    )
+
+
+def _adicionar_texto_livre(pedido_conversa, catalogo, texto):
+    """
+    Pedido em texto livre ("uma calabresa e 2 coca"): põe no carrinho os produtos
+    reconhecidos pelo índice de busca do cardápio (whatsapp_bot.busca), com as quantidades.
+    Retorna a resposta, ou None se o texto não citar nenhum produto.
+    """
+    resultado = catalogo.busca.interpretar(texto)
+    if not resultado.itens and not resultado.ambiguos:
+        return None
+    linhas = []
+    for item in resultado.itens:
+        pedido_conversa.adicionar_item_carrinho(type('ProdutoCardapio', (), item.produto)(), quantidade=item.quantidade)
+    if resultado.itens:
+        linhas.append("Adicionado: " + ", ".join(f"{item.quantidade}x {item.produto['nome']}" for item in resultado.itens) + ".")
+    for trecho, nomes in resultado.ambiguos:
+        linhas.append(f"Qual '{trecho}'? " + " / ".join(nomes[:5]) + ". Escreva o nome completo.")
+    if resultado.nao_encontrados:
+        linhas.append("Não encontrei: " + ", ".join(f"'{trecho}'" for trecho in resultado.nao_encontrados) + ".")
+    if resultado.itens:
+        categoria_id = resultado.itens[-1].categoria_id
+        pedido_conversa.dados_temporarios = {
+            'categoria_id': categoria_id, 'produtos_menu': catalogo.ids_produtos(categoria_id),
+        }
+        linhas.append(_opcoes_carrinho(pedido_conversa, catalogo, categoria_id))
+        pedido_conversa.estado_conversa = 'AGUARDANDO_ACAO_CARRINHO'
+    return "\n".join(linhas)
+
+
+def send_whatsapp_message(to_number, message_body):
+    """
+    Coloca a mensagem na fila de envio (MensagemEnviada). O envio pelo Twilio é feito
+    pelo despachante de whatsapp_bot.envio, com conexões reaproveitadas, limite por
+    segundo e novas tentativas, sem esperar o provedor aqui.
+    """
+    enfileirar_envio(to_number, message_body)
+
+
+def aplicar_mensagem(pedido_conversa, incoming_msg_body):
+    """
+    Máquina de estados da conversa: aplica uma mensagem do cliente (texto em minúsculas)
+    à sessão (ConversaWhatsApp), só em memória, e retorna (resposta, pedido_confirmado):
+    o PedidoWhatsApp ainda não gravado quando a mensagem confirma o pedido. Também usada para
+    refazer uma sessão a partir das mensagens gravadas (whatsapp_bot.sessoes).
+    """
+    # --- State Machine Logic ---
+    current_state = pedido_conversa.estado_conversa
+    pedido_confirmado = None # Pedido que esta mensagem enviou para a fila da cozinha
+    response_message = "Desculpe, não entendi. Pode repetir?" # Default fallback
+
+    if incoming_msg_body == 'cancelar': # Global cancel keyword
+        pedido_conversa.reset_conversa() # Resets state to INICIO
+        response_message = "Sua conversa foi reiniciada. " \
+                           "Olá! Bem-vindo à Pizzaria [Nome da Pizzaria]! 😊\n" \
+                           "Digite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬"
+        pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+
+    elif current_state == 'INICIO': # Also handles reset state
+        response_message = "Olá! Bem-vindo à Pizzaria [Nome da Pizzaria]! 😊\nDigite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬"
+        pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+
+    elif current_state == 'AGUARDANDO_OPCAO_INICIAL':
+        if incoming_msg_body == '1':
+            response_message = get_categories_formatted()
+            pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+        elif incoming_msg_body == '2':
+            response_message = "Um momento, vou te transferir para um de nossos atendentes. Se precisar recomeçar, digite 'cancelar'."
+            pedido_conversa.estado_conversa = 'TRANSFERIDO_ATENDENTE'
+        else:
+            response_message = _adicionar_texto_livre(pedido_conversa, obter_catalogo(), incoming_msg_body) or (
+                "Opção inválida. Digite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬\nOu 'cancelar' para recomeçar."
+            )
+
+    elif current_state == 'AGUARDANDO_ESCOLHA_CATEGORIA':
+        if incoming_msg_body.lower() == 'v':
+            response_message = "Olá! Bem-vindo à Pizzaria [Nome da Pizzaria]! 😊\nDigite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬"
+            pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+        else:
+            catalogo = obter_catalogo()
+            categoria = catalogo.categorias_por_numero.get(incoming_msg_body)
+            if categoria:
+                response_message = _mostrar_produtos(pedido_conversa, catalogo, categoria['id']) # Store selected category
+                pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_PRODUTO'
+            else:
+                response_message = (
+                    _adicionar_texto_livre(pedido_conversa, catalogo, incoming_msg_body)
+                    or "Categoria inválida. " + catalogo.menu_categorias
+                )
+
+    elif current_state == 'AGUARDANDO_ESCOLHA_PRODUTO':
+        categoria_id = pedido_conversa.dados_temporarios.get('categoria_id')
+        if incoming_msg_body.lower() == 'v':
+            response_message = get_categories_formatted()
+            pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+            pedido_conversa.dados_temporarios = {} # Clear temp data
+        else:
+            catalogo = obter_catalogo()
+            try:
+                escolha_produto_idx = int(incoming_msg_body) - 1
+                produtos_menu = pedido_conversa.dados_temporarios.get('produtos_menu', [])
+
+                if 0 <= escolha_produto_idx < len(produtos_menu):
+                    produto_escolhido = catalogo.produto(categoria_id, produtos_menu[escolha_produto_idx])
+                    if produto_escolhido is None: # Ficou indisponível depois que o menu foi mostrado
+                        response_message = "Desculpe, esse produto não está mais disponível. " + _mostrar_produtos(pedido_conversa, catalogo, categoria_id)
+                    else:
+                        # Add to cart (using method from ConversaWhatsApp model)
+                        mock_produto_obj = type('ProdutoCardapio', (), produto_escolhido)()
+                        pedido_conversa.adicionar_item_carrinho(mock_produto_obj)
+                        response_message = (
+                            f"'{produto_escolhido['nome']}' adicionado! " + _opcoes_carrinho(pedido_conversa, catalogo, categoria_id)
+                        )
+                        pedido_conversa.estado_conversa = 'AGUARDANDO_ACAO_CARRINHO'
+                else:
+                    response_message = "Número do produto inválido. " + _mostrar_produtos(pedido_conversa, catalogo, categoria_id)
+            except ValueError: # Texto livre: "uma calabresa e 2 coca"
+                response_message = _adicionar_texto_livre(pedido_conversa, catalogo, incoming_msg_body) or (
+                    "Entrada inválida. Por favor, digite o número do produto ou 'V' para voltar.\n" + _mostrar_produtos(pedido_conversa, catalogo, categoria_id)
+                )
+
+    elif current_state == 'AGUARDANDO_ACAO_CARRINHO':
+        categoria_id = pedido_conversa.dados_temporarios.get('categoria_id')
+        if incoming_msg_body == 'c': # Continuar na mesma categoria
+            catalogo = obter_catalogo()
+            if categoria_id in catalogo.categorias_por_id:
+                response_message = _mostrar_produtos(pedido_conversa, catalogo, categoria_id)
+                pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_PRODUTO'
+            else: # Categoria removida ou sem produtos disponíveis
+                response_message = catalogo.menu_categorias
+                pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+        elif incoming_msg_body == 'cat': # Ver categorias
+            response_message = get_categories_formatted()
+            pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+        elif incoming_msg_body == 'f': # Finalizar pedido
+            if pedido_conversa.carrinho_atual:
+                total_pedido = pedido_conversa.calcular_total_carrinho()
+                carrinho_formatado = pedido_conversa.formatar_carrinho_para_mensagem()
+                response_message = (
+                    f"{carrinho_formatado}\n\n"
+                    f"TOTAL DO PEDIDO: R${total_pedido:.2f}\n\n"
+                    f"Para confirmar e pagar com PIX, digite 'PIX'.\n"
+                    f"Para cancelar este pedido, digite 'X'."
+                )
+                pedido_conversa.estado_conversa = 'AGUARDANDO_CONFIRMACAO_PEDIDO'
+            else:
+                response_message = "Seu carrinho está vazio. Adicione itens antes de finalizar.\n" + get_categories_formatted()
+                pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+        elif incoming_msg_body == 'r': # Remover último item
+            if pedido_conversa.remover_ultimo_item_carrinho():
+                total_carrinho = pedido_conversa.calcular_total_carrinho()
+                carrinho_len = len(pedido_conversa.carrinho_atual)
+                if carrinho_len > 0:
+                    response_message = (
+                        f"Último item removido. Seu carrinho tem {carrinho_len} item(ns), totalizando R${total_carrinho:.2f}.\n"
+                        f"Digite 'C', 'CAT', 'F', ou 'R'."
+                    )
+                else:
+                     response_message = "Carrinho esvaziado. Adicione itens para continuar.\n" + get_categories_formatted()
+                     pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA' # Go back to categories
+            else:
+                response_message = "Seu carrinho já está vazio.\nDigite 'C' ou 'CAT' para adicionar itens."
+        else:
+            response_message = _adicionar_texto_livre(pedido_conversa, obter_catalogo(), incoming_msg_body) or (
+                "Opção inválida. Digite 'C' para continuar comprando, "
+                "'CAT' para categorias, 'F' para finalizar, ou 'R' para remover."
+            )
+
+    elif current_state == 'AGUARDANDO_CONFIRMACAO_PEDIDO':
+        if incoming_msg_body == 'pix':
+            # MVP: Static PIX key. Actual order saving will happen here.
+            # For now, just transition state and provide PIX info.
+            # In a real scenario, you'd create a `Pedido` object in your main orders app.
+            # pedido_conversa.pedido_confirmado_id = new_order.id (pseudo-code)
+            chave_pix_estatica = "CNPJ: XX.XXX.XXX/0001-XX (Banco XPTO)" # Placeholder
+            response_message = (
+                f"Ótimo! Seu pedido foi registrado e aguarda pagamento.\n"
+                f"Pague com a chave PIX: {chave_pix_estatica}\n"
+                f"Valor total: R${pedido_conversa.calcular_total_carrinho():.2f}\n\n"
+                f"IMPORTANTE: Após o pagamento, por favor, envie 'PAGO' ou o comprovante para este chat "
+                f"para que um atendente possa confirmar e processar seu pedido.\n\n"
+                f"Obrigado pela preferência!"
+            )
+            pedido_conversa.estado_conversa = 'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX'
+        elif incoming_msg_body == 'x':
+            pedido_conversa.reset_conversa() # Clears cart and state
+            response_message = "Pedido cancelado. Sua conversa foi reiniciada.\n" + \
+                               "Olá! Bem-vindo à Pizzaria [Nome da Pizzaria]! 😊\n" + \
+                               "Digite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬"
+            pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+        else:
+            response_message = "Opção inválida. Digite 'PIX' para confirmar ou 'X' para cancelar."
+
+    elif current_state == 'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX':
+        # MVP: Manual confirmation by attendant. Bot just acknowledges.
+        #      When attendant confirms, they would manually trigger next steps.
+        #      For the bot, upon receiving 'PAGO', we now also set kitchen status.
+        if 'pago' in incoming_msg_body or 'comprovante' in incoming_msg_body: # Simple check
+            # O carrinho vira um pedido próprio, já na fila da cozinha, e a conversa recomeça
+            pedido_confirmado = pedido_conversa.confirmar_pedido()
+
+            response_message = ("Obrigado por informar o pagamento! Seu pedido foi enviado para a cozinha e em breve um de nossos atendentes "
+                                "irá verificar e confirmar os detalhes. Para um novo pedido, é só mandar uma nova mensagem.")
+        else:
+            response_message = ("Aguardando sua confirmação de pagamento (envie 'PAGO') ou comprovante. "
+                                "Se preferir, digite 'cancelar' para reiniciar o atendimento.")
+        # This state could eventually time out or be escalated to an attendant.
+        # For MVP, it stays here until 'cancelar' or manual intervention.
+
+    elif current_state == 'TRANSFERIDO_ATENDENTE':
+        # Bot should ideally not respond further unless explicitly reset by 'cancelar'
+        # or by an internal mechanism (e.g., attendant marks as resolved).
+        if incoming_msg_body == 'cancelar': # Allow reset
+            pedido_conversa.reset_conversa()
+            response_message = "Sua conversa foi reiniciada. " + \
+                           "Olá! Bem-vindo à Pizzaria [Nome da Pizzaria]! 😊\n" + \
+                           "Digite:\n1️⃣ Ver Cardápio e Fazer Pedido 🍕\n2️⃣ Falar com um Atendente 💬"
+            pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+        else:
+            # No automatic response, or a very minimal one like:
+            response_message = "Você já foi direcionado a um atendente. Por favor, aguarde."
+            # To avoid loops, don't send message here or send it very rarely.
+            # For now, let's assume send_whatsapp_message might be skipped for this state after initial transfer.
+            # However, for testing, we'll allow it to respond.
+            pass
+
+
+    return response_message, pedido_confirmado
+
+
+def _registrar_pagamento_pix(pedido):
+    # Registrar o pagamento usando o serviço de pagamentos
+    try:
+        from pagamentos.services import registrar_pagamento_para_pedido
+        from pagamentos.models import Pagamento # Para acesso a choices
+
+        # Assumindo que o valor total do carrinho é o valor pago para PIX no MVP
+        valor_total_pedido = pedido.calcular_total_carrinho()
+
+        with transaction.atomic(): # Uma falha aqui não desfaz o checkpoint do pedido
+            registrar_pagamento_para_pedido(
+                pedido_obj=pedido,
+                metodo_pagamento=Pagamento.METODO_PIX,
+                valor_pago=valor_total_pedido,
+                status_pagamento=Pagamento.STATUS_APROVADO, # Manualmente confirmado
+                # qr_code_pix pode ser a chave estática informada, se desejado registrar
+            )
+        logger.info(f"Pagamento PIX registrado para PedidoWhatsApp ID {pedido.id}")
+    except Exception as e:
+        logger.error(f"Erro ao registrar pagamento para PedidoWhatsApp ID {pedido.id}: {e}")
+        # Continuar mesmo se o registro do pagamento falhar, pois o fluxo do bot é prioritário aqui.
+        # Mas logar o erro é crucial.
+
+
+def processar_mensagem(from_number, incoming_msg_body, mensagem_id=None):
+    """
+    Processa uma mensagem recebida do cliente (telefone já normalizado, texto em
+    minúsculas) e envia a resposta. Chamada pelos workers de whatsapp_bot.processamento,
+    nunca no request do webhook; mensagem_id é a MensagemRecebida sendo processada.
+
+    A sessão vem do armazém de sessões: a maioria das mensagens só atualiza a sessão;
+    pedido confirmado e transferência para atendente são checkpoints gravados no banco.
+    """
+    armazem = obter_armazem_sessoes()
+    pedido_conversa = armazem.carregar(from_number, mensagem_id)
+    estado_anterior = pedido_conversa.estado_conversa
+    response_message, pedido_confirmado = aplicar_mensagem(pedido_conversa, incoming_msg_body)
+    if mensagem_id is not None:
+        pedido_conversa.ultima_mensagem_id = mensagem_id
+
+    if pedido_confirmado is not None:
+        with transaction.atomic():
+            armazem.checkpoint(pedido_conversa) # Conversa reiniciada
+            # O INSERT também cria o ticket da cozinha (cozinha_api.signals) na mesma transação
+            pedido_confirmado.save()
+            registrar_itens_pedido_whatsapp(pedido_confirmado) # Itens normalizados para os relatórios
+            _registrar_pagamento_pix(pedido_confirmado)
+
+            # Notificar as telas da cozinha conectadas ao stream
+            from cozinha_api.eventos import publicar_evento_cozinha, EVENTO_PEDIDO_ENTROU
+            from cozinha_api.services import serializar_pedido_cozinha
+            pedido_cozinha = serializar_pedido_cozinha(pedido_confirmado)
+            publicar_evento_cozinha(EVENTO_PEDIDO_ENTROU, pedido_cozinha)
+            response_message += formatar_previsao_pronto(pedido_cozinha['horario_previsto_pronto'])
+    elif pedido_conversa.estado_conversa == 'TRANSFERIDO_ATENDENTE' and estado_anterior != 'TRANSFERIDO_ATENDENTE':
+        armazem.checkpoint(pedido_conversa) # O atendente precisa ver a conversa no banco
+    else:
+        armazem.guardar(pedido_conversa)
+
+    send_whatsapp_message(from_number, response_message)
+    return response_message
@@ -0,0 +1,369 @@
+"""
+Envio das mensagens ao cliente pelo provedor (API REST de mensagens do Twilio).
+
+send_whatsapp_message só grava a mensagem em MensagemEnviada; o Despachante envia a
+fila em lotes, fora dos requests e dos workers da conversa:
+  * conexões HTTP persistentes (keep-alive) reaproveitadas por um pool de
+    WHATSAPP_ENVIO_CONEXOES conexões, em vez de um cliente novo por mensagem;
+  * no máximo WHATSAPP_ENVIO_LIMITE_POR_SEGUNDO envios por segundo (o limite da conta
+    no provedor), espaçados; um 429 do provedor pausa os envios pelo Retry-After;
+  * falhas temporárias (rede, 429, 5xx) voltam para a fila com backoff exponencial;
+    esgotadas WHATSAPP_ENVIO_MAX_TENTATIVAS, ou em erro definitivo (4xx), a mensagem
+    fica 'Falhou' (dead letter) com o último erro;
+  * mensagens de um mesmo telefone são enviadas em ordem: dentro do lote, se uma falha,
+    as seguintes desse telefone esperam junto com ela; entre lotes, um telefone com
+    mensagem anterior ainda aguardando nova tentativa (ou reservada por outro
+    despachante) não tem as seguintes reservadas.
+
+Sem credenciais do Twilio (TWILIO_ACCOUNT_SID), as mensagens são apenas registradas no log.
+O limite de taxa vale para o processo do despachante, então o envio roda em um único
+processo dedicado, o comando enviar_mensagens_whatsapp. A thread de envio no processo web
+(WHATSAPP_ENVIO_AUTOMATICO = True) só serve para desenvolvimento com um único processo:
+com N processos web, seriam N despachantes e N vezes o limite por segundo.
+"""
+import base64
+import http.client
+import json
+import logging
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlencode, urlsplit
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import MensagemEnviada
+
+logger = logging.getLogger(__name__)
+
+# Erros de uma conexão keep-alive que o provedor já fechou: repete uma vez em conexão nova
+_ERROS_CONEXAO_FECHADA = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class ErroEnvio(Exception):
+    """ Falha ao enviar uma mensagem; tentar_novamente=False para erros definitivos (dead letter). """
+    def __init__(self, mensagem, tentar_novamente=True, aguardar_segundos=None):
+        super().__init__(mensagem)
+        self.tentar_novamente = tentar_novamente
+        self.aguardar_segundos = aguardar_segundos
+
+
+class LimitadorTaxa:
+    """
+    Espaça os envios em 1/por_segundo segundos, compartilhado entre as threads de envio,
+    para nunca passar do limite por segundo do provedor (sem rajadas).
+    """
+    def __init__(self, por_segundo):
+        self.intervalo = 1.0 / max(float(por_segundo), 0.001)
+        self._proximo = 0.0
+        self._lock = threading.Lock()
+
+    def aguardar(self):
+        with self._lock:
+            agora = time.monotonic()
+            horario = max(agora, self._proximo)
+            self._proximo = horario + self.intervalo
+        if horario > agora:
+            time.sleep(horario - agora)
+
+    def pausar(self, segundos):
+        """ Nenhum envio antes de 'segundos' a partir de agora (ex: Retry-After de um 429). """
+        with self._lock:
+            self._proximo = max(self._proximo, time.monotonic() + segundos)
+
+
+class ClienteProvedor:
+    """
+    Cliente da API de mensagens do Twilio (POST /2010-04-01/Accounts/<sid>/Messages.json)
+    com um pool de conexões HTTP persistentes, seguro para uso por várias threads.
+    """
+    def __init__(self, url_base, account_sid, auth_token, numero_remetente, conexoes=8, timeout=10):
+        partes = urlsplit(url_base)
+        self._classe_conexao = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+        self._host = partes.netloc
+        self._caminho = f"{partes.path.rstrip('/')}/2010-04-01/Accounts/{account_sid}/Messages.json"
+        credenciais = base64.b64encode(f"{account_sid}:{auth_token}".encode()).decode()
+        self._cabecalhos = {
+            'Authorization': f'Basic {credenciais}',
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Connection': 'keep-alive',
+        }
+        self.numero_remetente = numero_remetente
+        self.timeout = timeout
+        self._pool = queue.LifoQueue(maxsize=max(int(conexoes), 1))
+
+    def _obter_conexao(self):
+        try:
+            return self._pool.get_nowait()
+        except queue.Empty:
+            return self._classe_conexao(self._host, timeout=self.timeout)
+
+    def _devolver_conexao(self, conexao):
+        try:
+            self._pool.put_nowait(conexao)
+        except queue.Full:
+            conexao.close()
+
+    def _post(self, corpo_requisicao):
+        conexao = self._obter_conexao()
+        while True:
+            reaproveitada = conexao.sock is not None
+            try:
+                conexao.request('POST', self._caminho, body=corpo_requisicao, headers=self._cabecalhos)
+                resposta = conexao.getresponse()
+                dados = resposta.read()
+            except _ERROS_CONEXAO_FECHADA:
+                conexao.close()
+                if reaproveitada:
+                    continue # Fechada reabre sozinha no próximo request
+                raise
+            except BaseException:
+                conexao.close()
+                raise
+            if resposta.will_close:
+                conexao.close()
+            self._devolver_conexao(conexao)
+            return resposta, dados
+
+    def enviar(self, telefone, corpo):
+        """ Envia uma mensagem e retorna o sid do provedor; levanta ErroEnvio em caso de falha. """
+        corpo_requisicao = urlencode({'From': self.numero_remetente, 'To': f'whatsapp:{telefone}', 'Body': corpo})
+        try:
+            resposta, dados = self._post(corpo_requisicao)
+        except (http.client.HTTPException, OSError) as e:
+            raise ErroEnvio(f"Erro de conexão com o provedor: {e}")
+
+        if 200 <= resposta.status < 300:
+            try:
+                return json.loads(dados).get('sid')
+            except ValueError:
+                return None
+        detalhe = f"HTTP {resposta.status}: {dados[:200].decode(errors='replace')}"
+        if resposta.status == 429:
+            try:
+                aguardar = float(resposta.getheader('Retry-After') or 1)
+            except ValueError:
+                aguardar = 1.0
+            raise ErroEnvio(detalhe, aguardar_segundos=aguardar)
+        raise ErroEnvio(detalhe, tentar_novamente=resposta.status >= 500)
+
+    def fechar(self):
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class ClienteLog:
+    """ Usado sem credenciais do provedor (desenvolvimento): só registra a mensagem no log. """
+    def enviar(self, telefone, corpo):
+        logger.info(f"SIMULATING SENDING MESSAGE TO: {telefone}\nBODY: {corpo}")
+        return None
+
+    def fechar(self):
+        pass
+
+
+def cliente_configurado():
+    """ ClienteProvedor com as credenciais TWILIO_* dos settings, ou ClienteLog se não houver. """
+    account_sid = getattr(settings, 'TWILIO_ACCOUNT_SID', None)
+    if not account_sid:
+        return ClienteLog()
+    return ClienteProvedor(
+        getattr(settings, 'WHATSAPP_PROVEDOR_URL', 'https://api.twilio.com'),
+        account_sid,
+        getattr(settings, 'TWILIO_AUTH_TOKEN', ''),
+        getattr(settings, 'TWILIO_WHATSAPP_NUMBER', ''),
+        conexoes=getattr(settings, 'WHATSAPP_ENVIO_CONEXOES', 8),
+        timeout=getattr(settings, 'WHATSAPP_ENVIO_TIMEOUT_SEGUNDOS', 10),
+    )
+
+
+def intervalo_nova_tentativa(tentativas, aguardar_segundos=None):
+    """ Backoff exponencial com jitter (base WHATSAPP_ENVIO_BACKOFF_SEGUNDOS, até 5 minutos). """
+    base = getattr(settings, 'WHATSAPP_ENVIO_BACKOFF_SEGUNDOS', 2)
+    segundos = min(base * 2 ** max(tentativas - 1, 0), 300) * random.uniform(0.5, 1.0)
+    return timedelta(seconds=max(segundos, aguardar_segundos or 0))
+
+
+class Despachante:
+    """
+    Envia a fila de MensagemEnviada. despachar_lote faz uma rodada (reserva um lote,
+    envia em paralelo pelas conexões do pool e grava os resultados, com três consultas);
+    em produção, notificar() acorda a thread de envio do processo.
+    """
+    def __init__(self, cliente=None, limite_por_segundo=None, conexoes=None, tamanho_lote=None):
+        self.cliente = cliente or cliente_configurado()
+        self.limitador = LimitadorTaxa(
+            limite_por_segundo or getattr(settings, 'WHATSAPP_ENVIO_LIMITE_POR_SEGUNDO', 80)
+        )
+        self.executor = ThreadPoolExecutor(
+            max_workers=conexoes or getattr(settings, 'WHATSAPP_ENVIO_CONEXOES', 8),
+            thread_name_prefix='whatsapp-envio',
+        )
+        self.tamanho_lote = tamanho_lote or getattr(settings, 'WHATSAPP_ENVIO_LOTE', 200)
+        self.max_tentativas = getattr(settings, 'WHATSAPP_ENVIO_MAX_TENTATIVAS', 5)
+        self._acordar = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def reservar_lote(self, agora):
+        """
+        Reserva até tamanho_lote mensagens a enviar, em ordem de criação: 'Pendente' cujo
+        horário chegou, ou 'Enviando' cuja reserva expirou (despachante interrompido).
+        Fica de fora a mensagem cujo telefone tem uma anterior ainda por enviar e fora do
+        horário (aguardando nova tentativa, ou reservada por outro despachante), para não
+        ultrapassá-la. SKIP LOCKED deixa despachantes concorrentes pegarem lotes diferentes
+        no PostgreSQL.
+        """
+        reserva = timedelta(seconds=getattr(settings, 'WHATSAPP_ENVIO_RESERVA_SEGUNDOS', 300))
+        a_enviar = [MensagemEnviada.STATUS_PENDENTE, MensagemEnviada.STATUS_ENVIANDO]
+        anterior_aguardando = MensagemEnviada.objects.filter(
+            telefone_cliente=OuterRef('telefone_cliente'), id__lt=OuterRef('id'),
+            status__in=a_enviar, proxima_tentativa_em__gt=agora,
+        )
+        with transaction.atomic():
+            mensagens = list(MensagemEnviada.objects.select_for_update(skip_locked=True).filter(
+                status__in=a_enviar, proxima_tentativa_em__lte=agora,
+            ).exclude(Exists(anterior_aguardando)).order_by('id').values_list('id', 'telefone_cliente', 'corpo', 'tentativas')[:self.tamanho_lote])
+            if mensagens:
+                MensagemEnviada.objects.filter(pk__in=[mensagem[0] for mensagem in mensagens]).update(
+                    status=MensagemEnviada.STATUS_ENVIANDO, proxima_tentativa_em=agora + reserva
+                )
+        return mensagens
+
+    def _enviar_do_telefone(self, mensagens):
+        """ Envia, em ordem, as mensagens de um telefone. Roda nas threads do executor, sem banco. """
+        resultados = []
+        for indice, (mensagem_id, telefone, corpo, tentativas) in enumerate(mensagens):
+            self.limitador.aguardar()
+            try:
+                sid = self.cliente.enviar(telefone, corpo)
+            except ErroEnvio as e:
+                if e.aguardar_segundos:
+                    self.limitador.pausar(e.aguardar_segundos)
+                resultados.append((mensagem_id, tentativas + 1, None, e))
+                # As seguintes não podem chegar antes desta: voltam para a fila sem gastar tentativa
+                resultados.extend((m[0], m[3], None, None) for m in mensagens[indice + 1:])
+                break
+            resultados.append((mensagem_id, tentativas + 1, sid, None))
+        return resultados
+
+    def _registrar_resultados(self, resultados_por_telefone, agora):
+        atualizadas = []
+        for resultados in resultados_por_telefone:
+            proxima_tentativa = None # Definida quando uma mensagem do telefone falha
+            for mensagem_id, tentativas, sid, erro in resultados:
+                mensagem = MensagemEnviada(
+                    pk=mensagem_id, tentativas=tentativas, sid_provedor=sid, enviada_em=None,
+                    ultimo_erro=str(erro) if erro else None, proxima_tentativa_em=agora,
+                )
+                if proxima_tentativa is not None: # Adiada atrás da falha do mesmo telefone
+                    mensagem.status = MensagemEnviada.STATUS_PENDENTE
+                    mensagem.proxima_tentativa_em = proxima_tentativa
+                elif erro is None:
+                    mensagem.status = MensagemEnviada.STATUS_ENVIADA
+                    mensagem.enviada_em = agora
+                elif not erro.tentar_novamente or tentativas >= self.max_tentativas:
+                    logger.error(f"Mensagem {mensagem_id} para o WhatsApp descartada após {tentativas} tentativas: {erro}")
+                    mensagem.status = MensagemEnviada.STATUS_FALHOU
+                    proxima_tentativa = agora
+                else:
+                    proxima_tentativa = agora + intervalo_nova_tentativa(tentativas, erro.aguardar_segundos)
+                    mensagem.status = MensagemEnviada.STATUS_PENDENTE
+                    mensagem.proxima_tentativa_em = proxima_tentativa
+                atualizadas.append(mensagem)
+        MensagemEnviada.objects.bulk_update(
+            atualizadas,
+            ['status', 'tentativas', 'proxima_tentativa_em', 'ultimo_erro', 'sid_provedor', 'enviada_em'],
+            batch_size=500,
+        )
+
+    def despachar_lote(self):
+        """ Uma rodada de envio. Retorna quantas mensagens foram reservadas (0: nada a enviar agora). """
+        mensagens = self.reservar_lote(timezone.now())
+        if not mensagens:
+            return 0
+        por_telefone = {}
+        for mensagem in mensagens:
+            por_telefone.setdefault(mensagem[1], []).append(mensagem)
+        resultados = list(self.executor.map(self._enviar_do_telefone, por_telefone.values()))
+        self._registrar_resultados(resultados, timezone.now())
+        return len(mensagens)
+
+    def drenar(self):
+        """ Envia até não haver mais mensagens prontas para envio (novas tentativas agendadas ficam). """
+        total = 0
+        while True:
+            enviadas = self.despachar_lote()
+            if not enviadas:
+                return total
+            total += enviadas
+
+    def _executar(self):
+        while True:
+            self._acordar.wait(timeout=getattr(settings, 'WHATSAPP_ENVIO_INTERVALO_SEGUNDOS', 1))
+            self._acordar.clear()
+            close_old_connections()
+            try:
+                self.drenar()
+            except Exception:
+                logger.exception("Erro no despachante de mensagens do WhatsApp.")
+            finally:
+                close_old_connections()
+
+    def notificar(self):
+        """ Acorda a thread de envio (iniciada na primeira chamada). """
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._executar, name='whatsapp-despachante', daemon=True)
+                self._thread.start()
+        self._acordar.set()
+
+    def fechar(self):
+        self.executor.shutdown(wait=True)
+        self.cliente.fechar()
+
+
+_despachante = None
+_despachante_lock = threading.Lock()
+
+
+def obter_despachante():
+    global _despachante
+    with _despachante_lock:
+        if _despachante is None:
+            _despachante = Despachante()
+        return _despachante
+
+
+def _notificar_despachante():
+    # Por padrão o envio fica com o comando enviar_mensagens_whatsapp (um único despachante)
+    if getattr(settings, 'WHATSAPP_ENVIO_AUTOMATICO', False):
+        obter_despachante().notificar()
+
+
+def enfileirar_envio(telefone, corpo):
+    """ Grava a mensagem na fila de envio; o despachante é acordado após o commit. """
+    mensagem = MensagemEnviada.objects.create(telefone_cliente=telefone, corpo=corpo)
+    transaction.on_commit(_notificar_despachante)
+    return mensagem
+
+
+def enfileirar_envios_em_massa(telefones, corpo):
+    """
+    Enfileira a mesma mensagem para vários telefones (ex: promoções) com bulk_create.
+    O despachante envia no ritmo do limite por segundo, sem estourar o do provedor.
+    """
+    mensagens = MensagemEnviada.objects.bulk_create(
+        [MensagemEnviada(telefone_cliente=telefone, corpo=corpo) for telefone in telefones], batch_size=500
+    )
+    transaction.on_commit(_notificar_despachante)
+    return len(mensagens)
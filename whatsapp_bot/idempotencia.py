@@ -0,0 +1,65 @@
+"""
+Deduplicação das mensagens recebidas pelo MessageSid do provedor.
+
+O Twilio reenvia o webhook quando a resposta demora; sem deduplicação, um 'PAGO'
+reenviado registraria o pagamento duas vezes. A garantia é a restrição única de
+MensagemRecebida.sid_provedor; na frente dela fica um cache em memória, limitado em
+tamanho e com validade, que responde aos reenvios recentes sem consultar o banco.
+"""
+import collections
+import threading
+import time
+
+from django.conf import settings
+
+
+class CacheTTL:
+    """
+    Conjunto de chaves com validade (ttl_segundos) e no máximo `maximo` entradas; ao
+    passar do limite, descarta as mais antigas. Todas as operações são O(1).
+    """
+    def __init__(self, maximo, ttl_segundos):
+        self.maximo = maximo
+        self.ttl_segundos = ttl_segundos
+        self._expiracoes = collections.OrderedDict() # chave -> instante de expiração, em ordem de inserção
+        self._lock = threading.Lock()
+
+    def __contains__(self, chave):
+        with self._lock:
+            expira_em = self._expiracoes.get(chave)
+            if expira_em is None:
+                return False
+            if expira_em <= time.monotonic():
+                del self._expiracoes[chave]
+                return False
+            return True
+
+    def __len__(self):
+        return len(self._expiracoes)
+
+    def adicionar(self, chave):
+        with self._lock:
+            self._expiracoes.pop(chave, None)
+            self._expiracoes[chave] = time.monotonic() + self.ttl_segundos
+            while len(self._expiracoes) > self.maximo:
+                self._expiracoes.popitem(last=False)
+
+    def limpar(self):
+        with self._lock:
+            self._expiracoes.clear()
+
+
+_sids_recebidos = None
+_sids_lock = threading.Lock()
+
+
+def obter_sids_recebidos():
+    """ Cache dos MessageSid já gravados neste processo (WHATSAPP_IDEMPOTENCIA_*). """
+    global _sids_recebidos
+    with _sids_lock:
+        if _sids_recebidos is None:
+            _sids_recebidos = CacheTTL(
+                getattr(settings, 'WHATSAPP_IDEMPOTENCIA_MAXIMO', 10000),
+                getattr(settings, 'WHATSAPP_IDEMPOTENCIA_TTL_SEGUNDOS', 60 * 60),
+            )
+        return _sids_recebidos
@@ -0,0 +1,84 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from administracao.models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+from whatsapp_bot.catalogo import obter_catalogo
+from whatsapp_bot.models import ConversaWhatsApp, MensagemRecebida, MensagemEnviada
+from whatsapp_bot.processamento import processar_mensagem_recebida
+from whatsapp_bot.sessoes import obter_armazem_sessoes, BACKEND_CACHE, BACKEND_BANCO
+
+# Monta um carrinho com dois itens e confirma o pedido (sem pagar: não entra na cozinha)
+CONVERSA_SIMULADA = ['oi', '1', '1', '1', 'c', '1', 'f', 'pix']
+PREFIXO_TELEFONE = '+5500966'
+
+
+class Command(BaseCommand):
+    help = (
+        "Micro-benchmark da conversa do bot: processa as mensagens de N clientes simulados em "
+        "um único worker (sem threads) e mede mensagens por segundo, consultas e escritas no "
+        "ConversaWhatsApp por mensagem, para cada backend do armazém de sessões. As respostas "
+        "ficam na fila de envio sem serem enviadas; tudo é removido ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--conversas', type=int, default=200)
+        parser.add_argument('--backend', choices=[BACKEND_CACHE, BACKEND_BANCO], action='append',
+                            help="Backend(s) a medir (default: os dois).")
+
+    def handle(self, *args, **options):
+        telefones = [f"{PREFIXO_TELEFONE}{i:06d}" for i in range(options['conversas'])]
+        self._limpar(telefones)
+        categoria_temporaria = None
+        if not obter_catalogo().categorias: # A conversa simulada precisa de uma categoria com produtos
+            categoria_temporaria = CategoriaProdutoPlaceholder.objects.create(nome="Carga (temporária)")
+            ProdutoPlaceholder.objects.create(nome="Pizza de carga", categoria=categoria_temporaria, preco_base=30)
+        try:
+            for backend in options['backend'] or [BACKEND_BANCO, BACKEND_CACHE]:
+                with override_settings(WHATSAPP_SESSAO_BACKEND=backend, WHATSAPP_ENVIO_AUTOMATICO=False):
+                    self._medir(backend, telefones)
+                self._limpar(telefones)
+        finally:
+            self._limpar(telefones)
+            if categoria_temporaria:
+                ProdutoPlaceholder.objects.filter(categoria=categoria_temporaria).delete()
+                categoria_temporaria.delete()
+
+    def _medir(self, backend, telefones):
+        # Mensagens intercaladas entre os clientes, como chegam ao worker
+        MensagemRecebida.objects.bulk_create([
+            MensagemRecebida(telefone_cliente=telefone, corpo=corpo)
+            for corpo in CONVERSA_SIMULADA for telefone in telefones
+        ])
+        ids = list(MensagemRecebida.objects.filter(
+            telefone_cliente__in=telefones
+        ).order_by('id').values_list('id', flat=True))
+
+        contagem = {'consultas': 0, 'escritas': 0}
+
+        def contar(execute, sql, params, many, context):
+            contagem['consultas'] += 1
+            if sql.startswith(('INSERT', 'UPDATE')) and ConversaWhatsApp._meta.db_table in sql:
+                contagem['escritas'] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(contar):
+            inicio = time.perf_counter()
+            for mensagem_id in ids:
+                processar_mensagem_recebida(mensagem_id)
+            duracao = time.perf_counter() - inicio
+
+        total = len(ids)
+        self.stdout.write(
+            f"[{backend}] {total} mensagens de {len(telefones)} clientes em {duracao:.2f}s: "
+            f"{total / duracao:.0f} msg/s por worker; {contagem['consultas'] / total:.1f} consultas e "
+            f"{contagem['escritas'] / total:.2f} escritas no ConversaWhatsApp por mensagem"
+        )
+
+    def _limpar(self, telefones):
+        obter_armazem_sessoes().descartar(telefones)
+        MensagemRecebida.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        ConversaWhatsApp.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        MensagemEnviada.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
@@ -0,0 +1,65 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from whatsapp_bot.envio import Despachante, ClienteProvedor, enfileirar_envios_em_massa
+from whatsapp_bot.models import MensagemEnviada
+from whatsapp_bot.provedor_falso import ProvedorFalso
+
+PREFIXO_TELEFONE = '+5500988'
+
+
+class Command(BaseCommand):
+    help = (
+        "Simula um disparo promocional contra um provedor falso local (whatsapp_bot.provedor_falso) "
+        "com limite por segundo e latência: enfileira N mensagens e mede vazão, respostas 429, "
+        "conexões TCP abertas e mensagens descartadas. Com --limite-cliente acima do limite do "
+        "provedor, mostra o que acontece sem o limitador. As mensagens criadas são removidas ao final."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mensagens', type=int, default=1000)
+        parser.add_argument('--limite-provedor', type=int, default=80, help="Mensagens por segundo aceitas pelo provedor.")
+        parser.add_argument('--limite-cliente', type=int, default=None,
+                            help="WHATSAPP_ENVIO_LIMITE_POR_SEGUNDO do despachante (default: 90%% do limite do provedor).")
+        parser.add_argument('--latencia-ms', type=int, default=50, help="Latência de cada resposta do provedor.")
+        parser.add_argument('--conexoes', type=int, default=8)
+
+    def handle(self, *args, **options):
+        # Uma folga abaixo do limite do provedor absorve a variação de latência da rede
+        limite_cliente = options['limite_cliente'] or max(int(options['limite_provedor'] * 0.9), 1)
+        MensagemEnviada.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        with ProvedorFalso(
+            limite_por_segundo=options['limite_provedor'], latencia_segundos=options['latencia_ms'] / 1000
+        ) as provedor:
+            cliente = ClienteProvedor(provedor.url, 'ACcarga', 'token', 'whatsapp:+14155238886', conexoes=options['conexoes'])
+            despachante = Despachante(cliente=cliente, limite_por_segundo=limite_cliente, conexoes=options['conexoes'])
+            try:
+                with override_settings(WHATSAPP_ENVIO_AUTOMATICO=False, WHATSAPP_ENVIO_BACKOFF_SEGUNDOS=1):
+                    telefones = [f"{PREFIXO_TELEFONE}{i:06d}" for i in range(options['mensagens'])]
+                    enfileirar_envios_em_massa(telefones, "Promoção: pizza grande com 20% de desconto hoje!")
+                    inicio = time.perf_counter()
+                    a_enviar = MensagemEnviada.objects.filter(
+                        telefone_cliente__startswith=PREFIXO_TELEFONE,
+                        status__in=[MensagemEnviada.STATUS_PENDENTE, MensagemEnviada.STATUS_ENVIANDO],
+                    )
+                    while a_enviar.exists(): # Inclui as novas tentativas agendadas após um 429
+                        if not despachante.drenar():
+                            time.sleep(0.2)
+                    duracao = time.perf_counter() - inicio
+            finally:
+                despachante.fechar()
+
+            mensagens = MensagemEnviada.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE)
+            enviadas = mensagens.filter(status=MensagemEnviada.STATUS_ENVIADA).count()
+            falhas = mensagens.filter(status=MensagemEnviada.STATUS_FALHOU).count()
+            self.stdout.write(
+                f"{options['mensagens']} mensagens, provedor {options['limite_provedor']}/s "
+                f"(latência {options['latencia_ms']}ms), despachante {limite_cliente}/s com {options['conexoes']} conexões"
+            )
+            self.stdout.write(
+                f"Enviadas: {enviadas} em {duracao:.1f}s ({enviadas / duracao:.1f} msg/s); "
+                f"respostas 429: {provedor.limitadas}; conexões TCP: {provedor.conexoes}; descartadas: {falhas}"
+            )
+        mensagens.delete()
@@ -0,0 +1,253 @@
+import collections
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.backends.signals import connection_created
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from administracao.models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+from whatsapp_bot.catalogo import obter_catalogo
+from whatsapp_bot.models import ConversaWhatsApp, PedidoWhatsApp, MensagemRecebida, MensagemEnviada
+from whatsapp_bot.processamento import obter_processador, BACKEND_THREADS, BACKEND_SINCRONO
+from whatsapp_bot.sessoes import obter_armazem_sessoes
+
+# Roteiros de clientes: (mensagem, estado da conversa depois dela). Juntos passam por todos
+# os estados de ConversaWhatsApp.ESTADOS_CONVERSA alcançáveis pelo bot ('FINALIZADO' não
+# é usado: depois do 'PAGO' a conversa volta para 'INICIO'). Usam a categoria 1 e o
+# produto 1 do cardápio.
+ROTEIROS = {
+    'compra_pix': [
+        ('oi', 'AGUARDANDO_OPCAO_INICIAL'),
+        ('1', 'AGUARDANDO_ESCOLHA_CATEGORIA'),
+        ('1', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('1', 'AGUARDANDO_ACAO_CARRINHO'),
+        ('c', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('1', 'AGUARDANDO_ACAO_CARRINHO'),
+        ('f', 'AGUARDANDO_CONFIRMACAO_PEDIDO'),
+        ('pix', 'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX'),
+        ('ja vou pagar', 'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX'),
+        ('pago', 'INICIO'),
+    ],
+    'navega_e_remove': [
+        ('oi', 'AGUARDANDO_OPCAO_INICIAL'),
+        ('9', 'AGUARDANDO_OPCAO_INICIAL'), # Opção inválida
+        ('1', 'AGUARDANDO_ESCOLHA_CATEGORIA'),
+        ('1', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('v', 'AGUARDANDO_ESCOLHA_CATEGORIA'),
+        ('1', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('1', 'AGUARDANDO_ACAO_CARRINHO'),
+        ('cat', 'AGUARDANDO_ESCOLHA_CATEGORIA'),
+        ('1', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('1', 'AGUARDANDO_ACAO_CARRINHO'),
+        ('r', 'AGUARDANDO_ESCOLHA_CATEGORIA'), # Carrinho esvaziado
+        ('v', 'AGUARDANDO_OPCAO_INICIAL'),
+    ],
+    'desiste_no_pix': [
+        ('oi', 'AGUARDANDO_OPCAO_INICIAL'),
+        ('1', 'AGUARDANDO_ESCOLHA_CATEGORIA'),
+        ('1', 'AGUARDANDO_ESCOLHA_PRODUTO'),
+        ('1', 'AGUARDANDO_ACAO_CARRINHO'),
+        ('f', 'AGUARDANDO_CONFIRMACAO_PEDIDO'),
+        ('x', 'AGUARDANDO_OPCAO_INICIAL'),
+        ('cancelar', 'AGUARDANDO_OPCAO_INICIAL'),
+    ],
+    'atendente': [
+        ('oi', 'AGUARDANDO_OPCAO_INICIAL'),
+        ('2', 'TRANSFERIDO_ATENDENTE'),
+        ('alguém aí?', 'TRANSFERIDO_ATENDENTE'),
+        ('cancelar', 'AGUARDANDO_OPCAO_INICIAL'),
+    ],
+}
+PREFIXO_TELEFONE = '+5500988'
+
+
+def percentil(valores_ordenados, fracao):
+    """ Percentil por posição (nearest-rank) de uma lista já ordenada. """
+    if not valores_ordenados:
+        return None
+    return valores_ordenados[min(int(len(valores_ordenados) * fracao), len(valores_ordenados) - 1)]
+
+
+class ContadorConsultas:
+    """
+    Conta as consultas de todas as threads (requests e workers). Instalado em cada
+    conexão aberta enquanto ativo, via connection_created.
+    """
+    def __init__(self):
+        self.total = 0
+        self.ativo = False
+        self._lock = threading.Lock()
+
+    def __call__(self, execute, sql, params, many, context):
+        if self.ativo:
+            with self._lock:
+                self.total += 1
+        return execute(sql, params, many, context)
+
+    def instalar(self, sender, connection, **kwargs):
+        if self not in connection.execute_wrappers:
+            connection.execute_wrappers.append(self)
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga com roteiros de conversa: N clientes simulados seguem roteiros que "
+        "passam por todos os estados do bot (navegar, adicionar, remover, finalizar, PIX, "
+        "cancelar, atendente) e enviam as mensagens ao webhook em paralelo, com pausa entre "
+        "mensagens. Imprime um relatório JSON (vazão, latência p50/p95/p99, consultas por "
+        "mensagem, erros) para comparar com execuções anteriores. Cria conversas, pedidos e "
+        "pagamentos reais (removidos ao final): use em banco de teste/homologação. "
+        "Não funciona com SQLite em memória."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=200)
+        parser.add_argument('--concorrencia', type=int, default=32,
+                            help="Clientes conversando ao mesmo tempo.")
+        parser.add_argument('--pausa-ms', type=float, default=0,
+                            help="Tempo médio de digitação entre mensagens do mesmo cliente (sorteado entre 0,5x e 1,5x).")
+        parser.add_argument('--processamento', choices=[BACKEND_THREADS, BACKEND_SINCRONO], default=BACKEND_THREADS,
+                            help="'threads': a latência é a do webhook; 'sincrono': inclui o processamento da mensagem.")
+        parser.add_argument('--roteiro', choices=sorted(ROTEIROS), action='append',
+                            help="Roteiro(s) a usar, distribuídos entre os clientes (default: todos).")
+        parser.add_argument('--semente', type=int, default=0, help="Semente das pausas, para execuções comparáveis.")
+        parser.add_argument('--saida', help="Também grava o relatório JSON neste arquivo.")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("SQLite em memória não é compartilhado entre threads; use outro banco.")
+
+        nomes_roteiros = options['roteiro'] or sorted(ROTEIROS)
+        clientes = [
+            (f"{PREFIXO_TELEFONE}{i:06d}", nomes_roteiros[i % len(nomes_roteiros)])
+            for i in range(options['clientes'])
+        ]
+        telefones = [telefone for telefone, _ in clientes]
+        self._limpar(telefones)
+        categoria_temporaria = None
+        if not obter_catalogo().categorias: # Os roteiros precisam de uma categoria com produtos
+            categoria_temporaria = CategoriaProdutoPlaceholder.objects.create(nome="Carga (temporária)")
+            ProdutoPlaceholder.objects.create(nome="Pizza de carga", categoria=categoria_temporaria, preco_base=30)
+        try:
+            # As respostas ficam na fila de envio (removida ao final), sem acordar o despachante
+            with override_settings(WHATSAPP_PROCESSAMENTO_BACKEND=options['processamento'], WHATSAPP_ENVIO_AUTOMATICO=False):
+                relatorio = self._executar(clientes, options)
+        finally:
+            self._limpar(telefones)
+            if categoria_temporaria:
+                ProdutoPlaceholder.objects.filter(categoria=categoria_temporaria).delete()
+                categoria_temporaria.delete()
+
+        saida = json.dumps(relatorio, indent=2, sort_keys=True, ensure_ascii=False)
+        if options['saida']:
+            with open(options['saida'], 'w', encoding='utf-8') as arquivo:
+                arquivo.write(saida + "\n")
+        self.stdout.write(saida)
+
+    def _executar(self, clientes, options):
+        url = reverse('whatsapp_bot:whatsapp_webhook')
+        clientes_http = threading.local()
+        erros = {'http': 0, 'excecoes': 0}
+        erros_lock = threading.Lock()
+        pausa = options['pausa_ms'] / 1000
+
+        def conversa(indice, telefone, nome_roteiro):
+            cliente_http = getattr(clientes_http, 'cliente', None) or Client()
+            clientes_http.cliente = cliente_http
+            sorteio = random.Random(options['semente'] * 1_000_003 + indice)
+            medidas = []
+            try:
+                for posicao, (texto, _) in enumerate(ROTEIROS[nome_roteiro]):
+                    if pausa and posicao:
+                        time.sleep(pausa * sorteio.uniform(0.5, 1.5))
+                    inicio = time.perf_counter()
+                    try:
+                        response = cliente_http.post(url, {'From': f'whatsapp:{telefone}', 'Body': texto})
+                    except Exception:
+                        with erros_lock:
+                            erros['excecoes'] += 1
+                        continue
+                    medidas.append((time.perf_counter() - inicio) * 1000)
+                    if response.status_code != 200:
+                        with erros_lock:
+                            erros['http'] += 1
+            finally:
+                connection.close()
+            return medidas
+
+        contador = ContadorConsultas()
+        connection_created.connect(contador.instalar)
+        contador.instalar(None, connection)
+        contador.ativo = True
+        try:
+            inicio = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=options['concorrencia']) as executor:
+                futuros = [
+                    executor.submit(conversa, indice, telefone, nome_roteiro)
+                    for indice, (telefone, nome_roteiro) in enumerate(clientes)
+                ]
+                latencias = sorted(medida for futuro in futuros for medida in futuro.result())
+            duracao_entrada = time.perf_counter() - inicio
+            obter_processador().aguardar()
+            duracao = time.perf_counter() - inicio
+        finally:
+            contador.ativo = False
+            connection_created.disconnect(contador.instalar)
+
+        telefones = [telefone for telefone, _ in clientes]
+        mensagens = MensagemRecebida.objects.filter(telefone_cliente__in=telefones)
+        total = sum(len(ROTEIROS[nome_roteiro]) for _, nome_roteiro in clientes)
+        armazem = obter_armazem_sessoes() # A conversa pode estar só no cache de sessões
+        erros.update({
+            'processamento': mensagens.filter(status=MensagemRecebida.STATUS_ERRO).count(),
+            'nao_processadas': mensagens.exclude(
+                status__in=[MensagemRecebida.STATUS_PROCESSADA, MensagemRecebida.STATUS_ERRO]
+            ).count(),
+            'estado_final_inesperado': sum(
+                1 for telefone, nome_roteiro in clientes
+                if armazem.carregar(telefone).estado_conversa != ROTEIROS[nome_roteiro][-1][1]
+            ),
+        })
+        return {
+            'clientes': len(clientes),
+            'mensagens': total,
+            'concorrencia': options['concorrencia'],
+            'pausa_ms': options['pausa_ms'],
+            'processamento': options['processamento'],
+            'roteiros': dict(collections.Counter(nome_roteiro for _, nome_roteiro in clientes)),
+            'duracao_s': round(duracao, 3),
+            'vazao_msg_s': round(total / duracao, 1),
+            'vazao_entrada_msg_s': round(total / duracao_entrada, 1),
+            'latencia_ms': {
+                nome: round(valor, 2) for nome, valor in (
+                    ('p50', percentil(latencias, 0.50)),
+                    ('p95', percentil(latencias, 0.95)),
+                    ('p99', percentil(latencias, 0.99)),
+                    ('max', latencias[-1] if latencias else None),
+                ) if valor is not None
+            },
+            'consultas_por_mensagem': round(contador.total / total, 2) if total else 0,
+            'erros': erros,
+        }
+
+    def _limpar(self, telefones):
+        from pagamentos.models import Pagamento
+        from cozinha_api.models import EventoStatusCozinha
+
+        obter_armazem_sessoes().descartar(telefones)
+        pedidos = PedidoWhatsApp.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE)
+        content_type = ContentType.objects.get_for_model(PedidoWhatsApp)
+        ids_pedidos = list(pedidos.values_list('id', flat=True))
+        Pagamento.objects.filter(content_type=content_type, object_id__in=ids_pedidos).delete()
+        EventoStatusCozinha.objects.filter(content_type=content_type, object_id__in=ids_pedidos).delete()
+        pedidos.delete() # Itens em cascata; o ticket da cozinha sai pelo post_delete
+        MensagemRecebida.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        ConversaWhatsApp.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        MensagemEnviada.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
@@ -0,0 +1,120 @@
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from administracao.models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+from whatsapp_bot.catalogo import obter_catalogo
+from whatsapp_bot.models import ConversaWhatsApp, MensagemRecebida, MensagemEnviada
+from whatsapp_bot.processamento import obter_processador, BACKEND_THREADS
+from whatsapp_bot.sessoes import obter_armazem_sessoes
+
+# Cada cliente simulado navega até a lista de produtos; a conversa só termina no estado
+# esperado se as mensagens do mesmo telefone forem processadas na ordem de chegada.
+CONVERSA_SIMULADA = ['oi', '1', '1']
+ESTADO_FINAL_ESPERADO = 'AGUARDANDO_ESCOLHA_PRODUTO'
+PREFIXO_TELEFONE = '+5500977'
+
+
+class Command(BaseCommand):
+    help = (
+        "Teste de carga do webhook do WhatsApp: N clientes simulados enviam mensagens em "
+        "paralelo. Mede a latência de resposta do webhook (p50/p99) e a vazão de entrada, "
+        "aguarda os workers e verifica que as mensagens de cada cliente foram processadas "
+        "em ordem. Cria conversas reais (removidas ao final): use em banco de teste/homologação. "
+        "Não funciona com SQLite em memória."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clientes', type=int, default=1000)
+        parser.add_argument('--concorrencia', type=int, default=32,
+                            help="Requests simultâneos ao webhook (como o Twilio entregando em paralelo).")
+
+    def handle(self, *args, **options):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            raise CommandError("SQLite em memória não é compartilhado entre threads; use outro banco.")
+
+        telefones = [f"{PREFIXO_TELEFONE}{i:06d}" for i in range(options['clientes'])]
+        self._limpar(telefones)
+        categoria_temporaria = None
+        if not obter_catalogo().categorias: # A conversa simulada precisa de uma categoria com produtos
+            categoria_temporaria = CategoriaProdutoPlaceholder.objects.create(nome="Carga (temporária)")
+            ProdutoPlaceholder.objects.create(nome="Pizza de carga", categoria=categoria_temporaria, preco_base=30)
+        try:
+            # As respostas ficam na fila de envio (removida ao final), sem acordar o despachante
+            with override_settings(WHATSAPP_PROCESSAMENTO_BACKEND=BACKEND_THREADS, WHATSAPP_ENVIO_AUTOMATICO=False):
+                latencias, duracao_entrada = self._enviar(telefones, options['concorrencia'])
+                inicio = time.perf_counter()
+                obter_processador().aguardar()
+                duracao_processamento = duracao_entrada + time.perf_counter() - inicio
+            self._verificar(telefones)
+        finally:
+            self._limpar(telefones)
+            if categoria_temporaria:
+                ProdutoPlaceholder.objects.filter(categoria=categoria_temporaria).delete()
+                categoria_temporaria.delete()
+
+        total = len(latencias)
+        latencias.sort()
+        p99 = latencias[min(int(total * 0.99), total - 1)]
+        self.stdout.write(
+            f"{total} mensagens de {len(telefones)} clientes, concorrência {options['concorrencia']}"
+        )
+        self.stdout.write(
+            f"Entrada: {total / duracao_entrada:.0f} msg/s; latência do webhook "
+            f"p50={statistics.median(latencias):.1f}ms p99={p99:.1f}ms máx={latencias[-1]:.1f}ms"
+        )
+        self.stdout.write(f"Processamento completo em {duracao_processamento:.2f}s ({total / duracao_processamento:.0f} msg/s)")
+        self.stdout.write(self.style.SUCCESS("Todas as conversas processadas em ordem."))
+
+    def _enviar(self, telefones, concorrencia):
+        url = reverse('whatsapp_bot:whatsapp_webhook')
+        clientes_http = threading.local()
+        erros = []
+
+        def conversa(telefone):
+            cliente_http = getattr(clientes_http, 'cliente', None) or Client()
+            clientes_http.cliente = cliente_http
+            medidas = []
+            try:
+                for texto in CONVERSA_SIMULADA:
+                    inicio = time.perf_counter()
+                    response = cliente_http.post(url, {'From': f'whatsapp:{telefone}', 'Body': texto})
+                    medidas.append((time.perf_counter() - inicio) * 1000)
+                    if response.status_code != 200:
+                        erros.append(f"{telefone}: HTTP {response.status_code}")
+            finally:
+                connection.close()
+            return medidas
+
+        inicio = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concorrencia) as executor:
+            latencias = [medida for medidas in executor.map(conversa, telefones) for medida in medidas]
+        duracao = time.perf_counter() - inicio
+        if erros:
+            raise CommandError(f"{len(erros)} requests falharam, ex: {erros[0]}")
+        return latencias, duracao
+
+    def _verificar(self, telefones):
+        nao_processadas = MensagemRecebida.objects.filter(
+            telefone_cliente__in=telefones
+        ).exclude(status=MensagemRecebida.STATUS_PROCESSADA).count()
+        if nao_processadas:
+            raise CommandError(f"{nao_processadas} mensagens não foram processadas.")
+        armazem = obter_armazem_sessoes() # A conversa pode estar só no cache de sessões
+        fora_de_ordem = sum(
+            1 for telefone in telefones if armazem.carregar(telefone).estado_conversa != ESTADO_FINAL_ESPERADO
+        )
+        if fora_de_ordem:
+            raise CommandError(f"{fora_de_ordem} conversas terminaram em estado inesperado (mensagens fora de ordem?).")
+
+    def _limpar(self, telefones):
+        obter_armazem_sessoes().descartar(telefones)
+        MensagemRecebida.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        ConversaWhatsApp.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
+        MensagemEnviada.objects.filter(telefone_cliente__startswith=PREFIXO_TELEFONE).delete()
@@ -0,0 +1,36 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from whatsapp_bot.envio import Despachante
+
+
+class Command(BaseCommand):
+    help = (
+        "Envia a fila de mensagens do WhatsApp (MensagemEnviada) pelo provedor, respeitando "
+        "WHATSAPP_ENVIO_LIMITE_POR_SEGUNDO. É o despachante de produção: rode uma única "
+        "instância, pois o limite de taxa vale por processo."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--uma-vez', action='store_true',
+                            help="Envia o que estiver pronto para envio e termina.")
+
+    def handle(self, *args, **options):
+        despachante = Despachante()
+        try:
+            if options['uma_vez']:
+                total = despachante.drenar()
+                self.stdout.write(self.style.SUCCESS(f"{total} mensagens processadas."))
+                return
+            intervalo = getattr(settings, 'WHATSAPP_ENVIO_INTERVALO_SEGUNDOS', 1)
+            while True:
+                close_old_connections()
+                if not despachante.drenar():
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            despachante.fechar()
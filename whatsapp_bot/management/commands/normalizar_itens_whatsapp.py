@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+
+from whatsapp_bot.models import ItemPedidoWhatsApp
+from whatsapp_bot.pedidos import pedidos_confirmados, normalizar_itens_pedidos
+
+
+class Command(BaseCommand):
+    help = (
+        "Grava os ItemPedidoWhatsApp dos pedidos WhatsApp confirmados (na cozinha ou com "
+        "pagamento aprovado) a partir do carrinho_atual. Rode uma vez depois da migração que "
+        "cria a tabela; por padrão só trata os pedidos ainda sem itens."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--refazer', action='store_true', help="Regrava os itens de todos os pedidos confirmados.")
+        parser.add_argument('--lote', type=int, default=500)
+
+    def handle(self, *args, **options):
+        pedidos = pedidos_confirmados()
+        if not options['refazer']:
+            pedidos = pedidos.filter(~Exists(ItemPedidoWhatsApp.objects.filter(pedido_whatsapp=OuterRef('pk'))))
+        total_pedidos, total_itens = normalizar_itens_pedidos(pedidos, options['lote'])
+        self.stdout.write(self.style.SUCCESS(f"{total_itens} itens gravados para {total_pedidos} pedidos WhatsApp."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from whatsapp_bot.processamento import reenfileirar_pendentes, obter_processador
+
+
+class Command(BaseCommand):
+    help = (
+        "Reenfileira as mensagens do WhatsApp ainda 'Pendente' (recebidas pelo webhook mas não "
+        "processadas, ex: o processo reiniciou) ou presas em 'Processando' há mais de "
+        "WHATSAPP_PROCESSANDO_TIMEOUT_SEGUNDOS, e aguarda o processamento, em ordem por telefone."
+    )
+
+    def handle(self, *args, **options):
+        total = reenfileirar_pendentes()
+        obter_processador().aguardar()
+        self.stdout.write(self.style.SUCCESS(f"{total} mensagens pendentes processadas."))
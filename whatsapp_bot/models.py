@@ -6,9 +6,32 @@ from django.utils import timezone
 # For MVP, we might not need a direct ForeignKey to a general 'Pedidos' table
 # if the confirmation is manual. We'll store order details in JSON for now.
 
-class PedidoWhatsApp(models.Model):
+class CarrinhoMixin:
+    """ Leitura de carrinho_atual (lista de itens em JSON), comum à conversa e ao pedido. """
+
+    def formatar_carrinho_para_mensagem(self):
+        if not isinstance(self.carrinho_atual, list) or not self.carrinho_atual:
+            return "Seu carrinho está vazio."
+        
+        linhas_itens = ["Seu pedido atual:"]
+        for i, item in enumerate(self.carrinho_atual):
+            linhas_itens.append(f"{i+1}. {item.get('quantidade', 1)}x {item.get('nome', 'N/A')} - R${item.get('preco', 0.00):.2f} cada")
+        return "\n".join(linhas_itens)
+
+    def calcular_total_carrinho(self):
+        if not isinstance(self.carrinho_atual, list):
+            return 0.0
+        total = 0.0
+        for item in self.carrinho_atual:
+            total += item.get('preco', 0.0) * item.get('quantidade', 1)
+        return total
+
+
+class ConversaWhatsApp(CarrinhoMixin, models.Model):
     """
-    Armazena o estado da conversa e o pedido de um cliente via WhatsApp.
+    Estado da conversa de um cliente com o bot: uma linha pequena por telefone, alterada
+    a cada mensagem (pelo armazém de sessões, whatsapp_bot.sessoes). O pedido confirmado
+    vira um PedidoWhatsApp próprio e a conversa recomeça.
     """
     ESTADOS_CONVERSA = [
         ('INICIO', 'Início da conversa'),
@@ -24,45 +47,26 @@ class PedidoWhatsApp(models.Model):
 
     telefone_cliente = models.CharField(max_length=20, unique=True, help_text="Número de telefone do cliente (ex: +5511999998888)")
     estado_conversa = models.CharField(max_length=50, choices=ESTADOS_CONVERSA, default='INICIO')
-    carrinho_atual = models.JSONField(default=dict, help_text="Itens no carrinho, ex: [{'id': 1, 'nome': 'Pizza M', 'preco': 30.00, 'quantidade': 1}]")
-    # pedido_confirmado_id = models.ForeignKey('pedidos.Pedido', null=True, blank=True, on_delete=models.SET_NULL) # Pós-MVP
-    nome_cliente = models.CharField(max_length=255, blank=True, null=True) # Coletado durante o fluxo
-    endereco_entrega = models.TextField(blank=True, null=True) # Coletado durante o fluxo (se aplicável)
+    carrinho_atual = models.JSONField(default=list, blank=True, help_text="Itens no carrinho, ex: [{'id': 1, 'nome': 'Pizza M', 'preco': 30.00, 'quantidade': 1}]")
     dados_temporarios = models.JSONField(default=dict, blank=True, help_text="Dados temporários para a conversa, como categoria selecionada.")
-
-    # Campos para Cozinha
-    STATUS_COZINHA_AGUARDANDO = 'AguardandoPreparo'
-    STATUS_COZINHA_EM_PREPARO = 'EmPreparo'
-    STATUS_COZINHA_PRONTO = 'Pronto'
-    STATUS_COZINHA_ENTREGUE = 'Entregue' # Status final do ciclo da cozinha
-
-    STATUS_COZINHA_CHOICES = [
-        (STATUS_COZINHA_AGUARDANDO, 'Aguardando Preparo'),
-        (STATUS_COZINHA_EM_PREPARO, 'Em Preparo'),
-        (STATUS_COZINHA_PRONTO, 'Pronto'),
-        (STATUS_COZINHA_ENTREGUE, 'Entregue'),
-    ]
-    status_cozinha = models.CharField(
-        max_length=20,
-        choices=STATUS_COZINHA_CHOICES,
-        null=True, blank=True, # Pode ser nulo até o pedido ser confirmado para cozinha
-        help_text="Status do pedido na cozinha"
+    nome_cliente = models.CharField(max_length=255, blank=True, null=True) # Coletado durante o fluxo
+    ultima_mensagem_id = models.PositiveBigIntegerField(
+        null=True, blank=True,
+        help_text="Última MensagemRecebida refletida nesta linha (checkpoint da sessão, ver whatsapp_bot.sessoes)"
     )
-    horario_entrada_cozinha = models.DateTimeField(null=True, blank=True, help_text="Horário que o pedido entrou na fila da cozinha")
-
-
-    data_criacao = models.DateTimeField(auto_now_add=True)
     data_atualizacao = models.DateTimeField(auto_now=True)
 
     def __str__(self):
-        return f"Pedido WhatsApp de {self.telefone_cliente} - Estado: {self.get_estado_conversa_display()}"
+        return f"Conversa WhatsApp de {self.telefone_cliente} - Estado: {self.get_estado_conversa_display()}"
+
+    # Os métodos abaixo só alteram o objeto em memória: a gravação fica com o armazém de
+    # sessões (whatsapp_bot.sessoes), no máximo uma escrita por mensagem.
 
     def reset_conversa(self):
         self.estado_conversa = 'INICIO'
         self.carrinho_atual = [] # Reset to an empty list
         self.dados_temporarios = {} # Reset temporary data
         # Consider if other fields like nome_cliente, endereco_entrega should be reset
-        self.save()
 
     def adicionar_item_carrinho(self, produto, quantidade=1):
         if not isinstance(self.carrinho_atual, list):
@@ -75,7 +79,6 @@ class PedidoWhatsApp(models.Model):
             produto_id = getattr(produto, 'id', None)
             if produto_id is not None and item_no_carrinho.get('id') == produto_id:
                 item_no_carrinho['quantidade'] = item_no_carrinho.get('quantidade', 0) + quantidade
-                self.save()
                 return
 
         # If not in cart, add new item
@@ -85,33 +88,190 @@ class PedidoWhatsApp(models.Model):
             'preco': float(getattr(produto, 'preco', 0.0)), # Use 'preco' as per MOCKED_PRODUCTS
             'quantidade': quantidade
         })
-        self.save()
 
     def remover_ultimo_item_carrinho(self):
         if isinstance(self.carrinho_atual, list) and self.carrinho_atual:
             self.carrinho_atual.pop()
-            self.save()
             return True
         return False
 
-    def formatar_carrinho_para_mensagem(self):
-        if not isinstance(self.carrinho_atual, list) or not self.carrinho_atual:
-            return "Seu carrinho está vazio."
-        
-        linhas_itens = ["Seu pedido atual:"]
-        for i, item in enumerate(self.carrinho_atual):
-            linhas_itens.append(f"{i+1}. {item.get('quantidade', 1)}x {item.get('nome', 'N/A')} - R${item.get('preco', 0.00):.2f} cada")
-        return "\n".join(linhas_itens)
+    def confirmar_pedido(self):
+        """
+        Pedido (PedidoWhatsApp ainda não gravado) com o carrinho atual, já na fila da
+        cozinha, e reinicia a conversa para um próximo pedido.
+        """
+        pedido = PedidoWhatsApp(
+            telefone_cliente=self.telefone_cliente,
+            nome_cliente=self.nome_cliente,
+            carrinho_atual=list(self.carrinho_atual or []),
+            status_cozinha=PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO,
+            horario_entrada_cozinha=timezone.now(),
+        )
+        self.reset_conversa()
+        return pedido
 
-    def calcular_total_carrinho(self):
-        if not isinstance(self.carrinho_atual, list):
-            return 0.0
-        total = 0.0
-        for item in self.carrinho_atual:
-            total += item.get('preco', 0.0) * item.get('quantidade', 1)
-        return total
+    class Meta:
+        verbose_name = "Conversa WhatsApp"
+        verbose_name_plural = "Conversas WhatsApp"
+
+
+class PedidoWhatsApp(CarrinhoMixin, models.Model):
+    """
+    Pedido de um cliente via WhatsApp, criado quando o pagamento é informado. Um cliente
+    tem vários pedidos; o estado da conversa fica em ConversaWhatsApp. Depois de criado,
+    só o status da cozinha muda. Referenciado por Pagamento e pelos tickets da cozinha.
+    """
+    telefone_cliente = models.CharField(max_length=20, db_index=True, help_text="Número de telefone do cliente (ex: +5511999998888)")
+    carrinho_atual = models.JSONField(default=dict, help_text="Itens do pedido como estavam no carrinho, ex: [{'id': 1, 'nome': 'Pizza M', 'preco': 30.00, 'quantidade': 1}]")
+    # pedido_confirmado_id = models.ForeignKey('pedidos.Pedido', null=True, blank=True, on_delete=models.SET_NULL) # Pós-MVP
+    nome_cliente = models.CharField(max_length=255, blank=True, null=True) # Coletado durante o fluxo
+    endereco_entrega = models.TextField(blank=True, null=True) # Coletado durante o fluxo (se aplicável)
+
+    # Campos para Cozinha
+    STATUS_COZINHA_AGUARDANDO = 'AguardandoPreparo'
+    STATUS_COZINHA_EM_PREPARO = 'EmPreparo'
+    STATUS_COZINHA_PRONTO = 'Pronto'
+    STATUS_COZINHA_ENTREGUE = 'Entregue' # Status final do ciclo da cozinha
+
+    STATUS_COZINHA_CHOICES = [
+        (STATUS_COZINHA_AGUARDANDO, 'Aguardando Preparo'),
+        (STATUS_COZINHA_EM_PREPARO, 'Em Preparo'),
+        (STATUS_COZINHA_PRONTO, 'Pronto'),
+        (STATUS_COZINHA_ENTREGUE, 'Entregue'),
+    ]
+    status_cozinha = models.CharField(
+        max_length=20,
+        choices=STATUS_COZINHA_CHOICES,
+        null=True, blank=True, # Pode ser nulo até o pedido ser confirmado para cozinha
+        help_text="Status do pedido na cozinha"
+    )
+    horario_entrada_cozinha = models.DateTimeField(null=True, blank=True, help_text="Horário que o pedido entrou na fila da cozinha")
+
+
+    data_criacao = models.DateTimeField(auto_now_add=True)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"Pedido WhatsApp {self.pk} de {self.telefone_cliente}"
 
     class Meta:
         verbose_name = "Pedido WhatsApp"
         verbose_name_plural = "Pedidos WhatsApp"
         ordering = ['-data_atualizacao']
+
+
+class ItemPedidoWhatsApp(models.Model):
+    """
+    Item de um pedido WhatsApp confirmado, gravado a partir de carrinho_atual quando o
+    pagamento é informado (whatsapp_bot.pedidos). Permite agregar vendas com GROUP BY no
+    banco, sem ler o JSON de cada pedido. Pedidos anteriores: comando normalizar_itens_whatsapp.
+    """
+    pedido_whatsapp = models.ForeignKey(PedidoWhatsApp, on_delete=models.CASCADE, related_name='itens')
+    produto = models.ForeignKey(
+        'administracao.ProdutoPlaceholder', on_delete=models.SET_NULL, null=True, blank=True,
+        help_text="Produto do cardápio; vazio se o produto do carrinho não existe mais"
+    )
+    nome_produto = models.CharField(max_length=255, help_text="Nome do produto no momento do pedido")
+    quantidade = models.PositiveIntegerField(default=1)
+    preco_unitario = models.DecimalField(max_digits=10, decimal_places=2, help_text="Preço do produto no momento do pedido")
+    observacoes = models.TextField(blank=True, default='')
+
+    def __str__(self):
+        return f"{self.quantidade}x {self.nome_produto} no Pedido WhatsApp {self.pedido_whatsapp_id}"
+
+    class Meta:
+        verbose_name = "Item de Pedido WhatsApp"
+        verbose_name_plural = "Itens de Pedidos WhatsApp"
+        ordering = ['pedido_whatsapp', 'id']
+
+
+class MensagemRecebida(models.Model):
+    """
+    Mensagem recebida pelo webhook, gravada antes de responder ao Twilio e processada
+    depois pelos workers de whatsapp_bot.processamento (em ordem, por telefone_cliente).
+    Mensagens que ficaram 'Pendente', ou 'Processando' há mais de
+    WHATSAPP_PROCESSANDO_TIMEOUT_SEGUNDOS (ex: processo reiniciado no meio do
+    processamento), são reenfileiradas pelo comando processar_mensagens_pendentes.
+    """
+    STATUS_PENDENTE = 'Pendente'
+    STATUS_PROCESSANDO = 'Processando'
+    STATUS_PROCESSADA = 'Processada'
+    STATUS_ERRO = 'Erro'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDENTE, 'Pendente'),
+        (STATUS_PROCESSANDO, 'Processando'),
+        (STATUS_PROCESSADA, 'Processada'),
+        (STATUS_ERRO, 'Erro'),
+    ]
+
+    telefone_cliente = models.CharField(max_length=20, help_text="Número normalizado (sem o prefixo 'whatsapp:')")
+    corpo = models.TextField(blank=True, default='', help_text="Texto da mensagem como recebido")
+    sid_provedor = models.CharField(
+        max_length=64, unique=True, null=True, blank=True,
+        help_text="MessageSid do provedor; único para descartar os reenvios do webhook (whatsapp_bot.idempotencia)"
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDENTE)
+    erro = models.TextField(blank=True, null=True)
+    recebida_em = models.DateTimeField(auto_now_add=True)
+    processando_em = models.DateTimeField(null=True, blank=True, help_text="Quando a mensagem foi reivindicada por um worker")
+    processada_em = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Mensagem de {self.telefone_cliente} ({self.status})"
+
+    class Meta:
+        verbose_name = "Mensagem Recebida (WhatsApp)"
+        verbose_name_plural = "Mensagens Recebidas (WhatsApp)"
+        ordering = ['id']
+        indexes = [
+            # Reenfileiramento das pendentes, na ordem de chegada
+            models.Index(fields=['status', 'id'], name='whatsapp_msg_status_idx'),
+        ]
+
+
+class MensagemEnviada(models.Model):
+    """
+    Fila persistente de mensagens a enviar ao cliente pelo provedor (Twilio).
+    send_whatsapp_message só grava a mensagem; o envio é feito pelo despachante de
+    whatsapp_bot.envio, com limite de mensagens por segundo, novas tentativas com
+    backoff e, esgotadas as tentativas, status 'Falhou' (dead letter).
+    """
+    STATUS_PENDENTE = 'Pendente'
+    STATUS_ENVIANDO = 'Enviando'
+    STATUS_ENVIADA = 'Enviada'
+    STATUS_FALHOU = 'Falhou'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDENTE, 'Pendente'),
+        (STATUS_ENVIANDO, 'Enviando'),
+        (STATUS_ENVIADA, 'Enviada'),
+        (STATUS_FALHOU, 'Falhou'),
+    ]
+
+    telefone_cliente = models.CharField(max_length=20)
+    corpo = models.TextField()
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDENTE)
+    tentativas = models.PositiveIntegerField(default=0)
+    proxima_tentativa_em = models.DateTimeField(
+        default=timezone.now,
+        help_text="Pendente: quando pode ser enviada. Enviando: fim da reserva pelo despachante."
+    )
+    ultimo_erro = models.TextField(blank=True, null=True)
+    sid_provedor = models.CharField(max_length=64, blank=True, null=True, help_text="Identificador da mensagem no provedor")
+    criada_em = models.DateTimeField(auto_now_add=True)
+    enviada_em = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Mensagem para {self.telefone_cliente} ({self.status})"
+
+    class Meta:
+        verbose_name = "Mensagem Enviada (WhatsApp)"
+        verbose_name_plural = "Mensagens Enviadas (WhatsApp)"
+        ordering = ['id']
+        indexes = [
+            # Despachante: mensagens a enviar cujo horário já chegou, na ordem de criação
+            models.Index(fields=['status', 'proxima_tentativa_em', 'id'], name='whatsapp_envio_fila_idx'),
+            # Despachante: mensagem anterior do mesmo telefone ainda aguardando (ordem por telefone)
+            models.Index(fields=['telefone_cliente', 'id'], name='whatsapp_envio_telefone_idx'),
+        ]
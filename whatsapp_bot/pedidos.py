@@ -0,0 +1,90 @@
+"""
+Itens dos pedidos WhatsApp confirmados (ItemPedidoWhatsApp), normalizados a partir do
+carrinho_atual (lista JSON) do pedido.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+
+from administracao.models import ProdutoPlaceholder
+from .models import PedidoWhatsApp, ItemPedidoWhatsApp
+
+
+def _preco(valor):
+    try:
+        return Decimal(str(valor)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return Decimal('0.00')
+
+
+def itens_do_carrinho(pedidos_whatsapp):
+    """
+    ItemPedidoWhatsApp (não gravados) dos carrinhos dos pedidos, com uma consulta para
+    conferir quais produtos ainda existem no cardápio.
+    """
+    carrinhos = [
+        (pedido, [item for item in pedido.carrinho_atual if isinstance(item, dict)])
+        for pedido in pedidos_whatsapp if isinstance(pedido.carrinho_atual, list)
+    ]
+    ids_produtos = {item.get('id') for _, carrinho in carrinhos for item in carrinho if isinstance(item.get('id'), int)}
+    produtos_existentes = set(ProdutoPlaceholder.objects.filter(id__in=ids_produtos).values_list('id', flat=True))
+    return [
+        ItemPedidoWhatsApp(
+            pedido_whatsapp_id=pedido.pk,
+            produto_id=item.get('id') if item.get('id') in produtos_existentes else None,
+            nome_produto=item.get('nome') or 'Produto Desconhecido',
+            quantidade=item.get('quantidade', 1),
+            preco_unitario=_preco(item.get('preco', 0)),
+            observacoes=item.get('observacoes') or '',
+        )
+        for pedido, carrinho in carrinhos for item in carrinho
+        if (item.get('quantidade') or 0) > 0
+    ]
+
+
+def registrar_itens_pedido_whatsapp(pedido_whatsapp):
+    """ Grava os itens do carrinho do pedido confirmado, substituindo os de uma confirmação anterior. """
+    with transaction.atomic():
+        ItemPedidoWhatsApp.objects.filter(pedido_whatsapp_id=pedido_whatsapp.pk).delete()
+        return ItemPedidoWhatsApp.objects.bulk_create(itens_do_carrinho([pedido_whatsapp]))
+
+
+def pedidos_confirmados():
+    """ Pedidos WhatsApp que passaram da confirmação: entraram na cozinha ou têm pagamento aprovado. """
+    from pagamentos.models import Pagamento
+
+    pagamentos_aprovados = Pagamento.objects.filter(
+        content_type=ContentType.objects.get_for_model(PedidoWhatsApp),
+        object_id=OuterRef('pk'),
+        status_pagamento=Pagamento.STATUS_APROVADO,
+    )
+    return PedidoWhatsApp.objects.filter(
+        (Q(status_cozinha__isnull=False) & ~Q(status_cozinha='')) | Q(Exists(pagamentos_aprovados))
+    )
+
+
+def normalizar_itens_pedidos(pedidos_whatsapp, tamanho_lote=500):
+    """
+    Grava os itens dos pedidos (queryset), em lotes: uma leitura dos carrinhos, uma
+    consulta de produtos e um bulk_create por lote. Retorna (pedidos, itens).
+    """
+    total_pedidos = total_itens = 0
+    lote = []
+    for pedido in pedidos_whatsapp.only('id', 'carrinho_atual').order_by('id').iterator(chunk_size=tamanho_lote):
+        lote.append(pedido)
+        if len(lote) >= tamanho_lote:
+            total_itens += _gravar_lote(lote)
+            total_pedidos += len(lote)
+            lote = []
+    if lote:
+        total_itens += _gravar_lote(lote)
+        total_pedidos += len(lote)
+    return total_pedidos, total_itens
+
+
+def _gravar_lote(pedidos_whatsapp):
+    with transaction.atomic():
+        ItemPedidoWhatsApp.objects.filter(pedido_whatsapp_id__in=[pedido.pk for pedido in pedidos_whatsapp]).delete()
+        return len(ItemPedidoWhatsApp.objects.bulk_create(itens_do_carrinho(pedidos_whatsapp)))
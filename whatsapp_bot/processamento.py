@@ -0,0 +1,171 @@
+import logging
+import queue
+import threading
+import zlib
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import MensagemRecebida
+
+logger = logging.getLogger(__name__)
+
+BACKEND_THREADS = 'threads'
+BACKEND_SINCRONO = 'sincrono'
+
+
+class ProcessadorPorChaveThreads:
+    """
+    Pool de workers em threads, com uma fila em memória por worker.
+
+    Cada chave (telefone do cliente) é sempre atendida pelo mesmo worker, escolhido
+    por hash: as tarefas de uma mesma chave rodam estritamente na ordem em que foram
+    enfileiradas, e chaves diferentes são processadas em paralelo.
+
+    Atenção: as filas são por processo. O estado durável é o MensagemRecebida no banco;
+    o que estiver em memória quando o processo terminar volta a ser enfileirado por
+    processar_mensagens_pendentes.
+    """
+    def __init__(self, total_workers):
+        self.total_workers = max(int(total_workers), 1)
+        self._filas = [queue.Queue() for _ in range(self.total_workers)]
+        self._threads = []
+        self._lock = threading.Lock()
+
+    def _iniciar(self):
+        with self._lock:
+            if self._threads:
+                return
+            for indice, fila in enumerate(self._filas):
+                thread = threading.Thread(
+                    target=self._executar, args=(fila,), name=f"whatsapp-worker-{indice}", daemon=True
+                )
+                thread.start()
+                self._threads.append(thread)
+
+    def _executar(self, fila):
+        while True:
+            tarefa, args = fila.get()
+            close_old_connections() # Cada worker mantém sua conexão, como uma thread de request
+            try:
+                tarefa(*args)
+            except Exception:
+                logger.exception("Erro não tratado em worker de mensagens do WhatsApp.")
+            finally:
+                close_old_connections()
+                fila.task_done()
+
+    def indice_worker(self, chave):
+        return zlib.crc32(chave.encode()) % self.total_workers
+
+    def enfileirar(self, chave, tarefa, *args):
+        self._iniciar()
+        self._filas[self.indice_worker(chave)].put((tarefa, args))
+
+    def aguardar(self):
+        """ Bloqueia até todas as filas esvaziarem (usado pelos comandos de carga). """
+        for fila in self._filas:
+            fila.join()
+
+
+class ProcessadorSincrono:
+    """ Executa cada tarefa na hora, na thread de quem enfileira (testes e desenvolvimento). """
+    def enfileirar(self, chave, tarefa, *args):
+        tarefa(*args)
+
+    def aguardar(self):
+        pass
+
+
+_processadores = {}
+_processadores_lock = threading.Lock()
+
+
+def obter_processador():
+    """
+    Processador configurado em WHATSAPP_PROCESSAMENTO_BACKEND: 'threads' (default, com
+    WHATSAPP_PROCESSAMENTO_WORKERS workers, default 8) ou 'sincrono'.
+    """
+    backend = getattr(settings, 'WHATSAPP_PROCESSAMENTO_BACKEND', BACKEND_THREADS)
+    with _processadores_lock:
+        if backend not in _processadores:
+            if backend == BACKEND_SINCRONO:
+                _processadores[backend] = ProcessadorSincrono()
+            else:
+                _processadores[backend] = ProcessadorPorChaveThreads(
+                    getattr(settings, 'WHATSAPP_PROCESSAMENTO_WORKERS', 8)
+                )
+        return _processadores[backend]
+
+
+def _a_processar(agora):
+    """
+    Mensagens que um worker pode reivindicar: 'Pendente', ou 'Processando' há mais de
+    WHATSAPP_PROCESSANDO_TIMEOUT_SEGUNDOS (default 300), que ficaram presas quando o
+    processo terminou entre a reivindicação e o status final. O timeout deve ser maior
+    que o processamento mais demorado de uma mensagem, senão ela é processada de novo.
+    """
+    limite = agora - timedelta(seconds=getattr(settings, 'WHATSAPP_PROCESSANDO_TIMEOUT_SEGUNDOS', 300))
+    return MensagemRecebida.objects.filter(
+        Q(status=MensagemRecebida.STATUS_PENDENTE)
+        | Q(status=MensagemRecebida.STATUS_PROCESSANDO, processando_em__lt=limite)
+    )
+
+
+def processar_mensagem_recebida(mensagem_id):
+    """
+    Processa uma MensagemRecebida (máquina de estados da conversa e resposta ao cliente).
+    A mensagem é reivindicada com um UPDATE condicional (Pendente, ou Processando
+    expirada, -> Processando), então uma mensagem reenfileirada em duplicidade é
+    processada uma única vez.
+    """
+    from .conversa import processar_mensagem, send_whatsapp_message
+
+    agora = timezone.now()
+    if not _a_processar(agora).filter(pk=mensagem_id).update(
+        status=MensagemRecebida.STATUS_PROCESSANDO, processando_em=agora
+    ):
+        return
+    mensagem = MensagemRecebida.objects.only('telefone_cliente', 'corpo').get(pk=mensagem_id)
+    try:
+        processar_mensagem(mensagem.telefone_cliente, mensagem.corpo.strip().lower(), mensagem.id)
+    except Exception as e:
+        logger.error(f"Erro ao processar mensagem {mensagem_id} de {mensagem.telefone_cliente}: {e}", exc_info=True)
+        MensagemRecebida.objects.filter(pk=mensagem_id).update(
+            status=MensagemRecebida.STATUS_ERRO, erro=str(e), processada_em=timezone.now()
+        )
+        send_whatsapp_message(
+            mensagem.telefone_cliente,
+            "Ocorreu um erro interno. Por favor, tente novamente mais tarde ou contate o suporte."
+        )
+        return
+    MensagemRecebida.objects.filter(pk=mensagem_id).update(
+        status=MensagemRecebida.STATUS_PROCESSADA, processada_em=timezone.now()
+    )
+
+
+def enfileirar_mensagem(mensagem):
+    """ Agenda o processamento de uma MensagemRecebida após o commit da gravação. """
+    transaction.on_commit(
+        lambda: obter_processador().enfileirar(mensagem.telefone_cliente, processar_mensagem_recebida, mensagem.pk)
+    )
+
+
+def reenfileirar_pendentes():
+    """
+    Enfileira, em ordem de chegada, as mensagens ainda 'Pendente' (ex: recebidas antes de
+    o processo reiniciar) e as 'Processando' expiradas (o processo terminou no meio do
+    processamento). Retorna quantas foram enfileiradas.
+    """
+    processador = obter_processador()
+    total = 0
+    for mensagem_id, telefone_cliente in _a_processar(timezone.now()).order_by('id').values_list(
+        'id', 'telefone_cliente'
+    ).iterator():
+        processador.enfileirar(telefone_cliente, processar_mensagem_recebida, mensagem_id)
+        total += 1
+    return total
@@ -0,0 +1,113 @@
+"""
+Servidor HTTP local que imita o endpoint de mensagens do Twilio, para testar o envio
+(whatsapp_bot.envio) sem rede: registra as mensagens recebidas e as conexões abertas,
+aplica um limite por segundo (429 com Retry-After) e pode simular latência e falhas.
+"""
+import collections
+import itertools
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+
+_CAMINHO_MENSAGENS = re.compile(r'^/2010-04-01/Accounts/(?P<account_sid>[^/]+)/Messages\.json$')
+
+
+class ProvedorFalso:
+    """
+    Uso:
+        with ProvedorFalso(limite_por_segundo=80) as provedor:
+            ... configurar WHATSAPP_PROVEDOR_URL=provedor.url ...
+            provedor.recebidas  # [{'From': ..., 'To': ..., 'Body': ...}, ...]
+
+    respostas: códigos HTTP devolvidos às primeiras requisições (ex: [500, 429]); depois, 201.
+    """
+    def __init__(self, limite_por_segundo=None, latencia_segundos=0, respostas=None):
+        self.limite_por_segundo = limite_por_segundo
+        self.latencia_segundos = latencia_segundos
+        self._respostas = collections.deque(respostas or [])
+        self.recebidas = []
+        self.limitadas = 0 # Requisições recusadas com 429 pelo limite por segundo
+        self.conexoes = 0 # Conexões TCP abertas pelos clientes
+        self._janela = collections.deque()
+        self._sids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._servidor = None
+
+    @property
+    def url(self):
+        host, porta = self._servidor.server_address[:2]
+        return f"http://{host}:{porta}"
+
+    def _responder(self, dados):
+        """ (status, cabeçalhos, corpo) para uma mensagem recebida. """
+        with self._lock:
+            agora = time.monotonic()
+            if self.limite_por_segundo:
+                while self._janela and self._janela[0] <= agora - 1:
+                    self._janela.popleft()
+                if len(self._janela) >= self.limite_por_segundo:
+                    self.limitadas += 1
+                    return 429, {'Retry-After': '1'}, {'code': 20429, 'message': 'Too Many Requests'}
+                self._janela.append(agora)
+            if self._respostas:
+                status = self._respostas.popleft()
+                if status >= 300:
+                    return status, {'Retry-After': '1'} if status == 429 else {}, {'message': f'Erro simulado {status}'}
+            self.recebidas.append(dados)
+            sid = f"SM{next(self._sids):032d}"
+        return 201, {}, {'sid': sid, 'status': 'queued', 'to': dados.get('To'), 'body': dados.get('Body')}
+
+    def iniciar(self):
+        provedor = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1' # Keep-alive, como o provedor real
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with provedor._lock:
+                    provedor.conexoes += 1
+
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if not _CAMINHO_MENSAGENS.match(self.path):
+                    status, cabecalhos, resposta = 404, {}, {'message': 'Not Found'}
+                elif not (self.headers.get('Authorization') or '').startswith('Basic '):
+                    status, cabecalhos, resposta = 401, {}, {'message': 'Unauthorized'}
+                else:
+                    if provedor.latencia_segundos:
+                        time.sleep(provedor.latencia_segundos)
+                    dados = {chave: valores[0] for chave, valores in parse_qs(corpo.decode()).items()}
+                    status, cabecalhos, resposta = provedor._responder(dados)
+                conteudo = json.dumps(resposta).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(conteudo)))
+                for nome, valor in cabecalhos.items():
+                    self.send_header(nome, valor)
+                self.end_headers()
+                self.wfile.write(conteudo)
+
+            def log_message(self, *args):
+                pass
+
+        self._servidor = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._servidor.daemon_threads = True
+        threading.Thread(
+            target=self._servidor.serve_forever, kwargs={'poll_interval': 0.05}, name='provedor-falso', daemon=True
+        ).start()
+        return self
+
+    def parar(self):
+        self._servidor.shutdown()
+        self._servidor.server_close()
+
+    def __enter__(self):
+        return self.iniciar()
+
+    def __exit__(self, *exc):
+        self.parar()
@@ -0,0 +1,256 @@
+"""
+Armazém de sessões da conversa do bot (ConversaWhatsApp: estado_conversa, carrinho_atual,
+dados_temporarios).
+
+Backends (setting WHATSAPP_SESSAO_BACKEND):
+  * 'cache' (default): write-behind. A sessão fica no cache do Django
+    (WHATSAPP_SESSAO_CACHE, default 'default'; LocMemCache serve como cache local, Redis
+    ou Memcached para vários processos) e só vai para o banco em checkpoints (pedido
+    confirmado, transferência para atendente) e, em
+    segundo plano, a cada WHATSAPP_SESSAO_INTERVALO_GRAVACAO_SEGUNDOS para as sessões
+    alteradas. Uma conversa quente não escreve no banco a cada mensagem.
+  * 'banco': write-through, no máximo uma escrita por mensagem (só as colunas alteradas).
+
+Recuperação após queda: cada mensagem recebida já está gravada em MensagemRecebida e a
+ConversaWhatsApp guarda em ultima_mensagem_id até onde a linha está atualizada. Se a sessão
+não está no cache (processo reiniciado, expirada ou descartada), ela é refeita a partir da
+linha reaplicando, sem enviar respostas, as mensagens já processadas depois do checkpoint.
+Mensagens de checkpoint nunca são reaplicadas: são marcadas como processadas só depois
+que o checkpoint foi gravado. Sem linha (conversa nunca gravada), todas as mensagens
+processadas do telefone são reaplicadas.
+"""
+import copy
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ConversaWhatsApp, MensagemRecebida
+
+logger = logging.getLogger(__name__)
+
+BACKEND_CACHE = 'cache'
+BACKEND_BANCO = 'banco'
+
+# Colunas da conversa gravadas pelo armazém
+CAMPOS_SESSAO = ['estado_conversa', 'carrinho_atual', 'dados_temporarios', 'ultima_mensagem_id']
+
+
+def nova_conversa(telefone):
+    return ConversaWhatsApp(telefone_cliente=telefone, estado_conversa='INICIO')
+
+
+def fotografar(pedido_conversa):
+    """ Guarda os valores gravados no banco, para gravar depois só as colunas alteradas. """
+    pedido_conversa._sessao_gravada = copy.deepcopy(
+        {campo: getattr(pedido_conversa, campo) for campo in CAMPOS_SESSAO}
+    )
+
+
+def campos_alterados(pedido_conversa, campos):
+    """ Campos diferentes da foto; sem foto (sessão vinda do cache), todos os campos. """
+    gravada = getattr(pedido_conversa, '_sessao_gravada', None)
+    if gravada is None:
+        return list(campos)
+    return [campo for campo in campos if campo not in gravada or gravada[campo] != getattr(pedido_conversa, campo)]
+
+
+def gravar_conversa(pedido_conversa):
+    """
+    Grava a conversa com no máximo uma escrita: UPDATE só das colunas alteradas (nenhuma
+    escrita se nada mudou); se a linha não é conhecida, um upsert por telefone_cliente
+    (ela pode ter sido criada depois que a sessão foi carregada, ex: pela gravação
+    periódica). Retorna se gravou.
+    """
+    if pedido_conversa.pk is None:
+        ConversaWhatsApp.objects.bulk_create(
+            [pedido_conversa], update_conflicts=True,
+            unique_fields=['telefone_cliente'], update_fields=CAMPOS_SESSAO + ['data_atualizacao'],
+        )
+        if pedido_conversa.pk is None: # Banco sem RETURNING no upsert (ex: MySQL)
+            pedido_conversa.pk = ConversaWhatsApp.objects.filter(
+                telefone_cliente=pedido_conversa.telefone_cliente
+            ).values_list('pk', flat=True).get()
+    else:
+        campos = campos_alterados(pedido_conversa, CAMPOS_SESSAO)
+        if not campos:
+            return False
+        pedido_conversa.save(update_fields=campos + ['data_atualizacao'])
+    fotografar(pedido_conversa)
+    return True
+
+
+class ArmazemSessoesBanco:
+    """ Write-through: a sessão é a própria linha de ConversaWhatsApp. """
+    def carregar(self, telefone, ate_mensagem_id=None):
+        pedido_conversa = ConversaWhatsApp.objects.filter(telefone_cliente=telefone).first()
+        if pedido_conversa is None:
+            return nova_conversa(telefone)
+        fotografar(pedido_conversa)
+        return pedido_conversa
+
+    def guardar(self, pedido_conversa):
+        gravar_conversa(pedido_conversa)
+
+    def checkpoint(self, pedido_conversa):
+        gravar_conversa(pedido_conversa)
+
+    def descartar(self, telefones):
+        pass # Não há nada além da linha do banco
+
+
+class ArmazemSessoesCache:
+    """ Write-behind: ver o docstring do módulo. """
+    def __init__(self, alias_cache, ttl_segundos, intervalo_gravacao_segundos):
+        self.alias_cache = alias_cache
+        self.ttl_segundos = ttl_segundos
+        self.intervalo_gravacao_segundos = intervalo_gravacao_segundos
+        self._alteradas = set() # Telefones com sessão mais nova que a linha no banco
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def cache(self):
+        return caches[self.alias_cache]
+
+    @staticmethod
+    def _chave(telefone):
+        return f"whatsapp:sessao:{telefone}"
+
+    @staticmethod
+    def _serializar(pedido_conversa):
+        return {
+            'id': pedido_conversa.pk,
+            'telefone_cliente': pedido_conversa.telefone_cliente,
+            'nome_cliente': pedido_conversa.nome_cliente,
+            'estado_conversa': pedido_conversa.estado_conversa,
+            'carrinho_atual': pedido_conversa.carrinho_atual,
+            'dados_temporarios': pedido_conversa.dados_temporarios,
+            'ultima_mensagem_id': pedido_conversa.ultima_mensagem_id,
+        }
+
+    @staticmethod
+    def _instanciar(dados):
+        pedido_conversa = ConversaWhatsApp(**dados)
+        pedido_conversa._state.adding = dados['id'] is None
+        return pedido_conversa
+
+    def carregar(self, telefone, ate_mensagem_id=None):
+        """
+        Sessão do telefone. Sem sessão no cache, parte da linha do banco e reaplica as
+        mensagens já processadas depois do checkpoint (antes de ate_mensagem_id, a mensagem
+        sendo processada agora, se informada).
+        """
+        dados = self.cache.get(self._chave(telefone))
+        if dados is not None:
+            return self._instanciar(dados)
+
+        pedido_conversa = ConversaWhatsApp.objects.filter(telefone_cliente=telefone).first() or nova_conversa(telefone)
+        self._reaplicar(pedido_conversa, ate_mensagem_id)
+        return pedido_conversa
+
+    def _reaplicar(self, pedido_conversa, ate_mensagem_id):
+        from .conversa import aplicar_mensagem
+
+        mensagens = MensagemRecebida.objects.filter(
+            telefone_cliente=pedido_conversa.telefone_cliente, status=MensagemRecebida.STATUS_PROCESSADA
+        )
+        if ate_mensagem_id is not None:
+            mensagens = mensagens.filter(id__lt=ate_mensagem_id)
+        if pedido_conversa.ultima_mensagem_id is not None:
+            mensagens = mensagens.filter(id__gt=pedido_conversa.ultima_mensagem_id)
+        elif pedido_conversa.pk is not None: # Linha gravada antes dos checkpoints existirem
+            mensagens = mensagens.filter(recebida_em__gt=pedido_conversa.data_atualizacao)
+        reaplicadas = 0
+        for mensagem_id, corpo in mensagens.order_by('id').values_list('id', 'corpo').iterator():
+            aplicar_mensagem(pedido_conversa, corpo.strip().lower())
+            pedido_conversa.ultima_mensagem_id = mensagem_id
+            reaplicadas += 1
+        if reaplicadas:
+            logger.info(f"Sessão de {pedido_conversa.telefone_cliente} refeita com {reaplicadas} mensagens.")
+
+    def guardar(self, pedido_conversa):
+        self.cache.set(self._chave(pedido_conversa.telefone_cliente), self._serializar(pedido_conversa), self.ttl_segundos)
+        if self.intervalo_gravacao_segundos:
+            with self._lock:
+                self._alteradas.add(pedido_conversa.telefone_cliente)
+            self._iniciar_gravacao_periodica()
+
+    def checkpoint(self, pedido_conversa):
+        gravar_conversa(pedido_conversa)
+        self.cache.set(self._chave(pedido_conversa.telefone_cliente), self._serializar(pedido_conversa), self.ttl_segundos)
+        with self._lock:
+            self._alteradas.discard(pedido_conversa.telefone_cliente)
+
+    def descartar(self, telefones):
+        """ Remove as sessões sem gravá-las (ex: conversas de teste de carga). """
+        self.cache.delete_many([self._chave(telefone) for telefone in telefones])
+        with self._lock:
+            self._alteradas.difference_update(telefones)
+
+    def gravar_alteradas(self):
+        """
+        Grava no banco as sessões alteradas desde a última gravação, uma escrita por
+        conversa. Nunca regride a linha: só atualiza se ela está antes da sessão
+        (ultima_mensagem_id), pois o worker pode ter gravado um checkpoint mais novo.
+        """
+        with self._lock:
+            telefones, self._alteradas = self._alteradas, set()
+        gravadas = 0
+        for telefone in telefones:
+            dados = self.cache.get(self._chave(telefone))
+            if dados is None or dados['ultima_mensagem_id'] is None:
+                continue
+            valores = {campo: dados[campo] for campo in CAMPOS_SESSAO}
+            valores['data_atualizacao'] = timezone.now()
+            atualizadas = ConversaWhatsApp.objects.filter(telefone_cliente=telefone).filter(
+                Q(ultima_mensagem_id__isnull=True) | Q(ultima_mensagem_id__lt=dados['ultima_mensagem_id'])
+            ).update(**valores)
+            if not atualizadas and not ConversaWhatsApp.objects.filter(telefone_cliente=telefone).exists():
+                ConversaWhatsApp.objects.create(telefone_cliente=telefone, **valores)
+                atualizadas = 1
+            gravadas += atualizadas
+        return gravadas
+
+    def _iniciar_gravacao_periodica(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._gravar_periodicamente, name='whatsapp-sessoes', daemon=True)
+            self._thread.start()
+
+    def _gravar_periodicamente(self):
+        while True:
+            time.sleep(self.intervalo_gravacao_segundos)
+            close_old_connections()
+            try:
+                self.gravar_alteradas()
+            except Exception:
+                logger.exception("Erro ao gravar sessões do WhatsApp no banco.")
+            finally:
+                close_old_connections()
+
+
+_armazens = {}
+_armazens_lock = threading.Lock()
+
+
+def obter_armazem_sessoes():
+    """ Armazém configurado em WHATSAPP_SESSAO_BACKEND ('cache', default, ou 'banco'). """
+    backend = getattr(settings, 'WHATSAPP_SESSAO_BACKEND', BACKEND_CACHE)
+    with _armazens_lock:
+        if backend not in _armazens:
+            if backend == BACKEND_BANCO:
+                _armazens[backend] = ArmazemSessoesBanco()
+            else:
+                _armazens[backend] = ArmazemSessoesCache(
+                    getattr(settings, 'WHATSAPP_SESSAO_CACHE', 'default'),
+                    getattr(settings, 'WHATSAPP_SESSAO_TTL_SEGUNDOS', 24 * 60 * 60),
+                    getattr(settings, 'WHATSAPP_SESSAO_INTERVALO_GRAVACAO_SEGUNDOS', 300),
+                )
+        return _armazens[backend]
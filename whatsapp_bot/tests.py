@@ -1,14 +1,33 @@
-from django.test import TestCase
+from django.test import TestCase, SimpleTestCase, override_settings
 from unittest.mock import patch, MagicMock
+import threading
+import time
+from decimal import Decimal
+from io import StringIO
 
-from .models import PedidoWhatsApp
-# from .views import send_whatsapp_message # Se for testar a view diretamente
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.urls import reverse
+from django.utils import timezone
+
+from .models import ConversaWhatsApp, PedidoWhatsApp, MensagemRecebida, MensagemEnviada, ItemPedidoWhatsApp
+from .conversa import formatar_previsao_pronto
+from .processamento import ProcessadorPorChaveThreads, processar_mensagem_recebida, reenfileirar_pendentes
+from .conversa import send_whatsapp_message
+from .envio import Despachante, ClienteProvedor, LimitadorTaxa, enfileirar_envios_em_massa
+from .provedor_falso import ProvedorFalso
+from .catalogo import obter_catalogo, limpar_cache_catalogo
+from .busca import IndiceProdutos, QUANTIDADE_MAXIMA
+from .sessoes import obter_armazem_sessoes, ArmazemSessoesCache
+from .idempotencia import CacheTTL, obter_sids_recebidos
+from administracao.models import CategoriaProdutoPlaceholder, ProdutoPlaceholder
+# from .conversa import send_whatsapp_message # Se for testar a view diretamente
 
 # Refer to TESTING_STRATEGY.md for overall testing guidelines.
 
-class PedidoWhatsAppModelTests(TestCase):
+class ConversaWhatsAppModelTests(TestCase):
     def setUp(self):
-        self.pedido_conversa = PedidoWhatsApp.objects.create(telefone_cliente="+5511999998888")
+        self.pedido_conversa = ConversaWhatsApp.objects.create(telefone_cliente="+5511999998888")
         # Mock product data similar to what's used in views.py
         self.mock_produto_pizza = {'id': 101, 'nome': 'Pizza Calabresa', 'preco': 30.00}
         self.mock_produto_bebida = {'id': 301, 'nome': 'Refrigerante Lata', 'preco': 5.00}
@@ -81,7 +100,7 @@ class WhatsAppWebhookViewTests(TestCase):
         # Initial data setup for each test method if needed
         pass
 
-    @patch('whatsapp_bot.views.send_whatsapp_message') # Mock the function that sends messages
+    @patch('whatsapp_bot.conversa.send_whatsapp_message') # Mock the function that sends messages
     def test_webhook_inicio_conversa_opcao_1_cardapio(self, mock_send_message):
         """
         Testa o fluxo inicial: nova conversa -> envia '1' (Ver Cardápio).
@@ -130,7 +149,7 @@ class WhatsAppWebhookViewTests(TestCase):
     # e a mensagem enviada de volta (usando o mock de send_whatsapp_message).
 
     # Exemplo de como mockar a view diretamente se ela for muito complexa para test client
-    # @patch('whatsapp_bot.views.send_whatsapp_message')
+    # @patch('whatsapp_bot.conversa.send_whatsapp_message')
     # @patch('your_app.views.PedidoWhatsApp.objects.get_or_create')
     # def test_state_transition_logic_directly(self, mock_get_or_create, mock_send_message):
     #     # Setup mock_pedido_conversa
@@ -148,4 +167,769 @@ class WhatsAppWebhookViewTests(TestCase):
 # Para mais detalhes sobre testes de API com Django REST Framework, veja a documentação do DRF.
 # Para testes unitários de lógica de negócios complexa, isole a lógica em funções ou classes
 # que podem ser testadas independentemente das views.
+
+
+@override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono')
+class WhatsAppPagamentoPrevisaoTests(TestCase):
+    """ A confirmação de 'PAGO' informa a previsão de ficar pronto calculada pela cozinha. """
+    def setUp(self):
+        caches['default'].clear() # Sessões do bot
+        self.pedido_conversa = ConversaWhatsApp.objects.create(
+            telefone_cliente="+5511999990001",
+            estado_conversa='AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX',
+            carrinho_atual=[{'id': 101, 'nome': 'Calabresa', 'preco': 30.00, 'quantidade': 1}],
+        )
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_pago_inclui_previsao(self, mock_send_message):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('whatsapp_bot:whatsapp_webhook'), {
+                'From': 'whatsapp:+5511999990001', 'Body': 'PAGO'
+            })
+        self.assertEqual(response.status_code, 200)
+        mensagem = mock_send_message.call_args[0][1]
+        self.assertIn("Previsão de ficar pronto", mensagem)
+
+    def test_sem_previsao_nao_altera_mensagem(self):
+        self.assertEqual(formatar_previsao_pronto(None), "")
+
+
+class WebhookAssincronoTests(TestCase):
+    """ O webhook só grava a mensagem e responde; a conversa é processada pelos workers. """
+    url = reverse('whatsapp_bot:whatsapp_webhook')
+
+    def setUp(self):
+        caches['default'].clear() # Sessões do bot
+
+    def test_webhook_responde_com_uma_gravacao(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as contexto:
+            response = self.client.post(self.url, {'From': 'whatsapp:+5511999990002', 'Body': ' Oi '})
+        consultas = [query['sql'] for query in contexto.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(consultas), 1) # Só o INSERT da MensagemRecebida
+        self.assertEqual(response.status_code, 200)
+        mensagem = MensagemRecebida.objects.get()
+        self.assertEqual(mensagem.telefone_cliente, '+5511999990002')
+        self.assertEqual(mensagem.corpo, 'Oi')
+        self.assertEqual(mensagem.status, MensagemRecebida.STATUS_PENDENTE)
+        self.assertFalse(ConversaWhatsApp.objects.filter(telefone_cliente='+5511999990002').exists())
+
+    def test_webhook_sem_remetente(self):
+        response = self.client.post(self.url, {'Body': 'oi'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(MensagemRecebida.objects.exists())
+
+    @override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono')
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_processamento_apos_commit(self, mock_send_message):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(self.url, {'From': 'whatsapp:+5511999990003', 'Body': 'Oi'})
+        self.assertEqual(MensagemRecebida.objects.get().status, MensagemRecebida.STATUS_PROCESSADA)
+        pedido_conversa = obter_armazem_sessoes().carregar('+5511999990003')
+        self.assertEqual(pedido_conversa.estado_conversa, 'AGUARDANDO_OPCAO_INICIAL')
+        self.assertEqual(mock_send_message.call_args[0][0], '+5511999990003')
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_mensagem_processada_uma_unica_vez(self, mock_send_message):
+        mensagem = MensagemRecebida.objects.create(telefone_cliente='+5511999990004', corpo='oi')
+        processar_mensagem_recebida(mensagem.pk)
+        processar_mensagem_recebida(mensagem.pk) # Reenfileirada em duplicidade
+        self.assertEqual(mock_send_message.call_count, 1)
+
+    @patch('whatsapp_bot.conversa.processar_mensagem', side_effect=RuntimeError('falhou'))
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_erro_no_processamento(self, mock_send_message, mock_processar):
+        mensagem = MensagemRecebida.objects.create(telefone_cliente='+5511999990005', corpo='oi')
+        processar_mensagem_recebida(mensagem.pk)
+        mensagem.refresh_from_db()
+        self.assertEqual(mensagem.status, MensagemRecebida.STATUS_ERRO)
+        self.assertEqual(mensagem.erro, 'falhou')
+        self.assertIn("erro interno", mock_send_message.call_args[0][1])
+
+    @override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono')
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_reenfileirar_pendentes_em_ordem(self, mock_send_message):
+        limpar_cache_catalogo()
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30)
+        for corpo in ['oi', '1', '1']:
+            MensagemRecebida.objects.create(telefone_cliente='+5511999990006', corpo=corpo)
+        MensagemRecebida.objects.create(
+            telefone_cliente='+5511999990007', corpo='oi', status=MensagemRecebida.STATUS_PROCESSADA
+        )
+        self.assertEqual(reenfileirar_pendentes(), 3)
+        pedido_conversa = obter_armazem_sessoes().carregar('+5511999990006')
+        self.assertEqual(pedido_conversa.estado_conversa, 'AGUARDANDO_ESCOLHA_PRODUTO')
+        self.assertFalse(ConversaWhatsApp.objects.filter(telefone_cliente='+5511999990007').exists())
+
+
+    @override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono', WHATSAPP_PROCESSANDO_TIMEOUT_SEGUNDOS=300)
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_reenfileirar_processando_expiradas(self, mock_send_message):
+        agora = timezone.now()
+        presa = MensagemRecebida.objects.create(
+            telefone_cliente='+5511999990008', corpo='oi', status=MensagemRecebida.STATUS_PROCESSANDO,
+            processando_em=agora - timezone.timedelta(minutes=10),
+        )
+        em_andamento = MensagemRecebida.objects.create( # Outro worker ainda está nela
+            telefone_cliente='+5511999990009', corpo='oi', status=MensagemRecebida.STATUS_PROCESSANDO,
+            processando_em=agora,
+        )
+        self.assertEqual(reenfileirar_pendentes(), 1)
+        presa.refresh_from_db()
+        em_andamento.refresh_from_db()
+        self.assertEqual(presa.status, MensagemRecebida.STATUS_PROCESSADA)
+        self.assertEqual(em_andamento.status, MensagemRecebida.STATUS_PROCESSANDO)
+        self.assertEqual(mock_send_message.call_count, 1)
+
+class ProcessadorPorChaveThreadsTests(SimpleTestCase):
+    """ Ordem estrita por chave e chaves diferentes em paralelo (sem banco). """
+    def test_ordem_por_chave(self):
+        processador = ProcessadorPorChaveThreads(4)
+        recebidas = {}
+        lock = threading.Lock()
+
+        def registrar(chave, numero):
+            with lock:
+                recebidas.setdefault(chave, []).append(numero)
+
+        for numero in range(50):
+            for chave in ['+551100000001', '+551100000002', '+551100000003']:
+                processador.enfileirar(chave, registrar, chave, numero)
+        processador.aguardar()
+        for chave in ['+551100000001', '+551100000002', '+551100000003']:
+            self.assertEqual(recebidas[chave], list(range(50)))
+
+    def test_chave_lenta_nao_bloqueia_as_outras(self):
+        processador = ProcessadorPorChaveThreads(8)
+        liberar = threading.Event()
+        outra_processada = threading.Event()
+        chave_lenta = 'lenta'
+        outra_chave = next( # Uma chave atendida por outro worker
+            f'outra{i}' for i in range(100)
+            if processador.indice_worker(f'outra{i}') != processador.indice_worker(chave_lenta)
+        )
+        processador.enfileirar(chave_lenta, liberar.wait, 5)
+        processador.enfileirar(outra_chave, outra_processada.set)
+        self.assertTrue(outra_processada.wait(5))
+        liberar.set()
+        processador.aguardar()
+
+
+class EnvioMensagensTests(TestCase):
+    """ Fila de envio (MensagemEnviada) e despachante contra o provedor falso local. """
+    def setUp(self):
+        self.provedor = ProvedorFalso().iniciar()
+        self.addCleanup(self.provedor.parar)
+
+    def _despachante(self, conexoes=2):
+        cliente = ClienteProvedor(self.provedor.url, 'ACteste', 'token', 'whatsapp:+14155238886', conexoes=conexoes)
+        despachante = Despachante(cliente=cliente, limite_por_segundo=1000, conexoes=conexoes)
+        self.addCleanup(despachante.fechar)
+        return despachante
+
+    def test_send_whatsapp_message_so_enfileira(self):
+        send_whatsapp_message('+5511999990010', 'Olá!')
+        mensagem = MensagemEnviada.objects.get()
+        self.assertEqual((mensagem.telefone_cliente, mensagem.corpo), ('+5511999990010', 'Olá!'))
+        self.assertEqual(mensagem.status, MensagemEnviada.STATUS_PENDENTE)
+        self.assertEqual(self.provedor.recebidas, [])
+
+    def test_envio_em_lote_com_conexoes_reaproveitadas(self):
+        for i in range(10):
+            send_whatsapp_message(f'+55119999900{i % 3:02d}', f'mensagem {i}')
+        despachante = self._despachante()
+        with self.assertNumQueries(5): # Reserva (SAVEPOINT, SELECT, UPDATE, RELEASE) e um UPDATE com os resultados
+            self.assertEqual(despachante.despachar_lote(), 10)
+
+        self.assertEqual(MensagemEnviada.objects.filter(status=MensagemEnviada.STATUS_ENVIADA).count(), 10)
+        self.assertFalse(MensagemEnviada.objects.filter(sid_provedor__isnull=True).exists())
+        self.assertLessEqual(self.provedor.conexoes, 2)
+        recebidas = self.provedor.recebidas
+        self.assertEqual(recebidas[0]['From'], 'whatsapp:+14155238886')
+        # Em ordem por telefone
+        do_primeiro = [m['Body'] for m in recebidas if m['To'] == 'whatsapp:+5511999990000']
+        self.assertEqual(do_primeiro, ['mensagem 0', 'mensagem 3', 'mensagem 6', 'mensagem 9'])
+
+    def test_falha_temporaria_reagenda_mantendo_a_ordem(self):
+        self.provedor._respostas.append(500)
+        send_whatsapp_message('+5511999990020', 'primeira')
+        send_whatsapp_message('+5511999990020', 'segunda')
+        despachante = self._despachante()
+        despachante.despachar_lote()
+
+        primeira, segunda = MensagemEnviada.objects.order_by('id')
+        self.assertEqual(primeira.status, MensagemEnviada.STATUS_PENDENTE)
+        self.assertEqual(primeira.tentativas, 1)
+        self.assertIn('HTTP 500', primeira.ultimo_erro)
+        self.assertGreater(primeira.proxima_tentativa_em, timezone.now())
+        # A segunda não foi enviada antes da primeira e não gastou tentativa
+        self.assertEqual((segunda.status, segunda.tentativas), (MensagemEnviada.STATUS_PENDENTE, 0))
+        self.assertEqual(segunda.proxima_tentativa_em, primeira.proxima_tentativa_em)
+        self.assertEqual(despachante.despachar_lote(), 0) # Backoff ainda não venceu
+
+        MensagemEnviada.objects.update(proxima_tentativa_em=timezone.now())
+        despachante.drenar()
+        self.assertEqual([m['Body'] for m in self.provedor.recebidas], ['primeira', 'segunda'])
+        self.assertEqual(MensagemEnviada.objects.get(pk=primeira.pk).status, MensagemEnviada.STATUS_ENVIADA)
+
+    def test_mensagem_de_outro_lote_espera_a_falha_do_mesmo_telefone(self):
+        self.provedor._respostas.append(500)
+        send_whatsapp_message('+5511999990021', 'primeira')
+        despachante = self._despachante()
+        despachante.despachar_lote()
+        # Enfileirada depois da reserva do lote da falha, já no horário de envio
+        send_whatsapp_message('+5511999990021', 'resposta')
+        send_whatsapp_message('+5511999990022', 'outro cliente')
+        self.assertEqual(despachante.despachar_lote(), 1)
+        self.assertEqual([m['Body'] for m in self.provedor.recebidas], ['outro cliente'])
+
+        MensagemEnviada.objects.filter(telefone_cliente='+5511999990021').update(proxima_tentativa_em=timezone.now())
+        despachante.drenar()
+        do_telefone = [m['Body'] for m in self.provedor.recebidas if m['To'] == 'whatsapp:+5511999990021']
+        self.assertEqual(do_telefone, ['primeira', 'resposta'])
+
+    def test_erro_definitivo_vai_para_dead_letter(self):
+        self.provedor._respostas.append(400)
+        send_whatsapp_message('+5511999990030', 'número inválido')
+        self._despachante().despachar_lote()
+        mensagem = MensagemEnviada.objects.get()
+        self.assertEqual(mensagem.status, MensagemEnviada.STATUS_FALHOU)
+        self.assertIn('HTTP 400', mensagem.ultimo_erro)
+
+    @override_settings(WHATSAPP_ENVIO_MAX_TENTATIVAS=2)
+    def test_tentativas_esgotadas_vao_para_dead_letter(self):
+        self.provedor._respostas.extend([503, 503])
+        send_whatsapp_message('+5511999990040', 'oi')
+        despachante = self._despachante()
+        despachante.despachar_lote()
+        MensagemEnviada.objects.update(proxima_tentativa_em=timezone.now())
+        despachante.despachar_lote()
+        mensagem = MensagemEnviada.objects.get()
+        self.assertEqual((mensagem.status, mensagem.tentativas), (MensagemEnviada.STATUS_FALHOU, 2))
+
+    def test_429_respeita_retry_after(self):
+        self.provedor._respostas.append(429)
+        send_whatsapp_message('+5511999990050', 'oi')
+        antes = timezone.now()
+        self._despachante().despachar_lote()
+        mensagem = MensagemEnviada.objects.get()
+        self.assertEqual(mensagem.status, MensagemEnviada.STATUS_PENDENTE)
+        self.assertGreaterEqual(mensagem.proxima_tentativa_em, antes + timezone.timedelta(seconds=1))
+
+    def test_envio_em_massa(self):
+        telefones = [f'+55119999901{i:02d}' for i in range(30)]
+        self.assertEqual(enfileirar_envios_em_massa(telefones, 'Promoção!'), 30)
+        self.assertEqual(self._despachante(conexoes=4).drenar(), 30)
+        self.assertEqual(len(self.provedor.recebidas), 30)
+        self.assertLessEqual(self.provedor.conexoes, 4)
+
+
+class LimitadorTaxaTests(SimpleTestCase):
+    def test_espaca_os_envios(self):
+        limitador = LimitadorTaxa(50)
+        inicio = time.monotonic()
+        for _ in range(11):
+            limitador.aguardar()
+        self.assertGreaterEqual(time.monotonic() - inicio, 0.19) # 10 intervalos de 20ms
+
+
+class CatalogoBotTests(TestCase):
+    """ Menus do bot a partir do cardápio real, em cache com a versão 'catalogo'. """
+    def setUp(self):
+        limpar_cache_catalogo()
+        self.addCleanup(limpar_cache_catalogo)
+        caches['default'].clear() # Sessões do bot
+        self.salgadas = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        self.bebidas = CategoriaProdutoPlaceholder.objects.create(nome="Bebidas")
+        CategoriaProdutoPlaceholder.objects.create(nome="Sobremesas") # Sem produtos: fora do menu
+        self.calabresa = ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=self.salgadas, preco_base=30)
+        self.margherita = ProdutoPlaceholder.objects.create(nome="Margherita", categoria=self.salgadas, preco_base=28)
+        ProdutoPlaceholder.objects.create(nome="Refrigerante Lata", categoria=self.bebidas, preco_base=5)
+        ProdutoPlaceholder.objects.create(nome="Suco", categoria=self.bebidas, preco_base=7, disponivel=False)
+
+    def test_menus_formatados(self):
+        catalogo = obter_catalogo()
+        self.assertEqual(
+            catalogo.menu_categorias,
+            "Categorias:\n1. Bebidas\n2. Pizzas Salgadas\n\nDigite o número da categoria ou 'V' para voltar ao menu inicial.\n"
+            "Ou escreva o que deseja, ex: 'uma calabresa e 2 coca'."
+        )
+        self.assertEqual(
+            catalogo.menu_produtos(self.salgadas.id),
+            "Pizzas Salgadas:\n1. Calabresa - R$30.00\n2. Margherita - R$28.00\n\n"
+            "Digite o número do produto para adicionar ou 'V' para voltar às categorias."
+        )
+        self.assertNotIn("Suco", catalogo.menu_produtos(self.bebidas.id))
+
+    def test_menu_em_cache_sem_consultar_o_cardapio(self):
+        obter_catalogo()
+        with self.assertNumQueries(1): # Só a versão (ContadorVersao)
+            self.assertIn("Calabresa", obter_catalogo().menu_produtos(self.salgadas.id))
+
+    def test_produto_desligado_some_na_mensagem_seguinte(self):
+        self.assertIn("Calabresa", obter_catalogo().menu_produtos(self.salgadas.id))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.calabresa.disponivel = False
+            self.calabresa.save()
+        self.assertNotIn("Calabresa", obter_catalogo().menu_produtos(self.salgadas.id))
+
+    def test_escrita_pela_api_de_admin_invalida_o_cache(self):
+        obter_catalogo()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                reverse('administracao:admin-produto-detail', args=[self.margherita.id]),
+                {'nome': 'Margherita Especial'}, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("Margherita Especial", obter_catalogo().menu_produtos(self.salgadas.id))
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_produto_indisponivel_depois_do_menu_nao_entra_no_carrinho(self, mock_send_message):
+        from .conversa import processar_mensagem
+        telefone = '+5511999990060'
+        for texto in ['oi', '1', '2']: # Pizzas Salgadas
+            processar_mensagem(telefone, texto)
+        self.assertIn("1. Calabresa", mock_send_message.call_args[0][1])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.calabresa.disponivel = False
+            self.calabresa.save()
+        processar_mensagem(telefone, '1') # Número que o cliente viu para a Calabresa
+        self.assertIn("não está mais disponível", mock_send_message.call_args[0][1])
+        self.assertNotIn("Calabresa", mock_send_message.call_args[0][1])
+        self.assertFalse(obter_armazem_sessoes().carregar(telefone).carrinho_atual)
+
+        processar_mensagem(telefone, '1') # Agora é a Margherita
+        pedido_conversa = obter_armazem_sessoes().carregar(telefone)
+        self.assertEqual([item['nome'] for item in pedido_conversa.carrinho_atual], ['Margherita'])
+
+
+@override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono')
+class SessoesConversaTests(TestCase):
+    """ Conversa no armazém de sessões: só checkpoints e a gravação periódica escrevem no banco. """
+    telefone = '+5511999990070'
+
+    def setUp(self):
+        limpar_cache_catalogo()
+        self.addCleanup(limpar_cache_catalogo)
+        caches['default'].clear()
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30)
+
+    @staticmethod
+    def _escritas_conversa(contexto):
+        return [
+            query['sql'] for query in contexto.captured_queries
+            if query['sql'].startswith(('INSERT', 'UPDATE')) and ConversaWhatsApp._meta.db_table in query['sql']
+        ]
+
+    def _receber(self, *corpos):
+        for corpo in corpos:
+            mensagem = MensagemRecebida.objects.create(telefone_cliente=self.telefone, corpo=corpo)
+            processar_mensagem_recebida(mensagem.pk)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_conversa_sem_escritas_ate_o_pagamento(self, mock_send_message):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from pagamentos.models import Pagamento
+
+        with CaptureQueriesContext(connection) as contexto:
+            self._receber('oi', '1', '1', '1', 'f', 'pix')
+        self.assertEqual(self._escritas_conversa(contexto), [])
+        self.assertFalse(ConversaWhatsApp.objects.filter(telefone_cliente=self.telefone).exists())
+        self.assertFalse(PedidoWhatsApp.objects.exists())
+        self.assertEqual(obter_armazem_sessoes().carregar(self.telefone).estado_conversa, 'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX')
+
+        with CaptureQueriesContext(connection) as contexto:
+            self._receber('pago')
+        self.assertEqual(len(self._escritas_conversa(contexto)), 1) # O checkpoint
+        conversa = ConversaWhatsApp.objects.get(telefone_cliente=self.telefone)
+        self.assertEqual((conversa.estado_conversa, conversa.carrinho_atual), ('INICIO', []))
+        self.assertEqual(conversa.ultima_mensagem_id, MensagemRecebida.objects.latest('id').id)
+        pedido = PedidoWhatsApp.objects.get(telefone_cliente=self.telefone)
+        self.assertEqual(pedido.status_cozinha, PedidoWhatsApp.STATUS_COZINHA_AGUARDANDO)
+        self.assertEqual([item['nome'] for item in pedido.carrinho_atual], ['Calabresa'])
+        self.assertTrue(Pagamento.objects.filter(object_id=pedido.id).exists())
+        self.assertEqual(
+            list(pedido.itens.values_list('nome_produto', 'quantidade', 'preco_unitario')),
+            [('Calabresa', 1, Decimal('30.00'))]
+        )
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_cada_pagamento_cria_um_pedido(self, mock_send_message):
+        self._receber('oi', '1', '1', '1', 'f', 'pix', 'pago')
+        self._receber('oi', '1', '1', '1', 'c', '1', 'f', 'pix', 'pago') # Cliente que volta
+        pedidos = PedidoWhatsApp.objects.filter(telefone_cliente=self.telefone).order_by('id')
+        self.assertEqual([pedido.calcular_total_carrinho() for pedido in pedidos], [30.0, 60.0])
+        self.assertEqual(ConversaWhatsApp.objects.filter(telefone_cliente=self.telefone).count(), 1)
+        self.assertEqual(obter_armazem_sessoes().carregar(self.telefone).estado_conversa, 'INICIO')
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_sessao_perdida_e_refeita_das_mensagens(self, mock_send_message):
+        self._receber('oi', '1', '1')
+        caches['default'].clear() # Processo reiniciado
+        self._receber('1')
+        self.assertIn("'Calabresa' adicionado!", mock_send_message.call_args[0][1])
+        pedido_conversa = obter_armazem_sessoes().carregar(self.telefone)
+        self.assertEqual(pedido_conversa.estado_conversa, 'AGUARDANDO_ACAO_CARRINHO')
+        self.assertEqual(mock_send_message.call_count, 4) # Nada reenviado ao refazer a sessão
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_sessao_refeita_a_partir_do_checkpoint(self, mock_send_message):
+        self._receber('oi', '2') # Transferência para atendente é checkpoint
+        self.assertEqual(ConversaWhatsApp.objects.get(telefone_cliente=self.telefone).estado_conversa, 'TRANSFERIDO_ATENDENTE')
+        self._receber('cancelar', '1')
+        caches['default'].clear()
+        self._receber('1')
+        self.assertEqual(obter_armazem_sessoes().carregar(self.telefone).estado_conversa, 'AGUARDANDO_ESCOLHA_PRODUTO')
+
+    def test_gravacao_periodica_nao_regride_o_banco(self):
+        armazem = ArmazemSessoesCache('default', 60, 3600)
+        atrasada = ConversaWhatsApp.objects.create(telefone_cliente='+5511999990071', ultima_mensagem_id=3)
+        adiantada = ConversaWhatsApp.objects.create(
+            telefone_cliente='+5511999990072', estado_conversa='TRANSFERIDO_ATENDENTE', ultima_mensagem_id=7
+        )
+        with patch.object(ArmazemSessoesCache, '_iniciar_gravacao_periodica'):
+            for pedido_conversa in (atrasada, adiantada):
+                pedido_conversa.estado_conversa = 'AGUARDANDO_ESCOLHA_CATEGORIA'
+                pedido_conversa.ultima_mensagem_id = 5
+                armazem.guardar(pedido_conversa)
+            nova = ConversaWhatsApp(telefone_cliente='+5511999990073', estado_conversa='AGUARDANDO_OPCAO_INICIAL', ultima_mensagem_id=1)
+            armazem.guardar(nova)
+
+        self.assertEqual(armazem.gravar_alteradas(), 2)
+        atrasada.refresh_from_db()
+        adiantada.refresh_from_db()
+        self.assertEqual((atrasada.estado_conversa, atrasada.ultima_mensagem_id), ('AGUARDANDO_ESCOLHA_CATEGORIA', 5))
+        self.assertEqual((adiantada.estado_conversa, adiantada.ultima_mensagem_id), ('TRANSFERIDO_ATENDENTE', 7))
+        self.assertTrue(ConversaWhatsApp.objects.filter(telefone_cliente='+5511999990073').exists())
+        self.assertEqual(armazem.gravar_alteradas(), 0) # Nada alterado desde a última gravação
+
+    @override_settings(WHATSAPP_SESSAO_BACKEND='banco')
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_backend_banco_grava_cada_mensagem(self, mock_send_message):
+        self._receber('oi', '1')
+        pedido_conversa = ConversaWhatsApp.objects.get(telefone_cliente=self.telefone)
+        self.assertEqual(pedido_conversa.estado_conversa, 'AGUARDANDO_ESCOLHA_CATEGORIA')
+        self.assertEqual(pedido_conversa.ultima_mensagem_id, MensagemRecebida.objects.latest('id').id)
+
+@override_settings(WHATSAPP_SESSAO_BACKEND='banco')
+class OrcamentoConsultasConversaTests(TestCase):
+    """
+    Com o backend 'banco', cada mensagem faz no máximo uma escrita no ConversaWhatsApp,
+    só com as colunas alteradas. Orçamento de consultas por estado da conversa: ler a
+    linha, a versão do cardápio quando o estado usa o menu, a escrita e a resposta na
+    fila de envio.
+    """
+    telefone = '+5511999990080'
+    # estado: (mensagem, consultas)
+    ORCAMENTO = {
+        'INICIO': ('oi', 3),
+        'AGUARDANDO_OPCAO_INICIAL': ('1', 4),
+        'AGUARDANDO_ESCOLHA_CATEGORIA': ('1', 4),
+        'AGUARDANDO_ESCOLHA_PRODUTO': ('1', 4),
+        'AGUARDANDO_ACAO_CARRINHO': ('f', 3),
+        'AGUARDANDO_CONFIRMACAO_PEDIDO': ('pix', 3),
+        'AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX': ('pago', 24), # Checkpoint + pedido + ticket da cozinha + itens + pagamento + previsão
+        'TRANSFERIDO_ATENDENTE': ('oi', 2), # Nada muda: nenhuma escrita
+        'FINALIZADO': ('oi', 2),
+    }
+
+    def setUp(self):
+        limpar_cache_catalogo()
+        self.addCleanup(limpar_cache_catalogo)
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        produto = ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30)
+        obter_catalogo() # Cardápio já em cache, como em um worker aquecido
+        self.campos_iniciais = {
+            'carrinho_atual': [{'id': produto.id, 'nome': 'Calabresa', 'preco': 30.0, 'quantidade': 1}],
+            'dados_temporarios': {'categoria_id': categoria.id, 'produtos_menu': [produto.id]},
+        }
+
+    def test_cobre_todos_os_estados(self):
+        self.assertEqual(set(self.ORCAMENTO), {estado for estado, _ in ConversaWhatsApp.ESTADOS_CONVERSA})
+
+    def test_orcamento_por_estado(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+        from .conversa import processar_mensagem
+
+        for estado, (mensagem, consultas) in self.ORCAMENTO.items():
+            with self.subTest(estado=estado):
+                ConversaWhatsApp.objects.filter(telefone_cliente=self.telefone).delete()
+                ContentType.objects.clear_cache() # Mesma contagem isolado ou na suíte inteira
+                if estado != 'INICIO':
+                    ConversaWhatsApp.objects.create(telefone_cliente=self.telefone, estado_conversa=estado, **self.campos_iniciais)
+                with CaptureQueriesContext(connection) as contexto, self.assertNumQueries(consultas):
+                    processar_mensagem(self.telefone, mensagem)
+                escritas = [
+                    query['sql'] for query in contexto.captured_queries
+                    if query['sql'].startswith(('INSERT', 'UPDATE')) and ConversaWhatsApp._meta.db_table in query['sql']
+                ]
+                self.assertLessEqual(len(escritas), 1)
+                for sql in escritas:
+                    if sql.startswith('UPDATE'): # Só as colunas alteradas
+                        self.assertNotIn('"telefone_cliente"', sql.split(' WHERE ')[0])
+                        self.assertNotIn('"nome_cliente"', sql)
+
+    def test_sem_alteracao_nao_grava(self):
+        from .sessoes import ArmazemSessoesBanco, gravar_conversa
+        ConversaWhatsApp.objects.create(telefone_cliente=self.telefone, estado_conversa='AGUARDANDO_ACAO_CARRINHO', **self.campos_iniciais)
+        pedido_conversa = ArmazemSessoesBanco().carregar(self.telefone)
+        with self.assertNumQueries(0):
+            self.assertFalse(gravar_conversa(pedido_conversa))
+        pedido_conversa.carrinho_atual[0]['quantidade'] = 2 # Alteração dentro do JSON também conta
+        with self.assertNumQueries(1):
+            self.assertTrue(gravar_conversa(pedido_conversa))
+
+    def test_upsert_de_linha_criada_depois_da_sessao(self):
+        from .sessoes import nova_conversa, gravar_conversa
+        existente = ConversaWhatsApp.objects.create(telefone_cliente=self.telefone, nome_cliente='Ana')
+        pedido_conversa = nova_conversa(self.telefone) # Sessão criada antes da linha
+        pedido_conversa.estado_conversa = 'AGUARDANDO_OPCAO_INICIAL'
+        with self.assertNumQueries(1):
+            gravar_conversa(pedido_conversa)
+        self.assertEqual(pedido_conversa.pk, existente.pk)
+        existente.refresh_from_db()
+        self.assertEqual(existente.estado_conversa, 'AGUARDANDO_OPCAO_INICIAL')
+        self.assertEqual(existente.nome_cliente, 'Ana') # Fora das colunas da sessão
+
+@override_settings(WHATSAPP_PROCESSAMENTO_BACKEND='sincrono')
+class WebhookIdempotenteTests(TestCase):
+    """ Reenvios do Twilio (mesmo MessageSid) não são gravados nem processados de novo. """
+    url = reverse('whatsapp_bot:whatsapp_webhook')
+    telefone = '+5511999990090'
+
+    def setUp(self):
+        caches['default'].clear()
+        obter_sids_recebidos().limpar()
+        self.addCleanup(obter_sids_recebidos().limpar)
+
+    def _post(self, corpo, sid):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(self.url, {'From': f'whatsapp:{self.telefone}', 'Body': corpo, 'MessageSid': sid})
+        self.assertEqual(response.status_code, 200)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_reenvio_respondido_pelo_cache_sem_consultas(self, mock_send_message):
+        self._post('oi', 'SM001')
+        with self.assertNumQueries(0):
+            self._post('oi', 'SM001')
+        self.assertEqual(MensagemRecebida.objects.count(), 1)
+        self.assertEqual(mock_send_message.call_count, 1)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_reenvio_barrado_pela_restricao_unica(self, mock_send_message):
+        self._post('oi', 'SM002')
+        obter_sids_recebidos().limpar() # Reenvio entregue a outro processo
+        self._post('oi', 'SM002')
+        self.assertEqual(MensagemRecebida.objects.count(), 1)
+        self.assertEqual(mock_send_message.call_count, 1)
+        self.assertIn('SM002', obter_sids_recebidos())
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_pago_reenviado_registra_um_pagamento(self, mock_send_message):
+        from pagamentos.models import Pagamento
+        ConversaWhatsApp.objects.create(
+            telefone_cliente=self.telefone, estado_conversa='AGUARDANDO_CONFIRMACAO_PAGAMENTO_PIX',
+            carrinho_atual=[{'id': 101, 'nome': 'Calabresa', 'preco': 30.00, 'quantidade': 1}],
+        )
+        self._post('PAGO', 'SM003')
+        obter_sids_recebidos().limpar()
+        self._post('PAGO', 'SM003')
+        self.assertEqual(Pagamento.objects.count(), 1)
+        self.assertEqual(PedidoWhatsApp.objects.count(), 1)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_mensagens_sem_sid_nao_sao_deduplicadas(self, mock_send_message):
+        for _ in range(2):
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(self.url, {'From': f'whatsapp:{self.telefone}', 'Body': 'oi'})
+        self.assertEqual(MensagemRecebida.objects.count(), 2)
+
+
+class CacheTTLTests(SimpleTestCase):
+    def test_limite_descarta_as_mais_antigas(self):
+        cache = CacheTTL(maximo=2, ttl_segundos=60)
+        for chave in ['a', 'b', 'c']:
+            cache.adicionar(chave)
+        self.assertNotIn('a', cache)
+        self.assertIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_expiracao(self):
+        cache = CacheTTL(maximo=10, ttl_segundos=60)
+        with patch('whatsapp_bot.idempotencia.time.monotonic', return_value=1000):
+            cache.adicionar('a')
+        with patch('whatsapp_bot.idempotencia.time.monotonic', return_value=1059):
+            self.assertIn('a', cache)
+        with patch('whatsapp_bot.idempotencia.time.monotonic', return_value=1060):
+            self.assertNotIn('a', cache)
+        self.assertEqual(len(cache), 0)
+
+class ItensPedidoWhatsAppTests(TestCase):
+    """ Itens normalizados dos pedidos confirmados e o comando de carga dos pedidos anteriores. """
+    def setUp(self):
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        self.calabresa = ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30)
+
+    def _pedido(self, telefone, **campos):
+        return PedidoWhatsApp.objects.create(telefone_cliente=telefone, carrinho_atual=[
+            {'id': self.calabresa.id, 'nome': 'Calabresa', 'preco': 30.0, 'quantidade': 2, 'observacoes': 'sem cebola'},
+            {'id': 999999, 'nome': 'Pizza Antiga', 'preco': 25.5, 'quantidade': 1}, # Saiu do cardápio
+        ], **campos)
+
+    def test_normalizar_pedidos_confirmados(self):
+        from django.core.management import call_command
+        from pagamentos.models import Pagamento
+        na_cozinha = self._pedido('+5511999990100', status_cozinha=PedidoWhatsApp.STATUS_COZINHA_ENTREGUE)
+        pago = self._pedido('+5511999990101')
+        Pagamento.objects.create(pedido=pago, metodo_pagamento=Pagamento.METODO_PIX, valor_pago=85.50, status_pagamento=Pagamento.STATUS_APROVADO)
+        self._pedido('+5511999990102') # Ainda no carrinho: não é pedido
+
+        saida = StringIO()
+        call_command('normalizar_itens_whatsapp', stdout=saida)
+        self.assertIn("4 itens gravados para 2 pedidos", saida.getvalue())
+        self.assertEqual(
+            list(na_cozinha.itens.values_list('produto_id', 'nome_produto', 'quantidade', 'preco_unitario', 'observacoes')),
+            [(self.calabresa.id, 'Calabresa', 2, Decimal('30.00'), 'sem cebola'), (None, 'Pizza Antiga', 1, Decimal('25.50'), '')]
+        )
+
+        call_command('normalizar_itens_whatsapp', stdout=saida) # Já normalizados: nada a fazer
+        self.assertIn("0 itens gravados para 0 pedidos", saida.getvalue())
+        self.assertEqual(ItemPedidoWhatsApp.objects.count(), 4)
+
+    def test_nova_confirmacao_substitui_os_itens(self):
+        from .pedidos import registrar_itens_pedido_whatsapp
+        pedido = self._pedido('+5511999990103')
+        registrar_itens_pedido_whatsapp(pedido)
+        pedido.carrinho_atual = [{'id': self.calabresa.id, 'nome': 'Calabresa', 'preco': 30.0, 'quantidade': 1}]
+        registrar_itens_pedido_whatsapp(pedido)
+        self.assertEqual(list(pedido.itens.values_list('nome_produto', 'quantidade')), [('Calabresa', 1)])
+
+
+@override_settings(WHATSAPP_SESSAO_BACKEND='banco')
+class RoteirosCargaTests(TestCase):
+    """ Os roteiros do carga_roteiros continuam válidos para a máquina de estados atual. """
+    def setUp(self):
+        limpar_cache_catalogo()
+        self.addCleanup(limpar_cache_catalogo)
+        categoria = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=categoria, preco_base=30)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_roteiros_passam_pelos_estados_esperados(self, mock_send_message):
+        from .conversa import processar_mensagem
+        from .management.commands.carga_roteiros import ROTEIROS
+        for indice, (nome, roteiro) in enumerate(ROTEIROS.items()):
+            telefone = f'+551199999020{indice}'
+            for posicao, (mensagem, estado_esperado) in enumerate(roteiro):
+                with self.subTest(roteiro=nome, posicao=posicao):
+                    processar_mensagem(telefone, mensagem.lower())
+                    self.assertEqual(ConversaWhatsApp.objects.get(telefone_cliente=telefone).estado_conversa, estado_esperado)
+        self.assertEqual(PedidoWhatsApp.objects.count(), 1) # Só 'compra_pix' paga
+
+    def test_roteiros_cobrem_os_estados(self):
+        from .management.commands.carga_roteiros import ROTEIROS
+        visitados = {'INICIO'} | {estado for roteiro in ROTEIROS.values() for _, estado in roteiro}
+        self.assertEqual(visitados | {'FINALIZADO'}, {estado for estado, _ in ConversaWhatsApp.ESTADOS_CONVERSA})
+
+    def test_percentil(self):
+        from .management.commands.carga_roteiros import percentil
+        valores = list(range(1, 101))
+        self.assertEqual((percentil(valores, 0.5), percentil(valores, 0.99), percentil(valores, 1)), (51, 100, 100))
+        self.assertIsNone(percentil([], 0.5))
+
+
+class IndiceProdutosTests(SimpleTestCase):
+    def setUp(self):
+        self.indice = IndiceProdutos([
+            {'id': 1, 'nome': 'Pizzas', 'produtos': [
+                {'id': 1, 'nome': 'Calabresa', 'preco': 30.0},
+                {'id': 2, 'nome': 'Margherita', 'preco': 32.0},
+                {'id': 3, 'nome': 'Romeu e Julieta', 'preco': 35.0},
+                {'id': 4, 'nome': 'Quatro Queijos', 'preco': 38.0},
+            ]},
+            {'id': 2, 'nome': 'Bebidas', 'produtos': [
+                {'id': 10, 'nome': 'Coca-Cola Lata', 'preco': 6.0},
+                {'id': 11, 'nome': 'Coca-Cola 2L', 'preco': 12.0},
+                {'id': 12, 'nome': 'Guaraná Antarctica', 'preco': 5.0},
+            ]},
+        ])
+
+    def _itens(self, texto):
+        return [(item.produto['id'], item.quantidade) for item in self.indice.interpretar(texto).itens]
+
+    def test_nomes_e_quantidades(self):
+        self.assertEqual(self._itens("quero uma calabresa e 2 coca lata"), [(1, 1), (10, 2)])
+        self.assertEqual(self._itens("2 margherita 1 guarana"), [(2, 2), (12, 1)])
+        self.assertEqual(self._itens("calabresa 3, coca 2l"), [(1, 3), (11, 1)])
+        self.assertEqual(self._itens("3x Quatro Queijos"), [(4, 3)])
+
+    def test_acentos_e_erros_de_digitacao(self):
+        self.assertEqual(self._itens("CALABREZA"), [(1, 1)])
+        self.assertEqual(self._itens("marguerita"), [(2, 1)])
+        self.assertEqual(self._itens("guaraná antartica"), [(12, 1)])
+        self.assertEqual(self._itens("marg"), [(2, 1)]) # Começo do nome
+
+    def test_e_e_numeros_que_fazem_parte_do_nome(self):
+        self.assertEqual(self._itens("romeu e julieta"), [(3, 1)])
+        self.assertEqual(self._itens("quatro queijos e quatro calabresa"), [(4, 1), (1, 4)])
+
+    def test_ambiguo_e_nao_encontrado(self):
+        resultado = self.indice.interpretar("coca e pizza de abacaxi")
+        self.assertEqual(resultado.itens, [])
+        self.assertEqual(resultado.ambiguos, [('coca', ['Coca-Cola Lata', 'Coca-Cola 2L'])])
+        self.assertEqual(resultado.nao_encontrados, ['pizza abacaxi'])
+
+    def test_quantidade_limitada(self):
+        self.assertEqual(self._itens("5000 calabresa"), [(1, QUANTIDADE_MAXIMA)])
+
+
+@override_settings(WHATSAPP_SESSAO_BACKEND='banco')
+class PedidoTextoLivreTests(TestCase):
+    telefone = '+5511999990300'
+
+    def setUp(self):
+        limpar_cache_catalogo()
+        self.addCleanup(limpar_cache_catalogo)
+        self.pizzas = CategoriaProdutoPlaceholder.objects.create(nome="Pizzas Salgadas")
+        bebidas = CategoriaProdutoPlaceholder.objects.create(nome="Bebidas")
+        ProdutoPlaceholder.objects.create(nome="Calabresa", categoria=self.pizzas, preco_base=30)
+        ProdutoPlaceholder.objects.create(nome="Coca-Cola Lata", categoria=bebidas, preco_base=6)
+
+    def _conversa(self):
+        return ConversaWhatsApp.objects.get(telefone_cliente=self.telefone)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_texto_livre_depois_da_saudacao(self, mock_send_message):
+        from .conversa import processar_mensagem
+        processar_mensagem(self.telefone, 'oi')
+        processar_mensagem(self.telefone, 'quero uma calabresa e 2 coca')
+        conversa = self._conversa()
+        self.assertEqual(conversa.estado_conversa, 'AGUARDANDO_ACAO_CARRINHO')
+        self.assertEqual([(item['nome'], item['quantidade']) for item in conversa.carrinho_atual], [('Calabresa', 1), ('Coca-Cola Lata', 2)])
+        self.assertIn("Adicionado: 1x Calabresa, 2x Coca-Cola Lata.", mock_send_message.call_args[0][1])
+        self.assertEqual(conversa.calcular_total_carrinho(), 42.0)
+
+    @patch('whatsapp_bot.conversa.send_whatsapp_message')
+    def test_texto_livre_na_lista_de_produtos(self, mock_send_message):
+        from .conversa import processar_mensagem
+        for mensagem in ['oi', '1', '2', 'mais 2 calabreza']:
+            processar_mensagem(self.telefone, mensagem)
+        self.assertEqual(self._conversa().carrinho_atual[0]['quantidade'], 2)
+        processar_mensagem(self.telefone, 'abacaxi') # Nada reconhecido: resposta de antes
+        self.assertIn("Opção inválida", mock_send_message.call_args[0][1])
+
+    def test_indice_refeito_so_com_nova_versao_do_cardapio(self):
+        catalogo = obter_catalogo()
+        self.assertIs(catalogo.busca, obter_catalogo().busca)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProdutoPlaceholder.objects.create(nome="Portuguesa", categoria=self.pizzas, preco_base=33)
+        self.assertEqual([item.produto['nome'] for item in obter_catalogo().busca.interpretar('portuguesa').itens], ['Portuguesa'])
+
 ```